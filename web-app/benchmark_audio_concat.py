@@ -0,0 +1,106 @@
+# web-app/benchmark_audio_concat.py
+"""
+So sánh thời gian ghép audio nhiều dòng giữa hai cách:
+  - frames: nối trực tiếp frame MP3 (web_app.services.mp3_frames.join_mp3_files)
+  - pydub:  giải mã từng đoạn, chèn im lặng rồi mã hóa lại bằng ffmpeg (cách cũ)
+
+Mặc định dùng các file trong thư mục cache đoạn audio (FLASHCARD_AUDIO_SEGMENT_DIR).
+Nếu chưa có file nào, dùng --synthetic để tạo các đoạn MP3 mẫu cùng định dạng với gTTS
+(MPEG2 Layer III, 24 kHz, 32 kbps, mono).
+
+Ví dụ:
+    python benchmark_audio_concat.py --segments 3 --rounds 20
+    python benchmark_audio_concat.py --synthetic --segments 5
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+
+project_root = os.path.abspath(os.path.dirname(__file__))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from web_app.config import FLASHCARD_AUDIO_SEGMENT_DIR
+from web_app.services.mp3_frames import join_mp3_files, parse_frame_header, build_silence_frames
+
+# Header frame giống đầu ra của gTTS: MPEG2 Layer III, 32 kbps, 24 kHz, mono
+GTTS_LIKE_HEADER = bytes((0xFF, 0xF3, 0x44, 0xC4))
+
+
+def concat_with_pydub(input_paths, output_path, pause_ms):
+    from pydub import AudioSegment
+    combined = AudioSegment.from_file(input_paths[0])
+    silence = AudioSegment.silent(duration=pause_ms) if pause_ms > 0 else None
+    for path in input_paths[1:]:
+        if silence:
+            combined += silence
+        combined += AudioSegment.from_file(path)
+    combined.export(output_path, format="mp3")
+
+
+def make_synthetic_segments(directory, count, duration_ms):
+    header = parse_frame_header(GTTS_LIKE_HEADER, 0)
+    paths = []
+    for index in range(count):
+        path = os.path.join(directory, f"synthetic_{index}.mp3")
+        with open(path, 'wb') as f:
+            f.write(build_silence_frames(header, duration_ms + index * 100))
+        paths.append(path)
+    return paths
+
+
+def run(label, concat_function, input_paths, pause_ms, rounds, work_dir):
+    timings = []
+    output_path = os.path.join(work_dir, f"output_{label}.mp3")
+    for _ in range(rounds):
+        started = time.perf_counter()
+        concat_function(input_paths, output_path, pause_ms)
+        timings.append(time.perf_counter() - started)
+    size = os.path.getsize(output_path)
+    print(f"{label:>7}: trung bình {statistics.mean(timings) * 1000:8.2f} ms, "
+          f"trung vị {statistics.median(timings) * 1000:8.2f} ms, kích thước {size} byte")
+    return statistics.mean(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="So sánh nối frame MP3 với ghép bằng pydub.")
+    parser.add_argument('--source-dir', default=FLASHCARD_AUDIO_SEGMENT_DIR, help="Thư mục chứa các đoạn MP3.")
+    parser.add_argument('--segments', type=int, default=3, help="Số đoạn ghép trong mỗi lần.")
+    parser.add_argument('--rounds', type=int, default=10, help="Số lần lặp cho mỗi cách.")
+    parser.add_argument('--pause-ms', type=int, default=400, help="Khoảng lặng giữa các đoạn (ms).")
+    parser.add_argument('--synthetic', action='store_true', help="Tạo đoạn MP3 mẫu thay vì đọc từ thư mục cache.")
+    parser.add_argument('--synthetic-ms', type=int, default=2000, help="Độ dài mỗi đoạn mẫu (ms).")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='audio_concat_bench_')
+    try:
+        if args.synthetic:
+            input_paths = make_synthetic_segments(work_dir, args.segments, args.synthetic_ms)
+        else:
+            candidates = sorted(
+                os.path.join(args.source_dir, name) for name in os.listdir(args.source_dir) if name.endswith('.mp3')
+            ) if os.path.isdir(args.source_dir) else []
+            input_paths = candidates[:args.segments]
+            if len(input_paths) < 2:
+                print(f"Không đủ file MP3 trong {args.source_dir}. Dùng --synthetic để tạo dữ liệu mẫu.")
+                return 1
+
+        print(f"Ghép {len(input_paths)} đoạn, {args.rounds} lần mỗi cách, khoảng lặng {args.pause_ms} ms.")
+        frames_time = run('frames', join_mp3_files, input_paths, args.pause_ms, args.rounds, work_dir)
+        try:
+            pydub_time = run('pydub', concat_with_pydub, input_paths, args.pause_ms, args.rounds, work_dir)
+        except Exception as e:
+            print(f"  pydub: không chạy được ({e}). Cần cài ffmpeg để so sánh.")
+            return 0
+        print(f"Nối frame nhanh hơn {pydub_time / frames_time:.1f} lần.")
+        return 0
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,11 @@
 # web-app/database_install.py
 import os
+import re
 import sys
+import shutil
 import logging
+import argparse
+import tempfile
 from werkzeug.security import generate_password_hash
 
 # --- Thiết lập môi trường ---
@@ -21,6 +25,484 @@ if project_root not in sys.path:
     sys.path.insert(0, project_root)
     logger.info(f"Đã thêm thư mục gốc dự án vào sys.path: {project_root}")
 
+
+# ========================== MIGRATIONS ==========================
+# Mỗi bước migration có một số phiên bản tăng dần, được lưu trong `PRAGMA user_version`
+# của SQLite. Các bước chỉ được phép thêm (bảng, cột, index), không xóa dữ liệu.
+# Khi thêm bước mới, đồng thời cập nhật model tương ứng trong `web_app/models.py`
+# để database cài mới bằng `db.create_all()` có cùng cấu trúc.
+
+def _migration_001_hot_path_indexes(connection):
+    """
+    Thêm các index tổng hợp cho các bảng tiến trình, log điểm và bảng nội dung,
+    phục vụ các truy vấn trong `mode_strategies.py` và `stats_service.py`.
+    """
+    statements = [
+        'CREATE INDEX IF NOT EXISTS ix_ufp_user_skipped_due ON "UserFlashcardProgress" (user_id, is_skipped, due_time)',
+        'CREATE INDEX IF NOT EXISTS ix_ufp_user_learned ON "UserFlashcardProgress" (user_id, learned_date)',
+        'CREATE INDEX IF NOT EXISTS ix_ufp_user_last_reviewed ON "UserFlashcardProgress" (user_id, last_reviewed)',
+        'CREATE INDEX IF NOT EXISTS ix_ufp_flashcard ON "UserFlashcardProgress" (flashcard_id)',
+        'CREATE INDEX IF NOT EXISTS ix_uqp_user_last_answered ON "UserQuizProgress" (user_id, last_answered)',
+        'CREATE INDEX IF NOT EXISTS ix_uqp_question ON "UserQuizProgress" (question_id)',
+        'CREATE INDEX IF NOT EXISTS ix_scorelogs_user_timestamp ON "ScoreLogs" (user_id, timestamp)',
+        'CREATE INDEX IF NOT EXISTS ix_flashcards_set ON "Flashcards" (set_id)',
+        'CREATE INDEX IF NOT EXISTS ix_quizquestions_set_passage ON "QuizQuestions" (set_id, passage_id)',
+        'CREATE INDEX IF NOT EXISTS ix_users_last_seen ON "Users" (last_seen)',
+    ]
+    for statement in statements:
+        connection.exec_driver_sql(statement)
+    connection.exec_driver_sql('ANALYZE')
+
+
+def _column_exists(connection, table_name, column_name):
+    rows = connection.exec_driver_sql(f'PRAGMA table_info("{table_name}")').fetchall()
+    return any(row[1] == column_name for row in rows)
+
+
+def _migration_002_progress_set_id(connection):
+    """
+    Thêm cột `set_id` vào UserFlashcardProgress và UserQuizProgress, điền dữ liệu từ
+    Flashcards/QuizQuestions và tạo index để các truy vấn theo bộ không cần join.
+    """
+    if not _column_exists(connection, 'UserFlashcardProgress', 'set_id'):
+        connection.exec_driver_sql(
+            'ALTER TABLE "UserFlashcardProgress" ADD COLUMN set_id INTEGER '
+            'REFERENCES "VocabularySets" (set_id) ON DELETE CASCADE'
+        )
+    if not _column_exists(connection, 'UserQuizProgress', 'set_id'):
+        connection.exec_driver_sql(
+            'ALTER TABLE "UserQuizProgress" ADD COLUMN set_id INTEGER '
+            'REFERENCES "QuestionSets" (set_id) ON DELETE CASCADE'
+        )
+
+    connection.exec_driver_sql(
+        'UPDATE "UserFlashcardProgress" SET set_id = '
+        '(SELECT f.set_id FROM "Flashcards" f WHERE f.flashcard_id = "UserFlashcardProgress".flashcard_id)'
+    )
+    connection.exec_driver_sql(
+        'UPDATE "UserQuizProgress" SET set_id = '
+        '(SELECT q.set_id FROM "QuizQuestions" q WHERE q.question_id = "UserQuizProgress".question_id)'
+    )
+
+    statements = [
+        'CREATE INDEX IF NOT EXISTS ix_ufp_user_set_due ON "UserFlashcardProgress" (user_id, set_id, is_skipped, due_time)',
+        'CREATE INDEX IF NOT EXISTS ix_ufp_user_set_learned ON "UserFlashcardProgress" (user_id, set_id, learned_date)',
+        'CREATE INDEX IF NOT EXISTS ix_uqp_user_set ON "UserQuizProgress" (user_id, set_id)',
+    ]
+    for statement in statements:
+        connection.exec_driver_sql(statement)
+    connection.exec_driver_sql('ANALYZE')
+
+
+def _migration_003_daily_activity_rollups(connection):
+    """
+    Tạo bảng DailyActivityRollups và dựng dữ liệu ban đầu từ lịch sử tiến trình và log điểm.
+    """
+    from web_app.services.activity_rollup import rebuild_activity_rollups
+
+    connection.exec_driver_sql(
+        'CREATE TABLE IF NOT EXISTS "DailyActivityRollups" ('
+        'user_id INTEGER NOT NULL REFERENCES "Users" (user_id) ON DELETE CASCADE, '
+        'activity_date VARCHAR(10) NOT NULL, '
+        'source_type VARCHAR(50) NOT NULL, '
+        'review_count INTEGER NOT NULL DEFAULT 0, '
+        'distinct_item_count INTEGER NOT NULL DEFAULT 0, '
+        'new_item_count INTEGER NOT NULL DEFAULT 0, '
+        'score_gained INTEGER NOT NULL DEFAULT 0, '
+        'PRIMARY KEY (user_id, activity_date, source_type))'
+    )
+    rebuild_activity_rollups(connection)
+
+
+def _migration_004_leaderboard_totals(connection):
+    """
+    Tạo bảng LeaderboardTotals (tổng cộng dồn theo kỳ cho bảng xếp hạng) và dựng dữ liệu cho kỳ hiện tại.
+    """
+    from web_app.services.leaderboard import rebuild_leaderboard_totals
+
+    connection.exec_driver_sql(
+        'CREATE TABLE IF NOT EXISTS "LeaderboardTotals" ('
+        'user_id INTEGER NOT NULL REFERENCES "Users" (user_id) ON DELETE CASCADE, '
+        'period VARCHAR(20) NOT NULL, '
+        'period_start INTEGER NOT NULL DEFAULT 0, '
+        'score INTEGER NOT NULL DEFAULT 0, '
+        'review_count INTEGER NOT NULL DEFAULT 0, '
+        'learned_card_count INTEGER NOT NULL DEFAULT 0, '
+        'new_card_count INTEGER NOT NULL DEFAULT 0, '
+        'quiz_answer_count INTEGER NOT NULL DEFAULT 0, '
+        'PRIMARY KEY (user_id, period))'
+    )
+    connection.exec_driver_sql(
+        'CREATE INDEX IF NOT EXISTS ix_leaderboard_period_start ON "LeaderboardTotals" (period, period_start)'
+    )
+    rebuild_leaderboard_totals(connection)
+
+
+def _migration_005_search_indexes(connection):
+    """
+    Tạo các bảng FTS5 (kèm trigger đồng bộ) cho tìm kiếm bộ thẻ, thẻ, bộ câu hỏi và câu hỏi,
+    rồi đánh chỉ mục dữ liệu hiện có.
+    """
+    from web_app.services.search_index import install_search_indexes
+
+    for fts_table, row_count in install_search_indexes(connection).items():
+        logger.info(f"Đã đánh chỉ mục {row_count} dòng vào {fts_table}.")
+
+
+def _migration_006_flashcard_keyset_index(connection):
+    """
+    Thêm index (set_id, front) cho Flashcards để phân trang theo khóa (front, flashcard_id)
+    trong một bộ thẻ đọc thẳng từ index thay vì sắp xếp lại cả bộ ở mỗi trang.
+    """
+    connection.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_flashcards_set_front ON "Flashcards" (set_id, front)')
+    connection.exec_driver_sql('ANALYZE "Flashcards"')
+
+
+def _migration_007_media_registry(connection):
+    """
+    Tạo bảng MediaAssets (sổ đăng ký file media theo số tham chiếu) và dựng dữ liệu ban đầu từ thẻ, câu hỏi
+    và các file đang có trong thư mục media.
+    """
+    from web_app.services.media_registry import rebuild_media_registry
+
+    connection.exec_driver_sql(
+        'CREATE TABLE IF NOT EXISTS "MediaAssets" ('
+        'asset_id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT, '
+        'kind VARCHAR(30) NOT NULL, '
+        'media_key VARCHAR(500) NOT NULL, '
+        'content_hash VARCHAR(64), '
+        'file_size INTEGER, '
+        'ref_count INTEGER NOT NULL DEFAULT 0, '
+        'orphaned_at INTEGER, '
+        'created_at INTEGER NOT NULL, '
+        'CONSTRAINT _media_kind_key_uc UNIQUE (kind, media_key))'
+    )
+    connection.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_media_assets_orphaned ON "MediaAssets" (orphaned_at)')
+    connection.exec_driver_sql('CREATE INDEX IF NOT EXISTS ix_media_assets_content_hash ON "MediaAssets" (content_hash)')
+    rebuild_media_registry(connection)
+
+
+def _migration_008_leaderboard_learned_cards(connection):
+    """
+    Thêm cột learned_card_count (số thẻ đã học được ôn trong kỳ) cho LeaderboardTotals và dựng lại dữ liệu
+    để lượt ôn tập/câu trả lời được đếm theo số thẻ/câu hỏi khác nhau như khi dựng lại.
+    """
+    from web_app.services.leaderboard import rebuild_leaderboard_totals
+
+    columns = {row[1] for row in connection.exec_driver_sql('PRAGMA table_info("LeaderboardTotals")').all()}
+    if 'learned_card_count' not in columns:
+        connection.exec_driver_sql(
+            'ALTER TABLE "LeaderboardTotals" ADD COLUMN learned_card_count INTEGER NOT NULL DEFAULT 0'
+        )
+    rebuild_leaderboard_totals(connection)
+
+
+MIGRATIONS = [
+    (1, "Thêm index tổng hợp cho các bảng tiến trình và log điểm", _migration_001_hot_path_indexes),
+    (2, "Thêm cột set_id cho các bảng tiến trình và điền dữ liệu", _migration_002_progress_set_id),
+    (3, "Thêm bảng tổng hợp hoạt động theo ngày cho dashboard", _migration_003_daily_activity_rollups),
+    (4, "Thêm bảng tổng điểm theo kỳ cho bảng xếp hạng", _migration_004_leaderboard_totals),
+    (5, "Thêm chỉ mục tìm kiếm toàn văn (FTS5)", _migration_005_search_indexes),
+    (6, "Thêm index phân trang theo khóa cho thẻ trong bộ", _migration_006_flashcard_keyset_index),
+    (7, "Thêm sổ đăng ký file media theo số tham chiếu", _migration_007_media_registry),
+    (8, "Thêm số thẻ đã học theo kỳ cho bảng xếp hạng", _migration_008_leaderboard_learned_cards),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def _get_schema_version(connection):
+    return connection.exec_driver_sql('PRAGMA user_version').scalar() or 0
+
+
+def _set_schema_version(connection, version):
+    # PRAGMA không hỗ trợ tham số ràng buộc, version luôn là số nguyên do code định nghĩa.
+    connection.exec_driver_sql(f'PRAGMA user_version = {int(version)}')
+
+
+def apply_migrations(db):
+    """
+    Mô tả: Áp dụng lần lượt các bước migration có phiên bản lớn hơn phiên bản hiện tại của database.
+           Mỗi bước chạy trong một transaction riêng và cập nhật `user_version` khi thành công.
+    Args:
+        db (SQLAlchemy): Instance database, cần gọi trong app_context.
+    Returns:
+        int: Phiên bản schema sau khi migrate.
+    """
+    with db.engine.connect() as connection:
+        current_version = _get_schema_version(connection)
+    logger.info(f"Phiên bản schema hiện tại: {current_version}, phiên bản mới nhất: {SCHEMA_VERSION}")
+
+    for version, description, migration_func in MIGRATIONS:
+        if version <= current_version:
+            continue
+        logger.info(f"Đang áp dụng migration {version}: {description}...")
+        with db.engine.begin() as connection:
+            migration_func(connection)
+            _set_schema_version(connection, version)
+        current_version = version
+        logger.info(f"Áp dụng migration {version} thành công.")
+
+    return current_version
+
+
+def migrate_database():
+    """
+    Thực hiện nâng cấp cấu trúc database hiện có mà không xóa dữ liệu.
+    1. Gọi `db.create_all()` để tạo các bảng mới (nếu có). Bảng đã tồn tại không bị thay đổi.
+    2. Áp dụng các bước trong `MIGRATIONS` theo `PRAGMA user_version`.
+    """
+    try:
+        from web_app import create_app, db
+        from web_app.config import DATABASE_PATH
+
+        if not os.path.exists(DATABASE_PATH):
+            logger.error(f"Không tìm thấy database tại: {DATABASE_PATH}. Hãy chạy lệnh 'install' trước.")
+            return
+
+        app = create_app()
+        with app.app_context():
+            db.create_all()
+            version = apply_migrations(db)
+            logger.info(f"Migrate database hoàn tất. Phiên bản schema: {version}")
+
+    except ImportError as e:
+        logger.critical(f"LỖI IMPORT: Không thể import các thành phần từ 'web_app'. Lỗi: {e}", exc_info=True)
+    except Exception as e:
+        logger.critical(f"Đã xảy ra lỗi không mong muốn trong quá trình migrate: {e}", exc_info=True)
+
+
+def rebuild_rollups():
+    """
+    Dựng lại toàn bộ bảng DailyActivityRollups và LeaderboardTotals từ dữ liệu lịch sử
+    (ví dụ sau khi sửa dữ liệu thủ công).
+    """
+    try:
+        from web_app import create_app, db
+        from web_app.services.activity_rollup import rebuild_activity_rollups
+        from web_app.services.leaderboard import rebuild_leaderboard_totals
+
+        app = create_app()
+        with app.app_context():
+            with db.engine.begin() as connection:
+                row_count = rebuild_activity_rollups(connection)
+                leaderboard_row_count = rebuild_leaderboard_totals(connection)
+            logger.info(f"Dựng lại bảng tổng hợp hoạt động hoàn tất: {row_count} dòng.")
+            logger.info(f"Dựng lại bảng xếp hạng hoàn tất: {leaderboard_row_count} dòng.")
+
+    except ImportError as e:
+        logger.critical(f"LỖI IMPORT: Không thể import các thành phần từ 'web_app'. Lỗi: {e}", exc_info=True)
+    except Exception as e:
+        logger.critical(f"Đã xảy ra lỗi không mong muốn khi dựng lại bảng tổng hợp: {e}", exc_info=True)
+
+
+def rebuild_media_registry():
+    """
+    Dựng lại bảng MediaAssets từ dữ liệu thẻ, câu hỏi và thư mục media
+    (ví dụ sau khi chép hoặc xóa file media thủ công), rồi băm và gộp các file trùng nội dung.
+    """
+    try:
+        from web_app import create_app, db
+        from web_app.services.media_registry import rebuild_media_registry as rebuild_registry, media_registry
+
+        app = create_app()
+        with app.app_context():
+            with db.engine.begin() as connection:
+                row_count = rebuild_registry(connection)
+            logger.info(f"Dựng lại sổ đăng ký media hoàn tất: {row_count} dòng.")
+            report = media_registry.deduplicate_files()
+            logger.info(f"Đã băm {report['hashed']} file, gộp {report['linked']} file trùng lặp "
+                        f"(tiết kiệm {report['bytes_saved']} byte).")
+
+    except ImportError as e:
+        logger.critical(f"LỖI IMPORT: Không thể import các thành phần từ 'web_app'. Lỗi: {e}", exc_info=True)
+    except Exception as e:
+        logger.critical(f"Đã xảy ra lỗi không mong muốn khi dựng lại sổ đăng ký media: {e}", exc_info=True)
+
+
+# ========================== KIỂM TRA INDEX ==========================
+# Các bảng lớn, truy vấn trên chúng không được quét toàn bộ bảng.
+INDEX_CHECKED_TABLES = {
+    'UserFlashcardProgress', 'UserQuizProgress', 'ScoreLogs', 'Flashcards', 'QuizQuestions', 'DailyActivityRollups',
+    'LeaderboardTotals'
+}
+
+_FULL_SCAN_PATTERN = re.compile(r'^SCAN (?:TABLE )?"?(\w+)"?(.*)$')
+
+
+def _seed_index_check_data(db):
+    """
+    Tạo dữ liệu tối thiểu để mọi nhánh truy vấn trong các chiến lược và thống kê đều được thực thi.
+    Chỉ gọi trên bản sao tạm của database.
+    """
+    from web_app.models import (
+        User, VocabularySet, Flashcard, UserFlashcardProgress,
+        QuestionSet, QuizQuestion, UserQuizProgress, ScoreLog
+    )
+    user = User(username='__index_check__', password='', user_role='user', daily_new_limit=999, timezone_offset=7)
+    db.session.add(user)
+    db.session.flush()
+
+    vocab_set = VocabularySet(title='__index_check__', creator_user_id=user.user_id)
+    db.session.add(vocab_set)
+    db.session.flush()
+    cards = [Flashcard(set_id=vocab_set.set_id, front=f'front {i}', back=f'back {i}') for i in range(3)]
+    db.session.add_all(cards)
+    db.session.flush()
+    db.session.add(UserFlashcardProgress(
+        user_id=user.user_id, flashcard_id=cards[0].flashcard_id,
+        last_reviewed=1, due_time=1, learned_date=1, review_count=1
+    ))
+
+    question_set = QuestionSet(title='__index_check__', creator_user_id=user.user_id)
+    db.session.add(question_set)
+    db.session.flush()
+    question = QuizQuestion(set_id=question_set.set_id, question='q', option_a='a', option_b='b', correct_answer='A')
+    db.session.add(question)
+    db.session.flush()
+    db.session.add(UserQuizProgress(user_id=user.user_id, question_id=question.question_id, last_answered=1, times_correct=1))
+    db.session.add(ScoreLog(user_id=user.user_id, score_change=1, timestamp=1, reason='index_check', source_type='flashcard'))
+    db.session.commit()
+    return user, vocab_set
+
+
+def _build_index_check_workload(user, vocab_set):
+    """
+    Liệt kê các lời gọi tới mọi chiến lược học trong `mode_strategies.py` và các hàm của `StatsService`.
+    Returns:
+        list: Danh sách (nhãn, hàm không tham số) theo thứ tự thực thi.
+    """
+    from web_app.services import mode_strategies
+    from web_app.services.stats_service import StatsService
+    from web_app.config import (
+        MODE_SEQUENTIAL_LEARNING, MODE_NEW_CARDS_ONLY, MODE_REVIEW_ALL_DUE,
+        MODE_REVIEW_HARDEST, MODE_AUTOPLAY_REVIEW
+    )
+
+    current_ts = mode_strategies._get_current_unix_timestamp(user.timezone_offset)
+    strategy_kwargs = dict(
+        user=user, current_ts=current_ts,
+        today_midnight_ts=mode_strategies._get_midnight_timestamp(current_ts, user.timezone_offset),
+        daily_new_limit=user.daily_new_limit, tz_offset_hours=user.timezone_offset, log_prefix='[INDEX_CHECK]'
+    )
+    stats = StatsService()
+
+    workload = [
+        ('mode_strategies._get_wait_time_for_set', lambda: mode_strategies._get_wait_time_for_set(
+            user.user_id, vocab_set.set_id, current_ts, user.timezone_offset, '[INDEX_CHECK]')),
+        ('mode_strategies.get_card_for_new_cards_only', lambda: mode_strategies.get_card_for_new_cards_only(
+            user_id=user.user_id, set_id=vocab_set.set_id, mode=MODE_NEW_CARDS_ONLY, **strategy_kwargs)),
+        ('mode_strategies.get_card_for_sequential_learning', lambda: mode_strategies.get_card_for_sequential_learning(
+            user_id=user.user_id, set_id=vocab_set.set_id, mode=MODE_SEQUENTIAL_LEARNING, **strategy_kwargs)),
+        ('mode_strategies.get_card_for_review_modes[all_due]', lambda: mode_strategies.get_card_for_review_modes(
+            user_id=user.user_id, set_id=vocab_set.set_id, mode=MODE_REVIEW_ALL_DUE, **strategy_kwargs)),
+        ('mode_strategies.get_card_for_review_modes[hardest]', lambda: mode_strategies.get_card_for_review_modes(
+            user_id=user.user_id, set_id=None, mode=MODE_REVIEW_HARDEST, **strategy_kwargs)),
+        ('mode_strategies.get_card_for_autoplay_review', lambda: mode_strategies.get_card_for_autoplay_review(
+            user_id=user.user_id, set_id=vocab_set.set_id, mode=MODE_AUTOPLAY_REVIEW, **strategy_kwargs)),
+        ('stats_service.get_admin_dashboard_stats', stats.get_admin_dashboard_stats),
+        ('stats_service.get_dashboard_stats', lambda: stats.get_dashboard_stats(user.user_id)),
+        ('stats_service.get_user_stats_for_context', lambda: stats.get_user_stats_for_context(user.user_id, vocab_set.set_id)),
+    ]
+    for sort_by in ('total_score', 'total_reviews', 'learned_cards', 'new_cards', 'total_quiz_answers'):
+        for timeframe in ('all_time', 'day'):
+            workload.append((
+                f'stats_service.get_user_leaderboard_data[{sort_by}|{timeframe}]',
+                lambda sort_by=sort_by, timeframe=timeframe: stats.get_user_leaderboard_data(sort_by=sort_by, timeframe=timeframe)
+            ))
+    return workload
+
+
+def _drop_planner_statistics(db):
+    """
+    Xóa các bảng thống kê của ANALYZE và mở lại kết nối để query planner không còn dùng chúng.
+    """
+    with db.engine.begin() as connection:
+        stat_tables = connection.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'sqlite_stat%'"
+        ).scalars().all()
+        for table_name in stat_tables:
+            connection.exec_driver_sql(f'DROP TABLE "{table_name}"')
+    db.session.remove()
+    db.engine.dispose()
+
+
+def check_indexes():
+    """
+    Kiểm tra bằng EXPLAIN QUERY PLAN rằng mọi truy vấn SELECT do `mode_strategies.py` và
+    `stats_service.py` sinh ra đều dùng index trên các bảng trong `INDEX_CHECKED_TABLES`.
+    Kiểm tra chạy trên một bản sao tạm của database (đã được migrate), database thật không bị thay đổi.
+    Thống kê ANALYZE (sqlite_stat*) bị xóa trong bản sao: với database nhỏ, thống kê thật khiến SQLite chọn
+    quét toàn bộ bảng dù có index, nên kết quả sẽ phụ thuộc dữ liệu đang có thay vì các index hiện có.
+    Returns:
+        bool: True nếu không có truy vấn nào quét toàn bộ bảng.
+    """
+    from web_app import config as app_config
+    from web_app.config import DATABASE_PATH
+
+    temp_dir = tempfile.mkdtemp(prefix='mindstack_index_check_')
+    temp_db_path = os.path.join(temp_dir, 'flashcard.db')
+    if os.path.exists(DATABASE_PATH):
+        shutil.copyfile(DATABASE_PATH, temp_db_path)
+        logger.info(f"Đã sao chép database sang bản tạm: {temp_db_path}")
+
+    # create_app() đọc cấu hình từ module web_app.config, trỏ tạm sang bản sao.
+    original_uri = app_config.SQLALCHEMY_DATABASE_URI
+    app_config.SQLALCHEMY_DATABASE_URI = f'sqlite:///{temp_db_path}'
+    try:
+        from sqlalchemy import event
+        from web_app import create_app, db
+
+        app = create_app()
+        with app.app_context():
+            db.create_all()
+            apply_migrations(db)
+            _drop_planner_statistics(db)
+            user, vocab_set = _seed_index_check_data(db)
+
+            captured = []
+            current_label = {'value': None}
+
+            def _capture_select(conn, cursor, statement, parameters, context, executemany):
+                if current_label['value'] and statement.lstrip().upper().startswith('SELECT'):
+                    captured.append((current_label['value'], statement, parameters))
+
+            event.listen(db.engine, 'before_cursor_execute', _capture_select)
+            try:
+                for label, func in _build_index_check_workload(user, vocab_set):
+                    current_label['value'] = label
+                    func()
+                    current_label['value'] = None
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', _capture_select)
+
+            violations = []
+            raw_connection = db.engine.raw_connection()
+            try:
+                cursor = raw_connection.cursor()
+                for label, statement, parameters in captured:
+                    cursor.execute(f'EXPLAIN QUERY PLAN {statement}', parameters)
+                    for row in cursor.fetchall():
+                        match = _FULL_SCAN_PATTERN.match(row[-1])
+                        if match and match.group(1) in INDEX_CHECKED_TABLES and 'INDEX' not in match.group(2):
+                            violations.append((label, row[-1], ' '.join(statement.split())))
+            finally:
+                raw_connection.close()
+
+            logger.info(f"Đã kiểm tra {len(captured)} truy vấn.")
+            if violations:
+                for label, detail, statement in violations:
+                    logger.error(f"[{label}] {detail}\n    SQL: {statement}")
+                logger.error(f"Có {len(violations)} truy vấn quét toàn bộ bảng mà không dùng index.")
+                return False
+
+            logger.info("Tất cả truy vấn đều sử dụng index.")
+            return True
+    finally:
+        app_config.SQLALCHEMY_DATABASE_URI = original_uri
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
 def install_database():
     """
     Thực hiện quá trình cài đặt lại cơ sở dữ liệu từ đầu.
@@ -65,6 +547,14 @@ def install_database():
             db.create_all()
             logger.info("Tạo bảng thành công. Các cột mới (nếu có) sẽ được thêm vào.")
 
+            # Database mới đã có đầy đủ cấu trúc từ models, đánh dấu phiên bản schema mới nhất.
+            # Bảng FTS5 và trigger không khai báo được trong models nên được tạo riêng.
+            from web_app.services.search_index import install_search_indexes
+            with db.engine.begin() as connection:
+                install_search_indexes(connection)
+                _set_schema_version(connection, SCHEMA_VERSION)
+            logger.info(f"Đã đặt phiên bản schema: {SCHEMA_VERSION}")
+
             # Kiểm tra và tạo tài khoản admin mặc định
             if User.query.filter_by(username='admin').first():
                 logger.warning("Tài khoản 'admin' đã tồn tại. Bỏ qua bước tạo tài khoản mặc định.")
@@ -93,9 +583,28 @@ def install_database():
         logger.critical(f"Đã xảy ra lỗi không mong muốn trong quá trình cài đặt: {e}", exc_info=True)
 
 if __name__ == '__main__':
-    # Yêu cầu xác nhận từ người dùng trước khi thực hiện hành động nguy hiểm
-    confirm = input("BẠN CÓ CHẮC CHẮN MUỐN CÀI ĐẶT LẠI DATABASE KHÔNG? TOÀN BỘ DỮ LIỆU HIỆN TẠI SẼ BỊ XÓA. (yes/no): ")
-    if confirm.lower() == 'yes':
-        install_database()
+    parser = argparse.ArgumentParser(description="Quản lý cơ sở dữ liệu Mindstack.")
+    parser.add_argument(
+        'command', nargs='?', default='install', choices=['install', 'migrate', 'check-indexes', 'rebuild-rollups', 'rebuild-media-registry'],
+        help="install: cài đặt lại từ đầu (xóa dữ liệu); migrate: nâng cấp schema, giữ nguyên dữ liệu; "
+             "check-indexes: kiểm tra các truy vấn chính đều dùng index; "
+             "rebuild-rollups: dựng lại bảng tổng hợp hoạt động theo ngày và bảng xếp hạng; "
+             "rebuild-media-registry: dựng lại sổ đăng ký file media và gộp file trùng nội dung."
+    )
+    args = parser.parse_args()
+
+    if args.command == 'migrate':
+        migrate_database()
+    elif args.command == 'check-indexes':
+        sys.exit(0 if check_indexes() else 1)
+    elif args.command == 'rebuild-rollups':
+        rebuild_rollups()
+    elif args.command == 'rebuild-media-registry':
+        rebuild_media_registry()
     else:
-        logger.info("Hủy bỏ thao tác cài đặt.")
+        # Yêu cầu xác nhận từ người dùng trước khi thực hiện hành động nguy hiểm
+        confirm = input("BẠN CÓ CHẮC CHẮN MUỐN CÀI ĐẶT LẠI DATABASE KHÔNG? TOÀN BỘ DỮ LIỆU HIỆN TẠI SẼ BỊ XÓA. (yes/no): ")
+        if confirm.lower() == 'yes':
+            install_database()
+        else:
+            logger.info("Hủy bỏ thao tác cài đặt.")
@@ -2,9 +2,6 @@
 from flask import Flask, request, session, redirect, url_for, render_template
 from .db_instance import db
 import logging
-import json
-import os
-import time
 from datetime import datetime, timedelta, timezone
 
 logger = logging.getLogger(__name__)
@@ -42,22 +39,30 @@ def create_app():
         except (TypeError, ValueError, OSError):
             return "Invalid Time"
 
+    @app.template_filter('search_highlight')
+    def search_highlight_filter(value, search_text):
+        if not search_text:
+            return value
+        from .services.search_index import highlight_markup
+        return highlight_markup(value, search_text)
+
+    from .services.last_seen_buffer import last_seen_buffer
+    from .services.runtime_settings import is_maintenance_active
+    from .services.excel_import import import_jobs
+    from .services import audio_jobs
+
+    import_jobs.init_app(app)
+    audio_jobs.init_app(app)
+
     @app.before_request
     def update_last_seen():
         if 'user_id' in session:
             if request.endpoint and (request.endpoint.startswith('static') or request.endpoint.startswith('api.')):
                 return
 
-            from .models import User
-            
-            try:
-                user = User.query.get(session['user_id'])
-                if user:
-                    user.last_seen = int(time.time())
-                    db.session.commit()
-            except Exception as e:
-                logger.error(f"Lỗi khi cập nhật last_seen cho user {session['user_id']}: {e}")
-                db.session.rollback()
+            # Chỉ ghi vào bộ đệm trong bộ nhớ, luồng nền sẽ ghi xuống database theo lô.
+            last_seen_buffer.start(app)
+            last_seen_buffer.touch(session['user_id'])
 
     @app.before_request
     def check_maintenance_mode():
@@ -71,20 +76,9 @@ def create_app():
 
         if session.get('user_role') == 'admin':
             return
-            
-        from .config import MAINTENANCE_CONFIG_PATH
-        maintenance_config = {}
-        if os.path.exists(MAINTENANCE_CONFIG_PATH):
-            try:
-                with open(MAINTENANCE_CONFIG_PATH, 'r') as f:
-                    maintenance_config = json.load(f)
-            except (IOError, json.JSONDecodeError):
-                pass
-        
-        is_active = maintenance_config.get('is_active', False)
-        end_timestamp = maintenance_config.get('end_timestamp', 0)
-
-        if is_active and time.time() < end_timestamp:
+
+        # Trạng thái bảo trì được giữ trong bộ nhớ, chỉ đọc lại file khi file thay đổi.
+        if is_maintenance_active():
             return redirect(url_for('main.maintenance_page'))
 
     @app.before_request
@@ -9,15 +9,21 @@ MAINTENANCE_CONFIG_PATH = os.path.join(BASE_DIR, "..", "..", "instance", "mainte
 # --- BẮT ĐẦU THÊM MỚI: Đường dẫn file trạng thái tác vụ ---
 TASK_STATUS_PATH = os.path.join(BASE_DIR, "..", "..", "instance", "task_status.json")
 # --- KẾT THÚC THÊM MỚI ---
+# Thư mục chứa file Excel tải lên trong lúc tác vụ nhập chạy nền
+IMPORT_UPLOAD_DIR = os.path.join(BASE_DIR, "..", "..", "instance", "imports")
 
 APP_MEDIA_BASE_DIR = os.path.join(BASE_DIR, "..", "..", "media")
 
 FLASHCARD_MEDIA_DIR = os.path.join(APP_MEDIA_BASE_DIR, "flashcard")
 FLASHCARD_AUDIO_CACHE_DIR = os.path.join(FLASHCARD_MEDIA_DIR, "audio")
+# Cache audio theo từng dòng "lang: text", dùng lại khi ghép audio nhiều dòng
+FLASHCARD_AUDIO_SEGMENT_DIR = os.path.join(FLASHCARD_AUDIO_CACHE_DIR, "segments")
 FLASHCARD_IMAGES_DIR = os.path.join(FLASHCARD_MEDIA_DIR, "images")
 
 QUIZ_MEDIA_DIR = os.path.join(APP_MEDIA_BASE_DIR, "quiz")
 QUIZ_AUDIO_CACHE_DIR = os.path.join(QUIZ_MEDIA_DIR, "audio")
+# Bản sao cục bộ của các file audio quiz được tham chiếu bằng URL (tải về khi tạo audio hàng loạt)
+QUIZ_AUDIO_REMOTE_DIR = os.path.join(QUIZ_AUDIO_CACHE_DIR, "remote")
 QUIZ_IMAGES_DIR = os.path.join(QUIZ_MEDIA_DIR, "images")
 
 # --- BẮT ĐẦU THÊM MỚI: Cấu hình cho AI Service ---
@@ -85,14 +91,80 @@ DAILY_HISTORY_MAX_DAYS = 30
 SETS_PER_PAGE = 8
 LEADERBOARD_LIMIT = 50
 
+# Hàng đợi ôn tập trong bộ nhớ: dựng lại sau TTL, giới hạn số hàng đợi giữ cùng lúc
+REVIEW_QUEUE_TTL_SECONDS = 600
+REVIEW_QUEUE_MAX_QUEUES = 1000
+
+# Cache tóm tắt tiến trình theo (người dùng, bộ thẻ): số thẻ và thời điểm đến hạn kế tiếp
+SET_SUMMARY_CACHE_TTL_SECONDS = 600
+SET_SUMMARY_CACHE_MAX_ENTRIES = 2000
+
+# Bảng xếp hạng: chỉ mục xếp hạng trong bộ nhớ được dựng lại sau TTL (đồng bộ với các worker khác)
+LEADERBOARD_CACHE_TTL_SECONDS = 300
+
+# Tổng số mục theo danh mục (thẻ đến hạn, câu sai...) khi phân trang theo cursor: đếm lại sau TTL
+CATEGORY_COUNT_CACHE_TTL_SECONDS = 60
+CATEGORY_COUNT_CACHE_MAX_ENTRIES = 2000
+CATEGORY_PAGE_SIZE = 50
+
+# Chỉ mục câu hỏi của bộ quiz và bitmap câu đã trả lời theo người dùng: dựng lại sau TTL (đồng bộ với các worker khác)
+QUIZ_SET_INDEX_TTL_SECONDS = 600
+QUIZ_ANSWERED_CACHE_MAX_ENTRIES = 2000
+
+# Users.last_seen được ghi trễ theo lô: giá trị trong database chậm tối đa số giây này
+LAST_SEEN_FLUSH_INTERVAL_SECONDS = 5
+
+# Các file cấu hình lúc chạy (ví dụ bảo trì) được kiểm tra thay đổi tối đa một lần sau số giây này
+RUNTIME_SETTINGS_CHECK_INTERVAL_SECONDS = 2
+
+# API học theo phiên: số thẻ lấy trước mỗi lần và số đánh giá tối đa trong một lô
+PREFETCH_DEFAULT_CARDS = 20
+PREFETCH_MAX_CARDS = 50
+REVIEW_BATCH_MAX_SIZE = 500
+# Đánh giá offline cũ hơn số ngày này bị từ chối khi đồng bộ
+REVIEW_BATCH_MAX_CLIENT_AGE_DAYS = 30
+
+# Nhập Excel chạy nền: số hàng ghi và commit mỗi lần, số lỗi theo hàng giữ trong báo cáo, số tác vụ giữ trạng thái
+IMPORT_CHUNK_SIZE = 1000
+IMPORT_MAX_REPORTED_ERRORS = 200
+IMPORT_MAX_TRACKED_JOBS = 50
+
+# Hàng đợi tạo audio TTS: số luồng worker, số tác vụ chờ tối đa, thời gian giữ kết quả lỗi để client đọc được
+AUDIO_WORKER_COUNT = 2
+AUDIO_JOB_QUEUE_MAX_SIZE = 500
+AUDIO_JOB_RESULT_TTL_SECONDS = 300
+# Client chờ số giây này trước khi hỏi lại audio đang được tạo
+AUDIO_JOB_RETRY_AFTER_SECONDS = 1
+# Số luồng gọi TTS cho từng đoạn audio (dùng chung cho hàng đợi audio và tạo audio hàng loạt)
+AUDIO_TTS_MAX_WORKERS = 8
+# Cách ghép audio nhiều dòng: 'frames' nối trực tiếp frame MP3 (không giải mã/mã hóa lại, tự chuyển sang
+# pydub khi các đoạn khác định dạng), 'pydub' luôn giải mã rồi mã hóa lại bằng ffmpeg
+AUDIO_CONCAT_MODE = 'frames'
+
+# Tạo audio hàng loạt (công cụ admin): số mục chạy song song, tốc độ gọi TTS/tải file (token bucket),
+# số dòng đọc mỗi lô (checkpoint lưu sau mỗi lô vào TASK_STATUS_PATH) và số lỗi giữ trong báo cáo
+AUDIO_PREGEN_CONCURRENCY = 4
+AUDIO_PREGEN_RATE_PER_SECOND = 2.0
+AUDIO_PREGEN_BURST = 4
+AUDIO_PREGEN_CHUNK_SIZE = 500
+AUDIO_PREGEN_MAX_REPORTED_ERRORS = 200
+
+# Sổ đăng ký media: file ảnh/audio quiz do người dùng đưa vào chỉ bị dọn sau khi không còn được tham chiếu
+# trong khoảng thời gian này (audio tạo tự động được dọn ngay); số dòng xử lý mỗi lô khi dọn/băm file
+MEDIA_GC_GRACE_SECONDS = 86400
+MEDIA_GC_BATCH_SIZE = 500
+
 DEFAULT_TIMEZONE_OFFSET = 7
 
 DIRECTORIES_TO_CREATE = [
     os.path.join(BASE_DIR, "..", "..", "instance"),
     FLASHCARD_AUDIO_CACHE_DIR,
+    FLASHCARD_AUDIO_SEGMENT_DIR,
     FLASHCARD_IMAGES_DIR,
     QUIZ_AUDIO_CACHE_DIR,
+    QUIZ_AUDIO_REMOTE_DIR,
     QUIZ_IMAGES_DIR,
+    IMPORT_UPLOAD_DIR,
     AI_CACHE_DIR # --- THÊM MỚI ---
 ]
 
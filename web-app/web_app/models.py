@@ -38,6 +38,8 @@ class User(db.Model):
     enable_morning_brief = db.Column(db.Integer, default=1)
     last_morning_brief_sent_date = db.Column(db.String)
 
+    __table_args__ = (db.Index('ix_users_last_seen', 'last_seen'),)
+
     created_sets = db.relationship('VocabularySet', backref='creator', lazy=True, foreign_keys='VocabularySet.creator_user_id')
     progresses = db.relationship('UserFlashcardProgress', backref='user', lazy=True, cascade="all, delete-orphan")
     notes = db.relationship('FlashcardNote', backref='user', lazy=True, cascade="all, delete-orphan")
@@ -90,6 +92,11 @@ class Flashcard(db.Model):
     ai_prompt = db.Column(db.Text, nullable=True)
     # --- KẾT THÚC THÊM MỚI ---
 
+    __table_args__ = (
+        db.Index('ix_flashcards_set', 'set_id'),
+        db.Index('ix_flashcards_set_front', 'set_id', 'front'),
+    )
+
     progresses = db.relationship('UserFlashcardProgress', backref='flashcard', lazy=True, cascade="all, delete-orphan")
     notes = db.relationship('FlashcardNote', backref='flashcard', lazy=True, cascade="all, delete-orphan")
     feedbacks = db.relationship('Feedback', backref='flashcard', lazy=True, cascade="all, delete-orphan")
@@ -103,6 +110,8 @@ class UserFlashcardProgress(db.Model):
     progress_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(db.Integer, db.ForeignKey('Users.user_id', ondelete='CASCADE'), nullable=False)
     flashcard_id = db.Column(db.Integer, db.ForeignKey('Flashcards.flashcard_id', ondelete='CASCADE'), nullable=False)
+    # Bản sao của Flashcard.set_id để lọc theo bộ mà không cần join (đồng bộ khi tạo tiến trình và khi nhập Excel)
+    set_id = db.Column(db.Integer, db.ForeignKey('VocabularySets.set_id', ondelete='CASCADE'))
     last_reviewed = db.Column(db.Integer)
     due_time = db.Column(db.Integer)
     review_count = db.Column(db.Integer, default=0)
@@ -113,7 +122,16 @@ class UserFlashcardProgress(db.Model):
     lapse_count = db.Column(db.Integer, default=0)
     is_skipped = db.Column(db.Integer, default=0)
 
-    __table_args__ = (db.UniqueConstraint('user_id', 'flashcard_id', name='_user_flashcard_uc'),)
+    # Các index phục vụ truy vấn chiến lược học và thống kê (xem MIGRATIONS trong database_install.py)
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'flashcard_id', name='_user_flashcard_uc'),
+        db.Index('ix_ufp_user_skipped_due', 'user_id', 'is_skipped', 'due_time'),
+        db.Index('ix_ufp_user_learned', 'user_id', 'learned_date'),
+        db.Index('ix_ufp_user_last_reviewed', 'user_id', 'last_reviewed'),
+        db.Index('ix_ufp_flashcard', 'flashcard_id'),
+        db.Index('ix_ufp_user_set_due', 'user_id', 'set_id', 'is_skipped', 'due_time'),
+        db.Index('ix_ufp_user_set_learned', 'user_id', 'set_id', 'learned_date'),
+    )
 
     def __repr__(self):
         return f"<Progress User:{self.user_id} Card:{self.flashcard_id} Due:{self.due_time}>"
@@ -139,9 +157,46 @@ class ScoreLog(db.Model):
     reason = db.Column(db.String)
     source_type = db.Column(db.String(50)) # flashcard, quiz, etc.
 
+    __table_args__ = (db.Index('ix_scorelogs_user_timestamp', 'user_id', 'timestamp'),)
+
     def __repr__(self):
         return f"<ScoreLog User:{self.user_id} Change:{self.score_change}>"
 
+# ========================== DailyActivityRollup ==========================
+class DailyActivityRollup(db.Model):
+    # Số liệu hoạt động cộng dồn theo ngày (theo múi giờ người dùng), cập nhật khi ghi tiến trình/điểm
+    # và có thể dựng lại bằng `python database_install.py rebuild-rollups`.
+    __tablename__ = 'DailyActivityRollups'
+    user_id = db.Column(db.Integer, db.ForeignKey('Users.user_id', ondelete='CASCADE'), primary_key=True)
+    activity_date = db.Column(db.String(10), primary_key=True) # YYYY-MM-DD
+    source_type = db.Column(db.String(50), primary_key=True) # flashcard, quiz
+    review_count = db.Column(db.Integer, nullable=False, default=0)
+    distinct_item_count = db.Column(db.Integer, nullable=False, default=0)
+    new_item_count = db.Column(db.Integer, nullable=False, default=0)
+    score_gained = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<DailyActivity User:{self.user_id} Date:{self.activity_date} Source:{self.source_type}>"
+
+# ========================== LeaderboardTotal ==========================
+class LeaderboardTotal(db.Model):
+    # Tổng cộng dồn của người dùng trong kỳ hiện tại (all_time, month, week, day).
+    # Khi sang kỳ mới (period_start thay đổi), lần ghi đầu tiên sẽ đặt lại các giá trị.
+    __tablename__ = 'LeaderboardTotals'
+    user_id = db.Column(db.Integer, db.ForeignKey('Users.user_id', ondelete='CASCADE'), primary_key=True)
+    period = db.Column(db.String(20), primary_key=True)
+    period_start = db.Column(db.Integer, nullable=False, default=0) # Unix timestamp đầu kỳ, 0 với all_time
+    score = db.Column(db.Integer, nullable=False, default=0)
+    review_count = db.Column(db.Integer, nullable=False, default=0)
+    learned_card_count = db.Column(db.Integer, nullable=False, default=0)
+    new_card_count = db.Column(db.Integer, nullable=False, default=0)
+    quiz_answer_count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (db.Index('ix_leaderboard_period_start', 'period', 'period_start'),)
+
+    def __repr__(self):
+        return f"<LeaderboardTotal User:{self.user_id} Period:{self.period} Score:{self.score}>"
+
 # ========================== QuestionSet ==========================
 class QuestionSet(db.Model):
     __tablename__ = 'QuestionSets'
@@ -196,6 +251,9 @@ class QuizQuestion(db.Model):
     
     passage_id = db.Column(db.Integer, db.ForeignKey('QuizPassages.passage_id', ondelete='SET NULL'), nullable=True)
     passage_order = db.Column(db.Integer, nullable=True)
+
+    __table_args__ = (db.Index('ix_quizquestions_set_passage', 'set_id', 'passage_id'),)
+
     progresses = db.relationship('UserQuizProgress', backref='question', lazy=True, cascade="all, delete-orphan")
     notes = db.relationship('QuizQuestionNote', backref='question', lazy=True, cascade="all, delete-orphan")
     feedbacks = db.relationship('Feedback', backref='quiz_question', lazy=True, cascade="all, delete-orphan")
@@ -209,6 +267,8 @@ class UserQuizProgress(db.Model):
     progress_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(db.Integer, db.ForeignKey('Users.user_id', ondelete='CASCADE'), nullable=False)
     question_id = db.Column(db.Integer, db.ForeignKey('QuizQuestions.question_id', ondelete='CASCADE'), nullable=False)
+    # Bản sao của QuizQuestion.set_id để lọc theo bộ mà không cần join (đồng bộ khi tạo tiến trình và khi nhập Excel)
+    set_id = db.Column(db.Integer, db.ForeignKey('QuestionSets.set_id', ondelete='CASCADE'))
     
     last_answered = db.Column(db.Integer)
     times_correct = db.Column(db.Integer, default=0, nullable=False)
@@ -216,7 +276,12 @@ class UserQuizProgress(db.Model):
     correct_streak = db.Column(db.Integer, default=0, nullable=False)
     is_mastered = db.Column(db.Boolean, default=False, nullable=False)
 
-    __table_args__ = (db.UniqueConstraint('user_id', 'question_id', name='_user_question_uc'),)
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'question_id', name='_user_question_uc'),
+        db.Index('ix_uqp_user_last_answered', 'user_id', 'last_answered'),
+        db.Index('ix_uqp_question', 'question_id'),
+        db.Index('ix_uqp_user_set', 'user_id', 'set_id'),
+    )
 
     def __repr__(self):
         return f"<UserQuizProgress User:{self.user_id} Question:{self.question_id}>"
@@ -253,3 +318,28 @@ class Feedback(db.Model):
 
     def __repr__(self):
         return f"<Feedback ID:{self.feedback_id} User:{self.user_id} Status:{self.status}>"
+
+# ========================== MediaAsset ==========================
+class MediaAsset(db.Model):
+    # Sổ đăng ký file media (ảnh, audio quiz, audio cache và đoạn audio của flashcard), khóa theo (kind, media_key)
+    # với media_key là đường dẫn tương đối trong thư mục của loại media. ref_count là số tham chiếu từ thẻ/câu hỏi,
+    # được cập nhật trong cùng transaction với thao tác ghi; orphaned_at là thời điểm số tham chiếu về 0.
+    # Có thể dựng lại bằng `python database_install.py rebuild-media-registry`.
+    __tablename__ = 'MediaAssets'
+    asset_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    kind = db.Column(db.String(30), nullable=False) # flashcard_audio, audio_segment, flashcard_image, quiz_image, quiz_audio
+    media_key = db.Column(db.String(500), nullable=False)
+    content_hash = db.Column(db.String(64), nullable=True) # SHA-256 nội dung file, tính khi file đã tồn tại
+    file_size = db.Column(db.Integer, nullable=True)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    orphaned_at = db.Column(db.Integer, nullable=True) # Unix timestamp, NULL khi còn được tham chiếu
+    created_at = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('kind', 'media_key', name='_media_kind_key_uc'),
+        db.Index('ix_media_assets_orphaned', 'orphaned_at'),
+        db.Index('ix_media_assets_content_hash', 'content_hash'),
+    )
+
+    def __repr__(self):
+        return f"<MediaAsset {self.kind}:{self.media_key} Refs:{self.ref_count}>"
@@ -4,15 +4,16 @@ import logging
 import io
 import asyncio
 import threading
-import json
-import os
 import time
 from datetime import datetime
 from sqlalchemy import text 
-from ..services import user_service, set_service, stats_service, quiz_service, audio_service
+from ..services import user_service, set_service, stats_service, quiz_service, audio_pregeneration
+from ..services.last_seen_buffer import last_seen_buffer
+from ..services.runtime_settings import maintenance_settings
+from ..services.media_registry import media_registry
 from ..models import db, User, UserFlashcardProgress
 from .decorators import admin_required
-from ..config import DATABASE_PATH, MAINTENANCE_CONFIG_PATH
+from ..config import DATABASE_PATH
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 logger = logging.getLogger(__name__)
@@ -31,13 +32,13 @@ def audio_generation_worker(app, status_dict):
             status_dict['total'] = 0
             status_dict['message'] = 'Đang khởi động...'
             status_dict['stop_requested'] = False
-            processed, total = asyncio.run(audio_service.generate_cache_for_all_cards(status_dict))
+            created, failed = asyncio.run(audio_pregeneration.run(status_dict))
             if status_dict.get('stop_requested'):
                 status_dict['status'] = 'stopped'
-                status_dict['message'] = f"Quá trình đã được dừng. Đã tạo {processed}/{total} file audio mới."
+                status_dict['message'] = f"Quá trình đã được dừng, lần chạy sau sẽ tiếp tục từ vị trí này. Đã tạo {created} file audio mới ({failed} lỗi)."
             else:
                 status_dict['status'] = 'finished'
-                status_dict['message'] = f"Hoàn tất! Đã tạo thành công {processed}/{total} file audio mới."
+                status_dict['message'] = f"Hoàn tất! Đã tạo {created} file audio mới ({failed} lỗi)."
             logger.info(f"{log_prefix} Tác vụ chạy nền đã hoàn tất với trạng thái: {status_dict['status']}.")
         except Exception as e:
             logger.error(f"{log_prefix} Lỗi trong thread tạo audio: {e}", exc_info=True)
@@ -60,6 +61,7 @@ def dashboard():
 @admin_bp.route('/users')
 @admin_required
 def manage_users():
+    last_seen_buffer.flush()
     users = User.query.all()
     return render_template('admin/manage_users.html', users=users)
 
@@ -142,15 +144,11 @@ def tools_page():
         audio_generation_task['total'] = 0
         audio_generation_task['message'] = ''
     
-    maintenance_config = {'is_active': False, 'duration_hours': 1, 'message': ''}
-    if os.path.exists(MAINTENANCE_CONFIG_PATH):
-        try:
-            with open(MAINTENANCE_CONFIG_PATH, 'r') as f:
-                maintenance_config = json.load(f)
-        except (IOError, json.JSONDecodeError):
-            pass
+    maintenance_config = maintenance_settings.get() or {'is_active': False, 'duration_hours': 1, 'message': ''}
             
-    return render_template('admin/tools.html', task_status=audio_generation_task, maintenance_config=maintenance_config)
+    resumable_audio_task = audio_pregeneration.resumable_state() if audio_generation_task['status'] != 'running' else None
+    return render_template('admin/tools.html', task_status=audio_generation_task, maintenance_config=maintenance_config,
+                           resumable_audio_task=resumable_audio_task)
 
 @admin_bp.route('/backup-database')
 @admin_required
@@ -159,6 +157,7 @@ def backup_database():
     try:
         logger.info(f"{log_prefix} Yêu cầu sao lưu database từ admin ID: {session.get('user_id')}")
         
+        last_seen_buffer.flush()
         logger.info(f"{log_prefix} Đang thực hiện checkpoint WAL để đảm bảo dữ liệu nhất quán...")
         db.session.execute(text('PRAGMA wal_checkpoint(TRUNCATE);'))
         db.session.commit()
@@ -213,8 +212,7 @@ def update_maintenance():
             flash(f"Đã bật chế độ bảo trì trong {duration_hours} giờ.", "success")
         else:
             flash("Đã tắt chế độ bảo trì.", "info")
-        with open(MAINTENANCE_CONFIG_PATH, 'w') as f:
-            json.dump(config, f, indent=4)
+        maintenance_settings.write(config)
     except Exception as e:
         logger.error(f"Lỗi khi cập nhật chế độ bảo trì: {e}", exc_info=True)
         flash("Đã xảy ra lỗi khi cập nhật chế độ bảo trì.", "error")
@@ -234,15 +232,17 @@ def stop_audio_cache():
 @admin_bp.route('/clean-audio-cache', methods=['POST'])
 @admin_required
 def clean_audio_cache():
-    log_prefix = "[ADMIN_TOOLS|CleanAudioCache]"
-    logger.info(f"{log_prefix} Yêu cầu dọn dẹp cache từ admin ID: {session.get('user_id')}")
+    log_prefix = "[ADMIN_TOOLS|CleanMedia]"
+    logger.info(f"{log_prefix} Yêu cầu dọn dẹp media từ admin ID: {session.get('user_id')}")
     try:
-        deleted_count = audio_service.clean_orphan_audio_cache()
+        deleted_count = media_registry.collect_garbage()
         if deleted_count >= 0:
-            flash(f"Đã dọn dẹp thành công và xóa {deleted_count} file audio không còn sử dụng.", "success")
+            report = media_registry.deduplicate_files()
+            flash(f"Đã dọn dẹp thành công và xóa {deleted_count} file media không còn sử dụng. "
+                  f"Gộp {report['linked']} file trùng nội dung (tiết kiệm {report['bytes_saved'] // 1024} KB).", "success")
         else:
-            flash("Đã xảy ra lỗi trong quá trình dọn dẹp cache.", "error")
+            flash("Đã xảy ra lỗi trong quá trình dọn dẹp media.", "error")
     except Exception as e:
-        logger.error(f"{log_prefix} Lỗi nghiêm trọng khi dọn dẹp cache: {e}", exc_info=True)
+        logger.error(f"{log_prefix} Lỗi nghiêm trọng khi dọn dẹp media: {e}", exc_info=True)
         flash("Đã xảy ra lỗi nghiêm trọng. Vui lòng kiểm tra log.", "error")
     return redirect(url_for('admin.tools_page'))
\ No newline at end of file
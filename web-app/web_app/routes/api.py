@@ -1,34 +1,51 @@
 # web_app/routes/api.py
-from flask import Blueprint, send_file, session, jsonify, request, Response
+from flask import Blueprint, send_file, session, jsonify, request, Response, url_for
 import logging
 import os
-import asyncio
 import hashlib
-from ..services import audio_service, note_service, flashcard_service, quiz_service, quiz_note_service, feedback_service
-from ..models import Flashcard, QuizQuestion, UserQuizProgress, QuizPassage, User 
-from ..config import FLASHCARD_IMAGES_DIR, QUIZ_IMAGES_DIR, QUIZ_AUDIO_CACHE_DIR 
-from .decorators import login_required
+from ..services import audio_jobs, note_service, flashcard_service, quiz_service, quiz_note_service, feedback_service, learning_logic_service
+from ..models import Flashcard, QuizQuestion, UserQuizProgress, QuizPassage
+from ..config import (
+    FLASHCARD_IMAGES_DIR, QUIZ_IMAGES_DIR, QUIZ_AUDIO_CACHE_DIR,
+    LEARNING_MODE_DISPLAY_NAMES, PREFETCH_DEFAULT_CARDS, PREFETCH_MAX_CARDS, REVIEW_BATCH_MAX_SIZE,
+    AUDIO_JOB_RETRY_AFTER_SECONDS, CATEGORY_PAGE_SIZE
+)
+from .decorators import login_required, get_current_user
 from ..db_instance import db 
+from ..services.audio_jobs import AUDIO_JOB_ERROR
 from ..services import ai_service
 
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 logger = logging.getLogger(__name__)
 
-def _check_edit_permission(user_id, flashcard_obj):
+def _check_edit_permission(user, flashcard_obj):
     """
     Mô tả: Helper function để kiểm tra quyền sửa thẻ.
     """
-    user = User.query.get(user_id)
     if not user or not flashcard_obj:
         return False
     set_creator_id = flashcard_obj.vocabulary_set.creator_user_id
     return user.user_role == 'admin' or user.user_id == set_creator_id
 
+def _keyset_pagination_data(keyset_page, page_number):
+    """
+    Mô tả: Thông tin phân trang trả về cho client khi phân trang theo cursor.
+           `page` chỉ để hiển thị (client tự tăng/giảm), việc chuyển trang dùng next_cursor/prev_cursor.
+    """
+    total = keyset_page.total or 0
+    return {
+        'page': page_number, 'pages': (total + CATEGORY_PAGE_SIZE - 1) // CATEGORY_PAGE_SIZE,
+        'has_prev': keyset_page.has_prev, 'has_next': keyset_page.has_next, 'total': total,
+        'next_cursor': keyset_page.next_cursor, 'prev_cursor': keyset_page.prev_cursor
+    }
+
 @api_bp.route('/card_audio/<int:flashcard_id>/<string:side>')
 @login_required
 def get_card_audio(flashcard_id, side):
     """
     Mô tả: Phục vụ file audio cho một mặt của flashcard.
+           Nếu audio chưa có trong cache, nội dung được đưa vào hàng đợi tạo audio và trả về 202;
+           client gọi lại cùng URL sau Retry-After giây cho đến khi nhận được file.
     """
     if side not in ['front', 'back']:
         return jsonify({"error": "Mặt thẻ không hợp lệ"}), 400
@@ -40,12 +57,17 @@ def get_card_audio(flashcard_id, side):
         return jsonify({"error": "Không có nội dung audio cho mặt này"}), 404
 
     try:
-        audio_file_path, success, message = asyncio.run(audio_service.get_cached_or_generate_audio(audio_content))
-        
-        if success and audio_file_path and os.path.exists(audio_file_path):
+        audio_file_path, job = audio_jobs.request_audio(audio_content)
+
+        if audio_file_path:
             return send_file(audio_file_path, mimetype="audio/mpeg")
-        else:
-            return jsonify({"error": f"Không thể tạo hoặc lấy file audio: {message}"}), 500
+        if job.status == AUDIO_JOB_ERROR:
+            return jsonify({"error": f"Không thể tạo hoặc lấy file audio: {job.message}"}), 500
+
+        response = jsonify({"status": job.status, "message": "Audio đang được tạo, vui lòng thử lại sau giây lát."})
+        response.status_code = 202
+        response.headers['Retry-After'] = str(AUDIO_JOB_RETRY_AFTER_SECONDS)
+        return response
     except Exception as e:
         logger.error(f"Lỗi không mong muốn khi phục vụ audio flashcard {flashcard_id} ({side}): {e}", exc_info=True)
         return jsonify({"error": "Lỗi server nội bộ khi xử lý audio"}), 500
@@ -163,27 +185,31 @@ def regenerate_audio(flashcard_id, side):
     """
     Mô tả: API để tái tạo audio cho một mặt của flashcard.
     """
-    user_id = session.get('user_id')
     card = flashcard_service.get_card_by_id(flashcard_id)
     
-    if not _check_edit_permission(user_id, card):
+    if not _check_edit_permission(get_current_user(), card):
         return jsonify({'status': 'error', 'message': 'Bạn không có quyền thực hiện hành động này.'}), 403
 
     if side not in ['front', 'back']:
         return jsonify({'status': 'error', 'message': 'Mặt thẻ không hợp lệ.'}), 400
 
-    success, message = asyncio.run(audio_service.regenerate_audio_for_card(flashcard_id, side))
-    
-    if success:
-        return jsonify({'status': 'success', 'message': f'Đã gửi yêu cầu tái tạo audio cho mặt {side}.'})
+    audio_content = card.front_audio_content if side == 'front' else card.back_audio_content
+    if not audio_content or not audio_content.strip():
+        return jsonify({'status': 'error', 'message': 'Không có nội dung audio để tái tạo.'}), 400
+
+    _, job = audio_jobs.request_audio(audio_content, regenerate=True)
+
+    if job.status != AUDIO_JOB_ERROR:
+        return jsonify({'status': 'success', 'message': f'Đã gửi yêu cầu tái tạo audio cho mặt {side}.'}), 202
     else:
-        return jsonify({'status': 'error', 'message': f'Tái tạo audio thất bại: {message}. Vui lòng liên hệ quản trị viên.'}), 500
+        return jsonify({'status': 'error', 'message': f'Tái tạo audio thất bại: {job.message}. Vui lòng liên hệ quản trị viên.'}), 500
 
 @api_bp.route('/cards_by_category/<int:set_id>/<string:category>')
 @login_required
 def get_cards_by_category(set_id, category):
     """
-    Mô tả: Lấy danh sách các flashcard theo danh mục (ví dụ: due, mastered).
+    Mô tả: Lấy danh sách các flashcard theo danh mục (ví dụ: due, mastered), phân trang theo cursor
+           (tham số `after`/`before` lấy từ next_cursor/prev_cursor của trang trước).
     """
     user_id = session.get('user_id')
     page = request.args.get('page', 1, type=int)
@@ -193,15 +219,114 @@ def get_cards_by_category(set_id, category):
         return jsonify({'status': 'error', 'message': 'Danh mục không hợp lệ.'}), 400
 
     try:
-        pagination = flashcard_service.get_cards_by_category(user_id, set_id, category, page)
-        cards_data = [{'front': card.front, 'back': card.back} for card in pagination.items]
-        pagination_data = {'page': pagination.page, 'pages': pagination.pages, 'has_prev': pagination.has_prev, 'has_next': pagination.has_next, 'total': pagination.total}
-        
-        return jsonify({'status': 'success', 'cards': cards_data, 'pagination': pagination_data})
+        cards_page = flashcard_service.get_cards_by_category(
+            user_id, set_id, category, after=request.args.get('after'), before=request.args.get('before')
+        )
+        cards_data = [{'front': card.front, 'back': card.back} for card in cards_page.items]
+        return jsonify({'status': 'success', 'cards': cards_data, 'pagination': _keyset_pagination_data(cards_page, page)})
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
     except Exception as e:
         logger.error(f"Lỗi khi lấy thẻ theo danh mục '{category}' cho bộ {set_id}: {e}", exc_info=True)
         return jsonify({'status': 'error', 'message': 'Lỗi server nội bộ.'}), 500
 
+def _flashcard_image_url(image_value):
+    """
+    Mô tả: Helper trả về URL hình ảnh của thẻ, giống cách template learn_card.html hiển thị.
+    """
+    if not image_value:
+        return None
+    if image_value.startswith('http://') or image_value.startswith('https://'):
+        return image_value
+    return url_for('api.serve_flashcard_image', filename=image_value)
+
+def _serialize_learning_card(flashcard, progress):
+    """
+    Mô tả: Helper chuyển một thẻ và tiến trình của nó thành dict cho API học theo phiên.
+           Thẻ mới chưa có tiến trình (progress là None) có progress_id null; client gửi đánh giá kèm flashcard_id.
+    """
+    return {
+        'progress_id': progress.progress_id if progress else None,
+        'is_new': progress is None,
+        'flashcard_id': flashcard.flashcard_id,
+        'set_id': flashcard.set_id,
+        'front': flashcard.front,
+        'back': flashcard.back,
+        'front_audio_url': url_for('api.get_card_audio', flashcard_id=flashcard.flashcard_id, side='front') if flashcard.front_audio_content else None,
+        'back_audio_url': url_for('api.get_card_audio', flashcard_id=flashcard.flashcard_id, side='back') if flashcard.back_audio_content else None,
+        'front_img_url': _flashcard_image_url(flashcard.front_img),
+        'back_img_url': _flashcard_image_url(flashcard.back_img),
+        'notification_text': flashcard.notification_text,
+        'due_time': progress.due_time if progress else None,
+        'review_count': progress.review_count if progress else 0,
+        'correct_streak': progress.correct_streak if progress else 0
+    }
+
+# Ánh xạ giống route flashcard.rate_card
+REVIEW_RESPONSE_MAPPING = {'forget': -1, 'vague': 0, 'remember': 1, 'continue': 2}
+
+@api_bp.route('/flashcard/prefetch/<int:set_id>', methods=['GET'])
+@login_required
+def prefetch_flashcards(set_id):
+    """
+    Mô tả: Lấy trước N thẻ tiếp theo của phiên học trong một request.
+           Tham số: limit (mặc định PREFETCH_DEFAULT_CARDS, tối đa PREFETCH_MAX_CARDS),
+           mode (tùy chọn, mặc định là chế độ học hiện tại của người dùng).
+    """
+    user_id = session.get('user_id')
+    limit = request.args.get('limit', PREFETCH_DEFAULT_CARDS, type=int)
+    limit = max(1, min(limit, PREFETCH_MAX_CARDS))
+    mode = request.args.get('mode')
+    if mode is not None and mode not in LEARNING_MODE_DISPLAY_NAMES:
+        return jsonify({'status': 'error', 'message': 'Chế độ học không hợp lệ.'}), 400
+
+    try:
+        user = get_current_user()
+        if mode is None:
+            mode = user.current_mode
+        cards, wait_time_ts = learning_logic_service.get_next_cards_batch(user_id, set_id, mode, limit, user=user)
+        if cards is None:
+            return jsonify({'status': 'error', 'message': 'Không tìm thấy người dùng.'}), 404
+
+        cards_data = [_serialize_learning_card(flashcard, progress) for flashcard, progress in cards]
+        return jsonify({'status': 'success', 'mode': mode, 'cards': cards_data, 'wait_time_ts': wait_time_ts})
+    except Exception as e:
+        logger.error(f"Lỗi khi lấy trước thẻ cho bộ {set_id}: {e}", exc_info=True)
+        return jsonify({'status': 'error', 'message': 'Lỗi server nội bộ.'}), 500
+
+@api_bp.route('/flashcard/review_batch', methods=['POST'])
+@login_required
+def review_flashcards_batch():
+    """
+    Mô tả: Nhận một lô đánh giá và áp dụng trong một transaction.
+           Body JSON: {"ratings": [{"progress_id": 1, "response": "remember", "client_ts": 1700000000}, ...]}
+           Thẻ mới lấy từ API prefetch (progress_id null) gửi {"progress_id": null, "flashcard_id": 5, ...};
+           tiến trình của thẻ được tạo ở đánh giá đầu tiên và trả về trong kết quả.
+           response có thể là chuỗi như route rate_card ('forget', 'vague', 'remember', 'continue') hoặc số (-1, 0, 1, 2).
+           client_ts (tùy chọn) là thời điểm đánh giá phía client, dùng khi đồng bộ các lượt học offline.
+    """
+    user_id = session.get('user_id')
+    data = request.get_json(silent=True) or {}
+    ratings_data = data.get('ratings')
+    if not isinstance(ratings_data, list) or not ratings_data:
+        return jsonify({'status': 'error', 'message': 'Thiếu danh sách đánh giá.'}), 400
+    if len(ratings_data) > REVIEW_BATCH_MAX_SIZE:
+        return jsonify({'status': 'error', 'message': f'Tối đa {REVIEW_BATCH_MAX_SIZE} đánh giá mỗi lần gửi.'}), 400
+
+    ratings = []
+    for item in ratings_data:
+        if not isinstance(item, dict):
+            return jsonify({'status': 'error', 'message': 'Đánh giá không hợp lệ.'}), 400
+        response = item.get('response')
+        if isinstance(response, str):
+            response = REVIEW_RESPONSE_MAPPING.get(response)
+        ratings.append((item.get('progress_id'), response, item.get('client_ts'), item.get('flashcard_id')))
+
+    results, status = learning_logic_service.process_review_batch(user_id, ratings, user=get_current_user())
+    if results is None:
+        return jsonify({'status': 'error', 'message': status}), 500
+    return jsonify({'status': 'success', 'results': results})
+
 @api_bp.route('/quiz_note/<int:question_id>', methods=['GET', 'POST'])
 @login_required
 def handle_quiz_note(question_id):
@@ -332,7 +457,7 @@ def get_quiz_audio(filepath):
 @login_required
 def get_quiz_questions_by_category(set_id, category):
     """
-    Mô tả: Lấy danh sách các câu hỏi quiz theo danh mục.
+    Mô tả: Lấy danh sách các câu hỏi quiz theo danh mục, phân trang theo cursor như get_cards_by_category.
     """
     user_id = session.get('user_id')
     page = request.args.get('page', 1, type=int)
@@ -340,39 +465,18 @@ def get_quiz_questions_by_category(set_id, category):
     if category not in valid_categories:
         return jsonify({'status': 'error', 'message': 'Danh mục không hợp lệ.'}), 400
     try:
-        all_questions_in_set = QuizQuestion.query.filter_by(set_id=set_id).order_by(QuizQuestion.question_id).all()
-        user_progresses = {p.question_id: p for p in UserQuizProgress.query.filter_by(user_id=user_id).join(QuizQuestion).filter(QuizQuestion.set_id == set_id).all()}
-        filtered_questions = []
-        for question in all_questions_in_set:
-            progress = user_progresses.get(question.question_id)
-            if category == 'unanswered':
-                if not progress:
-                    filtered_questions.append(question)
-            elif progress:
-                if category == 'correct' and progress.times_correct > 0:
-                    filtered_questions.append(question)
-                elif category == 'incorrect' and progress.times_incorrect > 0:
-                    filtered_questions.append(question)
-                elif category == 'mastered' and progress.is_mastered:
-                    filtered_questions.append(question)
-        start_index = (page - 1) * 50
-        end_index = start_index + 50
-        paginated_items = filtered_questions[start_index:end_index]
-        total_items = len(filtered_questions)
-        total_pages = (total_items + 49) // 50
-        questions_data = []
-        for q in paginated_items:
-            questions_data.append({
-                'question_id': q.question_id, 'question': q.question,
-                'option_a': q.option_a, 'option_b': q.option_b,
-                'option_c': q.option_c, 'option_d': q.option_d,
-                'correct_answer': q.correct_answer
-            })
-        pagination_data = {
-            'page': page, 'pages': total_pages, 'has_prev': page > 1,
-            'has_next': page < total_pages, 'total': total_items
-        }
-        return jsonify({'status': 'success', 'questions': questions_data, 'pagination': pagination_data})
+        questions_page = quiz_service.get_questions_by_category(
+            user_id, set_id, category, after=request.args.get('after'), before=request.args.get('before')
+        )
+        questions_data = [{
+            'question_id': q.question_id, 'question': q.question,
+            'option_a': q.option_a, 'option_b': q.option_b,
+            'option_c': q.option_c, 'option_d': q.option_d,
+            'correct_answer': q.correct_answer
+        } for q in questions_page.items]
+        return jsonify({'status': 'success', 'questions': questions_data, 'pagination': _keyset_pagination_data(questions_page, page)})
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
     except Exception as e:
         logger.error(f"Lỗi khi lấy câu hỏi quiz theo danh mục '{category}' cho bộ {set_id}: {e}", exc_info=True)
         return jsonify({'status': 'error', 'message': 'Lỗi server nội bộ.'}), 500
@@ -1,7 +1,29 @@
 # web_app/routes/decorators.py
 from functools import wraps
-from flask import session, flash, redirect, url_for
-from ..models import User
+from flask import session, flash, redirect, url_for, g
+from sqlalchemy.orm import load_only
+from ..models import db, User
+
+# Các cột của người dùng hiện tại được dùng trong hầu hết các request; các cột còn lại
+# (mật khẩu, cấu hình thông báo...) chỉ được nạp khi truy cập lần đầu.
+CURRENT_USER_COLUMNS = (
+    User.user_id, User.username, User.user_role, User.score, User.timezone_offset,
+    User.daily_new_limit, User.current_mode, User.current_quiz_mode,
+    User.current_set_id, User.current_question_set_id,
+    User.front_audio, User.back_audio, User.front_image_enabled, User.back_image_enabled
+)
+
+def get_current_user():
+    """
+    Mô tả: Lấy người dùng đang đăng nhập. Bảng Users chỉ được truy vấn một lần cho mỗi request,
+    kết quả được lưu trong flask.g để decorator, route và service dùng chung.
+    Returns:
+        User | None: Người dùng hiện tại hoặc None nếu chưa đăng nhập/không tồn tại.
+    """
+    if '_current_user' not in g:
+        user_id = session.get('user_id')
+        g._current_user = db.session.get(User, user_id, options=[load_only(*CURRENT_USER_COLUMNS)]) if user_id else None
+    return g._current_user
 
 def login_required(f):
     """
@@ -23,7 +45,7 @@ def admin_required(f):
     @wraps(f)
     @login_required # Tự động kiểm tra đăng nhập trước
     def decorated_function(*args, **kwargs):
-        user = User.query.get(session.get('user_id'))
+        user = get_current_user()
         if not user or user.user_role != 'admin':
             flash("Bạn không có quyền truy cập trang quản trị.", "error")
             return redirect(url_for('flashcard.index')) # Đã cập nhật url_for
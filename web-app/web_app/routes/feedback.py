@@ -1,8 +1,7 @@
 # web_app/routes/feedback.py
 from flask import Blueprint, render_template, session, redirect, url_for, flash, request
 from ..services import feedback_service
-from ..models import User
-from .decorators import login_required
+from .decorators import login_required, get_current_user
 
 feedback_bp = Blueprint('feedback', __name__, url_prefix='/feedback')
 
@@ -13,7 +12,7 @@ def list_feedback():
     Mô tả: Hiển thị trang danh sách feedback cho người dùng đã đăng nhập, có hỗ trợ lọc.
     """
     user_id = session['user_id']
-    user = User.query.get(user_id)
+    user = get_current_user()
 
     # BẮT ĐẦU THAY ĐỔI: Lấy tham số lọc từ URL
     filter_sent = request.args.get('filter_sent', 'all')
@@ -2,12 +2,11 @@
 from flask import Blueprint, render_template, session, redirect, url_for, flash, request
 import logging
 import json
-import os
 import time
 from ..services import stats_service
-from ..models import User
-from .decorators import login_required
-from ..config import MAINTENANCE_CONFIG_PATH
+from ..services.stats_service import LEADERBOARD_SORT_METRICS
+from .decorators import login_required, get_current_user
+from ..services.runtime_settings import maintenance_settings
 
 main_bp = Blueprint('main', __name__)
 logger = logging.getLogger(__name__)
@@ -33,8 +32,8 @@ def dashboard():
     Mô tả: Hiển thị trang thống kê (dashboard) cho người dùng.
     """
     user_id = session.get('user_id')
-    user = User.query.get(user_id)
-    dashboard_data = stats_service.get_dashboard_stats(user_id)
+    user = get_current_user()
+    dashboard_data = stats_service.get_dashboard_stats(user_id, user=user)
     if not dashboard_data:
         flash("Không thể tải dữ liệu thống kê.", "error")
         return redirect(url_for('main.home'))
@@ -42,11 +41,14 @@ def dashboard():
     
     current_question_set_id = user.current_question_set_id if user else None
     sort_by = request.args.get('sort_by', 'total_score')
+    if sort_by not in LEADERBOARD_SORT_METRICS:
+        sort_by = 'total_score'
     timeframe = request.args.get('timeframe', 'all_time')
     
     leaderboard_data = stats_service.get_user_leaderboard_data(
         sort_by=sort_by, timeframe=timeframe, limit=10
     )
+    current_user_rank = stats_service.get_user_leaderboard_rank(user_id, sort_by=sort_by, timeframe=timeframe)
 
     return render_template(
         'dashboard.html', 
@@ -55,6 +57,7 @@ def dashboard():
         current_set_id=user.current_set_id,
         current_question_set_id=current_question_set_id,
         leaderboard_data=leaderboard_data,
+        current_user_rank=current_user_rank,
         current_sort_by=sort_by,
         current_timeframe=timeframe
     )
@@ -64,12 +67,6 @@ def maintenance_page():
     """
     Mô tả: Hiển thị trang thông báo bảo trì cho người dùng.
     """
-    config = {'end_timestamp': time.time() + 3600, 'message': 'Hệ thống sẽ sớm quay trở lại.'}
-    if os.path.exists(MAINTENANCE_CONFIG_PATH):
-        try:
-            with open(MAINTENANCE_CONFIG_PATH, 'r') as f:
-                config = json.load(f)
-        except (IOError, json.JSONDecodeError):
-            pass
+    config = maintenance_settings.get() or {'end_timestamp': time.time() + 3600, 'message': 'Hệ thống sẽ sớm quay trở lại.'}
     
     return render_template('maintenance.html', config=config)
@@ -1,13 +1,12 @@
 # web_app/routes/quiz.py
 from flask import Blueprint, render_template, session, redirect, url_for, request, flash, jsonify
 import logging
-from ..services import quiz_service, quiz_note_service
-from ..models import db, User, QuizQuestion, UserQuizProgress, QuizPassage, QuestionSet
-# BẮT ĐẦU SỬA: Import thêm `or_`
+from ..services import quiz_service
+from ..models import db, QuizPassage, QuestionSet
 from ..config import QUIZ_MODE_DISPLAY_NAMES, SETS_PER_PAGE
-from sqlalchemy import func, or_
-# KẾT THÚC SỬA
-from .decorators import login_required
+from .decorators import login_required, get_current_user
+from ..services.search_index import question_set_search
+from ..services.set_listing import quiz_set_listing
 from markupsafe import Markup, escape
 import json
 import os
@@ -15,40 +14,6 @@ import os
 quiz_bp = Blueprint('quiz', __name__, url_prefix='/quiz')
 logger = logging.getLogger(__name__)
 
-class CustomPagination:
-    def __init__(self, page, per_page, total, items):
-        self.page = page
-        self.per_page = per_page
-        self.total = total
-        self.items = items
-        self.pages = (total + per_page - 1) // per_page if total > 0 else 0
-        self.has_prev = page > 1
-        self.has_next = page < self.pages
-        self.prev_num = page - 1
-        self.next_num = page + 1
-    
-    def iter_pages(self, left_edge=1, right_edge=1, left_current=1, right_current=2):
-        last_page = 0
-        for num in range(1, self.pages + 1):
-            if num <= left_edge or \
-               (num > self.page - left_current - 1 and num < self.page + right_current) or \
-               num > self.pages - right_edge:
-                if last_page + 1 != num:
-                    yield None
-                yield num
-                last_page = num
-
-def _sort_sets_by_progress(set_items, total_key, completed_key):
-    def custom_sort_key(set_item):
-        total = getattr(set_item, total_key, 0)
-        completed = getattr(set_item, completed_key, 0)
-        title = getattr(set_item, 'title', '')
-        if total == 0: return (float('-inf'), title) 
-        percentage = (completed * 100 / total)
-        if percentage == 100: return (0, title) 
-        return (-percentage, title)
-    return sorted(set_items, key=custom_sort_key)
-
 def _serialize_quiz_question(q_data_dict):
     """
     Mô tả: Chuyển đổi đối tượng QuizQuestion và các dữ liệu liên quan thành dictionary.
@@ -93,73 +58,25 @@ def _serialize_quiz_question(q_data_dict):
 @login_required
 def index():
     user_id = session.get('user_id')
-    user = User.query.get(user_id)
+    user = get_current_user()
     page_started = request.args.get('page_started', 1, type=int)
     page_new = request.args.get('page_new', 1, type=int)
     # BẮT ĐẦU THÊM MỚI: Lấy tham số tìm kiếm
     search_query = request.args.get('q', None)
     # KẾT THÚC THÊM MỚI
 
-    started_set_ids_query = db.session.query(QuizQuestion.set_id).join(
-        UserQuizProgress, UserQuizProgress.question_id == QuizQuestion.question_id
-    ).filter(UserQuizProgress.user_id == user_id).distinct()
-    started_set_ids = {row[0] for row in started_set_ids_query.all()}
-
-    started_sets_with_progress = []
-    if started_set_ids:
-        # BẮT ĐẦU SỬA: Thêm logic lọc tìm kiếm cho các bộ đã bắt đầu
-        started_sets_query = QuestionSet.query.filter(QuestionSet.set_id.in_(started_set_ids))
-        if search_query:
-            search_term = f"%{search_query}%"
-            started_sets_query = started_sets_query.filter(
-                or_(
-                    QuestionSet.title.ilike(search_term),
-                    QuestionSet.description.ilike(search_term)
-                )
-            )
-        started_sets_raw = started_sets_query.all()
-        # KẾT THÚC SỬA
-
-        total_questions_map = dict(db.session.query(
-            QuizQuestion.set_id, func.count(QuizQuestion.question_id)
-        ).filter(QuizQuestion.set_id.in_(started_set_ids)).group_by(QuizQuestion.set_id).all())
-        
-        answered_questions_map = dict(db.session.query(
-            QuizQuestion.set_id, func.count(UserQuizProgress.progress_id)
-        ).join(QuizQuestion).filter(
-            UserQuizProgress.user_id == user_id,
-            QuizQuestion.set_id.in_(started_set_ids)
-        ).group_by(QuizQuestion.set_id).all())
-
-        for set_item in started_sets_raw:
-            set_item.total_questions = total_questions_map.get(set_item.set_id, 0)
-            set_item.answered_questions = answered_questions_map.get(set_item.set_id, 0)
-            set_item.creator_username = set_item.creator.username if set_item.creator else "N/A"
-            started_sets_with_progress.append(set_item)
-
-    sorted_started_sets = _sort_sets_by_progress(started_sets_with_progress, 
-                                                 total_key='total_questions', 
-                                                 completed_key='answered_questions')
-    
-    total_items_started = len(sorted_started_sets)
-    start_index_started = (page_started - 1) * SETS_PER_PAGE
-    end_index_started = start_index_started + SETS_PER_PAGE
-    paginated_started_sets_items = sorted_started_sets[start_index_started:end_index_started]
-    started_sets_pagination = CustomPagination(page_started, SETS_PER_PAGE, total_items_started, paginated_started_sets_items)
+    started_sets_pagination = quiz_set_listing.paginate(user_id, page_started, SETS_PER_PAGE, search_text=search_query)
+    for set_item in started_sets_pagination.items:
+        set_item.creator_username = set_item.creator.username if set_item.creator else "N/A"
 
     # BẮT ĐẦU SỬA: Thêm logic lọc tìm kiếm cho các bộ mới
     new_sets_query = QuestionSet.query.filter(
         QuestionSet.is_public == True,
-        ~QuestionSet.set_id.in_(started_set_ids)
+        ~QuestionSet.set_id.in_(quiz_set_listing.started_set_ids_query(user_id))
     )
     if search_query:
-        search_term = f"%{search_query}%"
-        new_sets_query = new_sets_query.filter(
-            or_(
-                QuestionSet.title.ilike(search_term),
-                QuestionSet.description.ilike(search_term)
-            )
-        )
+        # Kết quả tìm kiếm sắp xếp theo độ liên quan, cùng độ liên quan thì theo tên
+        new_sets_query = question_set_search.filter_query(new_sets_query, search_query)
     new_sets_query = new_sets_query.order_by(QuestionSet.title.asc())
     # KẾT THÚC SỬA
     new_sets_pagination = new_sets_query.paginate(page=page_new, per_page=SETS_PER_PAGE, error_out=False)
@@ -177,24 +94,22 @@ def index():
 @login_required
 def take_set(set_id):
     user_id = session.get('user_id')
-    user = User.query.get(user_id)
-    user.current_question_set_id = set_id
-    db.session.commit()
+    user = get_current_user()
+    # Chỉ ghi khi bộ hiện tại thay đổi: commit sẽ làm hết hạn đối tượng user và phải nạp lại.
+    if user.current_question_set_id != set_id:
+        user.current_question_set_id = set_id
+        db.session.commit()
     
     current_mode = user.current_quiz_mode
-    questions, passage = quiz_service.get_next_question_group_for_user(user_id, set_id, current_mode)
+    questions, passage = quiz_service.get_next_question_group_for_user(user_id, set_id, current_mode, user=user)
     
     if not questions:
         flash("Chúc mừng! Bạn đã hoàn thành tất cả câu hỏi trong chế độ này.", "success")
         return redirect(url_for('quiz.index'))
 
-    total_questions_in_set = QuizQuestion.query.filter_by(set_id=set_id).count()
-    answered_count_in_set = UserQuizProgress.query.join(QuizQuestion).filter(
-        UserQuizProgress.user_id == user_id, QuizQuestion.set_id == set_id
-    ).count()
-
-    progress_data = {'current': answered_count_in_set, 'total': total_questions_in_set}
-    quiz_set_stats = quiz_service.get_quiz_set_stats_for_user(user_id, set_id)
+    group_view = quiz_service.get_question_group_view(user_id, set_id, questions)
+    quiz_set_stats = group_view['stats']
+    progress_data = {'current': quiz_set_stats.get('answered_questions', 0), 'total': quiz_set_stats.get('total_questions', 0)}
     
     questions_data_for_template = []
     common_audio_file_for_group = None
@@ -210,11 +125,11 @@ def take_set(set_id):
             common_image_file_for_group = first_q_image
 
     for i, q in enumerate(questions):
-        can_edit_q = (user.user_id == q.question_set.creator_user_id)
+        can_edit_q = (group_view['question_set'] is not None and user.user_id == group_view['question_set'].creator_user_id)
         can_feedback_q = not can_edit_q
         
-        note = quiz_note_service.get_note_by_question_id(user_id, q.question_id)
-        question_progress = UserQuizProgress.query.filter_by(user_id=user_id, question_id=q.question_id).first()
+        note = group_view['notes'].get(q.question_id)
+        question_progress = group_view['progress'].get(q.question_id)
 
         display_pre_text = i == 0 or (q.passage_id is None or q.pre_question_text != questions[i-1].pre_question_text)
         
@@ -251,7 +166,7 @@ def submit_answers():
     data = request.get_json()
     if not data or not isinstance(data, list):
         return jsonify({'status': 'error', 'message': 'Dữ liệu không hợp lệ.'}), 400
-    results = quiz_service.process_user_answers(user_id, data)
+    results = quiz_service.process_user_answers(user_id, data, user=get_current_user())
     if not results or any(r.get('status') == 'error' for r in results):
         return jsonify({'status': 'error', 'message': 'Lỗi khi xử lý câu trả lời.', 'results': results}), 500
     return jsonify({'status': 'success', 'message': 'Đã nộp câu trả lời thành công!', 'results': results})
@@ -259,7 +174,7 @@ def submit_answers():
 @quiz_bp.route('/select-mode')
 @login_required
 def select_mode():
-    user = User.query.get(session.get('user_id'))
+    user = get_current_user()
     return render_template('quiz/select_quiz_mode.html', 
                            modes=QUIZ_MODE_DISPLAY_NAMES, 
                            current_mode=user.current_quiz_mode)
@@ -271,7 +186,7 @@ def set_quiz_mode(mode_code):
         flash("Chế độ làm bài không hợp lệ.", "error")
         return redirect(url_for('quiz.select_mode'))
     
-    user = User.query.get(session.get('user_id'))
+    user = get_current_user()
     user.current_quiz_mode = mode_code
     db.session.commit()
     flash(f"Chế độ làm bài đã được thay đổi thành '{QUIZ_MODE_DISPLAY_NAMES[mode_code]}'.", "success")
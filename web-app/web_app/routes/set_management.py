@@ -1,13 +1,34 @@
 # web_app/routes/set_management.py
-from flask import Blueprint, render_template, request, flash, redirect, url_for, session, send_file
+import unicodedata
+from urllib.parse import quote
+
+from flask import Blueprint, render_template, request, flash, redirect, url_for, session, send_file, jsonify, Response, stream_with_context
 # --- BẮT ĐẦU THAY ĐỔI: Import thêm flashcard_service ---
 from ..services import set_service, quiz_service, flashcard_service
 # --- KẾT THÚC THAY ĐỔI ---
 from ..models import User
+from ..services.excel_import import import_jobs
+from ..services.set_service import IMPORT_KIND_FLASHCARD
+from ..services.quiz_service import IMPORT_KIND_QUIZ
 from .decorators import login_required
 
 set_management_bp = Blueprint('set_management', __name__, url_prefix='/sets')
 
+def _zip_download_response(zip_chunks, download_name):
+    """
+    Mô tả: Trả file ZIP dạng luồng (chunked) thay vì dựng toàn bộ trong bộ nhớ rồi gửi bằng send_file.
+           Header Content-Disposition được đặt giống send_file (có filename* cho tên không phải ASCII).
+    """
+    response = Response(stream_with_context(zip_chunks), mimetype='application/zip')
+    try:
+        download_name.encode('ascii')
+        names = {'filename': download_name}
+    except UnicodeEncodeError:
+        simple_name = unicodedata.normalize('NFKD', download_name).encode('ascii', 'ignore').decode('ascii')
+        names = {'filename': simple_name, 'filename*': f"UTF-8''{quote(download_name, safe='!#$&+^`|~')}"}
+    response.headers.set('Content-Disposition', 'attachment', **names)
+    return response
+
 @set_management_bp.route('/manage')
 @login_required
 def manage():
@@ -49,6 +70,9 @@ def add_flashcard_set():
         
         if status == "success":
             flash(f"Bộ thẻ '{new_set.title}' đã được thêm thành công.", "success")
+            if file_stream:
+                flash("Dữ liệu từ file Excel đang được nhập trong nền, tiến độ hiển thị bên dưới.", "info")
+                return redirect(url_for('set_management.edit_flashcard_set', set_id=new_set.set_id))
             if session.get('user_role') == 'admin':
                 return redirect(url_for('admin.manage_sets'))
             return redirect(url_for('set_management.manage'))
@@ -67,7 +91,7 @@ def edit_flashcard_set(set_id):
     """
     user_id = session['user_id']
     user_role = session.get('user_role')
-    set_to_edit = set_service.get_set_by_id(set_id)
+    set_to_edit = set_service.get_set_by_id(set_id, with_cards=False)
 
     # Kiểm tra quyền truy cập
     if not set_to_edit or (set_to_edit.creator_user_id != user_id and user_role != 'admin'):
@@ -83,10 +107,17 @@ def edit_flashcard_set(set_id):
             if file and file.filename != '':
                 file_stream = file.stream
         
-        updated_set, status = set_service.update_set(set_id, data, user_id, file_stream)
+        if file_stream:
+            # Thông tin bộ thẻ và nội dung Excel được ghi trong cùng một giao dịch
+            report, status = set_service.sync_set_from_excel(set_id, user_id, file_stream, data=data)
+            if status == "success":
+                flash(f"Đồng bộ từ Excel: thêm {report['added']}, cập nhật {report['changed']}, "
+                      f"giữ nguyên {report['unchanged']}, xóa {report['removed']} thẻ.", "info")
+        else:
+            _, status = set_service.update_set(set_id, data, user_id)
         
         if status == "success":
-            flash(f"Cập nhật bộ thẻ '{updated_set.title}' thành công.", "success")
+            flash(f"Cập nhật bộ thẻ '{set_to_edit.title}' thành công.", "success")
             # Chuyển hướng về chính trang edit để xem thay đổi
             return redirect(url_for('set_management.edit_flashcard_set', set_id=set_id))
         else:
@@ -109,6 +140,7 @@ def edit_flashcard_set(set_id):
     return render_template(
         'set_management/edit_flashcard_set.html', 
         set_data=set_to_edit,
+        import_job=import_jobs.latest_for_set(IMPORT_KIND_FLASHCARD, set_id),
         cards_pagination=cards_pagination,
         search_term=search_term,
         search_field=search_field
@@ -175,9 +207,18 @@ def export_flashcard_set_zip(set_id):
     
     safe_title = "".join(c for c in set_to_export.title if c.isalnum() or c in (' ', '_')).rstrip()
     filename = f"BoThe_{safe_title}_Full.zip"
-    return send_file(
-        zip_stream, as_attachment=True, download_name=filename, mimetype='application/zip'
-    )
+    return _zip_download_response(zip_stream, filename)
+
+@set_management_bp.route('/import-jobs/<job_id>')
+@login_required
+def import_job_status(job_id):
+    """
+    Mô tả: Trả về tiến độ và báo cáo lỗi theo hàng của một tác vụ nhập Excel chạy nền.
+    """
+    job = import_jobs.get(job_id)
+    if not job or (job.user_id != session['user_id'] and session.get('user_role') != 'admin'):
+        return jsonify({'status': 'error', 'message': 'Không tìm thấy tác vụ nhập dữ liệu.'}), 404
+    return jsonify({'status': 'success', 'job': job.to_dict()})
 
 # --- Routes cho Quiz Sets ---
 
@@ -200,6 +241,9 @@ def add_quiz_set():
         
         if status == "success":
             flash(f"Bộ câu hỏi '{new_set.title}' đã được thêm thành công.", "success")
+            if file_stream:
+                flash("Dữ liệu từ file Excel đang được nhập trong nền, tiến độ hiển thị bên dưới.", "info")
+                return redirect(url_for('set_management.edit_quiz_set', set_id=new_set.set_id))
             if session.get('user_role') == 'admin':
                 return redirect(url_for('admin.manage_question_sets'))
             return redirect(url_for('set_management.manage'))
@@ -244,7 +288,8 @@ def edit_quiz_set(set_id):
         else:
             flash(f"Lỗi khi cập nhật bộ câu hỏi: {status}", "error")
     
-    return render_template('set_management/edit_quiz_set.html', set_data=set_to_edit)
+    return render_template('set_management/edit_quiz_set.html', set_data=set_to_edit,
+                           import_job=import_jobs.latest_for_set(IMPORT_KIND_QUIZ, set_id))
 
 @set_management_bp.route('/quiz/delete/<int:set_id>', methods=['POST'])
 @login_required
@@ -307,6 +352,4 @@ def export_quiz_set_zip(set_id):
     
     safe_title = "".join(c for c in set_to_export.title if c.isalnum() or c in (' ', '_')).rstrip()
     filename = f"BoCauHoi_{safe_title}_Full.zip"
-    return send_file(
-        zip_stream, as_attachment=True, download_name=filename, mimetype='application/zip'
-    )
+    return _zip_download_response(zip_stream, filename)
@@ -9,11 +9,15 @@ from .flashcard_service import FlashcardService
 from .quiz_service import QuizService
 from .quiz_note_service import QuizNoteService
 from .feedback_service import FeedbackService
+from .audio_jobs import AudioJobQueue
+from .audio_pregeneration import AudioPregenerationPipeline
 
 learning_logic_service = LearningLogicService()
 user_service = UserService()
 stats_service = StatsService()
 audio_service = AudioService()
+audio_jobs = AudioJobQueue(audio_service)
+audio_pregeneration = AudioPregenerationPipeline(audio_service)
 note_service = NoteService()
 set_service = SetService()
 flashcard_service = FlashcardService()
@@ -0,0 +1,166 @@
+# web_app/services/activity_rollup.py
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func, select, delete, insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from ..models import db, User, UserFlashcardProgress, UserQuizProgress, ScoreLog, DailyActivityRollup
+from ..config import DEFAULT_TIMEZONE_OFFSET
+from .leaderboard import leaderboard_engine
+
+logger = logging.getLogger(__name__)
+
+SOURCE_FLASHCARD = 'flashcard'
+SOURCE_QUIZ = 'quiz'
+
+ROLLUP_COUNTERS = ('review_count', 'distinct_item_count', 'new_item_count', 'score_gained')
+
+
+def local_date_key(ts, tz_offset_hours):
+    """
+    Mô tả: Chuyển Unix timestamp thành khóa ngày 'YYYY-MM-DD' theo múi giờ của người dùng.
+    """
+    if tz_offset_hours is None:
+        tz_offset_hours = DEFAULT_TIMEZONE_OFFSET
+    tz = timezone(timedelta(hours=tz_offset_hours))
+    return datetime.fromtimestamp(ts, tz).strftime('%Y-%m-%d')
+
+
+class ActivityRollupBuffer:
+    """
+    Mô tả: Gom các thay đổi hoạt động theo (user_id, activity_date, source_type) trong một thao tác ghi
+           rồi cộng dồn vào bảng DailyActivityRollups bằng một lệnh upsert, trong cùng transaction
+           với tiến trình/điểm số (không tự commit). Các hoạt động cũng được chuyển cho bảng xếp hạng.
+    """
+    def __init__(self, tz_offset_hours):
+        self.tz_offset_hours = tz_offset_hours
+        self._deltas = defaultdict(lambda: dict.fromkeys(ROLLUP_COUNTERS, 0))
+        self._events = []
+
+    def add(self, user_id, source_type, ts, reviews=0, distinct_items=0, new_items=0, score=0,
+            previous_review_ts=None, is_learned=False):
+        """
+        Mô tả: Cộng các giá trị vào ngày (theo múi giờ người dùng) chứa thời điểm `ts`.
+               previous_review_ts và is_learned chỉ dùng cho bảng xếp hạng (xem LeaderboardEngine.record_activity).
+        """
+        delta = self._deltas[(user_id, local_date_key(ts, self.tz_offset_hours), source_type)]
+        delta['review_count'] += reviews
+        delta['distinct_item_count'] += distinct_items
+        delta['new_item_count'] += new_items
+        delta['score_gained'] += score
+        self._events.append((user_id, source_type, ts, previous_review_ts, reviews, new_items, is_learned, score))
+
+    def add_review(self, user_id, source_type, review_ts, previous_review_ts, is_new=False, is_learned=False, score=0):
+        """
+        Mô tả: Ghi nhận một lượt ôn tập/trả lời. Thẻ (câu hỏi) chỉ được tính vào số thẻ khác nhau của ngày
+               nếu lần ôn trước đó của nó không nằm trong cùng ngày, nên không cần đọc lại lịch sử.
+        Args:
+            review_ts (int): Thời điểm ôn tập.
+            previous_review_ts (int | None): Giá trị last_reviewed/last_answered trước lượt ôn này.
+            is_new (bool): Lượt ôn này đánh dấu thẻ là đã học (learned_date vừa được đặt).
+            is_learned (bool): Thẻ đã được học sau lượt ôn này (learned_date khác None).
+            score (int): Điểm cộng thêm của lượt ôn.
+        """
+        is_first_today = (
+            previous_review_ts is None
+            or local_date_key(previous_review_ts, self.tz_offset_hours) != local_date_key(review_ts, self.tz_offset_hours)
+        )
+        self.add(user_id, source_type, review_ts, reviews=1, distinct_items=int(is_first_today),
+                 new_items=int(is_new), score=score, previous_review_ts=previous_review_ts, is_learned=is_learned)
+
+    def flush(self):
+        """
+        Mô tả: Thực thi upsert các giá trị đã gom vào session hiện tại. Người gọi chịu trách nhiệm commit.
+        """
+        if not self._deltas:
+            return
+        rows = [
+            dict(user_id=user_id, activity_date=activity_date, source_type=source_type, **delta)
+            for (user_id, activity_date, source_type), delta in self._deltas.items()
+        ]
+        statement = sqlite_insert(DailyActivityRollup)
+        statement = statement.on_conflict_do_update(
+            index_elements=['user_id', 'activity_date', 'source_type'],
+            set_={column: getattr(DailyActivityRollup, column) + getattr(statement.excluded, column) for column in ROLLUP_COUNTERS}
+        )
+        db.session.execute(statement, rows)
+        leaderboard_engine.record_activity(self._events)
+        self._deltas.clear()
+        self._events = []
+
+
+def _local_date_expr(ts_column):
+    return func.date(ts_column + func.coalesce(User.timezone_offset, DEFAULT_TIMEZONE_OFFSET) * 3600, 'unixepoch')
+
+
+def build_activity_rollup_rows(executor, user_id=None):
+    """
+    Mô tả: Tính lại các dòng rollup từ dữ liệu lịch sử hiện có bằng các truy vấn GROUP BY.
+           Vì bảng tiến trình chỉ lưu lần ôn cuối của mỗi thẻ, số lần ôn tập được dựng lại bằng
+           số thẻ ôn lần cuối trong ngày (giống cách dashboard tính trước đây); số câu hỏi quiz mới
+           không có dữ liệu lịch sử nên bằng 0.
+    Args:
+        executor: Session hoặc Connection của SQLAlchemy (dùng được cả trong migration).
+        user_id (int | None): Chỉ tính cho một người dùng, None là tất cả.
+    Returns:
+        list: Danh sách dict sẵn sàng để insert vào DailyActivityRollups.
+    """
+    rollups = defaultdict(lambda: dict.fromkeys(ROLLUP_COUNTERS, 0))
+
+    def _grouped(ts_column, user_column, *aggregates, extra_filters=(), extra_group=None):
+        activity_date = _local_date_expr(ts_column)
+        columns = [user_column, activity_date] + ([extra_group] if extra_group is not None else []) + list(aggregates)
+        query = select(*columns).join(User, User.user_id == user_column).where(ts_column.isnot(None), *extra_filters)
+        if user_id is not None:
+            query = query.where(user_column == user_id)
+        group_by = [user_column, activity_date] + ([extra_group] if extra_group is not None else [])
+        return executor.execute(query.group_by(*group_by)).all()
+
+    for row_user_id, activity_date, reviews, distinct_cards in _grouped(
+            UserFlashcardProgress.last_reviewed, UserFlashcardProgress.user_id,
+            func.count(), func.count(func.distinct(UserFlashcardProgress.flashcard_id))):
+        rollup = rollups[(row_user_id, activity_date, SOURCE_FLASHCARD)]
+        rollup['review_count'] = reviews
+        rollup['distinct_item_count'] = distinct_cards
+
+    for row_user_id, activity_date, new_cards in _grouped(
+            UserFlashcardProgress.learned_date, UserFlashcardProgress.user_id, func.count()):
+        rollups[(row_user_id, activity_date, SOURCE_FLASHCARD)]['new_item_count'] = new_cards
+
+    for row_user_id, activity_date, answers, distinct_questions in _grouped(
+            UserQuizProgress.last_answered, UserQuizProgress.user_id,
+            func.count(), func.count(func.distinct(UserQuizProgress.question_id))):
+        rollup = rollups[(row_user_id, activity_date, SOURCE_QUIZ)]
+        rollup['review_count'] = answers
+        rollup['distinct_item_count'] = distinct_questions
+
+    for row_user_id, activity_date, source_type, score in _grouped(
+            ScoreLog.timestamp, ScoreLog.user_id, func.sum(ScoreLog.score_change),
+            extra_filters=(ScoreLog.source_type.in_([SOURCE_FLASHCARD, SOURCE_QUIZ]),),
+            extra_group=ScoreLog.source_type):
+        rollups[(row_user_id, activity_date, source_type)]['score_gained'] = score or 0
+
+    return [
+        dict(user_id=row_user_id, activity_date=activity_date, source_type=source_type, **counters)
+        for (row_user_id, activity_date, source_type), counters in rollups.items()
+    ]
+
+
+def rebuild_activity_rollups(executor, user_id=None):
+    """
+    Mô tả: Xóa và dựng lại bảng DailyActivityRollups (của một người dùng hoặc toàn bộ) từ dữ liệu lịch sử.
+           Không tự commit.
+    Returns:
+        int: Số dòng rollup đã ghi.
+    """
+    rows = build_activity_rollup_rows(executor, user_id)
+    delete_statement = delete(DailyActivityRollup)
+    if user_id is not None:
+        delete_statement = delete_statement.where(DailyActivityRollup.user_id == user_id)
+    executor.execute(delete_statement)
+    if rows:
+        executor.execute(insert(DailyActivityRollup), rows)
+    logger.info(f"[ACTIVITY_ROLLUP|Rebuild|User:{user_id if user_id is not None else 'ALL'}] Đã dựng lại {len(rows)} dòng.")
+    return len(rows)
@@ -0,0 +1,177 @@
+# web_app/services/audio_jobs.py
+import asyncio
+import hashlib
+import logging
+import os
+import queue
+import threading
+import time
+
+from ..config import (
+    FLASHCARD_AUDIO_CACHE_DIR, AUDIO_WORKER_COUNT, AUDIO_JOB_QUEUE_MAX_SIZE, AUDIO_JOB_RESULT_TTL_SECONDS
+)
+from .media_registry import media_registry, audio_content_refs
+
+logger = logging.getLogger(__name__)
+
+AUDIO_JOB_QUEUED = 'queued'
+AUDIO_JOB_RUNNING = 'running'
+AUDIO_JOB_FINISHED = 'finished'
+AUDIO_JOB_ERROR = 'error'
+
+
+class AudioJob:
+    """
+    Mô tả: Một yêu cầu tạo audio cho một chuỗi nội dung, định danh bằng hash nội dung
+           (cùng hash với tên file trong FLASHCARD_AUDIO_CACHE_DIR).
+    """
+    __slots__ = ('content_hash', 'content', 'regenerate', 'status', 'message', 'created_at', 'finished_at')
+
+    def __init__(self, content_hash, content, regenerate=False):
+        self.content_hash = content_hash
+        self.content = content
+        self.regenerate = regenerate
+        self.status = AUDIO_JOB_QUEUED
+        self.message = ''
+        self.created_at = time.time()
+        self.finished_at = None
+
+    @property
+    def is_active(self):
+        return self.status in (AUDIO_JOB_QUEUED, AUDIO_JOB_RUNNING)
+
+
+class AudioJobQueue:
+    """
+    Mô tả: Hàng đợi tạo audio TTS với một nhóm luồng worker sống lâu (khởi động ở lần gửi đầu tiên),
+           để request không phải chờ gTTS khi cache chưa có.
+           - Các yêu cầu cùng nội dung đang chờ/đang chạy dùng chung một AudioJob (không gọi TTS hai lần).
+           - Tác vụ thành công được bỏ khỏi bảng theo dõi ngay vì file cache đã tồn tại;
+             tác vụ lỗi được giữ lại đến khi client đọc kết quả hoặc quá AUDIO_JOB_RESULT_TTL_SECONDS.
+           - File vừa tạo được ghi nhận vào sổ đăng ký media (cần init_app) để được dọn khi không thẻ nào tham chiếu.
+    """
+    def __init__(self, audio_service, worker_count=AUDIO_WORKER_COUNT, max_queue_size=AUDIO_JOB_QUEUE_MAX_SIZE):
+        self.audio_service = audio_service
+        self.worker_count = worker_count
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._jobs = {}
+        self._workers = []
+        self._lock = threading.Lock()
+        self._app = None
+
+    def init_app(self, app):
+        self._app = app
+
+    @staticmethod
+    def content_hash(audio_content_string):
+        return hashlib.sha1(audio_content_string.encode('utf-8')).hexdigest()
+
+    def _ensure_workers(self):
+        if self._workers:
+            return
+        for index in range(self.worker_count):
+            worker = threading.Thread(target=self._worker_loop, name=f'audio-worker-{index}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        logger.info(f"[AUDIO_JOBS] Đã khởi động {self.worker_count} worker tạo audio.")
+
+    def _prune(self, now):
+        expired = [
+            content_hash for content_hash, job in self._jobs.items()
+            if not job.is_active and now - job.finished_at > AUDIO_JOB_RESULT_TTL_SECONDS
+        ]
+        for content_hash in expired:
+            del self._jobs[content_hash]
+
+    def request_audio(self, audio_content_string, regenerate=False):
+        """
+        Mô tả: Lấy file audio đã cache, hoặc đưa nội dung vào hàng đợi tạo audio.
+        Args:
+            audio_content_string (str): Nội dung audio (không rỗng).
+            regenerate (bool): Xóa file cache cũ và tạo lại.
+        Returns:
+            tuple: (đường dẫn file cache hoặc None, AudioJob hoặc None).
+                   Job ở trạng thái lỗi chỉ được trả về một lần; lần gọi sau sẽ tạo tác vụ mới.
+                   Yêu cầu tạo lại gộp vào job cùng nội dung đang chờ; nếu job đó đã chạy mà không tạo lại,
+                   một job tạo lại được xếp tiếp theo.
+        """
+        content_hash = self.content_hash(audio_content_string)
+        if not regenerate:
+            cached_file_path = os.path.join(FLASHCARD_AUDIO_CACHE_DIR, f"{content_hash}.mp3")
+            if os.path.exists(cached_file_path):
+                return cached_file_path, None
+
+        with self._lock:
+            self._prune(time.time())
+            job = self._jobs.get(content_hash)
+            if job is not None:
+                if job.status == AUDIO_JOB_ERROR:
+                    del self._jobs[content_hash]
+                    return None, job
+                if job.status == AUDIO_JOB_QUEUED and regenerate:
+                    job.regenerate = True
+                if not regenerate or job.regenerate:
+                    return None, job
+
+            job = AudioJob(content_hash, audio_content_string, regenerate)
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                logger.warning(f"[AUDIO_JOBS|Hash:{content_hash[:10]}] Hàng đợi tạo audio đã đầy.")
+                job.status = AUDIO_JOB_ERROR
+                job.message = "Hàng đợi tạo audio đang quá tải, vui lòng thử lại sau."
+                job.finished_at = time.time()
+                return None, job
+            self._jobs[content_hash] = job
+            self._ensure_workers()
+            logger.debug(f"[AUDIO_JOBS|Hash:{content_hash[:10]}] Đã đưa vào hàng đợi ({self._queue.qsize()} đang chờ).")
+            return None, job
+
+    def get_job(self, content_hash):
+        with self._lock:
+            return self._jobs.get(content_hash)
+
+    def pending_count(self):
+        return self._queue.qsize()
+
+    def _worker_loop(self):
+        # Mỗi worker giữ một event loop riêng cho các hàm async của AudioService
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        while True:
+            job = self._queue.get()
+            try:
+                self._run_job(job, loop)
+            finally:
+                self._queue.task_done()
+
+    def _run_job(self, job, loop):
+        log_prefix = f"[AUDIO_JOBS|Hash:{job.content_hash[:10]}]"
+        with self._lock:
+            job.status = AUDIO_JOB_RUNNING
+            regenerate = job.regenerate
+        try:
+            if regenerate:
+                self.audio_service.remove_cached_audio(job.content)
+            path, success, message = loop.run_until_complete(
+                self.audio_service.get_cached_or_generate_audio(job.content)
+            )
+        except Exception as e:
+            logger.error(f"{log_prefix} Lỗi không mong muốn khi tạo audio: {e}", exc_info=True)
+            path, success, message = None, False, str(e)
+
+        if success and path and self._app is not None:
+            with self._app.app_context():
+                media_registry.register_generated(audio_content_refs(job.content))
+
+        with self._lock:
+            job.finished_at = time.time()
+            if success and path:
+                job.status = AUDIO_JOB_FINISHED
+                # Job tạo lại xếp sau có thể đã thay chỗ job này trong bảng theo dõi.
+                if self._jobs.get(job.content_hash) is job:
+                    del self._jobs[job.content_hash]
+            else:
+                job.status = AUDIO_JOB_ERROR
+                job.message = message
+        logger.info(f"{log_prefix} Kết thúc với trạng thái {job.status} sau {job.finished_at - job.created_at:.2f}s.")
@@ -0,0 +1,306 @@
+# web_app/services/audio_pregeneration.py
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from sqlalchemy import select, func, or_, and_
+
+from ..models import db, Flashcard, QuizQuestion
+from ..config import (
+    TASK_STATUS_PATH, FLASHCARD_AUDIO_CACHE_DIR, QUIZ_AUDIO_CACHE_DIR, QUIZ_AUDIO_REMOTE_DIR,
+    AUDIO_PREGEN_CONCURRENCY, AUDIO_PREGEN_RATE_PER_SECOND, AUDIO_PREGEN_BURST,
+    AUDIO_PREGEN_CHUNK_SIZE, AUDIO_PREGEN_MAX_REPORTED_ERRORS
+)
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_KEY = 'audio_pregeneration'
+PREGEN_RUNNING = 'running'
+PREGEN_STOPPED = 'stopped'
+PREGEN_FINISHED = 'finished'
+
+_REMOTE_PREFIXES = ('http://', 'https://')
+
+
+def quiz_remote_audio_path(url):
+    """
+    Mô tả: Đường dẫn bản sao cục bộ của một file audio quiz được tham chiếu bằng URL.
+    """
+    extension = os.path.splitext(urlsplit(url).path)[1].lower() or '.mp3'
+    return os.path.join(QUIZ_AUDIO_REMOTE_DIR, hashlib.sha1(url.encode('utf-8')).hexdigest() + extension)
+
+
+class TokenBucket:
+    """
+    Mô tả: Giới hạn tốc độ kiểu token bucket cho các coroutine trong cùng một event loop:
+           trung bình `rate_per_second` lượt mỗi giây, cho phép dồn tối đa `capacity` lượt.
+    """
+    def __init__(self, rate_per_second, capacity):
+        self.rate_per_second = rate_per_second
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate_per_second)
+            self._updated_at = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate_per_second)
+
+
+class PregenerationCheckpoint:
+    """
+    Mô tả: Lưu tiến độ tạo audio hàng loạt vào TASK_STATUS_PATH (dưới khóa CHECKPOINT_KEY) sau mỗi lô,
+           để lần chạy sau tiếp tục từ vị trí đã dừng kể cả khi tiến trình bị khởi động lại.
+    """
+    def __init__(self, path=TASK_STATUS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _read_all(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"[AUDIO_PREGEN] Không đọc được file trạng thái {self.path}: {e}")
+            return {}
+
+    def load(self):
+        with self._lock:
+            return self._read_all().get(CHECKPOINT_KEY) or {}
+
+    def save(self, state):
+        with self._lock:
+            data = self._read_all()
+            data[CHECKPOINT_KEY] = state
+            temp_path = f"{self.path}.part"
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.path)
+
+
+class AudioPregenerationPipeline:
+    """
+    Mô tả: Tạo trước audio cho toàn bộ thẻ và câu hỏi quiz.
+           - Đọc database theo lô bằng khóa chính (chỉ các cột audio), không nạp đối tượng ORM.
+           - Thẻ: tạo audio TTS còn thiếu trong FLASHCARD_AUDIO_CACHE_DIR (cùng khóa cache với khi phát).
+           - Quiz: tải về bản sao cục bộ của các file audio tham chiếu bằng URL (QUIZ_AUDIO_REMOTE_DIR)
+             và ghi nhận các file cục bộ bị thiếu.
+           - Tối đa AUDIO_PREGEN_CONCURRENCY mục chạy cùng lúc; mỗi lượt gọi TTS hoặc tải file phải lấy
+             token từ token bucket.
+           - Checkpoint được lưu sau mỗi lô; lô đang chạy dở khi dừng sẽ được xử lý lại (mục đã có file được bỏ qua).
+    """
+    def __init__(self, audio_service, concurrency=AUDIO_PREGEN_CONCURRENCY, rate_per_second=AUDIO_PREGEN_RATE_PER_SECOND,
+                 burst=AUDIO_PREGEN_BURST, chunk_size=AUDIO_PREGEN_CHUNK_SIZE, checkpoint=None):
+        self.audio_service = audio_service
+        self.concurrency = concurrency
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self.chunk_size = chunk_size
+        self.checkpoint = checkpoint or PregenerationCheckpoint()
+
+    def resumable_state(self):
+        """
+        Returns:
+            dict | None: Checkpoint của lần chạy chưa hoàn tất (để giao diện báo sẽ chạy tiếp), None nếu không có.
+        """
+        state = self.checkpoint.load()
+        return state if state.get('status') in (PREGEN_RUNNING, PREGEN_STOPPED) else None
+
+    @staticmethod
+    def _flashcard_audio_filter():
+        return or_(
+            and_(Flashcard.front_audio_content.isnot(None), Flashcard.front_audio_content != ''),
+            and_(Flashcard.back_audio_content.isnot(None), Flashcard.back_audio_content != '')
+        )
+
+    @staticmethod
+    def _quiz_audio_filter():
+        return and_(QuizQuestion.question_audio_file.isnot(None), QuizQuestion.question_audio_file != '')
+
+    def _iter_chunks(self, columns, pk_column, row_filter, after_id):
+        """
+        Mô tả: Duyệt các dòng theo khóa chính tăng dần, mỗi lần một lô `chunk_size` dòng.
+        """
+        while True:
+            rows = db.session.execute(
+                select(*columns).where(row_filter, pk_column > after_id).order_by(pk_column).limit(self.chunk_size)
+            ).all()
+            db.session.rollback()  # Không giữ transaction đọc mở trong lúc chờ TTS
+            if not rows:
+                return
+            yield rows
+            after_id = rows[-1][0]
+
+    def _count(self, pk_column, row_filter, up_to_id=None):
+        query = select(func.count(pk_column)).where(row_filter)
+        if up_to_id is not None:
+            query = query.where(pk_column <= up_to_id)
+        return db.session.execute(query).scalar() or 0
+
+    def _record_error(self, state, message):
+        state['failed'] += 1
+        if len(state['errors']) < AUDIO_PREGEN_MAX_REPORTED_ERRORS:
+            state['errors'].append(message)
+
+    async def _generate_flashcard_audio(self, content, semaphore, rate_limiter, status_dict):
+        async with semaphore:
+            if status_dict.get('stop_requested'):
+                return None, False, 'stopped'
+            return await self.audio_service.get_cached_or_generate_audio(content, rate_limiter=rate_limiter)
+
+    def _download_sync(self, url, target_path):
+        temp_path = f"{target_path}.part"
+        try:
+            with requests.get(url, timeout=30, stream=True) as response:
+                if response.status_code != 200:
+                    return False, f"HTTP {response.status_code}"
+                with open(temp_path, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        f.write(chunk)
+            os.replace(temp_path, target_path)
+            return True, ''
+        except (requests.exceptions.RequestException, OSError) as e:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return False, str(e)
+
+    async def _mirror_quiz_audio(self, url, semaphore, rate_limiter, status_dict):
+        async with semaphore:
+            if status_dict.get('stop_requested'):
+                return False, 'stopped'
+            await rate_limiter.acquire()
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, self._download_sync, url, quiz_remote_audio_path(url))
+
+    async def _process_flashcards(self, state, status_dict, semaphore, rate_limiter, log_prefix):
+        # media_registry import quiz_remote_audio_path từ module này.
+        from .media_registry import media_registry, audio_content_refs
+
+        existing_files = set(os.listdir(FLASHCARD_AUDIO_CACHE_DIR)) if os.path.isdir(FLASHCARD_AUDIO_CACHE_DIR) else set()
+        columns = (Flashcard.flashcard_id, Flashcard.front_audio_content, Flashcard.back_audio_content)
+        for rows in self._iter_chunks(columns, Flashcard.flashcard_id, self._flashcard_audio_filter(), state['flashcard_last_id']):
+            if status_dict.get('stop_requested'):
+                return False
+            pending = {}
+            for _, front_content, back_content in rows:
+                for content in (front_content, back_content):
+                    if not content or not content.strip():
+                        continue
+                    filename = f"{hashlib.sha1(content.encode('utf-8')).hexdigest()}.mp3"
+                    if filename not in existing_files:
+                        pending[filename] = content
+
+            results = await asyncio.gather(*[
+                self._generate_flashcard_audio(content, semaphore, rate_limiter, status_dict) for content in pending.values()
+            ])
+            generated_refs = []
+            for (filename, content), (_, success, message) in zip(pending.items(), results):
+                if success:
+                    existing_files.add(filename)
+                    state['created'] += 1
+                    generated_refs.extend(audio_content_refs(content))
+                elif message != 'stopped':
+                    self._record_error(state, f"Lỗi tạo audio cho '{content[:50]}...': {message}")
+            media_registry.register_generated(generated_refs)
+            if status_dict.get('stop_requested'):
+                return False
+
+            state['flashcard_last_id'] = rows[-1][0]
+            status_dict['progress'] += len(rows)
+            self._save(state, status_dict)
+            logger.info(f"{log_prefix} Thẻ đến ID {state['flashcard_last_id']}: đã tạo {state['created']}, lỗi {state['failed']}.")
+        return True
+
+    async def _process_quiz_questions(self, state, status_dict, semaphore, rate_limiter, log_prefix):
+        os.makedirs(QUIZ_AUDIO_REMOTE_DIR, exist_ok=True)
+        columns = (QuizQuestion.question_id, QuizQuestion.question_audio_file)
+        for rows in self._iter_chunks(columns, QuizQuestion.question_id, self._quiz_audio_filter(), state['quiz_last_id']):
+            if status_dict.get('stop_requested'):
+                return False
+            pending_urls = []
+            for question_id, audio_file in rows:
+                if audio_file.startswith(_REMOTE_PREFIXES):
+                    if audio_file not in pending_urls and not os.path.exists(quiz_remote_audio_path(audio_file)):
+                        pending_urls.append(audio_file)
+                elif audio_file.strip() and not os.path.exists(os.path.join(QUIZ_AUDIO_CACHE_DIR, audio_file)):
+                    self._record_error(state, f"Câu hỏi {question_id}: thiếu file audio '{audio_file}'.")
+
+            results = await asyncio.gather(*[
+                self._mirror_quiz_audio(url, semaphore, rate_limiter, status_dict) for url in pending_urls
+            ])
+            for url, (success, message) in zip(pending_urls, results):
+                if success:
+                    state['created'] += 1
+                elif message != 'stopped':
+                    self._record_error(state, f"Lỗi tải audio quiz '{url[:80]}': {message}")
+            if status_dict.get('stop_requested'):
+                return False
+
+            state['quiz_last_id'] = rows[-1][0]
+            status_dict['progress'] += len(rows)
+            self._save(state, status_dict)
+            logger.info(f"{log_prefix} Câu hỏi đến ID {state['quiz_last_id']}: đã tạo {state['created']}, lỗi {state['failed']}.")
+        return True
+
+    def _save(self, state, status_dict):
+        state['updated_at'] = int(time.time())
+        status_dict['errors'] = state['errors']
+        try:
+            self.checkpoint.save(state)
+        except OSError as e:
+            logger.error(f"[AUDIO_PREGEN] Không ghi được checkpoint: {e}", exc_info=True)
+
+    async def run(self, status_dict):
+        """
+        Mô tả: Chạy (hoặc chạy tiếp từ checkpoint) quá trình tạo audio hàng loạt.
+        Args:
+            status_dict (dict): Trạng thái hiển thị cho admin (total, progress, errors, stop_requested).
+        Returns:
+            tuple: (số file đã tạo, số lỗi) tính cả các lần chạy trước của cùng quá trình.
+        """
+        log_prefix = "[AUDIO_PREGEN]"
+        state = self.resumable_state()
+        if state:
+            logger.info(f"{log_prefix} Tiếp tục từ checkpoint: thẻ sau ID {state['flashcard_last_id']}, câu hỏi sau ID {state['quiz_last_id']}.")
+        else:
+            state = {
+                'status': PREGEN_RUNNING, 'started_at': int(time.time()), 'updated_at': int(time.time()),
+                'flashcard_last_id': 0, 'quiz_last_id': 0, 'created': 0, 'failed': 0, 'errors': []
+            }
+        state['status'] = PREGEN_RUNNING
+
+        flashcard_filter, quiz_filter = self._flashcard_audio_filter(), self._quiz_audio_filter()
+        status_dict['total'] = self._count(Flashcard.flashcard_id, flashcard_filter) + self._count(QuizQuestion.question_id, quiz_filter)
+        status_dict['progress'] = (
+            self._count(Flashcard.flashcard_id, flashcard_filter, state['flashcard_last_id'])
+            + self._count(QuizQuestion.question_id, quiz_filter, state['quiz_last_id'])
+        )
+        db.session.rollback()
+        self._save(state, status_dict)
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        rate_limiter = TokenBucket(self.rate_per_second, self.burst)
+        completed = (
+            await self._process_flashcards(state, status_dict, semaphore, rate_limiter, log_prefix)
+            and await self._process_quiz_questions(state, status_dict, semaphore, rate_limiter, log_prefix)
+        )
+
+        state['status'] = PREGEN_FINISHED if completed else PREGEN_STOPPED
+        self._save(state, status_dict)
+        logger.info(f"{log_prefix} Kết thúc với trạng thái {state['status']}: đã tạo {state['created']}, lỗi {state['failed']}.")
+        return state['created'], state['failed']
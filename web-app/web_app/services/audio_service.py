@@ -6,13 +6,16 @@ import hashlib
 import shutil
 import asyncio
 import random
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 
 from gtts import gTTS
 from pydub import AudioSegment
 
 from .. import db
 from ..models import Flashcard, User
-from ..config import FLASHCARD_AUDIO_CACHE_DIR
+from ..config import FLASHCARD_AUDIO_CACHE_DIR, FLASHCARD_AUDIO_SEGMENT_DIR, AUDIO_CONCAT_MODE, AUDIO_TTS_MAX_WORKERS
+from .mp3_frames import join_mp3_files
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +24,11 @@ class AudioService:
         """
         Mô tả: Khởi tạo dịch vụ AudioService, đảm bảo thư mục cache audio tồn tại.
         """
+        # Các đoạn đang được tạo: segment_path -> Future, để các yêu cầu song song (kể cả từ event loop
+        # của luồng khác) cùng chờ một lượt gọi TTS thay vì gọi lại cho cùng một đoạn
+        self._segment_jobs = {}
+        self._segment_jobs_lock = threading.Lock()
+        self._segment_executor = ThreadPoolExecutor(max_workers=AUDIO_TTS_MAX_WORKERS, thread_name_prefix='tts-segment')
         try:
             os.makedirs(FLASHCARD_AUDIO_CACHE_DIR, exist_ok=True)
             logger.info(f"AudioService khởi tạo thành công. Thư mục cache: {FLASHCARD_AUDIO_CACHE_DIR}")
@@ -66,14 +74,99 @@ class AudioService:
                     logger.error(f"{log_prefix} Lỗi xóa file TTS tạm lỗi {temp_path}: {e_remove}")
             return None, False, f"Lỗi tạo audio từ Google Text-to-Speech. Có thể do giới hạn API hoặc lỗi kết nối: {e}"
 
-    async def _generate_concatenated_audio(self, audio_content_string, output_format="mp3", pause_ms=400):
+    @staticmethod
+    def _parse_audio_lines(audio_content_string):
+        """
+        Mô tả: Tách chuỗi nội dung audio thành các đoạn theo dòng, mỗi dòng có thể có định dạng 'lang: text'.
+        Returns:
+            list: Các tuple (lang_code, text); dòng không có nội dung text bị bỏ qua.
+        """
+        segments = []
+        if not audio_content_string:
+            return segments
+        for line in audio_content_string.strip().splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            lang_code, text_to_read = 'en', line
+            if ":" in line:
+                parts = line.split(":", 1)
+                if len(parts) == 2 and parts[0].strip():
+                    lang_code, text_to_read = parts[0].strip().lower(), parts[1].strip()
+            if not text_to_read:
+                logger.warning(f"[PARSE_AUDIO_LINES] Bỏ qua dòng không có nội dung text: '{line}'")
+                continue
+            segments.append((lang_code, text_to_read))
+        return segments
+
+    @staticmethod
+    def _segment_cache_filename(lang_code, text):
+        return hashlib.sha1(f"{lang_code}\n{text}".encode('utf-8')).hexdigest() + ".mp3"
+
+    def _generate_segment_sync(self, text, lang, segment_path):
+        """
+        Mô tả: Tạo audio TTS cho một đoạn và lưu vào cache đoạn (ghi file tạm rồi os.replace,
+               để request khác không đọc phải file ghi dở).
+        Returns:
+            tuple: (đường dẫn file trong cache đoạn, thành công (bool), thông báo).
+        """
+        temp_path, success, message = self._generate_tts_sync(text, lang)
+        if not success:
+            return None, False, message
+        partial_path = f"{segment_path}.{os.getpid()}.{threading.get_ident()}.part"
+        try:
+            shutil.move(temp_path, partial_path)
+            os.replace(partial_path, segment_path)
+            return segment_path, True, message
+        except Exception as e:
+            logger.error(f"[SEGMENT_CACHE] Lỗi khi lưu đoạn audio vào cache {segment_path}: {e}", exc_info=True)
+            for path in (temp_path, partial_path):
+                if path and os.path.exists(path):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+            return None, False, f"Lỗi khi lưu đoạn audio vào cache: {e}"
+
+    def _running_segment_job(self, segment_path):
+        with self._segment_jobs_lock:
+            return self._segment_jobs.get(segment_path)
+
+    def _submit_segment_job(self, text, lang, segment_path):
+        """
+        Mô tả: Lấy Future của đoạn đang được tạo, hoặc gửi đoạn vào executor TTS nếu chưa có trong cache.
+        Returns:
+            concurrent.futures.Future: Kết quả như _generate_segment_sync.
+        """
+        with self._segment_jobs_lock:
+            future = self._segment_jobs.get(segment_path)
+            if future is not None:
+                return future
+            if os.path.exists(segment_path):
+                future = Future()
+                future.set_result((segment_path, True, "Đoạn đã có trong cache."))
+                return future
+            future = self._segment_executor.submit(self._generate_segment_sync, text, lang, segment_path)
+            self._segment_jobs[segment_path] = future
+
+        def forget(done_future):
+            with self._segment_jobs_lock:
+                if self._segment_jobs.get(segment_path) is done_future:
+                    del self._segment_jobs[segment_path]
+        future.add_done_callback(forget)
+        return future
+
+    async def _generate_concatenated_audio(self, audio_content_string, output_format="mp3", pause_ms=400, rate_limiter=None):
         """
         Mô tả: Ghép nhiều đoạn audio TTS thành một file duy nhất.
-               Hỗ trợ định dạng 'lang: text' cho từng dòng.
+               Hỗ trợ định dạng 'lang: text' cho từng dòng. Mỗi dòng được cache riêng theo (lang, text)
+               trong FLASHCARD_AUDIO_SEGMENT_DIR, nên chỉ những dòng chưa có trong cache mới gọi TTS.
         Args:
             audio_content_string (str): Chuỗi chứa nội dung audio, mỗi dòng có thể có định dạng 'lang: text'.
             output_format (str): Định dạng đầu ra của file audio (mặc định là 'mp3').
             pause_ms (int): Thời gian tạm dừng giữa các đoạn audio khi ghép (miligiây).
+            rate_limiter (TokenBucket, optional): Giới hạn tốc độ gọi TTS dùng chung (tạo audio hàng loạt);
+                                                  nếu không có, mỗi lượt gọi TTS chờ một khoảng ngẫu nhiên.
         Returns:
             tuple: (đường dẫn file tạm thời cuối cùng, thành công (bool), thông báo lỗi/thành công).
                    Trả về (None, False, message) nếu có lỗi.
@@ -83,117 +176,114 @@ class AudioService:
             logger.warning(f"{log_prefix} Chuỗi nội dung audio rỗng. Không cần ghép.")
             return None, True, "Nội dung audio rỗng, không cần ghép."
 
-        lines = [line.strip() for line in audio_content_string.strip().splitlines() if line.strip()]
-        if not lines:
+        segments = self._parse_audio_lines(audio_content_string)
+        if not segments:
             logger.warning(f"{log_prefix} Không có dòng hợp lệ nào để tạo TTS.")
             return None, True, "Không có dòng hợp lệ để tạo TTS."
 
-        temp_files = []
-        final_temp_path = None
         loop = asyncio.get_running_loop()
-        overall_success = True
-        overall_message = "Ghép audio thành công."
 
         try:
-            tasks = []
-            for line in lines:
-                try:
-                    lang_code, text_to_read = 'en', line
-                    if ":" in line:
-                        parts = line.split(":", 1)
-                        if len(parts) == 2 and parts[0].strip():
-                            lang_code, text_to_read = parts[0].strip().lower(), parts[1].strip()
-
-                    if not text_to_read:
-                        logger.warning(f"{log_prefix} Bỏ qua dòng không có nội dung text: '{line}'")
-                        continue
-
-                    # Thêm độ trễ ngẫu nhiên để tránh bị rate limit
-                    delay = random.uniform(0.5, 2.0)
-                    await asyncio.sleep(delay)
-                    logger.debug(f"{log_prefix} Chờ {delay:.2f} giây trước khi gọi TTS.")
-                    
-                    tasks.append(loop.run_in_executor(None, self._generate_tts_sync, text_to_read, lang_code))
-                except Exception as e_prep:
-                    logger.error(f"{log_prefix} Lỗi chuẩn bị TTS cho dòng '{line}': {e_prep}", exc_info=True)
-                    overall_success = False
-                    overall_message = f"Lỗi chuẩn bị audio cho một phần: {e_prep}"
-                    # Không return ngay, để các task khác có thể hoàn thành hoặc thất bại
-                    # và dọn dẹp các file tạm đã tạo.
-
-            if not tasks:
-                logger.warning(f"{log_prefix} Không có tác vụ TTS nào được tạo.")
-                return None, False, "Không có tác vụ TTS nào được tạo."
-
-            logger.info(f"{log_prefix} Đang đợi {len(tasks)} tác vụ TTS.")
-            generated_files_results = await asyncio.gather(*tasks)
-            
-            # Kiểm tra kết quả từ các tác vụ TTS riêng lẻ
-            for path, success, msg in generated_files_results:
-                if not success:
-                    overall_success = False
-                    overall_message = msg # Lấy thông báo lỗi từ TTS thất bại đầu tiên
-                    logger.error(f"{log_prefix} Một tác vụ TTS đã thất bại: {msg}")
-                if path:
-                    temp_files.append(path) # Thêm vào danh sách để dọn dẹp sau
-
-            if not overall_success:
-                logger.error(f"{log_prefix} Một hoặc nhiều tác vụ TTS đã thất bại. Hủy bỏ việc ghép audio.")
-                return None, False, overall_message
-            
-            logger.info(f"{log_prefix} Tạo thành công {len(temp_files)} file audio riêng lẻ.")
-
-            if len(temp_files) == 0:
-                logger.warning(f"{log_prefix} Không có file audio nào được tạo để ghép.")
-                return None, False, "Không có file audio nào được tạo để ghép."
-            elif len(temp_files) == 1:
-                final_temp_path = temp_files[0]
-                logger.info(f"{log_prefix} Chỉ có 1 file, không cần ghép. Trả về: {final_temp_path}")
-                return final_temp_path, True, "Tạo audio thành công (chỉ 1 file)."
-            
+            os.makedirs(FLASHCARD_AUDIO_SEGMENT_DIR, exist_ok=True)
+            segment_paths = []
+            tasks = {}
+            for lang_code, text_to_read in segments:
+                segment_path = os.path.join(FLASHCARD_AUDIO_SEGMENT_DIR, self._segment_cache_filename(lang_code, text_to_read))
+                segment_paths.append(segment_path)
+                if segment_path in tasks or os.path.exists(segment_path):
+                    continue
+
+                if self._running_segment_job(segment_path) is None:
+                    if rate_limiter is not None:
+                        await rate_limiter.acquire()
+                    else:
+                        # Thêm độ trễ ngẫu nhiên để tránh bị rate limit (chỉ với đoạn phải gọi TTS)
+                        delay = random.uniform(0.5, 2.0)
+                        await asyncio.sleep(delay)
+                        logger.debug(f"{log_prefix} Chờ {delay:.2f} giây trước khi gọi TTS.")
+
+                tasks[segment_path] = asyncio.wrap_future(self._submit_segment_job(text_to_read, lang_code, segment_path))
+
+            logger.info(f"{log_prefix} {len(segments)} đoạn: {len(segments) - len(tasks)} lấy từ cache đoạn, {len(tasks)} cần tạo TTS.")
+            if tasks:
+                generated_results = await asyncio.gather(*tasks.values())
+                for path, success, msg in generated_results:
+                    if not success:
+                        logger.error(f"{log_prefix} Một tác vụ TTS đã thất bại: {msg}. Hủy bỏ việc ghép audio.")
+                        return None, False, msg
+
             def concatenate_sync_internal():
                 """
-                Mô tả: Hàm đồng bộ để ghép các file audio.
+                Mô tả: Hàm đồng bộ để ghép các file audio (hoặc sao chép nếu chỉ có một đoạn).
+                       Mặc định nối trực tiếp các frame MP3; pydub (giải mã + mã hóa lại) chỉ dùng khi
+                       các đoạn khác định dạng. File kết quả là file tạm riêng, các file trong cache đoạn được giữ nguyên.
                 """
+                exported_path = None
                 try:
-                    combined = AudioSegment.from_file(temp_files[0])
-                    silence = AudioSegment.silent(duration=pause_ms) if pause_ms > 0 else None
-                    for i in range(1, len(temp_files)):
-                        if silence: combined += silence
-                        combined += AudioSegment.from_file(temp_files[i])
-                    
                     with tempfile.NamedTemporaryFile(suffix=f".{output_format}", delete=False) as tmp:
                         exported_path = tmp.name
+                    if len(segment_paths) == 1:
+                        shutil.copyfile(segment_paths[0], exported_path)
+                        logger.info(f"{log_prefix} Chỉ có 1 đoạn, không cần ghép. Trả về: {exported_path}")
+                        return exported_path, True, "Tạo audio thành công (chỉ 1 file)."
+
+                    if AUDIO_CONCAT_MODE == 'frames' and output_format == 'mp3':
+                        try:
+                            join_mp3_files(segment_paths, exported_path, pause_ms)
+                            logger.info(f"{log_prefix} Nối frame MP3 thành công -> {exported_path}")
+                            return exported_path, True, "Ghép audio thành công."
+                        except ValueError as e_frames:
+                            logger.warning(f"{log_prefix} Không thể nối trực tiếp frame MP3 ({e_frames}). Chuyển sang ghép bằng pydub.")
+
+                    combined = AudioSegment.from_file(segment_paths[0])
+                    silence = AudioSegment.silent(duration=pause_ms) if pause_ms > 0 else None
+                    for i in range(1, len(segment_paths)):
+                        if silence: combined += silence
+                        combined += AudioSegment.from_file(segment_paths[i])
+
                     combined.export(exported_path, format=output_format)
                     logger.info(f"{log_prefix} Ghép thành công -> {exported_path}")
                     return exported_path, True, "Ghép audio thành công."
                 except Exception as e_concat:
                     logger.error(f"{log_prefix} Lỗi khi ghép đồng bộ: {e_concat}", exc_info=True)
+                    if exported_path and os.path.exists(exported_path):
+                        os.remove(exported_path)
                     return None, False, f"Lỗi khi ghép các đoạn audio: {e_concat}"
 
-            final_temp_path, success, msg = await loop.run_in_executor(None, concatenate_sync_internal)
-            return final_temp_path, success, msg
+            return await loop.run_in_executor(None, concatenate_sync_internal)
 
         except Exception as e:
             logger.critical(f"{log_prefix} Lỗi nghiêm trọng trong quá trình ghép audio: {e}", exc_info=True)
             return None, False, f"Lỗi nghiêm trọng trong quá trình tạo/ghép audio: {e}"
-        finally:
-            # Dọn dẹp các file tạm thời đã tạo, trừ file cuối cùng nếu nó thành công
-            if temp_files:
-                logger.debug(f"{log_prefix} Dọn dẹp {len(temp_files)} file TTS tạm...")
-                for f in temp_files:
-                    if f and os.path.exists(f) and f != final_temp_path:
-                        try:
-                            os.remove(f)
-                        except Exception as e_remove:
-                             logger.error(f"{log_prefix} Lỗi xóa file tạm {f}: {e_remove}")
 
-    async def get_cached_or_generate_audio(self, audio_content_string, output_format="mp3"):
+    def remove_cached_audio(self, audio_content_string):
+        """
+        Mô tả: Xóa file cache của cả chuỗi nội dung và các đoạn của nó, để lần tạo sau gọi lại TTS cho mọi dòng.
+        Returns:
+            int: Số file đã xóa.
+        """
+        log_prefix = "[AUDIO_SERVICE|RemoveCache]"
+        content_hash = hashlib.sha1(audio_content_string.encode('utf-8')).hexdigest()
+        paths = [os.path.join(FLASHCARD_AUDIO_CACHE_DIR, f"{content_hash}.mp3")]
+        paths.extend(
+            os.path.join(FLASHCARD_AUDIO_SEGMENT_DIR, self._segment_cache_filename(lang_code, text))
+            for lang_code, text in self._parse_audio_lines(audio_content_string)
+        )
+        removed_count = 0
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+                removed_count += 1
+                logger.info(f"{log_prefix} Đã xóa file cache cũ: {os.path.basename(path)}")
+        return removed_count
+
+    async def get_cached_or_generate_audio(self, audio_content_string, output_format="mp3", rate_limiter=None):
         """
         Mô tả: Lấy đường dẫn đến file audio đã cache hoặc tạo mới nếu chưa có.
         Args:
             audio_content_string (str): Chuỗi nội dung dùng để tạo audio và làm khóa cache.
             output_format (str): Định dạng file audio (mặc định là 'mp3').
+            rate_limiter (TokenBucket, optional): Giới hạn tốc độ gọi TTS, xem _generate_concatenated_audio.
         Returns:
             tuple: (đường dẫn file audio, thành công (bool), thông báo lỗi/thành công).
                    Trả về (None, False, message) nếu có lỗi.
@@ -214,7 +304,7 @@ class AudioService:
             
             logger.info(f"{log_prefix} Cache MISS cho hash {content_hash}. Đang tạo audio...")
             # Gọi hàm tạo audio và nhận lại trạng thái và thông báo
-            temp_generated_path, success, message = await self._generate_concatenated_audio(audio_content_string, output_format)
+            temp_generated_path, success, message = await self._generate_concatenated_audio(audio_content_string, output_format, rate_limiter=rate_limiter)
             
             if success and temp_generated_path and os.path.exists(temp_generated_path):
                 logger.info(f"{log_prefix} Tạo thành công file tạm: {temp_generated_path}. Chuẩn bị cache...")
@@ -240,126 +330,6 @@ class AudioService:
             logger.critical(f"{log_prefix} {error_message}", exc_info=True)
             return None, False, error_message
 
-    async def generate_cache_for_all_cards(self, status_dict):
-        """
-        Mô tả: Quét toàn bộ database, xác định các file audio còn thiếu và tạo chúng.
-               Có thể dừng giữa chừng.
-        Args:
-            status_dict (dict): Từ điển để cập nhật trạng thái tiến độ (total, progress, stop_requested).
-        Returns:
-            tuple: (created_count, total_to_process) - Số lượng file đã tạo và tổng số file cần xử lý.
-        """
-        log_prefix = "[AUDIO_SERVICE|GenerateAllCache]"
-        logger.info(f"{log_prefix} Bắt đầu quá trình tạo cache cho toàn bộ audio.")
-        
-        # 1. Lấy tất cả nội dung audio duy nhất từ DB
-        all_audio_contents = set()
-        cards_with_audio = Flashcard.query.filter(
-            (Flashcard.front_audio_content != None) & (Flashcard.front_audio_content != '') |
-            (Flashcard.back_audio_content != None) & (Flashcard.back_audio_content != '')
-        ).all()
-
-        for card in cards_with_audio:
-            if card.front_audio_content:
-                all_audio_contents.add(card.front_audio_content.strip())
-            if card.back_audio_content:
-                all_audio_contents.add(card.back_audio_content.strip())
-        
-        # 2. Lọc ra những nội dung chưa có file trong cache
-        contents_to_generate = []
-        for content in all_audio_contents:
-            content_hash = hashlib.sha1(content.encode('utf-8')).hexdigest()
-            cached_file_path = os.path.join(FLASHCARD_AUDIO_CACHE_DIR, f"{content_hash}.mp3")
-            if not os.path.exists(cached_file_path):
-                contents_to_generate.append(content)
-
-        # 3. Cập nhật tổng số file cần tạo
-        total_to_process = len(contents_to_generate)
-        status_dict['total'] = total_to_process
-        status_dict['progress'] = 0
-        status_dict['errors'] = [] # Thêm danh sách lỗi để báo cáo
-
-        logger.info(f"{log_prefix} Tìm thấy {total_to_process} nội dung audio mới cần tạo cache.")
-
-        if total_to_process == 0:
-            return 0, 0
-
-        created_count = 0
-        # 4. Chỉ lặp qua danh sách các file cần tạo
-        for content in contents_to_generate:
-            if status_dict.get('stop_requested'):
-                logger.info(f"{log_prefix} Nhận được yêu cầu dừng. Kết thúc sớm.")
-                break
-            try:
-                # Gọi hàm get_cached_or_generate_audio và nhận kết quả chi tiết
-                result_path, success, message = await self.get_cached_or_generate_audio(content)
-                if success:
-                    created_count += 1
-                else:
-                    # Ghi nhận lỗi để báo cáo lại cho người dùng
-                    status_dict['errors'].append(f"Lỗi tạo audio cho '{content[:50]}...': {message}")
-                    logger.error(f"{log_prefix} Lỗi khi xử lý nội dung: '{content[:50]}...': {message}")
-            except Exception as e:
-                # Lỗi không mong muốn trong vòng lặp
-                error_message = f"Lỗi không mong muốn khi xử lý nội dung: '{content[:50]}...': {e}"
-                status_dict['errors'].append(error_message)
-                logger.error(f"{log_prefix} {error_message}", exc_info=True)
-            finally:
-                status_dict['progress'] += 1
-
-        logger.info(f"{log_prefix} Hoàn tất. Đã tạo thành công {created_count}/{total_to_process} file audio mới.")
-        return created_count, total_to_process
-
-    def clean_orphan_audio_cache(self):
-        """
-        Mô tả: Dọn dẹp các file audio trong cache không còn được liên kết với bất kỳ flashcard nào.
-        Returns:
-            int: Số lượng file đã bị xóa.
-        """
-        log_prefix = "[AUDIO_SERVICE|CleanCache]"
-        logger.info(f"{log_prefix} Bắt đầu quá trình dọn dẹp cache audio.")
-        
-        try:
-            active_audio_contents = set()
-            cards_with_audio = Flashcard.query.filter(
-                (Flashcard.front_audio_content != None) & (Flashcard.front_audio_content != '') |
-                (Flashcard.back_audio_content != None) & (Flashcard.back_audio_content != '')
-            ).all()
-
-            for card in cards_with_audio:
-                if card.front_audio_content:
-                    active_audio_contents.add(card.front_audio_content.strip())
-                if card.back_audio_content:
-                    active_audio_contents.add(card.back_audio_content.strip())
-
-            valid_cache_files = set()
-            for content in active_audio_contents:
-                content_hash = hashlib.sha1(content.encode('utf-8')).hexdigest()
-                valid_cache_files.add(f"{content_hash}.mp3")
-            
-            logger.info(f"{log_prefix} Tìm thấy {len(valid_cache_files)} file cache hợp lệ trong database.")
-
-            deleted_count = 0
-            if not os.path.exists(FLASHCARD_AUDIO_CACHE_DIR):
-                logger.warning(f"{log_prefix} Thư mục cache không tồn tại: {FLASHCARD_AUDIO_CACHE_DIR}")
-                return 0
-
-            for filename in os.listdir(FLASHCARD_AUDIO_CACHE_DIR):
-                if filename.endswith('.mp3') and filename not in valid_cache_files:
-                    try:
-                        file_path = os.path.join(FLASHCARD_AUDIO_CACHE_DIR, filename)
-                        os.remove(file_path)
-                        deleted_count += 1
-                        logger.info(f"{log_prefix} Đã xóa file cache mồ côi: {filename}")
-                    except OSError as e:
-                        logger.error(f"{log_prefix} Lỗi khi xóa file {filename}: {e}")
-            
-            logger.info(f"{log_prefix} Hoàn tất. Đã xóa {deleted_count} file cache không hợp lệ.")
-            return deleted_count
-        except Exception as e:
-            logger.error(f"{log_prefix} Lỗi nghiêm trọng trong quá trình dọn dẹp cache: {e}", exc_info=True)
-            return -1
-
     async def regenerate_audio_for_card(self, flashcard_id, side):
         """
         Mô tả: Tái tạo file audio cho một mặt cụ thể của một flashcard.
@@ -389,12 +359,7 @@ class AudioService:
             return False, "Không có nội dung audio để tái tạo."
 
         try:
-            content_hash = hashlib.sha1(audio_content.encode('utf-8')).hexdigest()
-            cache_filename = f"{content_hash}.mp3"
-            cached_file_path = os.path.join(FLASHCARD_AUDIO_CACHE_DIR, cache_filename)
-            if os.path.exists(cached_file_path):
-                os.remove(cached_file_path)
-                logger.info(f"{log_prefix} Đã xóa file cache cũ: {cache_filename}")
+            self.remove_cached_audio(audio_content)
 
             # Gọi hàm get_cached_or_generate_audio và nhận kết quả chi tiết
             new_path, success, message = await self.get_cached_or_generate_audio(audio_content)
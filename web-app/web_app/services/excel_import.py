@@ -0,0 +1,213 @@
+# web_app/services/excel_import.py
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import openpyxl
+
+from ..config import IMPORT_UPLOAD_DIR, IMPORT_MAX_REPORTED_ERRORS, IMPORT_MAX_TRACKED_JOBS
+
+logger = logging.getLogger(__name__)
+
+JOB_STATUS_QUEUED = 'queued'
+JOB_STATUS_RUNNING = 'running'
+JOB_STATUS_FINISHED = 'finished'
+JOB_STATUS_ERROR = 'error'
+
+
+def save_upload(file_stream):
+    """
+    Mô tả: Sao chép file tải lên ra đĩa theo từng khối (không đọc toàn bộ vào bộ nhớ),
+           để tác vụ nền đọc được sau khi request kết thúc.
+    Returns:
+        str: Đường dẫn file tạm; người gọi chịu trách nhiệm xóa.
+    """
+    os.makedirs(IMPORT_UPLOAD_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix='import_', suffix='.xlsx', dir=IMPORT_UPLOAD_DIR)
+    with os.fdopen(fd, 'wb') as f:
+        shutil.copyfileobj(file_stream, f, 1024 * 1024)
+    return path
+
+
+def remove_upload(path):
+    try:
+        if path and os.path.exists(path):
+            os.remove(path)
+    except OSError as e:
+        logger.warning(f"[EXCEL_IMPORT] Không thể xóa file tạm {path}: {e}")
+
+
+class ExcelRowReader:
+    """
+    Mô tả: Đọc sheet đầu tiên của file Excel ở chế độ read-only (openpyxl streaming), từng hàng một,
+           nên bộ nhớ không phụ thuộc số hàng. Hàng đầu tiên là tiêu đề (không phân biệt hoa thường).
+    """
+    def __init__(self, path, required_headers=()):
+        self.path = path
+        self._workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            self._sheet = self._workbook.active
+            header_row = next(self._sheet.iter_rows(min_row=1, max_row=1, values_only=True), ())
+            self.headers = [str(value).strip().lower() if value is not None else "" for value in header_row]
+            missing_headers = [h for h in required_headers if h not in self.headers]
+            if missing_headers:
+                raise ValueError(f"File Excel thiếu các cột bắt buộc: {', '.join(missing_headers)}.")
+        except Exception:
+            self.close()
+            raise
+        self.column_map = {header: idx for idx, header in enumerate(self.headers) if header}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._workbook is not None:
+            self._workbook.close()
+            self._workbook = None
+
+    def iter_rows(self):
+        """
+        Mô tả: Duyệt các hàng dữ liệu (bỏ qua hàng hoàn toàn trống).
+        Yields:
+            tuple: (row_index bắt đầu từ 2, dict tiêu đề -> giá trị gốc).
+        """
+        for row_index, values in enumerate(self._sheet.iter_rows(min_row=2, values_only=True), start=2):
+            if values is None or all(value is None for value in values):
+                continue
+            yield row_index, {
+                header: values[idx] if idx < len(values) else None
+                for header, idx in self.column_map.items()
+            }
+
+
+def cell_text(row, column, default=''):
+    """
+    Mô tả: Lấy giá trị ô dạng chuỗi đã strip, `default` nếu cột không có hoặc ô trống.
+    """
+    value = row.get(column)
+    return str(value).strip() if value is not None else default
+
+
+class ImportJob:
+    """
+    Mô tả: Trạng thái một tác vụ nhập Excel chạy nền (tiến độ và báo cáo lỗi theo hàng).
+           Danh sách lỗi được giới hạn IMPORT_MAX_REPORTED_ERRORS phần tử, error_count vẫn đếm đủ.
+    """
+    def __init__(self, kind, set_id, user_id):
+        self.job_id = uuid.uuid4().hex
+        self.kind = kind
+        self.set_id = set_id
+        self.user_id = user_id
+        self.status = JOB_STATUS_QUEUED
+        self.message = ''
+        self.processed_rows = 0
+        self.inserted = 0
+        self.skipped = 0
+        self.error_count = 0
+        self.errors = []
+        self.created_at = time.time()
+        self.finished_at = None
+
+    def record_error(self, row_index, message, skipped=True):
+        self.error_count += 1
+        if skipped:
+            self.skipped += 1
+        if len(self.errors) < IMPORT_MAX_REPORTED_ERRORS:
+            self.errors.append({'row': row_index, 'message': message})
+
+    @property
+    def is_active(self):
+        return self.status in (JOB_STATUS_QUEUED, JOB_STATUS_RUNNING)
+
+    def to_dict(self):
+        return {
+            'job_id': self.job_id, 'kind': self.kind, 'set_id': self.set_id, 'status': self.status,
+            'message': self.message, 'processed_rows': self.processed_rows, 'inserted': self.inserted,
+            'skipped': self.skipped, 'error_count': self.error_count, 'errors': list(self.errors),
+            'created_at': self.created_at, 'finished_at': self.finished_at
+        }
+
+
+class ImportJobRegistry:
+    """
+    Mô tả: Chạy các tác vụ nhập Excel trong luồng nền (có app_context) và giữ trạng thái của
+           IMPORT_MAX_TRACKED_JOBS tác vụ gần nhất trong bộ nhớ để trang quản lý theo dõi tiến độ.
+           Mỗi bộ chỉ có tối đa một tác vụ đang chạy.
+    """
+    def __init__(self, max_jobs=IMPORT_MAX_TRACKED_JOBS):
+        self.max_jobs = max_jobs
+        self._app = None
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self._app = app
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def latest_for_set(self, kind, set_id):
+        """
+        Returns:
+            ImportJob | None: Tác vụ mới nhất của bộ.
+        """
+        with self._lock:
+            for job in reversed(self._jobs.values()):
+                if job.kind == kind and job.set_id == set_id:
+                    return job
+        return None
+
+    def has_active_job(self, kind, set_id):
+        job = self.latest_for_set(kind, set_id)
+        return job is not None and job.is_active
+
+    def submit(self, kind, set_id, user_id, target, *args):
+        """
+        Mô tả: Tạo tác vụ và chạy `target(job, *args)` trong luồng nền.
+               `target` cập nhật tiến độ trên job và tự commit theo từng khối.
+        Returns:
+            ImportJob
+        """
+        if self._app is None:
+            raise RuntimeError("ImportJobRegistry chưa được khởi tạo với ứng dụng Flask.")
+        job = ImportJob(kind, set_id, user_id)
+        with self._lock:
+            self._jobs[job.job_id] = job
+            while len(self._jobs) > self.max_jobs:
+                oldest_id, oldest_job = next(iter(self._jobs.items()))
+                if oldest_job.is_active:
+                    break
+                del self._jobs[oldest_id]
+        thread = threading.Thread(target=self._run, args=(job, target, args), name=f'excel-import-{job.job_id[:8]}', daemon=True)
+        thread.start()
+        return job
+
+    def _run(self, job, target, args):
+        log_prefix = f"[EXCEL_IMPORT|{job.kind}|Set:{job.set_id}|Job:{job.job_id[:8]}]"
+        with self._app.app_context():
+            job.status = JOB_STATUS_RUNNING
+            logger.info(f"{log_prefix} Bắt đầu nhập dữ liệu.")
+            try:
+                target(job, *args)
+                job.status = JOB_STATUS_FINISHED
+                job.message = f"Hoàn tất: đã thêm {job.inserted} dòng, bỏ qua {job.skipped} dòng."
+            except Exception as e:
+                logger.error(f"{log_prefix} Lỗi khi nhập dữ liệu: {e}", exc_info=True)
+                job.status = JOB_STATUS_ERROR
+                job.message = f"Đã xảy ra lỗi sau khi thêm {job.inserted} dòng: {e}"
+            finally:
+                job.finished_at = time.time()
+            logger.info(f"{log_prefix} Kết thúc với trạng thái {job.status}: {job.processed_rows} hàng, "
+                        f"{job.inserted} đã thêm, {job.error_count} lỗi.")
+
+
+import_jobs = ImportJobRegistry()
@@ -2,8 +2,11 @@
 import logging
 from datetime import datetime, timedelta, timezone
 from ..models import db, Flashcard, User, UserFlashcardProgress, VocabularySet
-from ..config import DEFAULT_TIMEZONE_OFFSET
-from sqlalchemy import or_
+from ..config import DEFAULT_TIMEZONE_OFFSET, CATEGORY_PAGE_SIZE
+from .set_summary_cache import set_summary_cache
+from .search_index import flashcard_search
+from .keyset_pagination import paginate_keyset, category_count_cache
+from .media_registry import media_registry, flashcard_media_refs
 
 logger = logging.getLogger(__name__)
 
@@ -39,6 +42,7 @@ class FlashcardService:
             return None, "permission_denied"
 
         try:
+            media_before = flashcard_media_refs(card)
             card.front = data.get('front', card.front)
             card.back = data.get('back', card.back)
             card.front_audio_content = data.get('front_audio_content', card.front_audio_content)
@@ -46,7 +50,8 @@ class FlashcardService:
             card.front_img = data.get('front_img', card.front_img)
             card.back_img = data.get('back_img', card.back_img)
             card.ai_prompt = data.get('ai_prompt', card.ai_prompt)
-            
+            media_registry.apply_diff(media_before, flashcard_media_refs(card))
+
             db.session.commit()
             logger.info(f"{log_prefix} Cập nhật thẻ thành công.")
             return card, "success"
@@ -75,9 +80,13 @@ class FlashcardService:
             logger.warning(f"{log_prefix} Người dùng không có quyền xóa thẻ này.")
             return False, "permission_denied"
 
+        set_id = card.set_id
         try:
+            media_registry.release(flashcard_media_refs(card))
             db.session.delete(card)
             db.session.commit()
+            set_summary_cache.invalidate(set_id=set_id)
+            category_count_cache.invalidate(set_id=set_id)
             logger.info(f"{log_prefix} Xóa thẻ thành công.")
             return True, "success"
         except Exception as e:
@@ -88,6 +97,7 @@ class FlashcardService:
     def search_cards_in_set_paginated(self, set_id, search_term=None, search_field='all', page=1, per_page=10):
         """
         Mô tả: Tìm kiếm và phân trang danh sách các thẻ trong một bộ cụ thể.
+               Tìm theo nội dung dùng chỉ mục FTS5 (không dấu, theo tiền tố), kết quả xếp theo độ liên quan.
         """
         log_prefix = f"[FLASHSVC|SearchCards|Set:{set_id}]"
         logger.info(f"{log_prefix} Tìm kiếm với term='{search_term}', field='{search_field}', page={page}.")
@@ -95,59 +105,63 @@ class FlashcardService:
         query = Flashcard.query.filter_by(set_id=set_id)
 
         if search_term:
-            term = f"%{search_term}%"
             if search_field == 'id':
                 if search_term.isdigit():
                     query = query.filter(Flashcard.flashcard_id == int(search_term))
-            elif search_field == 'front':
-                query = query.filter(Flashcard.front.ilike(term))
-            elif search_field == 'back':
-                query = query.filter(Flashcard.back.ilike(term))
+            elif search_field in ('front', 'back'):
+                query = flashcard_search.filter_query(query, search_term, columns=(search_field,))
             else: # 'all'
-                query = query.filter(or_(
-                    Flashcard.front.ilike(term),
-                    Flashcard.back.ilike(term)
-                ))
+                query = flashcard_search.filter_query(query, search_term)
 
         query = query.order_by(Flashcard.flashcard_id.asc())
         pagination = query.paginate(page=page, per_page=per_page, error_out=False)
         return pagination
 
-    def get_cards_by_category(self, user_id, set_id, category, page, per_page=50):
+    def get_cards_by_category(self, user_id, set_id, category, after=None, before=None, per_page=CATEGORY_PAGE_SIZE):
+        """
+        Mô tả: Lấy một trang thẻ của bộ theo danh mục tiến trình, phân trang theo khóa (front, flashcard_id).
+               Điều kiện danh mục được lọc trong SQL; tổng số thẻ được cache ngắn hạn theo danh mục.
+        Args:
+            category (str): 'unseen', 'due', 'mastered', 'lapsed', 'due_soon' hoặc 'learning'.
+            after (str | None): Cursor của trang kế tiếp.
+            before (str | None): Cursor của trang trước.
+        Returns:
+            KeysetPage
+        Raises:
+            ValueError: Nếu danh mục hoặc cursor không hợp lệ.
+        """
         log_prefix = f"[FLASHSVC|GetCards|User:{user_id}|Set:{set_id}|Cat:{category}]"
-        logger.info(f"{log_prefix} Đang lấy trang {page}...")
-        
-        query = None
+
         if category == 'unseen':
-            subquery = db.session.query(UserFlashcardProgress.flashcard_id).filter_by(user_id=user_id)
-            query = Flashcard.query.filter(
-                Flashcard.set_id == set_id,
-                ~Flashcard.flashcard_id.in_(subquery)
-            )
+            seen = db.session.query(UserFlashcardProgress.progress_id).filter(
+                UserFlashcardProgress.user_id == user_id,
+                UserFlashcardProgress.flashcard_id == Flashcard.flashcard_id
+            ).exists()
+            query = Flashcard.query.filter(Flashcard.set_id == set_id, ~seen)
         else:
+            current_ts = _get_current_unix_timestamp()
+            category_filters = {
+                'due': [UserFlashcardProgress.due_time <= current_ts],
+                'mastered': [UserFlashcardProgress.correct_streak > 5],
+                'lapsed': [UserFlashcardProgress.lapse_count > 0],
+                'due_soon': [UserFlashcardProgress.due_time > current_ts, UserFlashcardProgress.due_time <= current_ts + 86400],
+                'learning': [UserFlashcardProgress.correct_streak <= 5],
+            }
+            if category not in category_filters:
+                raise ValueError(f"Danh mục không hợp lệ: {category}")
             query = Flashcard.query.join(UserFlashcardProgress).filter(
+                UserFlashcardProgress.user_id == user_id,
+                UserFlashcardProgress.set_id == set_id,
                 Flashcard.set_id == set_id,
-                UserFlashcardProgress.user_id == user_id
+                *category_filters[category]
             )
-            current_ts = _get_current_unix_timestamp()
-            ts_in_24_hours = current_ts + 86400
-            if category == 'due':
-                query = query.filter(UserFlashcardProgress.due_time <= current_ts)
-            elif category == 'mastered':
-                query = query.filter(UserFlashcardProgress.correct_streak > 5)
-            elif category == 'lapsed':
-                query = query.filter(UserFlashcardProgress.lapse_count > 0)
-            elif category == 'due_soon':
-                query = query.filter(UserFlashcardProgress.due_time > current_ts, UserFlashcardProgress.due_time <= ts_in_24_hours)
-            elif category == 'learning':
-                query = query.filter(UserFlashcardProgress.correct_streak <= 5)
-
-        if query is None:
-            raise ValueError(f"Danh mục không hợp lệ: {category}")
-
-        query = query.order_by(Flashcard.front)
-        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
-        logger.info(f"{log_prefix} Tìm thấy {pagination.total} thẻ. Trả về trang {page}.")
-        return pagination
+
+        page = paginate_keyset(
+            query, [Flashcard.front, Flashcard.flashcard_id],
+            lambda card: (card.front, card.flashcard_id), per_page, after=after, before=before
+        )
+        page.total = category_count_cache.get_or_count(('flashcard', user_id, set_id, category), query.count)
+        logger.info(f"{log_prefix} Trả về {len(page.items)}/{page.total} thẻ.")
+        return page
 
 flashcard_service = FlashcardService()
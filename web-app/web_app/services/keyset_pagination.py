@@ -0,0 +1,140 @@
+# web_app/services/keyset_pagination.py
+import base64
+import binascii
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import tuple_
+
+from ..config import CATEGORY_COUNT_CACHE_TTL_SECONDS, CATEGORY_COUNT_CACHE_MAX_ENTRIES
+
+logger = logging.getLogger(__name__)
+
+
+def encode_cursor(key_values):
+    """
+    Mô tả: Mã hóa khóa sắp xếp của một dòng thành chuỗi cursor an toàn cho URL.
+    """
+    payload = json.dumps(list(key_values), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, key_length):
+    """
+    Mô tả: Giải mã cursor do encode_cursor tạo ra.
+    Raises:
+        ValueError: Nếu cursor không hợp lệ.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+    except (binascii.Error, UnicodeError, ValueError) as e:
+        raise ValueError(f"Cursor không hợp lệ: {e}")
+    if not isinstance(values, list) or len(values) != key_length:
+        raise ValueError("Cursor không hợp lệ.")
+    return tuple(values)
+
+
+class KeysetPage:
+    """
+    Mô tả: Một trang kết quả phân trang theo khóa (keyset): thay vì OFFSET, trang kế tiếp bắt đầu
+           ngay sau khóa sắp xếp của dòng cuối trang hiện tại, nên chi phí mỗi trang không phụ thuộc
+           vị trí trang trong danh sách.
+    """
+    def __init__(self, items, next_cursor, prev_cursor, total=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def paginate_keyset(query, sort_columns, key_function, per_page, after=None, before=None):
+    """
+    Mô tả: Lấy một trang của `query` theo thứ tự tăng dần của `sort_columns`.
+    Args:
+        query (Query): Truy vấn đã lọc, chưa sắp xếp.
+        sort_columns (list): Các cột sắp xếp; tổ hợp phải duy nhất (cột cuối thường là khóa chính).
+        key_function (callable): Hàm lấy tuple giá trị khóa sắp xếp từ một dòng kết quả.
+        per_page (int): Số dòng mỗi trang.
+        after (str | None): Cursor, lấy các dòng đứng sau dòng này.
+        before (str | None): Cursor, lấy các dòng đứng trước dòng này (trang trước).
+    Returns:
+        KeysetPage (total luôn là None, người gọi tự gắn nếu cần).
+    Raises:
+        ValueError: Nếu cursor không hợp lệ.
+    """
+    key = tuple_(*sort_columns)
+    if before:
+        query = query.filter(key < tuple_(*decode_cursor(before, len(sort_columns))))
+        rows = query.order_by(*[col.desc() for col in sort_columns]).limit(per_page + 1).all()
+        has_more_before = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        has_more_after = True
+    else:
+        if after:
+            query = query.filter(key > tuple_(*decode_cursor(after, len(sort_columns))))
+        rows = query.order_by(*sort_columns).limit(per_page + 1).all()
+        has_more_after = len(rows) > per_page
+        items = rows[:per_page]
+        has_more_before = bool(after)
+
+    next_cursor = encode_cursor(key_function(items[-1])) if items and has_more_after else None
+    prev_cursor = encode_cursor(key_function(items[0])) if items and has_more_before else None
+    return KeysetPage(items, next_cursor, prev_cursor)
+
+
+class CategoryCountCache:
+    """
+    Mô tả: Cache ngắn hạn cho tổng số dòng của mỗi danh mục (ví dụ (user, bộ, 'due')), để các trang sau
+           của cùng một danh mục không phải COUNT lại. Số đếm có thể chậm tối đa TTL giây.
+    """
+    def __init__(self, ttl_seconds=CATEGORY_COUNT_CACHE_TTL_SECONDS, max_entries=CATEGORY_COUNT_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_count(self, key, count_function):
+        """
+        Returns:
+            int: Số đếm trong cache còn hạn, hoặc kết quả mới của `count_function()`.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[1] <= self.ttl_seconds:
+                return entry[0]
+        count = count_function()
+        with self._lock:
+            self._entries[key] = (count, now)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return count
+
+    def invalidate(self, user_id=None, set_id=None):
+        """
+        Mô tả: Hủy các số đếm khớp với user_id và/hoặc set_id (khóa có dạng (loại, user_id, set_id, danh mục)).
+               Gọi không tham số để hủy toàn bộ.
+        """
+        with self._lock:
+            for key in list(self._entries.keys()):
+                if user_id is not None and key[1] != user_id:
+                    continue
+                if set_id is not None and key[2] != set_id:
+                    continue
+                del self._entries[key]
+
+
+category_count_cache = CategoryCountCache()
@@ -0,0 +1,109 @@
+# web_app/services/last_seen_buffer.py
+import atexit
+import logging
+import threading
+import time
+
+from sqlalchemy import update, func, bindparam
+
+from ..models import db, User
+from ..config import LAST_SEEN_FLUSH_INTERVAL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class LastSeenBuffer:
+    """
+    Mô tả: Bộ đệm ghi trễ (write-behind) cho cột Users.last_seen.
+           Mỗi request chỉ ghi timestamp vào bộ nhớ; một luồng nền gom các giá trị và ghi bằng một lệnh
+           UPDATE theo lô sau mỗi `flush_interval` giây và khi tiến trình kết thúc.
+           Giá trị trong database chậm tối đa `flush_interval` giây so với thực tế (giới hạn độ cũ);
+           các thống kê cần chính xác (ví dụ người dùng hoạt động hôm nay) gọi flush() trước khi đọc.
+    """
+    def __init__(self, flush_interval=LAST_SEEN_FLUSH_INTERVAL_SECONDS):
+        self.flush_interval = flush_interval
+        self._pending = {}  # user_id -> last_seen
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._app = None
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def touch(self, user_id, ts=None):
+        """
+        Mô tả: Ghi nhận người dùng vừa hoạt động. Không truy cập database.
+        Args:
+            user_id (int): ID của người dùng.
+            ts (int | None): Thời điểm hoạt động, mặc định là hiện tại.
+        """
+        ts = int(ts if ts is not None else time.time())
+        with self._lock:
+            if ts > self._pending.get(user_id, 0):
+                self._pending[user_id] = ts
+
+    def start(self, app):
+        """
+        Mô tả: Khởi động luồng nền ghi định kỳ (một lần cho mỗi tiến trình) và đăng ký ghi lần cuối khi thoát.
+        Args:
+            app (Flask): Ứng dụng Flask, dùng để tạo app_context cho luồng nền.
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._app = app
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name='last-seen-flusher', daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+        logger.info(f"[LAST_SEEN] Đã khởi động luồng ghi last_seen (chu kỳ {self.flush_interval} giây).")
+
+    def stop(self):
+        """
+        Mô tả: Dừng luồng nền và ghi nốt các giá trị còn trong bộ đệm.
+        """
+        self._stop_event.set()
+        if self._app is not None:
+            with self._app.app_context():
+                self.flush()
+
+    def _run(self):
+        while not self._stop_event.wait(self.flush_interval):
+            try:
+                with self._app.app_context():
+                    self.flush()
+            except Exception as e:
+                logger.error(f"[LAST_SEEN] Lỗi trong luồng ghi last_seen: {e}", exc_info=True)
+
+    def flush(self):
+        """
+        Mô tả: Ghi toàn bộ giá trị đang chờ bằng một lệnh UPDATE theo lô trong transaction riêng
+               (không dùng db.session của request). Giá trị mới không bao giờ ghi đè giá trị lớn hơn.
+               Cần gọi trong app_context.
+        Returns:
+            int: Số người dùng đã ghi.
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+
+            statement = update(User.__table__).where(User.__table__.c.user_id == bindparam('b_user_id')).values(
+                last_seen=func.max(func.coalesce(User.__table__.c.last_seen, 0), bindparam('b_last_seen'))
+            )
+            try:
+                with db.engine.begin() as connection:
+                    connection.execute(statement, [
+                        {'b_user_id': user_id, 'b_last_seen': last_seen} for user_id, last_seen in pending.items()
+                    ])
+            except Exception as e:
+                logger.error(f"[LAST_SEEN] Lỗi khi ghi last_seen cho {len(pending)} người dùng: {e}", exc_info=True)
+                for user_id, last_seen in pending.items():
+                    self.touch(user_id, last_seen)
+                return 0
+
+            logger.debug(f"[LAST_SEEN] Đã ghi last_seen cho {len(pending)} người dùng.")
+            return len(pending)
+
+
+last_seen_buffer = LastSeenBuffer()
@@ -0,0 +1,281 @@
+# web_app/services/leaderboard.py
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import event, func, select, delete, insert, and_, case
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sortedcontainers import SortedList
+
+from ..models import db, User, UserFlashcardProgress, UserQuizProgress, ScoreLog, LeaderboardTotal
+from ..config import DEFAULT_TIMEZONE_OFFSET, LEADERBOARD_CACHE_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+PERIOD_ALL_TIME = 'all_time'
+PERIOD_MONTH = 'month'
+PERIOD_WEEK = 'week'
+PERIOD_DAY = 'day'
+PERIODS = (PERIOD_ALL_TIME, PERIOD_MONTH, PERIOD_WEEK, PERIOD_DAY)
+
+# review_count/learned_card_count/quiz_answer_count đếm số thẻ/câu hỏi khác nhau có lần ôn cuối nằm trong kỳ
+# (thẻ đã học với learned_card_count); new_card_count đếm thẻ được học lần đầu trong kỳ.
+METRICS = ('score', 'review_count', 'learned_card_count', 'new_card_count', 'quiz_answer_count')
+
+_PENDING_SESSION_KEY = 'leaderboard_pending'
+
+
+def get_period_start(period, ts, tz_offset_hours=DEFAULT_TIMEZONE_OFFSET):
+    """
+    Mô tả: Tính Unix timestamp đầu kỳ (nửa đêm đầu ngày/tuần/tháng theo múi giờ) chứa thời điểm `ts`.
+    Returns:
+        int: Timestamp đầu kỳ, 0 với PERIOD_ALL_TIME.
+    """
+    if period == PERIOD_ALL_TIME:
+        return 0
+    tz = timezone(timedelta(hours=tz_offset_hours))
+    local_date = datetime.fromtimestamp(ts, tz).date()
+    if period == PERIOD_WEEK:
+        local_date = local_date - timedelta(days=local_date.weekday())
+    elif period == PERIOD_MONTH:
+        local_date = local_date.replace(day=1)
+    return int(datetime.combine(local_date, datetime.min.time(), tzinfo=tz).timestamp())
+
+
+class RankIndex:
+    """
+    Mô tả: Tập (-value, user_id) có thứ tự của một chỉ số trong một kỳ, lưu bằng SortedList.
+           Cập nhật giá trị và tìm thứ hạng của một người dùng đều là O(log n), top-N là O(log n + N).
+    """
+    def __init__(self, values):
+        self._values = dict(values)
+        self._sorted = SortedList((-value, user_id) for user_id, value in self._values.items())
+
+    def __len__(self):
+        return len(self._sorted)
+
+    def get(self, user_id):
+        return self._values.get(user_id, 0)
+
+    def add(self, user_id, delta):
+        old_value = self._values.get(user_id)
+        if old_value is not None:
+            self._sorted.discard((-old_value, user_id))
+        new_value = (old_value or 0) + delta
+        self._values[user_id] = new_value
+        self._sorted.add((-new_value, user_id))
+
+    def top(self, limit):
+        return [(user_id, -negative_value) for negative_value, user_id in self._sorted.islice(0, limit)]
+
+    def rank(self, user_id):
+        """
+        Returns:
+            int | None: Thứ hạng (bắt đầu từ 1, cùng giá trị thì user_id nhỏ hơn đứng trước).
+        """
+        value = self._values.get(user_id)
+        if value is None:
+            return None
+        return self._sorted.bisect_left((-value, user_id)) + 1
+
+
+class LeaderboardEngine:
+    """
+    Mô tả: Quản lý bảng xếp hạng dựa trên bảng LeaderboardTotals (tổng cộng dồn theo kỳ).
+           - Ghi: mỗi lần ghi điểm/hoạt động, các giá trị được upsert vào dòng (user, period) trong cùng
+             transaction; dòng của kỳ cũ được đặt lại khi sang kỳ mới.
+           - Đọc: mỗi kỳ có một RankIndex cho từng chỉ số, dựng bằng một truy vấn và được cập nhật
+             tăng dần sau khi transaction ghi commit thành công.
+    """
+    def __init__(self, ttl_seconds=LEADERBOARD_CACHE_TTL_SECONDS, tz_offset_hours=DEFAULT_TIMEZONE_OFFSET):
+        self.ttl_seconds = ttl_seconds
+        self.tz_offset_hours = tz_offset_hours
+        self._indexes = {}  # (period, period_start) -> (built_at, {metric: RankIndex})
+        self._lock = threading.RLock()
+
+    def record_activity(self, events):
+        """
+        Mô tả: Cộng dồn các hoạt động vào LeaderboardTotals trong session hiện tại (không commit).
+               Chỉ hoạt động thuộc kỳ hiện tại được cộng vào kỳ đó (hoạt động cũ, ví dụ từ đồng bộ offline,
+               chỉ được tính vào all_time). Một lượt ôn chỉ được đếm nếu lần ôn trước của thẻ/câu hỏi nằm ngoài
+               kỳ, nên các chỉ số đếm trùng khớp với rebuild_leaderboard_totals.
+        Args:
+            events (iterable): Các tuple (user_id, source_type, ts, previous_review_ts, reviews, new_items, is_learned, score).
+        """
+        now = int(time.time())
+        current_starts = {period: get_period_start(period, now, self.tz_offset_hours) for period in PERIODS}
+        deltas = defaultdict(lambda: dict.fromkeys(METRICS, 0))
+        for user_id, source_type, ts, previous_review_ts, reviews, new_items, is_learned, score in events:
+            for period in PERIODS:
+                if get_period_start(period, ts, self.tz_offset_hours) != current_starts[period]:
+                    continue
+                delta = deltas[(user_id, period)]
+                delta['score'] += score
+                is_first_in_period = bool(reviews) and (
+                    previous_review_ts is None or previous_review_ts < current_starts[period]
+                )
+                if source_type == 'quiz':
+                    delta['quiz_answer_count'] += int(is_first_in_period)
+                else:
+                    delta['review_count'] += int(is_first_in_period)
+                    # Thẻ đã ôn trong kỳ nhưng vừa được học ở lượt này cũng bắt đầu được tính.
+                    delta['learned_card_count'] += int(bool(reviews) and is_learned and (is_first_in_period or bool(new_items)))
+                    delta['new_card_count'] += new_items
+
+        rows = [
+            dict(user_id=user_id, period=period, period_start=current_starts[period], **delta)
+            for (user_id, period), delta in deltas.items() if any(delta.values())
+        ]
+        if not rows:
+            return
+
+        statement = sqlite_insert(LeaderboardTotal)
+        same_period = LeaderboardTotal.period_start == statement.excluded.period_start
+        update_values = {
+            metric: case((same_period, getattr(LeaderboardTotal, metric) + getattr(statement.excluded, metric)),
+                         else_=getattr(statement.excluded, metric))
+            for metric in METRICS
+        }
+        update_values['period_start'] = statement.excluded.period_start
+        db.session.execute(statement.on_conflict_do_update(index_elements=['user_id', 'period'], set_=update_values), rows)
+        db.session.info.setdefault(_PENDING_SESSION_KEY, []).extend(rows)
+
+    def _apply_committed(self, rows):
+        with self._lock:
+            for row in rows:
+                cached = self._indexes.get((row['period'], row['period_start']))
+                if cached is None:
+                    continue
+                for metric in METRICS:
+                    if row[metric]:
+                        cached[1][metric].add(row['user_id'], row[metric])
+
+    def _build(self, period, period_start):
+        columns = [
+            func.coalesce(getattr(LeaderboardTotal, metric), 0) for metric in METRICS
+        ]
+        rows = db.session.execute(
+            select(User.user_id, *columns).outerjoin(LeaderboardTotal, and_(
+                LeaderboardTotal.user_id == User.user_id,
+                LeaderboardTotal.period == period,
+                LeaderboardTotal.period_start == period_start
+            ))
+        ).all()
+        indexes = {
+            metric: RankIndex((row[0], row[position + 1]) for row in rows)
+            for position, metric in enumerate(METRICS)
+        }
+        logger.debug(f"[LEADERBOARD|{period}|{period_start}] Đã dựng chỉ mục xếp hạng cho {len(rows)} người dùng.")
+        return indexes
+
+    def _get_indexes(self, period):
+        period_start = get_period_start(period, int(time.time()), self.tz_offset_hours)
+        now = time.time()
+        with self._lock:
+            cached = self._indexes.get((period, period_start))
+            if cached is not None and now - cached[0] <= self.ttl_seconds:
+                return cached[1]
+            indexes = self._build(period, period_start)
+            # Bỏ chỉ mục của các kỳ đã qua.
+            for key in [key for key in self._indexes if key[0] == period]:
+                del self._indexes[key]
+            self._indexes[(period, period_start)] = (now, indexes)
+            return indexes
+
+    def top(self, period, metric, limit):
+        """
+        Mô tả: Lấy `limit` người dùng đứng đầu theo chỉ số trong kỳ hiện tại.
+        Returns:
+            list: Danh sách (user_id, value) theo thứ tự xếp hạng.
+        """
+        with self._lock:
+            return self._get_indexes(period)[metric].top(limit)
+
+    def rank(self, user_id, period, metric):
+        """
+        Mô tả: Thứ hạng của một người dùng theo chỉ số trong kỳ hiện tại.
+        Returns:
+            tuple: (rank, value, total_users); rank là None nếu người dùng chưa có trong chỉ mục.
+        """
+        with self._lock:
+            index = self._get_indexes(period)[metric]
+            return index.rank(user_id), index.get(user_id), len(index)
+
+    def get_values(self, user_ids, period):
+        """
+        Mô tả: Lấy tất cả chỉ số của các người dùng trong kỳ hiện tại.
+        Returns:
+            dict: user_id -> {metric: value}.
+        """
+        with self._lock:
+            indexes = self._get_indexes(period)
+            return {user_id: {metric: indexes[metric].get(user_id) for metric in METRICS} for user_id in user_ids}
+
+    def invalidate(self):
+        """
+        Mô tả: Hủy toàn bộ chỉ mục trong bộ nhớ (ví dụ sau khi xóa người dùng hoặc dựng lại bảng).
+        """
+        with self._lock:
+            self._indexes.clear()
+
+
+def rebuild_leaderboard_totals(executor, tz_offset_hours=DEFAULT_TIMEZONE_OFFSET):
+    """
+    Mô tả: Xóa và dựng lại LeaderboardTotals cho kỳ hiện tại của mọi loại kỳ từ dữ liệu lịch sử,
+           theo cùng cách tính của bảng xếp hạng trước đây (không tự commit).
+    Args:
+        executor: Session hoặc Connection của SQLAlchemy.
+    Returns:
+        int: Số dòng đã ghi.
+    """
+    now = int(time.time())
+    totals = defaultdict(lambda: dict.fromkeys(METRICS, 0))
+    # learned_date là nửa đêm theo múi giờ của người dùng; dời về nửa đêm cùng ngày theo múi giờ kỳ
+    # để thẻ học hôm nay của người dùng ở múi giờ lớn hơn không rơi ra ngoài kỳ hiện tại.
+    user_offset = select(func.coalesce(User.timezone_offset, DEFAULT_TIMEZONE_OFFSET))\
+        .where(User.user_id == UserFlashcardProgress.user_id).scalar_subquery()
+    learned_date_expr = UserFlashcardProgress.learned_date + (user_offset - tz_offset_hours) * 3600
+    for period in PERIODS:
+        period_start = get_period_start(period, now, tz_offset_hours)
+        sources = [
+            ('score', ScoreLog.user_id, func.sum(ScoreLog.score_change), ScoreLog.timestamp, ()),
+            ('review_count', UserFlashcardProgress.user_id, func.count(), UserFlashcardProgress.last_reviewed, ()),
+            ('learned_card_count', UserFlashcardProgress.user_id, func.count(), UserFlashcardProgress.last_reviewed,
+             (UserFlashcardProgress.learned_date.isnot(None),)),
+            ('new_card_count', UserFlashcardProgress.user_id, func.count(), learned_date_expr, ()),
+            ('quiz_answer_count', UserQuizProgress.user_id, func.count(), UserQuizProgress.last_answered, ()),
+        ]
+        for metric, user_column, aggregate, ts_column, extra_filters in sources:
+            query = select(user_column, aggregate).where(
+                ts_column.isnot(None), ts_column >= period_start, *extra_filters
+            ).group_by(user_column)
+            for user_id, value in executor.execute(query).all():
+                totals[(user_id, period)][metric] = value or 0
+
+    rows = [
+        dict(user_id=user_id, period=period, period_start=get_period_start(period, now, tz_offset_hours), **values)
+        for (user_id, period), values in totals.items()
+    ]
+    executor.execute(delete(LeaderboardTotal))
+    if rows:
+        executor.execute(insert(LeaderboardTotal), rows)
+    leaderboard_engine.invalidate()
+    logger.info(f"[LEADERBOARD|Rebuild] Đã dựng lại {len(rows)} dòng.")
+    return len(rows)
+
+
+leaderboard_engine = LeaderboardEngine()
+
+
+@event.listens_for(db.session, 'after_commit')
+def _apply_pending_after_commit(session):
+    rows = session.info.pop(_PENDING_SESSION_KEY, None)
+    if rows:
+        leaderboard_engine._apply_committed(rows)
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _discard_pending_after_rollback(session, previous_transaction):
+    session.info.pop(_PENDING_SESSION_KEY, None)
@@ -4,6 +4,7 @@ import time
 import math
 import random
 from datetime import datetime, timedelta, time as dt_time, timezone
+from collections import Counter
 
 # --- BẮT ĐẦU SỬA: Thêm ScoreLog ---
 from ..models import db, User, VocabularySet, Flashcard, UserFlashcardProgress, ScoreLog
@@ -19,7 +20,8 @@ from ..config import (
     MODE_NEW_CARDS_ONLY,
     MODE_REVIEW_ALL_DUE,
     MODE_REVIEW_HARDEST,
-    MODE_AUTOPLAY_REVIEW
+    MODE_AUTOPLAY_REVIEW,
+    REVIEW_BATCH_MAX_CLIENT_AGE_DAYS
 )
 
 from .mode_strategies import (
@@ -31,10 +33,17 @@ from .mode_strategies import (
     get_card_for_sequential_learning,
     get_card_for_autoplay_review
 )
+from .review_queue import review_queue_registry, ORDER_RANDOM, ORDER_HARDEST
+from .set_summary_cache import set_summary_cache
+from .keyset_pagination import category_count_cache
+from .activity_rollup import ActivityRollupBuffer, SOURCE_FLASHCARD
 
 
 logger = logging.getLogger(__name__)
 
+# -1 (quên), 0 (mơ hồ), 1 (nhớ), 2 (tiếp tục với thẻ mới)
+REVIEW_RESPONSES = (-1, 0, 1, 2)
+
 class LearningLogicService:
     def __init__(self):
         self.mode_strategies = {
@@ -80,48 +89,24 @@ class LearningLogicService:
         return _get_wait_time_for_set(user_id, set_id, current_ts, tz_offset_hours, log_prefix)
 
 
-    def process_review_response(self, user_id, progress_id, response):
-        log_prefix = f"[PROCESS_ANSWER|UserUID:{user_id}|ProgID:{progress_id}|Resp:{response}]" 
-        logger.info(f"{log_prefix} Bắt đầu xử lý đánh giá.")
-
-        progress = UserFlashcardProgress.query.get(progress_id)
-        if not progress:
-            logger.error(f"{log_prefix} Không tìm thấy tiến trình với ID: {progress_id}")
-            return None, None
-
-        user = User.query.get(user_id)
-        if not user:
-            logger.error(f"{log_prefix} Không tìm thấy người dùng với ID: {user_id}")
-            return None, None
-
-        if user.current_mode == MODE_AUTOPLAY_REVIEW:
-            logger.info(f"{log_prefix} Chế độ Autoplay, không cập nhật tiến trình và điểm số.")
-            flashcard_info_updated = {
-                'progress_id': progress.progress_id,
-                'flashcard_id': progress.flashcard.flashcard_id,
-                'user_id': progress.user_id,
-                'front': progress.flashcard.front,
-                'back': progress.flashcard.back,
-                'front_audio_content': progress.flashcard.front_audio_content,
-                'back_audio_content': progress.flashcard.back_audio_content,
-                'front_img': progress.flashcard.front_img,
-                'back_img': progress.flashcard.back_img,
-                'notification_text': progress.flashcard.notification_text,
-                'set_id': progress.flashcard.set_id,
-                'title': progress.flashcard.vocabulary_set.title if progress.flashcard.vocabulary_set else None
-            }
-            return flashcard_info_updated, self._get_current_unix_timestamp(user.timezone_offset)
-
+    def _apply_review(self, progress, response, current_mode, current_ts, tz_offset_hours):
+        """
+        Mô tả: Tính toán các giá trị SRS mới và gán vào tiến trình (chỉ trong bộ nhớ, không commit).
+        Args:
+            progress (UserFlashcardProgress): Tiến trình cần cập nhật.
+            response (int): -1 (quên), 0 (mơ hồ), 1 (nhớ), 2 (tiếp tục với thẻ mới).
+            current_mode (str): Chế độ học hiện tại của người dùng.
+            current_ts (int): Unix timestamp của lượt đánh giá.
+            tz_offset_hours (int): Độ lệch múi giờ của người dùng.
+        Returns:
+            tuple: (score_to_add, score_reason), hoặc (None, None) nếu response không hợp lệ.
+        """
         current_streak_correct = progress.correct_streak
         current_total_correct = progress.correct_count
         current_incorrect_count = progress.incorrect_count
         current_lapse_count = progress.lapse_count
         current_review_count = progress.review_count
 
-        tz_offset_hours = user.timezone_offset
-        current_mode = user.current_mode
-        current_ts = self._get_current_unix_timestamp(tz_offset_hours)
-
         is_quick_review_score_only_mode = (current_mode == MODE_REVIEW_HARDEST) 
 
         new_streak_correct = current_streak_correct
@@ -133,9 +118,6 @@ class LearningLogicService:
         score_to_add = 0
         score_reason = ''
         next_review_time = progress.due_time or current_ts + 60
-        
-        logger.debug(f"{log_prefix} Initial score_to_add: {score_to_add}, current_user_score: {user.score}")
-
 
         if is_quick_review_score_only_mode:
             if response == 1: 
@@ -166,7 +148,6 @@ class LearningLogicService:
                 score_to_add = SCORE_INCREASE_NEW_CARD
                 score_reason = 'new_card'
             else:
-                logger.error(f"{log_prefix} Response không hợp lệ: {response}")
                 return None, None
 
         progress.last_reviewed = current_ts
@@ -176,9 +157,113 @@ class LearningLogicService:
         progress.correct_count = new_total_correct
         progress.incorrect_count = new_incorrect_count
         progress.lapse_count = new_lapse_count
+        return score_to_add, score_reason
+
+    def _count_new_cards_on(self, user_id, midnight_ts):
+        return UserFlashcardProgress.query.filter(
+            UserFlashcardProgress.user_id == user_id,
+            UserFlashcardProgress.learned_date == midnight_ts
+        ).count()
+
+    def _start_new_card(self, user, flashcard, review_ts, tz_offset_hours):
+        """
+        Mô tả: Tạo tiến trình (chưa commit) cho một thẻ mới ngay khi người dùng đánh giá nó lần đầu.
+               learned_date được đặt theo ngày của lượt đánh giá, giống tiến trình do các chiến lược học tạo.
+        Returns:
+            UserFlashcardProgress
+        """
+        progress = UserFlashcardProgress(
+            user_id=user.user_id,
+            flashcard_id=flashcard.flashcard_id,
+            set_id=flashcard.set_id,
+            last_reviewed=None,
+            due_time=review_ts + RETRY_INTERVAL_NEW_MIN * 60,
+            review_count=0,
+            learned_date=None,
+            correct_streak=0,
+            correct_count=0,
+            incorrect_count=0,
+            lapse_count=0,
+            is_skipped=0
+        )
+        db.session.add(progress)
+        return progress
+
+    def process_review_response(self, user_id, progress_id, response, user=None, flashcard_id=None):
+        """
+        Mô tả: Áp dụng một đánh giá cho một thẻ.
+        Args:
+            progress_id (int | None): ID tiến trình; None với thẻ mới lấy từ API lấy trước (khi đó dùng flashcard_id).
+            flashcard_id (int, optional): Thẻ mới chưa có tiến trình; tiến trình được tạo khi đánh giá đầu tiên đến.
+        Returns:
+            tuple: (thông tin thẻ sau khi cập nhật, thời điểm ôn tiếp theo), hoặc (None, None) nếu lỗi.
+        """
+        log_prefix = f"[PROCESS_ANSWER|UserUID:{user_id}|ProgID:{progress_id}|Card:{flashcard_id}|Resp:{response}]"
+        logger.info(f"{log_prefix} Bắt đầu xử lý đánh giá.")
+
+        if user is None:
+            user = User.query.get(user_id)
+        if not user:
+            logger.error(f"{log_prefix} Không tìm thấy người dùng với ID: {user_id}")
+            return None, None
+
+        if progress_id is not None:
+            progress = UserFlashcardProgress.query.get(progress_id)
+        else:
+            progress = UserFlashcardProgress.query.filter_by(user_id=user_id, flashcard_id=flashcard_id).first()
+            if not progress and user.current_mode != MODE_AUTOPLAY_REVIEW and response in REVIEW_RESPONSES:
+                flashcard = Flashcard.query.get(flashcard_id) if flashcard_id is not None else None
+                if not flashcard:
+                    logger.error(f"{log_prefix} Không tìm thấy thẻ.")
+                    return None, None
+                current_ts = self._get_current_unix_timestamp(user.timezone_offset)
+                if self._count_new_cards_on(user_id, self._get_midnight_timestamp(current_ts, user.timezone_offset)) >= user.daily_new_limit:
+                    logger.info(f"{log_prefix} Đã đạt giới hạn thẻ MỚI hàng ngày, không tạo tiến trình.")
+                    return None, None
+                progress = self._start_new_card(user, flashcard, current_ts, user.timezone_offset)
+        if not progress or progress.user_id != user_id:
+            logger.error(f"{log_prefix} Không tìm thấy tiến trình.")
+            return None, None
+
+        if user.current_mode == MODE_AUTOPLAY_REVIEW:
+            logger.info(f"{log_prefix} Chế độ Autoplay, không cập nhật tiến trình và điểm số.")
+            flashcard_info_updated = {
+                'progress_id': progress.progress_id,
+                'flashcard_id': progress.flashcard.flashcard_id,
+                'user_id': progress.user_id,
+                'front': progress.flashcard.front,
+                'back': progress.flashcard.back,
+                'front_audio_content': progress.flashcard.front_audio_content,
+                'back_audio_content': progress.flashcard.back_audio_content,
+                'front_img': progress.flashcard.front_img,
+                'back_img': progress.flashcard.back_img,
+                'notification_text': progress.flashcard.notification_text,
+                'set_id': progress.flashcard.set_id,
+                'title': progress.flashcard.vocabulary_set.title if progress.flashcard.vocabulary_set else None
+            }
+            return flashcard_info_updated, self._get_current_unix_timestamp(user.timezone_offset)
+
+        tz_offset_hours = user.timezone_offset
+        current_ts = self._get_current_unix_timestamp(tz_offset_hours)
+        previous_reviewed_ts = progress.last_reviewed
+        previous_learned_date = progress.learned_date
+        if progress.progress_id is None:
+            progress.learned_date = self._get_midnight_timestamp(current_ts, tz_offset_hours)
+
+        score_to_add, score_reason = self._apply_review(progress, response, user.current_mode, current_ts, tz_offset_hours)
+        if score_to_add is None:
+            logger.error(f"{log_prefix} Response không hợp lệ: {response}")
+            return None, None
+        next_review_time = progress.due_time
 
         try:
             db.session.add(progress)
+
+            activity = ActivityRollupBuffer(tz_offset_hours)
+            activity.add_review(user_id, SOURCE_FLASHCARD, current_ts, previous_reviewed_ts,
+                                is_new=(previous_learned_date is None and progress.learned_date is not None),
+                                is_learned=progress.learned_date is not None, score=score_to_add)
+            activity.flush()
             
             # --- BẮT ĐẦU SỬA: Ghi lại log điểm ---
             if score_to_add != 0:
@@ -205,6 +290,10 @@ class LearningLogicService:
             logger.error(f"{log_prefix} Lỗi khi commit progress/score: {e}", exc_info=True)
             return None, None
 
+        review_queue_registry.on_progress_changed(progress)
+        set_summary_cache.on_progress_changed(progress)
+        category_count_cache.invalidate(user_id=progress.user_id, set_id=progress.set_id)
+
         flashcard_info_updated = {
             'progress_id': progress.progress_id,
             'flashcard_id': progress.flashcard.flashcard_id,
@@ -230,11 +319,291 @@ class LearningLogicService:
         }
         return flashcard_info_updated, next_review_time
 
-    def get_next_card_for_review(self, user_id, set_id, mode):
+    def _normalize_rating(self, rating):
+        """
+        Mô tả: Chuẩn hóa một đánh giá trong lô về dạng tuple (progress_id, response, client_ts, flashcard_id).
+        Args:
+            rating (tuple | dict): (progress_id, response[, client_ts[, flashcard_id]]) hoặc dict có các khóa tương ứng.
+        Returns:
+            tuple: (progress_id, response, client_ts, flashcard_id); client_ts/flashcard_id là None nếu client không gửi.
+        """
+        if isinstance(rating, dict):
+            return rating.get('progress_id'), rating.get('response'), rating.get('client_ts'), rating.get('flashcard_id')
+        progress_id, response, *rest = rating
+        rest = list(rest) + [None] * (2 - len(rest))
+        return progress_id, response, rest[0], rest[1]
+
+    def process_review_batch(self, user_id, ratings, user=None):
+        """
+        Mô tả: Áp dụng nhiều đánh giá của cùng một người dùng (ví dụ: đồng bộ từ client offline)
+               với chi phí cố định: một truy vấn IN để nạp tiến trình, tính SRS trong bộ nhớ,
+               ghi ScoreLog bằng bulk insert và commit một lần.
+               Các đánh giá được áp dụng theo thứ tự thời gian client_ts (ổn định với thứ tự gửi lên).
+        Args:
+            user_id (int): ID của người dùng.
+            ratings (list): Danh sách (progress_id, response, client_ts, flashcard_id) hoặc dict cùng khóa.
+                            Thẻ mới từ API lấy trước có progress_id None và flashcard_id: tiến trình được tạo
+                            ở đánh giá đầu tiên, trong giới hạn thẻ mới của ngày đánh giá.
+                            client_ts là Unix timestamp lúc người dùng đánh giá, None = thời điểm hiện tại;
+                            giá trị trong tương lai được giới hạn về thời điểm hiện tại, giá trị cũ hơn
+                            REVIEW_BATCH_MAX_CLIENT_AGE_DAYS bị từ chối.
+            user (User, optional): Đối tượng người dùng đã nạp sẵn trong request, tránh truy vấn lại.
+        Returns:
+            tuple: (results, "success") với results là danh sách dict {'progress_id', 'status', 'due_time'}
+                   (thêm 'flashcard_id' với thẻ mới) theo đúng thứ tự gửi lên; hoặc (None, thông báo lỗi).
+                   status của từng phần tử: 'success', 'not_found', 'invalid_response',
+                   'invalid_timestamp', 'skipped', 'daily_limit_reached'.
+        """
+        log_prefix = f"[PROCESS_ANSWER_BATCH|UserUID:{user_id}|Count:{len(ratings)}]"
+        logger.info(f"{log_prefix} Bắt đầu xử lý đánh giá hàng loạt.")
+
+        if user is None:
+            user = User.query.get(user_id)
+        if not user:
+            logger.error(f"{log_prefix} Không tìm thấy người dùng với ID: {user_id}")
+            return None, "user_not_found"
+
+        tz_offset_hours = user.timezone_offset
+        current_mode = user.current_mode
+        server_ts = self._get_current_unix_timestamp(tz_offset_hours)
+        oldest_allowed_ts = server_ts - REVIEW_BATCH_MAX_CLIENT_AGE_DAYS * 86400
+
+        items = [self._normalize_rating(rating) for rating in ratings]
+        results = [None] * len(items)
+        review_ts_by_index = {}
+        for index, (progress_id, _, client_ts, _) in enumerate(items):
+            if client_ts is None:
+                review_ts_by_index[index] = server_ts
+                continue
+            try:
+                review_ts = min(int(client_ts), server_ts)
+            except (TypeError, ValueError):
+                review_ts = None
+            if review_ts is None or review_ts < oldest_allowed_ts:
+                results[index] = {'progress_id': progress_id, 'status': 'invalid_timestamp', 'due_time': None}
+                continue
+            review_ts_by_index[index] = review_ts
+
+        requested_ids = {progress_id for progress_id, _, _, _ in items if isinstance(progress_id, int)}
+        progress_map = {}
+        if requested_ids:
+            progress_map = {
+                progress.progress_id: progress for progress in
+                UserFlashcardProgress.query.filter(
+                    UserFlashcardProgress.progress_id.in_(requested_ids),
+                    UserFlashcardProgress.user_id == user_id
+                ).all()
+            }
+
+        # Thẻ mới (chưa có tiến trình khi được lấy trước): nạp thẻ và tiến trình có sẵn (nếu đã được tạo ở nơi khác).
+        new_card_ids = {
+            flashcard_id for progress_id, _, _, flashcard_id in items
+            if progress_id is None and isinstance(flashcard_id, int)
+        }
+        new_card_map = {}
+        progress_by_card = {}
+        if new_card_ids:
+            new_card_map = {card.flashcard_id: card for card in Flashcard.query.filter(Flashcard.flashcard_id.in_(new_card_ids)).all()}
+            progress_by_card = {
+                progress.flashcard_id: progress for progress in
+                UserFlashcardProgress.query.filter(
+                    UserFlashcardProgress.flashcard_id.in_(new_card_ids),
+                    UserFlashcardProgress.user_id == user_id
+                ).all()
+            }
+        new_cards_by_day = {}
+
+        changed_progresses = {}
+        score_log_rows = []
+        activity = ActivityRollupBuffer(tz_offset_hours)
+        for index in sorted(review_ts_by_index, key=lambda i: review_ts_by_index[i]):
+            progress_id, response, _, flashcard_id = items[index]
+            review_ts = review_ts_by_index[index]
+
+            is_new_card_item = progress_id is None and flashcard_id is not None
+            if is_new_card_item and response not in REVIEW_RESPONSES:
+                results[index] = {'progress_id': None, 'flashcard_id': flashcard_id, 'status': 'invalid_response', 'due_time': None}
+                continue
+            if is_new_card_item:
+                progress, status = self._progress_for_new_card(
+                    user, new_card_map.get(flashcard_id), progress_by_card, new_cards_by_day,
+                    current_mode, review_ts, tz_offset_hours
+                )
+                if status != 'success':
+                    results[index] = {'progress_id': None, 'flashcard_id': flashcard_id, 'status': status, 'due_time': None}
+                    continue
+                progress_id = progress.progress_id
+            else:
+                progress = progress_map.get(progress_id)
+                if not progress:
+                    results[index] = {'progress_id': progress_id, 'status': 'not_found', 'due_time': None}
+                    continue
+
+            if current_mode == MODE_AUTOPLAY_REVIEW:
+                results[index] = {'progress_id': progress_id, 'status': 'skipped', 'due_time': progress.due_time}
+                continue
+
+            previous_reviewed_ts = progress.last_reviewed
+            previous_learned_date = progress.learned_date
+            if is_new_card_item and progress.learned_date is None:
+                progress.learned_date = self._get_midnight_timestamp(review_ts, tz_offset_hours)
+            score_to_add, score_reason = self._apply_review(progress, response, current_mode, review_ts, tz_offset_hours)
+            if score_to_add is None:
+                results[index] = {'progress_id': progress_id, 'status': 'invalid_response', 'due_time': progress.due_time}
+                continue
+
+            changed_progresses[progress_id] = progress
+            activity.add_review(user_id, SOURCE_FLASHCARD, review_ts, previous_reviewed_ts,
+                                is_new=(previous_learned_date is None and progress.learned_date is not None),
+                                is_learned=progress.learned_date is not None, score=score_to_add)
+            if score_to_add != 0:
+                score_log_rows.append({
+                    'user_id': user_id,
+                    'score_change': score_to_add,
+                    'timestamp': review_ts,
+                    'reason': score_reason,
+                    'source_type': 'flashcard'
+                })
+            results[index] = {'progress_id': progress_id, 'status': 'success', 'due_time': progress.due_time}
+            if is_new_card_item:
+                results[index]['flashcard_id'] = flashcard_id
+
+        total_score_added = sum(row['score_change'] for row in score_log_rows)
+        try:
+            if score_log_rows:
+                db.session.bulk_insert_mappings(ScoreLog, score_log_rows)
+            if total_score_added != 0:
+                user.score = (user.score or 0) + total_score_added
+            activity.flush()
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"{log_prefix} Lỗi khi commit đánh giá hàng loạt: {e}", exc_info=True)
+            return None, str(e)
+
+        for progress in changed_progresses.values():
+            review_queue_registry.on_progress_changed(progress)
+            set_summary_cache.on_progress_changed(progress)
+        if changed_progresses:
+            category_count_cache.invalidate(user_id=user_id)
+
+        status_counts = Counter(item['status'] for item in results)
+        logger.info(f"{log_prefix} Hoàn tất. Kết quả: {dict(status_counts)}. Điểm cộng thêm: {total_score_added}.")
+        return results, "success"
+
+    def _progress_for_new_card(self, user, flashcard, progress_by_card, new_cards_by_day, current_mode, review_ts, tz_offset_hours):
+        """
+        Mô tả: Lấy hoặc tạo (flush, chưa commit) tiến trình cho một thẻ mới được đánh giá trong lô.
+               Tiến trình mới chỉ được tạo khi số thẻ mới của ngày đánh giá còn dưới giới hạn hàng ngày.
+        Returns:
+            tuple: (UserFlashcardProgress | None, status)
+        """
+        if flashcard is None:
+            return None, 'not_found'
+        progress = progress_by_card.get(flashcard.flashcard_id)
+        if progress is not None:
+            return progress, 'success'
+        if current_mode == MODE_AUTOPLAY_REVIEW:
+            return None, 'skipped'
+
+        review_midnight_ts = self._get_midnight_timestamp(review_ts, tz_offset_hours)
+        if review_midnight_ts not in new_cards_by_day:
+            new_cards_by_day[review_midnight_ts] = self._count_new_cards_on(user.user_id, review_midnight_ts)
+        if new_cards_by_day[review_midnight_ts] >= user.daily_new_limit:
+            return None, 'daily_limit_reached'
+
+        progress = self._start_new_card(user, flashcard, review_ts, tz_offset_hours)
+        db.session.flush()
+        progress_by_card[flashcard.flashcard_id] = progress
+        new_cards_by_day[review_midnight_ts] += 1
+        return progress, 'success'
+
+    def _select_new_cards(self, user, set_id, today_midnight_ts, count, log_prefix):
+        """
+        Mô tả: Chọn tối đa `count` thẻ mới (theo thứ tự tuần tự, trong giới hạn thẻ mới hàng ngày) để lấy trước.
+               Không ghi gì: tiến trình của thẻ mới chỉ được tạo khi người dùng đánh giá thẻ.
+        Returns:
+            list: Danh sách Flashcard.
+        """
+        if count <= 0:
+            return []
+
+        learned_today_count = self._count_new_cards_on(user.user_id, today_midnight_ts)
+        count = min(count, user.daily_new_limit - learned_today_count)
+        if count <= 0:
+            logger.info(f"{log_prefix} Đã đạt giới hạn thẻ MỚI hàng ngày ({learned_today_count}/{user.daily_new_limit}).")
+            return []
+
+        return Flashcard.query.filter(
+            Flashcard.set_id == set_id,
+            ~Flashcard.progresses.any(user_id=user.user_id)
+        ).order_by(Flashcard.flashcard_id.asc()).limit(count).all()
+
+    def get_next_cards_batch(self, user_id, set_id, mode, limit, user=None):
+        """
+        Mô tả: Lấy trước tối đa `limit` thẻ tiếp theo theo chế độ học, để client học cả phiên
+               mà không phải tải lại trang cho từng thẻ. Thứ tự ưu tiên giống các chiến lược học:
+               thẻ đến hạn trước, sau đó đến thẻ mới (trong giới hạn hàng ngày).
+               Chỉ đọc: thẻ mới được trả về không kèm tiến trình, tiến trình được tạo khi có đánh giá đầu tiên.
+        Args:
+            user_id (int): ID của người dùng.
+            set_id (int | None): ID bộ thẻ.
+            mode (str): Chế độ học.
+            limit (int): Số thẻ tối đa.
+            user (User, optional): Đối tượng người dùng đã nạp sẵn trong request, tránh truy vấn lại.
+        Returns:
+            tuple: (list các (Flashcard, UserFlashcardProgress | None), wait_time_ts).
+                   wait_time_ts chỉ có giá trị khi không còn thẻ nào; (None, None) nếu người dùng không tồn tại.
+        """
+        log_prefix = f"[PREFETCH_CARDS|UserUID:{user_id}|Set:{set_id}|Mode:{mode}|Limit:{limit}]"
+        logger.info(f"{log_prefix} Bắt đầu lấy trước thẻ.")
+
+        if user is None:
+            user = User.query.get(user_id)
+        if not user:
+            logger.error(f"{log_prefix} Người dùng không tồn tại: {user_id}")
+            return None, None
+
+        tz_offset_hours = user.timezone_offset
+        current_ts = self._get_current_unix_timestamp(tz_offset_hours)
+        today_midnight_ts = self._get_midnight_timestamp(current_ts, tz_offset_hours)
+
+        progresses = []
+        new_cards = []
+        if mode == MODE_AUTOPLAY_REVIEW:
+            learned_query = UserFlashcardProgress.query.filter(
+                UserFlashcardProgress.user_id == user_id,
+                UserFlashcardProgress.learned_date.isnot(None)
+            )
+            if set_id:
+                learned_query = learned_query.filter(UserFlashcardProgress.set_id == set_id)
+            learned_ids = [row[0] for row in learned_query.with_entities(UserFlashcardProgress.progress_id).all()]
+            selected_ids = random.sample(learned_ids, min(limit, len(learned_ids)))
+            if selected_ids:
+                progresses = UserFlashcardProgress.query.filter(UserFlashcardProgress.progress_id.in_(selected_ids)).all()
+        else:
+            if mode in (MODE_SEQUENTIAL_LEARNING, MODE_REVIEW_ALL_DUE, MODE_REVIEW_HARDEST):
+                ordering = ORDER_HARDEST if mode == MODE_REVIEW_HARDEST else ORDER_RANDOM
+                progresses = review_queue_registry.next_due_progresses(user_id, set_id, ordering, current_ts, limit)
+            if mode in (MODE_SEQUENTIAL_LEARNING, MODE_NEW_CARDS_ONLY) and set_id:
+                new_cards = self._select_new_cards(user, set_id, today_midnight_ts, limit - len(progresses), log_prefix)
+
+        if not progresses and not new_cards:
+            _, _, wait_time_ts = self._get_wait_time_for_set(user_id, set_id, current_ts, tz_offset_hours, log_prefix)
+            return [], wait_time_ts
+
+        # Nạp toàn bộ thẻ trong một truy vấn để progress.flashcard lấy từ identity map.
+        if progresses:
+            Flashcard.query.filter(Flashcard.flashcard_id.in_([p.flashcard_id for p in progresses])).all()
+        logger.info(f"{log_prefix} Trả về {len(progresses)} thẻ đến hạn và {len(new_cards)} thẻ mới.")
+        return [(progress.flashcard, progress) for progress in progresses] + [(card, None) for card in new_cards], None
+
+    def get_next_card_for_review(self, user_id, set_id, mode, user=None):
         log_prefix = f"[GET_NEXT_CARD|UserUID:{user_id}|Set:{set_id}|Mode:{mode}]"
         logger.info(f"{log_prefix} Bắt đầu tìm thẻ tiếp theo.")
 
-        user = User.query.get(user_id)
+        if user is None:
+            user = User.query.get(user_id)
         if not user:
             logger.error(f"{log_prefix} Người dùng không tồn tại: {user_id}")
             return None, None, None
@@ -0,0 +1,459 @@
+# web_app/services/media_registry.py
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+from sqlalchemy import bindparam, case, delete, func, insert, null, or_, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from ..models import db, MediaAsset, Flashcard, QuizQuestion
+from ..config import (
+    FLASHCARD_AUDIO_CACHE_DIR, FLASHCARD_AUDIO_SEGMENT_DIR, FLASHCARD_IMAGES_DIR, QUIZ_IMAGES_DIR, QUIZ_AUDIO_CACHE_DIR,
+    IMPORT_CHUNK_SIZE, MEDIA_GC_GRACE_SECONDS, MEDIA_GC_BATCH_SIZE
+)
+from .audio_service import AudioService
+from .audio_pregeneration import quiz_remote_audio_path
+from .set_sync import iter_chunks, SQL_IN_CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+MEDIA_FLASHCARD_AUDIO = 'flashcard_audio'
+MEDIA_AUDIO_SEGMENT = 'audio_segment'
+MEDIA_FLASHCARD_IMAGE = 'flashcard_image'
+MEDIA_QUIZ_IMAGE = 'quiz_image'
+MEDIA_QUIZ_AUDIO = 'quiz_audio'
+
+MEDIA_KIND_DIRS = {
+    MEDIA_FLASHCARD_AUDIO: FLASHCARD_AUDIO_CACHE_DIR,
+    MEDIA_AUDIO_SEGMENT: FLASHCARD_AUDIO_SEGMENT_DIR,
+    MEDIA_FLASHCARD_IMAGE: FLASHCARD_IMAGES_DIR,
+    MEDIA_QUIZ_IMAGE: QUIZ_IMAGES_DIR,
+    MEDIA_QUIZ_AUDIO: QUIZ_AUDIO_CACHE_DIR,
+}
+# Audio tạo từ nội dung thẻ: tạo lại được bất cứ lúc nào nên bị dọn ngay khi hết tham chiếu và không cần khử trùng lặp.
+GENERATED_MEDIA_KINDS = (MEDIA_FLASHCARD_AUDIO, MEDIA_AUDIO_SEGMENT)
+# File do người dùng đưa vào: được băm nội dung, các bản trùng nhau chỉ lưu một lần trên đĩa.
+HASHED_MEDIA_KINDS = (MEDIA_FLASHCARD_IMAGE, MEDIA_QUIZ_IMAGE, MEDIA_QUIZ_AUDIO)
+
+FLASHCARD_MEDIA_FIELDS = ('front_img', 'back_img', 'front_audio_content', 'back_audio_content')
+QUIZ_MEDIA_FIELDS = ('question_image_file', 'question_audio_file')
+
+_HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def _is_remote(value):
+    return value.startswith('http://') or value.startswith('https://')
+
+
+def _field_values(source, fields):
+    if isinstance(source, dict):
+        return [source.get(field) for field in fields]
+    return [getattr(source, field, None) for field in fields]
+
+
+def audio_content_refs(audio_content):
+    """
+    Mô tả: Các file cache mà một chuỗi nội dung audio của thẻ sử dụng: file ghép của cả chuỗi và file của từng đoạn
+           (cùng quy tắc đặt tên với AudioService).
+    Returns:
+        list: Các tuple (kind, media_key).
+    """
+    if not audio_content or not audio_content.strip():
+        return []
+    refs = [(MEDIA_FLASHCARD_AUDIO, hashlib.sha1(audio_content.encode('utf-8')).hexdigest() + '.mp3')]
+    refs.extend(
+        (MEDIA_AUDIO_SEGMENT, AudioService._segment_cache_filename(lang_code, text))
+        for lang_code, text in AudioService._parse_audio_lines(audio_content)
+    )
+    return refs
+
+
+def flashcard_media_refs(source):
+    """
+    Mô tả: Đếm các file media mà một flashcard tham chiếu. Ảnh dạng URL không được quản lý.
+    Args:
+        source: Đối tượng Flashcard, dòng truy vấn hoặc dict có các cột trong FLASHCARD_MEDIA_FIELDS.
+    Returns:
+        Counter: (kind, media_key) -> số tham chiếu.
+    """
+    front_img, back_img, front_audio_content, back_audio_content = _field_values(source, FLASHCARD_MEDIA_FIELDS)
+    refs = Counter()
+    for image in (front_img, back_img):
+        if image and not _is_remote(image):
+            refs[(MEDIA_FLASHCARD_IMAGE, image)] += 1
+    for audio_content in (front_audio_content, back_audio_content):
+        refs.update(audio_content_refs(audio_content))
+    return refs
+
+
+def quiz_media_refs(source):
+    """
+    Mô tả: Đếm các file media mà một câu hỏi tham chiếu. Audio dạng URL được tính là bản sao cục bộ trong
+           thư mục remote (xem quiz_remote_audio_path), ảnh dạng URL không được quản lý.
+    Returns:
+        Counter: (kind, media_key) -> số tham chiếu.
+    """
+    question_image_file, question_audio_file = _field_values(source, QUIZ_MEDIA_FIELDS)
+    refs = Counter()
+    if question_image_file and not _is_remote(question_image_file):
+        refs[(MEDIA_QUIZ_IMAGE, question_image_file)] += 1
+    if question_audio_file:
+        if _is_remote(question_audio_file):
+            media_key = os.path.relpath(quiz_remote_audio_path(question_audio_file), QUIZ_AUDIO_CACHE_DIR).replace(os.sep, '/')
+        else:
+            media_key = question_audio_file
+        refs[(MEDIA_QUIZ_AUDIO, media_key)] += 1
+    return refs
+
+
+def media_path(kind, media_key):
+    """
+    Returns:
+        str | None: Đường dẫn file của media, None nếu khóa trỏ ra ngoài thư mục của loại media.
+    """
+    base_dir = os.path.abspath(MEDIA_KIND_DIRS[kind])
+    path = os.path.abspath(os.path.join(base_dir, media_key))
+    if os.path.commonpath([base_dir, path]) != base_dir or path == base_dir:
+        return None
+    return path
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _iter_kind_files(kind):
+    """
+    Mô tả: Liệt kê (đệ quy) các file trong thư mục của một loại media, bỏ qua thư mục của loại khác nằm bên trong
+           (ví dụ thư mục segments trong thư mục audio cache) và file tạm đang ghi.
+    """
+    base_dir = os.path.abspath(MEDIA_KIND_DIRS[kind])
+    other_dirs = {os.path.abspath(directory) for other_kind, directory in MEDIA_KIND_DIRS.items() if other_kind != kind}
+    if not os.path.isdir(base_dir):
+        return
+    for root, dirs, files in os.walk(base_dir):
+        dirs[:] = [name for name in dirs if os.path.join(root, name) not in other_dirs]
+        for filename in files:
+            if filename.endswith('.part'):
+                continue
+            if kind in GENERATED_MEDIA_KINDS and not filename.endswith('.mp3'):
+                continue
+            yield os.path.relpath(os.path.join(root, filename), base_dir).replace(os.sep, '/')
+
+
+def rebuild_media_registry(executor):
+    """
+    Mô tả: Xóa và dựng lại bảng MediaAssets: số tham chiếu tính từ Flashcards và QuizQuestions,
+           các file đang có trên đĩa nhưng không được tham chiếu được ghi nhận là mồ côi từ thời điểm này.
+           Đây là lần duy nhất thư mục media bị liệt kê; sau đó sổ đăng ký được cập nhật theo từng thao tác ghi.
+           Không tự commit.
+    Returns:
+        int: Số dòng đã ghi.
+    """
+    now = int(time.time())
+    refs = Counter()
+    for row in executor.execute(select(*[getattr(Flashcard, field) for field in FLASHCARD_MEDIA_FIELDS])):
+        refs.update(flashcard_media_refs(row))
+    for row in executor.execute(select(*[getattr(QuizQuestion, field) for field in QUIZ_MEDIA_FIELDS])):
+        refs.update(quiz_media_refs(row))
+
+    rows = [
+        dict(kind=kind, media_key=media_key, ref_count=count, orphaned_at=None, created_at=now)
+        for (kind, media_key), count in refs.items()
+    ]
+    orphan_count = 0
+    for kind in MEDIA_KIND_DIRS:
+        for media_key in _iter_kind_files(kind):
+            if (kind, media_key) not in refs:
+                rows.append(dict(kind=kind, media_key=media_key, ref_count=0, orphaned_at=now, created_at=now))
+                orphan_count += 1
+
+    executor.execute(delete(MediaAsset))
+    for chunk in iter_chunks(rows, IMPORT_CHUNK_SIZE):
+        executor.execute(insert(MediaAsset), chunk)
+    logger.info(f"[MEDIA_REGISTRY|Rebuild] Đã ghi {len(rows)} media, trong đó {orphan_count} file không còn được tham chiếu.")
+    return len(rows)
+
+
+class MediaRegistry:
+    """
+    Mô tả: Sổ đăng ký file media theo số tham chiếu. Các service ghi thẻ/câu hỏi gọi apply_changes trong cùng
+           transaction với thao tác ghi, nên việc tìm file mồ côi là một truy vấn trên index orphaned_at
+           thay vì đọc lại toàn bộ thẻ và liệt kê thư mục. File ảnh/audio quiz mới chỉ được băm SHA-256 (ghi
+           content_hash) khi được tham chiếu lần đầu; file trên đĩa chỉ bị thay đổi bởi deduplicate_files.
+    """
+    def __init__(self, grace_seconds=MEDIA_GC_GRACE_SECONDS, batch_size=MEDIA_GC_BATCH_SIZE):
+        self.grace_seconds = grace_seconds
+        self.batch_size = batch_size
+
+    def flashcard_set_refs(self, set_id):
+        """
+        Returns:
+            Counter: Tổng tham chiếu media của mọi thẻ trong bộ (chỉ đọc các cột media).
+        """
+        columns = [getattr(Flashcard, field) for field in FLASHCARD_MEDIA_FIELDS]
+        rows = db.session.query(*columns).filter(
+            Flashcard.set_id == set_id, or_(*[column.isnot(None) for column in columns])
+        ).yield_per(IMPORT_CHUNK_SIZE)
+        refs = Counter()
+        for row in rows:
+            refs.update(flashcard_media_refs(row))
+        return refs
+
+    def question_set_refs(self, set_id):
+        """
+        Returns:
+            Counter: Tổng tham chiếu media của mọi câu hỏi trong bộ.
+        """
+        columns = [getattr(QuizQuestion, field) for field in QUIZ_MEDIA_FIELDS]
+        rows = db.session.query(*columns).filter(
+            QuizQuestion.set_id == set_id, or_(*[column.isnot(None) for column in columns])
+        ).yield_per(IMPORT_CHUNK_SIZE)
+        refs = Counter()
+        for row in rows:
+            refs.update(quiz_media_refs(row))
+        return refs
+
+    def apply_diff(self, before, after):
+        """
+        Mô tả: Ghi nhận thay đổi tham chiếu giữa hai trạng thái (ví dụ trước và sau khi sửa/đồng bộ). Không tự commit.
+        """
+        delta = Counter(after)
+        delta.subtract(before)
+        self.apply_changes(delta)
+
+    def release(self, refs):
+        """
+        Mô tả: Bỏ các tham chiếu của dữ liệu sắp bị xóa. Không tự commit.
+        """
+        self.apply_changes({media: -count for media, count in refs.items()})
+
+    def apply_changes(self, delta):
+        """
+        Mô tả: Cộng/trừ số tham chiếu trong transaction hiện tại (không commit). Media chưa có được thêm mới;
+               media về 0 tham chiếu được đánh dấu thời điểm mồ côi, media được tham chiếu lại thì bỏ đánh dấu.
+        Args:
+            delta (dict): (kind, media_key) -> số tham chiếu thay đổi (âm là bỏ tham chiếu).
+        """
+        added = [(media, count) for media, count in delta.items() if count > 0]
+        removed = [(media, -count) for media, count in delta.items() if count < 0]
+        if not added and not removed:
+            return
+        now = int(time.time())
+        table = MediaAsset.__table__
+
+        if added:
+            statement = sqlite_insert(MediaAsset)
+            statement = statement.on_conflict_do_update(
+                index_elements=['kind', 'media_key'],
+                set_={'ref_count': table.c.ref_count + statement.excluded.ref_count, 'orphaned_at': null()}
+            )
+            db.session.execute(statement, [
+                dict(kind=kind, media_key=media_key, ref_count=count, orphaned_at=None, created_at=now)
+                for (kind, media_key), count in added
+            ])
+
+        if removed:
+            remaining = table.c.ref_count - bindparam('amount')
+            statement = update(table).where(
+                table.c.kind == bindparam('media_kind'), table.c.media_key == bindparam('key')
+            ).values(
+                ref_count=case((remaining > 0, remaining), else_=0),
+                orphaned_at=case((remaining > 0, null()), else_=func.coalesce(table.c.orphaned_at, now))
+            )
+            db.session.execute(statement, [
+                {'media_kind': kind, 'key': media_key, 'amount': count} for (kind, media_key), count in removed
+            ])
+
+        new_hashed_keys = [(kind, media_key) for (kind, media_key), _ in added if kind in HASHED_MEDIA_KINDS]
+        if new_hashed_keys:
+            self._fingerprint_keys(new_hashed_keys)
+
+    def _fingerprint_keys(self, media_keys):
+        keys_by_kind = {}
+        for kind, media_key in media_keys:
+            keys_by_kind.setdefault(kind, []).append(media_key)
+        for kind, keys in keys_by_kind.items():
+            for key_chunk in iter_chunks(keys, SQL_IN_CHUNK_SIZE):
+                assets = MediaAsset.query.filter(
+                    MediaAsset.kind == kind, MediaAsset.media_key.in_(key_chunk), MediaAsset.content_hash.is_(None)
+                ).all()
+                for asset in assets:
+                    self._fingerprint(asset)
+
+    def register_generated(self, refs):
+        """
+        Mô tả: Ghi nhận các file audio vừa được tạo. File chưa có dòng đăng ký (nội dung không còn thẻ nào tham chiếu,
+               ví dụ thẻ được sửa trong lúc audio đang tạo) được thêm với 0 tham chiếu để lần dọn dẹp sau xóa được;
+               dòng đã có giữ nguyên. Tự commit.
+        Args:
+            refs (iterable): Các tuple (kind, media_key), xem audio_content_refs.
+        """
+        now = int(time.time())
+        rows = [
+            dict(kind=kind, media_key=media_key, ref_count=0, orphaned_at=now, created_at=now)
+            for kind, media_key in set(refs)
+        ]
+        if not rows:
+            return
+        try:
+            statement = sqlite_insert(MediaAsset).on_conflict_do_nothing(index_elements=['kind', 'media_key'])
+            db.session.execute(statement, rows)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"[MEDIA_REGISTRY|RegisterGenerated] Lỗi khi ghi nhận {len(rows)} file audio: {e}", exc_info=True)
+
+    def _fingerprint(self, asset):
+        """
+        Mô tả: Băm file của media (nếu đã có trên đĩa) và ghi content_hash/file_size, không thay đổi file.
+        Returns:
+            bool: True nếu đã băm được.
+        """
+        path = media_path(asset.kind, asset.media_key)
+        if path is None or not os.path.isfile(path):
+            return False
+        try:
+            asset.content_hash = _file_digest(path)
+            asset.file_size = os.path.getsize(path)
+        except OSError as e:
+            logger.warning(f"[MEDIA_REGISTRY|Fingerprint] Không đọc được {asset.kind}:{asset.media_key}: {e}")
+            return False
+        return True
+
+    @staticmethod
+    def _has_content(path, content_hash):
+        try:
+            return path is not None and os.path.isfile(path) and _file_digest(path) == content_hash
+        except OSError:
+            return False
+
+    @staticmethod
+    def _link_duplicate(original_path, path, file_size):
+        if os.path.samefile(original_path, path):
+            return 0
+        partial_path = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+        try:
+            os.link(original_path, partial_path)
+            os.replace(partial_path, path)
+        except OSError as e:
+            # Khác ổ đĩa hoặc hệ thống file không hỗ trợ hard link: giữ nguyên bản sao.
+            logger.warning(f"[MEDIA_REGISTRY|Dedupe] Không tạo được hard link cho {path}: {e}")
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            return 0
+        logger.info(f"[MEDIA_REGISTRY|Dedupe] {os.path.basename(path)} trùng nội dung với {os.path.basename(original_path)}, đã lưu chung một bản.")
+        return file_size
+
+    def deduplicate_files(self):
+        """
+        Mô tả: Tác vụ quản trị (trang công cụ admin và `database_install.py rebuild-media-registry`), không chạy
+               trong request. Băm các file ảnh/audio quiz đang được tham chiếu mà chưa có mã băm (ví dụ file được
+               chép vào sau khi thẻ đã tham chiếu tới, hoặc sau khi dựng lại sổ đăng ký), rồi thay các bản trùng nội
+               dung bằng hard link tới bản có asset_id nhỏ nhất. Mỗi file được băm lại ngay trước khi gộp.
+               Lưu ý: các tên được gộp dùng chung một inode, nên ghi đè tại chỗ vào một tên (ví dụ `cp` đè lên file
+               ảnh đã có, hoặc mở file ở chế độ 'wb') sẽ đổi nội dung của mọi tên còn lại. Ứng dụng chỉ thay file
+               bằng os.replace (tạo inode mới); khi thay file media thủ công hãy xóa file cũ trước hoặc dùng `mv`.
+        Returns:
+            dict: Số file đã băm (hashed), số file đã gộp (linked), số byte tiết kiệm (bytes_saved).
+        """
+        log_prefix = "[MEDIA_REGISTRY|Dedupe]"
+        report = {'hashed': 0, 'linked': 0, 'bytes_saved': 0}
+        last_id = 0
+        try:
+            while True:
+                assets = MediaAsset.query.filter(
+                    MediaAsset.asset_id > last_id, MediaAsset.content_hash.is_(None),
+                    MediaAsset.ref_count > 0, MediaAsset.kind.in_(HASHED_MEDIA_KINDS)
+                ).order_by(MediaAsset.asset_id).limit(self.batch_size).all()
+                if not assets:
+                    break
+                for asset in assets:
+                    if self._fingerprint(asset):
+                        report['hashed'] += 1
+                last_id = assets[-1].asset_id
+                db.session.commit()
+
+            duplicate_hashes = db.session.execute(
+                select(MediaAsset.content_hash).where(
+                    MediaAsset.content_hash.isnot(None), MediaAsset.ref_count > 0, MediaAsset.kind.in_(HASHED_MEDIA_KINDS)
+                ).group_by(MediaAsset.content_hash).having(func.count() > 1)
+            ).scalars().all()
+            for hash_chunk in iter_chunks(duplicate_hashes, SQL_IN_CHUNK_SIZE):
+                assets = MediaAsset.query.filter(
+                    MediaAsset.content_hash.in_(hash_chunk), MediaAsset.ref_count > 0, MediaAsset.kind.in_(HASHED_MEDIA_KINDS)
+                ).order_by(MediaAsset.content_hash, MediaAsset.asset_id).all()
+                original_paths = {}
+                for asset in assets:
+                    path = media_path(asset.kind, asset.media_key)
+                    if not self._has_content(path, asset.content_hash):
+                        # File đã bị xóa hoặc sửa sau khi băm: băm lại ở lần chạy sau.
+                        asset.content_hash = None
+                        continue
+                    original_path = original_paths.setdefault(asset.content_hash, path)
+                    if original_path != path:
+                        saved = self._link_duplicate(original_path, path, asset.file_size or os.path.getsize(path))
+                        if saved:
+                            report['linked'] += 1
+                            report['bytes_saved'] += saved
+                db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"{log_prefix} Lỗi khi gộp file trùng lặp: {e}", exc_info=True)
+            raise
+        logger.info(f"{log_prefix} Hoàn tất: {report}")
+        return report
+
+    def collect_garbage(self, now=None):
+        """
+        Mô tả: Xóa file và dòng đăng ký của các media không còn được tham chiếu: audio tạo tự động bị xóa ngay,
+               file do người dùng đưa vào chỉ bị xóa sau grace_seconds kể từ khi hết tham chiếu.
+               Dòng đăng ký được xóa (và commit) trước file, theo từng lô trên index orphaned_at.
+        Returns:
+            int: Số file đã xóa, -1 nếu có lỗi.
+        """
+        log_prefix = "[MEDIA_REGISTRY|CollectGarbage]"
+        now = int(time.time()) if now is None else now
+        deleted_files = 0
+        deleted_rows = 0
+        expired_ids = select(MediaAsset.asset_id).where(
+            MediaAsset.orphaned_at <= now,
+            or_(MediaAsset.kind.in_(GENERATED_MEDIA_KINDS), MediaAsset.orphaned_at <= now - self.grace_seconds),
+            MediaAsset.ref_count == 0
+        ).limit(self.batch_size)
+        try:
+            while True:
+                rows = db.session.execute(
+                    delete(MediaAsset).where(MediaAsset.asset_id.in_(expired_ids))
+                    .returning(MediaAsset.kind, MediaAsset.media_key)
+                    .execution_options(synchronize_session=False)
+                ).all()
+                db.session.commit()
+                for kind, media_key in rows:
+                    path = media_path(kind, media_key)
+                    if path is None or not os.path.isfile(path):
+                        continue
+                    try:
+                        os.remove(path)
+                        deleted_files += 1
+                    except OSError as e:
+                        logger.error(f"{log_prefix} Lỗi khi xóa file {kind}:{media_key}: {e}")
+                deleted_rows += len(rows)
+                if len(rows) < self.batch_size:
+                    break
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"{log_prefix} Lỗi trong quá trình dọn dẹp media: {e}", exc_info=True)
+            return -1
+        logger.info(f"{log_prefix} Hoàn tất: xóa {deleted_files} file, {deleted_rows} dòng đăng ký.")
+        return deleted_files
+
+
+media_registry = MediaRegistry()
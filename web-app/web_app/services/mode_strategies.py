@@ -23,6 +23,10 @@ from ..config import (
     SRS_MAX_INTERVAL_DAYS
     # KẾT THÚC THAY ĐỔI
 )
+from .review_queue import review_queue_registry, ORDER_RANDOM, ORDER_HARDEST
+from .set_summary_cache import set_summary_cache
+from .keyset_pagination import category_count_cache
+from .activity_rollup import ActivityRollupBuffer, SOURCE_FLASHCARD
 
 logger = logging.getLogger(__name__)
 
@@ -75,11 +79,8 @@ def _get_wait_time_for_set(user_id, set_id, current_ts, tz_offset_hours, log_pre
     Returns:
         tuple: (None, None, UnixTimestamp) nếu không có thẻ nào và cần chờ.
     """
-    next_due_time_overall = UserFlashcardProgress.query.filter(
-        UserFlashcardProgress.user_id == user_id,
-        UserFlashcardProgress.is_skipped == 0,
-        UserFlashcardProgress.due_time > current_ts
-    ).join(Flashcard).filter(Flashcard.set_id == set_id).with_entities(db.func.min(UserFlashcardProgress.due_time)).scalar()
+    # Lấy từ cache tóm tắt của bộ thay vì chạy MIN(due_time) trên bảng tiến trình mỗi lần.
+    next_due_time_overall = set_summary_cache.get_next_due_time(user_id, set_id, current_ts) if set_id else None
 
     if next_due_time_overall:
         logger.info(f"{log_prefix} Không có thẻ ngay lập tức. Thẻ tiếp theo đến hạn lúc: {next_due_time_overall}")
@@ -130,6 +131,7 @@ def get_card_for_new_cards_only(user_id, set_id, mode, user, current_ts, today_m
         new_progress = UserFlashcardProgress(
             user_id=user_id,
             flashcard_id=new_card.flashcard_id,
+            set_id=new_card.set_id,
             last_reviewed=None,
             due_time=current_ts + RETRY_INTERVAL_NEW_MIN * 60,
             review_count=0,
@@ -141,7 +143,13 @@ def get_card_for_new_cards_only(user_id, set_id, mode, user, current_ts, today_m
             is_skipped=0
         )
         db.session.add(new_progress)
+        activity = ActivityRollupBuffer(tz_offset_hours)
+        activity.add(user_id, SOURCE_FLASHCARD, current_ts, new_items=1)
+        activity.flush()
         db.session.commit()
+        review_queue_registry.on_progress_changed(new_progress)
+        set_summary_cache.on_progress_changed(new_progress)
+        category_count_cache.invalidate(user_id=user_id, set_id=set_id)
         logger.info(f"{log_prefix} Tìm thấy và tạo progress cho thẻ MỚI (ID: {new_card.flashcard_id}).")
         return new_card, new_progress, None
     else:
@@ -169,34 +177,12 @@ def get_card_for_review_modes(user_id, set_id, mode, user, current_ts, today_mid
     """
     logger.debug(f"{log_prefix} Chế độ: Ôn tập (MODE_REVIEW_ALL_DUE hoặc MODE_REVIEW_HARDEST).")
     
-    due_cards_query = UserFlashcardProgress.query.filter(
-        UserFlashcardProgress.user_id == user_id,
-        UserFlashcardProgress.is_skipped == 0,
-        UserFlashcardProgress.due_time <= current_ts
-    )
-    
-    # Lọc theo set_id nếu không phải chế độ ôn tập tổng hợp (nếu set_id được cung cấp)
-    if set_id:
-        due_cards_query = due_cards_query.join(Flashcard).filter(Flashcard.set_id == set_id)
-    else:
-        # Nếu set_id là None (ví dụ: cho ôn tập tổng hợp toàn bộ),
-        # cần đảm bảo chỉ lấy thẻ thuộc các bộ mà người dùng có quyền truy cập
-        # (ví dụ: bộ của người dùng tạo hoặc bộ công khai).
-        # Hiện tại, chúng ta sẽ cho phép ôn tập tất cả thẻ đến hạn của người dùng.
-        pass
-
-    if mode == MODE_REVIEW_HARDEST:
-        # Sắp xếp theo số lần sai và số lần lỡ (lapse) giảm dần
-        due_cards_query = due_cards_query.order_by(
-            UserFlashcardProgress.incorrect_count.desc(),
-            UserFlashcardProgress.lapse_count.desc(),
-            db.func.random() # Thêm random để có sự đa dạng nếu các chỉ số bằng nhau
-        )
-    elif mode == MODE_REVIEW_ALL_DUE:
-        # Sắp xếp ngẫu nhiên cho ôn tập tổng hợp
-        due_cards_query = due_cards_query.order_by(db.func.random())
-
-    due_card_progress = due_cards_query.first() # Lấy một thẻ duy nhất
+    # Lấy thẻ đến hạn từ hàng đợi ôn tập trong bộ nhớ thay vì ORDER BY random() trên database.
+    # Nếu set_id là None (ôn tập tổng hợp), hàng đợi bao gồm tất cả thẻ đến hạn của người dùng.
+    # MODE_REVIEW_HARDEST: ưu tiên số lần sai rồi số lần lỡ (lapse) giảm dần, ngẫu nhiên khi bằng nhau.
+    # MODE_REVIEW_ALL_DUE: chọn ngẫu nhiên trong các thẻ đến hạn.
+    ordering = ORDER_HARDEST if mode == MODE_REVIEW_HARDEST else ORDER_RANDOM
+    due_card_progress = review_queue_registry.next_due_progress(user_id, set_id, ordering, current_ts)
 
     if due_card_progress:
         flashcard_to_return = due_card_progress.flashcard
@@ -230,13 +216,7 @@ def get_card_for_sequential_learning(user_id, set_id, mode, user, current_ts, to
     logger.debug(f"{log_prefix} Chế độ: Học tuần tự (MODE_SEQUENTIAL_LEARNING).")
     
     # 1. Tìm thẻ đến hạn trước (ngẫu nhiên trong các thẻ đến hạn của bộ hiện tại)
-    due_cards_query = UserFlashcardProgress.query.filter(
-        UserFlashcardProgress.user_id == user_id,
-        UserFlashcardProgress.is_skipped == 0,
-        UserFlashcardProgress.due_time <= current_ts
-    ).join(Flashcard).filter(Flashcard.set_id == set_id).order_by(db.func.random())
-
-    due_card_progress = due_cards_query.first()
+    due_card_progress = review_queue_registry.next_due_progress(user_id, set_id, ORDER_RANDOM, current_ts)
     
     if due_card_progress:
         flashcard_to_return = due_card_progress.flashcard
@@ -266,6 +246,7 @@ def get_card_for_sequential_learning(user_id, set_id, mode, user, current_ts, to
         new_progress = UserFlashcardProgress(
             user_id=user_id,
             flashcard_id=new_card.flashcard_id,
+            set_id=new_card.set_id,
             last_reviewed=None,
             due_time=current_ts + RETRY_INTERVAL_NEW_MIN * 60,
             review_count=0,
@@ -277,7 +258,13 @@ def get_card_for_sequential_learning(user_id, set_id, mode, user, current_ts, to
             is_skipped=0
         )
         db.session.add(new_progress)
+        activity = ActivityRollupBuffer(tz_offset_hours)
+        activity.add(user_id, SOURCE_FLASHCARD, current_ts, new_items=1)
+        activity.flush()
         db.session.commit()
+        review_queue_registry.on_progress_changed(new_progress)
+        set_summary_cache.on_progress_changed(new_progress)
+        category_count_cache.invalidate(user_id=user_id, set_id=set_id)
         logger.info(f"{log_prefix} Tìm thấy và tạo progress cho thẻ MỚI: {new_card.flashcard_id}.")
         return new_card, new_progress, None
     else:
@@ -312,7 +299,7 @@ def get_card_for_autoplay_review(user_id, set_id, mode, user, current_ts, today_
     )
 
     if set_id:
-        learned_cards_query = learned_cards_query.join(Flashcard).filter(Flashcard.set_id == set_id)
+        learned_cards_query = learned_cards_query.filter(UserFlashcardProgress.set_id == set_id)
     else:
         # Nếu không có set_id, lấy tất cả các thẻ đã học của người dùng
         pass
@@ -0,0 +1,196 @@
+# web_app/services/mp3_frames.py
+
+# Bảng bitrate (kbps) của MPEG Layer III theo bitrate index
+_BITRATES_MPEG1 = (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320)
+_BITRATES_MPEG2 = (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160)
+# Tần số lấy mẫu theo version bits (0: MPEG2.5, 2: MPEG2, 3: MPEG1)
+_SAMPLE_RATES = {0: (11025, 12000, 8000), 2: (22050, 24000, 16000), 3: (44100, 48000, 32000)}
+_VERSION_MPEG1 = 3
+_LAYER_III = 1
+_CHANNEL_MODE_MONO = 3
+
+
+class Mp3FrameHeader:
+    """
+    Mô tả: Header 4 byte của một frame MPEG Layer III đã giải mã.
+    """
+    __slots__ = ('raw', 'version', 'has_crc', 'bitrate', 'sample_rate', 'padding', 'channel_mode')
+
+    def __init__(self, raw, version, has_crc, bitrate, sample_rate, padding, channel_mode):
+        self.raw = raw
+        self.version = version
+        self.has_crc = has_crc
+        self.bitrate = bitrate
+        self.sample_rate = sample_rate
+        self.padding = padding
+        self.channel_mode = channel_mode
+
+    @property
+    def is_mpeg1(self):
+        return self.version == _VERSION_MPEG1
+
+    @property
+    def is_mono(self):
+        return self.channel_mode == _CHANNEL_MODE_MONO
+
+    @property
+    def frame_length(self):
+        coefficient = 144000 if self.is_mpeg1 else 72000
+        return coefficient * self.bitrate // self.sample_rate + self.padding
+
+    @property
+    def samples_per_frame(self):
+        return 1152 if self.is_mpeg1 else 576
+
+    @property
+    def side_info_length(self):
+        if self.is_mpeg1:
+            return 17 if self.is_mono else 32
+        return 9 if self.is_mono else 17
+
+    @property
+    def stream_format(self):
+        """
+        Mô tả: Các thuộc tính phải giống nhau để hai luồng MP3 nối trực tiếp được với nhau
+               (bitrate có thể khác giữa các frame).
+        """
+        return self.version, self.sample_rate, self.is_mono
+
+
+def parse_frame_header(data, offset):
+    """
+    Mô tả: Đọc header frame MPEG Layer III tại `offset`.
+    Returns:
+        Mp3FrameHeader | None: None nếu không phải header hợp lệ (hoặc không phải Layer III).
+    """
+    if offset + 4 > len(data):
+        return None
+    b0, b1, b2, b3 = data[offset], data[offset + 1], data[offset + 2], data[offset + 3]
+    if b0 != 0xFF or (b1 & 0xE0) != 0xE0:
+        return None
+    version = (b1 >> 3) & 0x03
+    layer = (b1 >> 1) & 0x03
+    bitrate_index = b2 >> 4
+    sample_rate_index = (b2 >> 2) & 0x03
+    if version == 1 or layer != _LAYER_III or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+    bitrates = _BITRATES_MPEG1 if version == _VERSION_MPEG1 else _BITRATES_MPEG2
+    return Mp3FrameHeader(
+        raw=bytes(data[offset:offset + 4]),
+        version=version,
+        has_crc=not (b1 & 0x01),
+        bitrate=bitrates[bitrate_index],
+        sample_rate=_SAMPLE_RATES[version][sample_rate_index],
+        padding=(b2 >> 1) & 0x01,
+        channel_mode=b3 >> 6,
+    )
+
+
+def _id3v2_length(data):
+    if len(data) < 10 or data[:3] != b'ID3':
+        return 0
+    size = (data[6] & 0x7F) << 21 | (data[7] & 0x7F) << 14 | (data[8] & 0x7F) << 7 | (data[9] & 0x7F)
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def _is_info_frame(data, offset, header):
+    """
+    Mô tả: Frame Xing/Info/VBRI chỉ chứa thông tin về cả file (số frame, bảng seek),
+           không có âm thanh; phải bỏ đi khi nối vì số liệu sẽ sai với file mới.
+    """
+    tag_offset = offset + 4 + (2 if header.has_crc else 0) + header.side_info_length
+    if data[tag_offset:tag_offset + 4] in (b'Xing', b'Info'):
+        return True
+    return data[offset + 36:offset + 40] == b'VBRI'
+
+
+class Mp3Stream:
+    """
+    Mô tả: Danh sách các frame âm thanh của một file MP3 (không gồm thẻ ID3 và frame Xing/Info),
+           đủ để ghi lại trực tiếp vào file khác mà không cần giải mã.
+    """
+    def __init__(self, data):
+        self.data = data
+        self.frames = []
+        self.first_header = None
+
+        offset = _id3v2_length(data)
+        data_length = len(data)
+        while offset + 4 <= data_length:
+            header = parse_frame_header(data, offset)
+            if header is None:
+                if data[offset:offset + 3] == b'TAG' or data[offset:offset + 8] == b'APETAGEX':
+                    break
+                raise ValueError(f"Dữ liệu không phải frame MP3 Layer III tại byte {offset}.")
+            frame_length = header.frame_length
+            if offset + frame_length > data_length:
+                # Frame cuối bị cắt cụt: bỏ đi thay vì ghi ra frame hỏng
+                break
+            if self.first_header is None and _is_info_frame(data, offset, header):
+                offset += frame_length
+                continue
+            if self.first_header is None:
+                self.first_header = header
+            elif header.stream_format != self.first_header.stream_format:
+                raise ValueError("File MP3 thay đổi tần số lấy mẫu hoặc số kênh giữa chừng.")
+            self.frames.append((offset, frame_length))
+            offset += frame_length
+
+        if self.first_header is None:
+            raise ValueError("Không tìm thấy frame MP3 nào.")
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, 'rb') as f:
+            return cls(f.read())
+
+    @property
+    def stream_format(self):
+        return self.first_header.stream_format
+
+    def write_frames(self, output):
+        view = memoryview(self.data)
+        for offset, frame_length in self.frames:
+            output.write(view[offset:offset + frame_length])
+
+
+def build_silence_frames(template_header, duration_ms):
+    """
+    Mô tả: Tạo các frame im lặng cùng định dạng với `template_header` (cùng version, bitrate,
+           tần số lấy mẫu, chế độ kênh). Frame có side info toàn 0 (không có dữ liệu Huffman)
+           được mọi bộ giải mã hiểu là im lặng, nên không cần bộ mã hóa.
+    Returns:
+        bytes: Các frame im lặng nối liền, b'' nếu duration_ms <= 0.
+    """
+    if duration_ms <= 0:
+        return b''
+    b0, b1, b2, b3 = template_header.raw
+    # Bỏ CRC (protection bit = 1) và padding để mọi frame có cùng độ dài
+    header = bytes((b0, b1 | 0x01, b2 & ~0x02 & 0xFF, b3))
+    silent_header = parse_frame_header(header, 0)
+    samples_per_frame = silent_header.samples_per_frame
+    frame_count = -(-duration_ms * silent_header.sample_rate // (1000 * samples_per_frame))
+    frame = header + bytes(silent_header.frame_length - 4)
+    return frame * frame_count
+
+
+def join_mp3_files(input_paths, output_path, pause_ms=0):
+    """
+    Mô tả: Nối các file MP3 bằng cách ghi lại trực tiếp các frame (không giải mã/mã hóa lại),
+           chèn frame im lặng `pause_ms` giữa các file.
+    Raises:
+        ValueError: Nếu một file không đọc được như MP3 Layer III hoặc các file khác định dạng
+                    (tần số lấy mẫu, version, số kênh); người gọi nên dùng cách ghép có giải mã.
+    """
+    streams = [Mp3Stream.from_file(path) for path in input_paths]
+    formats = {stream.stream_format for stream in streams}
+    if len(formats) > 1:
+        raise ValueError(f"Các file MP3 khác định dạng, không thể nối trực tiếp: {sorted(formats)}.")
+
+    silence = build_silence_frames(streams[0].first_header, pause_ms)
+    with open(output_path, 'wb') as output:
+        for index, stream in enumerate(streams):
+            if index and silence:
+                output.write(silence)
+            stream.write_frames(output)
@@ -2,42 +2,34 @@
 import logging
 import openpyxl
 import io
-import random
 import time
 import hashlib
 import os
-import zipfile
 import requests
-from sqlalchemy import func
-from ..models import db, QuestionSet, User, QuizQuestion, UserQuizProgress, ScoreLog, QuizPassage
+from collections import Counter
+from sqlalchemy import func, case, select, insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from ..models import db, QuestionSet, User, QuizQuestion, UserQuizProgress, ScoreLog, QuizPassage, QuizQuestionNote
 from ..config import (
     SCORE_QUIZ_CORRECT_FIRST_TIME, SCORE_QUIZ_CORRECT_REPEAT,
     QUIZ_MODE_NEW_SEQUENTIAL, QUIZ_MODE_NEW_RANDOM, QUIZ_MODE_REVIEW,
-    QUIZ_IMAGES_DIR, QUIZ_AUDIO_CACHE_DIR
+    QUIZ_IMAGES_DIR, QUIZ_AUDIO_CACHE_DIR, IMPORT_CHUNK_SIZE, CATEGORY_PAGE_SIZE
 )
+from .activity_rollup import ActivityRollupBuffer, SOURCE_QUIZ
+from .quiz_set_index import quiz_set_index
+from .excel_import import ExcelRowReader, cell_text, save_upload, remove_upload, import_jobs
+from .zip_stream import stream_zip
+from .keyset_pagination import paginate_keyset, category_count_cache
+from .set_listing import quiz_set_listing
+from .audio_pregeneration import quiz_remote_audio_path
+from .media_registry import media_registry, quiz_media_refs
 
 logger = logging.getLogger(__name__)
 
-def _sort_sets_by_progress(set_items, total_key, completed_key):
-    """
-    Mô tả: Sắp xếp danh sách các bộ dựa trên tiến độ hoàn thành.
-    """
-    def custom_sort_key(set_item):
-        total = getattr(set_item, total_key, 0)
-        completed = getattr(set_item, completed_key, 0)
-        title = getattr(set_item, 'title', '')
-
-        if total == 0:
-            return (float('-inf'), title) 
-
-        percentage = (completed * 100 / total)
-
-        if percentage == 100:
-            return (0, title) 
-        
-        return (-percentage, title)
+IMPORT_KIND_QUIZ = 'quiz'
+QUIZ_REQUIRED_HEADERS = ('question', 'option_a', 'option_b', 'correct_answer_text')
 
-    return sorted(set_items, key=custom_sort_key)
+QUIZ_PROGRESS_UPSERT_COLUMNS = ('set_id', 'last_answered', 'times_correct', 'times_incorrect', 'correct_streak', 'is_mastered')
 
 class QuizService:
     """
@@ -51,39 +43,13 @@ class QuizService:
         Mô tả: Lấy và phân loại các bộ câu hỏi thành "đã bắt đầu" và "mới".
         """
         try:
-            started_set_ids_query = db.session.query(QuizQuestion.set_id).join(
-                UserQuizProgress, UserQuizProgress.question_id == QuizQuestion.question_id
-            ).filter(UserQuizProgress.user_id == user_id).distinct()
-            
-            started_set_ids = {row[0] for row in started_set_ids_query.all()}
-            
-            started_sets_raw = []
-            if started_set_ids:
-                total_questions_map = dict(db.session.query(
-                    QuizQuestion.set_id, func.count(QuizQuestion.question_id)
-                ).filter(QuizQuestion.set_id.in_(started_set_ids)).group_by(QuizQuestion.set_id).all())
-                
-                answered_questions_map = dict(db.session.query(
-                    QuizQuestion.set_id, func.count(UserQuizProgress.progress_id)
-                ).join(QuizQuestion).filter(
-                    UserQuizProgress.user_id == user_id,
-                    QuizQuestion.set_id.in_(started_set_ids)
-                ).group_by(QuizQuestion.set_id).all())
-
-                set_objects = QuestionSet.query.filter(QuestionSet.set_id.in_(started_set_ids)).all()
-                for s in set_objects:
-                    s.total_questions = total_questions_map.get(s.set_id, 0)
-                    s.answered_questions = answered_questions_map.get(s.set_id, 0)
-                    s.creator_username = s.creator.username if s.creator else "N/A"
-                    started_sets_raw.append(s)
-
-            started_sets = _sort_sets_by_progress(started_sets_raw, 
-                                                total_key='total_questions', 
-                                                completed_key='answered_questions')
-            
+            started_sets = quiz_set_listing.all(user_id)
+            for s in started_sets:
+                s.creator_username = s.creator.username if s.creator else "N/A"
+
             new_sets_query = QuestionSet.query.filter(
                 QuestionSet.is_public == True,
-                ~QuestionSet.set_id.in_(started_set_ids)
+                ~QuestionSet.set_id.in_(quiz_set_listing.started_set_ids_query(user_id))
             ).order_by(QuestionSet.title.asc())
             new_sets = new_sets_query.all()
             for s in new_sets:
@@ -95,132 +61,206 @@ class QuizService:
             logger.error(f"Lỗi khi phân loại bộ câu hỏi: {e}", exc_info=True)
             return [], []
 
-    def get_next_question_group_for_user(self, user_id, set_id, mode):
+    def get_next_question_group_for_user(self, user_id, set_id, mode, user=None):
         """
         Mô tả: Lấy nhóm câu hỏi tiếp theo cho người dùng.
+               Việc chọn câu hỏi dùng chỉ mục của bộ và bitmap câu đã trả lời trong bộ nhớ (quiz_set_index),
+               database chỉ được truy vấn để nạp các câu hỏi của nhóm được chọn.
+        Args:
+            user (User, optional): Đối tượng người dùng đã nạp sẵn trong request, tránh truy vấn lại.
         """
-        all_q_ids_in_set = {row[0] for row in QuizQuestion.query.with_entities(QuizQuestion.question_id).filter_by(set_id=set_id).all()}
-        if not all_q_ids_in_set:
+        answered = quiz_set_index.get_answered(user_id, set_id)
+        index = answered.index
+        if not len(index):
             return None, None
 
-        answered_q_ids = {row[0] for row in UserQuizProgress.query.with_entities(UserQuizProgress.question_id).filter_by(user_id=user_id).join(QuizQuestion).filter(QuizQuestion.set_id == set_id).all()}
-
-        user = User.query.get(user_id)
-        if user and user.current_question_set_id == set_id:
-            last_answered_progress = UserQuizProgress.query.filter_by(user_id=user_id)\
-                                     .join(QuizQuestion).filter(QuizQuestion.set_id == set_id)\
-                                     .order_by(UserQuizProgress.last_answered.desc())\
-                                     .first()
-            
-            if last_answered_progress and last_answered_progress.question.passage_id:
-                current_passage_id = last_answered_progress.question.passage_id
-                
-                unanswered_in_passage_count = QuizQuestion.query.filter(
-                    QuizQuestion.set_id == set_id,
-                    QuizQuestion.passage_id == current_passage_id,
-                    ~QuizQuestion.progresses.any(user_id=user_id)
-                ).count()
-
-                if unanswered_in_passage_count > 0:
-                    questions_in_passage = QuizQuestion.query.filter(
-                        QuizQuestion.set_id == set_id,
-                        QuizQuestion.passage_id == current_passage_id
-                    ).order_by(QuizQuestion.passage_order.asc(), QuizQuestion.question_id.asc()).all()
-                    
-                    return questions_in_passage, questions_in_passage[0].passage
+        if user is None:
+            user = User.query.get(user_id)
+        if user and user.current_question_set_id == set_id and answered.last_question_id is not None:
+            group_question_ids, passage_id = index.group_for(answered.last_question_id)
+            if passage_id is not None and answered.has_unanswered(group_question_ids):
+                return self._load_question_group(group_question_ids)
         
         next_question_id = None
         
         if mode == QUIZ_MODE_NEW_SEQUENTIAL:
-            new_q_ids = all_q_ids_in_set - answered_q_ids
-            if new_q_ids:
-                next_question_id = min(new_q_ids)
+            next_question_id = answered.first_unanswered()
 
         elif mode == QUIZ_MODE_NEW_RANDOM:
-            new_q_ids = all_q_ids_in_set - answered_q_ids
-            if new_q_ids:
-                next_question_id = random.choice(list(new_q_ids))
+            next_question_id = answered.random_question(answered=False)
         
         elif mode == QUIZ_MODE_REVIEW:
-            if answered_q_ids:
-                next_question_id = random.choice(list(answered_q_ids))
+            next_question_id = answered.random_question(answered=True)
         
-        if next_question_id:
-            next_question = self.get_question_by_id(next_question_id)
-            if next_question.passage_id:
-                questions_in_passage = QuizQuestion.query.filter(
-                    QuizQuestion.set_id == set_id,
-                    QuizQuestion.passage_id == next_question.passage_id
-                ).order_by(QuizQuestion.passage_order.asc(), QuizQuestion.question_id.asc()).all()
-                return questions_in_passage, next_question.passage
-            else:
-                return [next_question], None
+        if next_question_id is not None:
+            group_question_ids, _ = index.group_for(next_question_id)
+            return self._load_question_group(group_question_ids)
         
         return None, None
 
-    def process_user_answers(self, user_id, answers_data):
+    def _load_question_group(self, question_ids):
         """
-        Mô tả: Xử lý nhiều câu trả lời của người dùng.
+        Mô tả: Nạp các câu hỏi của một nhóm bằng một truy vấn, giữ đúng thứ tự hiển thị của chỉ mục.
+        Returns:
+            tuple: (list QuizQuestion, QuizPassage hoặc None).
         """
+        questions_by_id = {q.question_id: q for q in QuizQuestion.query.filter(QuizQuestion.question_id.in_(question_ids)).all()}
+        questions = [questions_by_id[question_id] for question_id in question_ids if question_id in questions_by_id]
+        if not questions:
+            return None, None
+        return questions, questions[0].passage if questions[0].passage_id else None
+
+    def get_question_group_view(self, user_id, set_id, questions):
+        """
+        Mô tả: Nạp toàn bộ dữ liệu phụ cần để hiển thị một nhóm câu hỏi (ví dụ cả một đoạn văn)
+               với số truy vấn cố định, không phụ thuộc số câu hỏi trong nhóm:
+               thông tin bộ, ghi chú và tiến trình của người dùng (mỗi loại một truy vấn)
+               và thống kê của bộ (một truy vấn tổng hợp).
+        Args:
+            user_id (int): ID của người dùng.
+            set_id (int): ID của bộ câu hỏi.
+            questions (list): Các QuizQuestion trong nhóm.
+        Returns:
+            dict: {'question_set', 'notes', 'progress', 'stats'} với notes/progress là dict theo question_id.
+        """
+        question_ids = [q.question_id for q in questions]
+        # Nạp bộ vào identity map để q.question_set không phát sinh truy vấn cho từng câu hỏi.
+        question_set = db.session.get(QuestionSet, set_id)
+        notes = {}
+        progress = {}
+        if question_ids:
+            notes = {
+                note.question_id: note for note in QuizQuestionNote.query.filter(
+                    QuizQuestionNote.user_id == user_id, QuizQuestionNote.question_id.in_(question_ids)
+                ).all()
+            }
+            progress = {
+                p.question_id: p for p in UserQuizProgress.query.filter(
+                    UserQuizProgress.user_id == user_id, UserQuizProgress.question_id.in_(question_ids)
+                ).all()
+            }
+        return {
+            'question_set': question_set,
+            'notes': notes,
+            'progress': progress,
+            'stats': self._build_quiz_set_stats(user_id, set_id, question_set),
+        }
+
+    def process_user_answers(self, user_id, answers_data, user=None):
+        """
+        Mô tả: Xử lý nhiều câu trả lời của người dùng theo lô với số câu lệnh cố định:
+               nạp câu hỏi và tiến trình bằng truy vấn IN, tính kết quả trong bộ nhớ theo thứ tự gửi lên,
+               upsert toàn bộ tiến trình bằng một lệnh, ghi ScoreLog hàng loạt và cập nhật điểm người dùng một lần.
+        Args:
+            user_id (int): ID của người dùng.
+            answers_data (list): Danh sách dict {'question_id', 'selected_option'}.
+            user (User, optional): Đối tượng người dùng đã nạp sẵn trong request, tránh truy vấn lại.
+        Returns:
+            list: Kết quả theo đúng thứ tự gửi lên.
+        """
+        log_prefix = f"[QUIZ_SERVICE|ProcessAnswers|User:{user_id}|Count:{len(answers_data)}]"
         results = []
         try:
+            if user is None:
+                user = User.query.get(user_id)
+            activity = ActivityRollupBuffer(user.timezone_offset if user else None)
+
+            requested_ids = {answer.get('question_id') for answer in answers_data if isinstance(answer.get('question_id'), int)}
+            questions = {}
+            progress_state = {}
+            if requested_ids:
+                questions = {
+                    q.question_id: q for q in QuizQuestion.query.filter(QuizQuestion.question_id.in_(requested_ids)).all()
+                }
+                for progress in UserQuizProgress.query.filter(
+                    UserQuizProgress.user_id == user_id,
+                    UserQuizProgress.question_id.in_(list(questions))
+                ).all():
+                    progress_state[progress.question_id] = {
+                        'set_id': progress.set_id,
+                        'last_answered': progress.last_answered,
+                        'times_correct': progress.times_correct or 0,
+                        'times_incorrect': progress.times_incorrect or 0,
+                        'correct_streak': progress.correct_streak or 0,
+                        'is_mastered': progress.is_mastered,
+                    }
+
+            now = int(time.time())
+            changed_ids = []
+            score_log_rows = []
             for answer in answers_data:
                 question_id = answer.get('question_id')
                 selected_option = answer.get('selected_option')
 
-                question = self.get_question_by_id(question_id)
+                question = questions.get(question_id)
                 if not question:
                     results.append({'question_id': question_id, 'status': 'error'})
                     continue
 
                 is_correct = (selected_option == question.correct_answer)
-                
-                progress = UserQuizProgress.query.filter_by(user_id=user_id, question_id=question_id).first()
-                if not progress:
-                    progress = UserQuizProgress(user_id=user_id, question_id=question_id)
-                    db.session.add(progress)
-                
-                if progress.times_correct is None: progress.times_correct = 0
-                if progress.times_incorrect is None: progress.times_incorrect = 0
-                if progress.correct_streak is None: progress.correct_streak = 0
-
-                progress.last_answered = int(time.time())
+
+                state = progress_state.get(question_id)
+                is_new_question = state is None
+                if is_new_question:
+                    state = {'set_id': question.set_id, 'last_answered': None, 'times_correct': 0,
+                             'times_incorrect': 0, 'correct_streak': 0, 'is_mastered': False}
+                    progress_state[question_id] = state
+                previous_answered_ts = state['last_answered']
+                state['last_answered'] = now
+
                 score_change = 0
-                
-                is_first_correct = False
                 if is_correct:
-                    is_first_correct = (progress.times_correct == 0)
+                    is_first_correct = (state['times_correct'] == 0)
                     score_change = SCORE_QUIZ_CORRECT_FIRST_TIME if is_first_correct else SCORE_QUIZ_CORRECT_REPEAT
-                    progress.times_correct += 1
-                    progress.correct_streak += 1
-                else:
-                    progress.times_incorrect += 1
-                    progress.correct_streak = 0
-                
-                if progress.correct_streak >= 3:
-                    progress.is_mastered = True
+                    state['times_correct'] += 1
+                    state['correct_streak'] += 1
+                    if score_change > 0:
+                        score_log_rows.append({
+                            'user_id': user_id,
+                            'score_change': score_change,
+                            'timestamp': now,
+                            'reason': f"quiz_answer_{'first_correct' if is_first_correct else 'correct'}",
+                            'source_type': 'quiz'
+                        })
                 else:
-                    progress.is_mastered = False
-
-                if score_change > 0:
-                    user = User.query.get(user_id)
-                    user.score = (user.score or 0) + score_change
-                    db.session.add(user)
-                    
-                    reason = f"quiz_answer_{'first_correct' if is_first_correct else 'correct'}"
-                    score_log = ScoreLog(user_id=user_id, score_change=score_change, timestamp=int(time.time()), reason=reason, source_type='quiz')
-                    db.session.add(score_log)
-                
-                db.session.add(progress)
-                
+                    state['times_incorrect'] += 1
+                    state['correct_streak'] = 0
+                state['is_mastered'] = state['correct_streak'] >= 3
+
+                if question_id not in changed_ids:
+                    changed_ids.append(question_id)
+                activity.add_review(user_id, SOURCE_QUIZ, now, previous_answered_ts,
+                                    is_new=is_new_question, score=score_change)
+
                 results.append({'question_id': question_id, 'is_correct': is_correct, 'correct_answer': question.correct_answer, 'guidance': question.guidance or '', 'status': 'success'})
-            
+
+            if changed_ids:
+                statement = sqlite_insert(UserQuizProgress)
+                statement = statement.on_conflict_do_update(
+                    index_elements=['user_id', 'question_id'],
+                    set_={column: getattr(statement.excluded, column) for column in QUIZ_PROGRESS_UPSERT_COLUMNS}
+                )
+                db.session.execute(statement, [
+                    dict(user_id=user_id, question_id=question_id, **progress_state[question_id])
+                    for question_id in changed_ids
+                ])
+            if score_log_rows:
+                db.session.bulk_insert_mappings(ScoreLog, score_log_rows)
+            total_score_added = sum(row['score_change'] for row in score_log_rows)
+            if total_score_added and user:
+                user.score = (user.score or 0) + total_score_added
+            activity.flush()
             db.session.commit()
+            quiz_set_index.on_answers_committed(
+                user_id, [(progress_state[question_id]['set_id'], question_id) for question_id in changed_ids], now
+            )
+            category_count_cache.invalidate(user_id=user_id)
+            logger.info(f"{log_prefix} Hoàn tất: {len(changed_ids)} câu hỏi cập nhật, điểm cộng thêm {total_score_added}.")
             return results
             
         except Exception as e:
             db.session.rollback()
-            logger.error(f"Lỗi khi xử lý câu trả lời: {e}", exc_info=True)
+            logger.error(f"{log_prefix} Lỗi khi xử lý câu trả lời: {e}", exc_info=True)
             return [{'status': 'error', 'message': 'Lỗi server nội bộ.'}]
 
     def get_all_question_sets_with_details(self):
@@ -295,6 +335,7 @@ class QuizService:
             return None, "permission_denied"
 
         try:
+            media_before = quiz_media_refs(question)
             question.pre_question_text = data.get('pre_question_text') or None
             question.question = data.get('question') or None
             question.question_image_file = data.get('question_image_file') or None
@@ -313,91 +354,104 @@ class QuizService:
                     question.passage_order = None
             else:
                 question.passage_order = None
-            
+            media_registry.apply_diff(media_before, quiz_media_refs(question))
+
             db.session.commit()
+            quiz_set_index.invalidate(set_id=question.set_id)
             return question, "success"
         except Exception as e:
             db.session.rollback()
             return None, str(e)
 
-    def _process_excel_file(self, question_set, file_stream, sync=False):
+    def _parse_excel_row(self, row, passage_content_to_id_map):
         """
-        Mô tả: Xử lý file Excel để thêm hoặc đồng bộ hóa câu hỏi.
+        Mô tả: Chuyển một hàng Excel (dict tiêu đề -> giá trị) thành dữ liệu câu hỏi.
+               Đoạn văn mới được tạo trong session hiện tại và ghi vào `passage_content_to_id_map`.
+        Returns:
+            tuple: (question_data hoặc None, lý do bỏ qua).
         """
-        file_content = file_stream.read()
-        in_memory_file = io.BytesIO(file_content)
-        workbook = openpyxl.load_workbook(in_memory_file)
-        sheet = workbook.active
-        headers = [str(cell.value).strip().lower() if cell.value is not None else "" for cell in sheet[1]]
-        required_headers = ['question', 'option_a', 'option_b', 'correct_answer_text']
-        
-        missing_headers = [h for h in required_headers if h not in headers]
-        if missing_headers:
-            raise ValueError(f"File Excel thiếu các cột bắt buộc: {', '.join(missing_headers)}.")
+        question_id_from_excel = None
+        if row.get('question_id') is not None:
+            try:
+                question_id_from_excel = int(row['question_id'])
+            except (ValueError, TypeError):
+                pass
+
+        question_text = cell_text(row, 'question')
+        question_image_file = cell_text(row, 'question_image_file')
+        question_audio_file = cell_text(row, 'question_audio_file')
+
+        if not question_text and not question_image_file and not question_audio_file:
+            return None, "Không có nội dung câu hỏi, ảnh hoặc audio."
+
+        option_a_text = str(row.get('option_a')).strip()
+        option_b_text = str(row.get('option_b')).strip()
+        option_c_text = cell_text(row, 'option_c')
+        option_d_text = cell_text(row, 'option_d')
+        correct_answer_text = str(row.get('correct_answer_text')).strip()
+
+        determined_answer = None
+        if correct_answer_text and option_a_text and correct_answer_text == option_a_text: determined_answer = 'A'
+        elif correct_answer_text and option_b_text and correct_answer_text == option_b_text: determined_answer = 'B'
+        elif correct_answer_text and option_c_text and correct_answer_text == option_c_text: determined_answer = 'C'
+        elif correct_answer_text and option_d_text and correct_answer_text == option_d_text: determined_answer = 'D'
+
+        if not determined_answer:
+            return None, "correct_answer_text không khớp với đáp án nào."
+
+        passage_text_from_excel = cell_text(row, 'passage_text')
+        passage_order_from_excel = None
+        if row.get('passage_order') is not None:
+            try:
+                passage_order_from_excel = int(row['passage_order'])
+            except (ValueError, TypeError):
+                pass
+
+        passage_id_for_db = None
+        if passage_text_from_excel:
+            passage_hash = hashlib.sha256(passage_text_from_excel.encode('utf-8')).hexdigest()
+            if passage_hash not in passage_content_to_id_map:
+                new_passage = QuizPassage(passage_content=passage_text_from_excel, passage_hash=passage_hash)
+                db.session.add(new_passage)
+                db.session.flush()
+                passage_content_to_id_map[passage_hash] = new_passage.passage_id
+            passage_id_for_db = passage_content_to_id_map[passage_hash]
         
-        column_map = {header: idx for idx, header in enumerate(headers)}
-        questions_from_excel = []
-        passage_content_to_id_map = {p.passage_hash: p.passage_id for p in QuizPassage.query.all()}
+        question_data = {
+            'question_id': question_id_from_excel, 'question': question_text or None,
+            'option_a': option_a_text, 'option_b': option_b_text, 'option_c': option_c_text or None,
+            'option_d': option_d_text or None, 'correct_answer': determined_answer, 
+            'pre_question_text': cell_text(row, 'pre_question_text', None),
+            'guidance': cell_text(row, 'guidance', None),
+            'question_image_file': question_image_file or None, 'question_audio_file': question_audio_file or None,
+            'passage_id': passage_id_for_db, 'passage_order': passage_order_from_excel
+        }
+        return question_data, None
+
+    def _load_passage_hash_map(self):
+        return {passage_hash: passage_id for passage_hash, passage_id in
+                db.session.query(QuizPassage.passage_hash, QuizPassage.passage_id).all()}
 
-        for row_index, row_cells in enumerate(sheet.iter_rows(min_row=2), start=2):
-            row_values = [cell.value for cell in row_cells]
-            question_id_from_excel = None
-            if 'question_id' in column_map and row_values[column_map['question_id']] is not None:
-                try:
-                    question_id_from_excel = int(row_values[column_map['question_id']])
-                except ValueError:
-                    pass
-
-            question_text = str(row_values[column_map.get('question')]).strip() if column_map.get('question') is not None and row_values[column_map.get('question')] is not None else ''
-            question_image_file = str(row_values[column_map.get('question_image_file')]).strip() if column_map.get('question_image_file') is not None and row_values[column_map.get('question_image_file')] is not None else ''
-            question_audio_file = str(row_values[column_map.get('question_audio_file')]).strip() if column_map.get('question_audio_file') is not None and row_values[column_map.get('question_audio_file')] is not None else ''
-
-            if not question_text and not question_image_file and not question_audio_file:
-                continue
-
-            option_a_text = str(row_values[column_map['option_a']]).strip()
-            option_b_text = str(row_values[column_map['option_b']]).strip()
-            option_c_text = str(row_values[column_map.get('option_c')]).strip() if column_map.get('option_c') is not None and row_values[column_map.get('option_c')] is not None else ''
-            option_d_text = str(row_values[column_map.get('option_d')]).strip() if column_map.get('option_d') is not None and row_values[column_map.get('option_d')] is not None else ''
-            correct_answer_text = str(row_values[column_map['correct_answer_text']]).strip()
-
-            determined_answer = None
-            if correct_answer_text and option_a_text and correct_answer_text == option_a_text: determined_answer = 'A'
-            elif correct_answer_text and option_b_text and correct_answer_text == option_b_text: determined_answer = 'B'
-            elif correct_answer_text and option_c_text and correct_answer_text == option_c_text: determined_answer = 'C'
-            elif correct_answer_text and option_d_text and correct_answer_text == option_d_text: determined_answer = 'D'
-
-            if not determined_answer: continue
-
-            passage_text_from_excel = str(row_values[column_map.get('passage_text')]).strip() if column_map.get('passage_text') is not None and row_values[column_map.get('passage_text')] is not None else ''
-            passage_order_from_excel = None
-            if 'passage_order' in column_map and row_values[column_map['passage_order']] is not None:
-                try:
-                    passage_order_from_excel = int(row_values[column_map['passage_order']])
-                except (ValueError, TypeError):
-                    pass
-
-            passage_id_for_db = None
-            if passage_text_from_excel:
-                passage_hash = hashlib.sha256(passage_text_from_excel.encode('utf-8')).hexdigest()
-                if passage_hash not in passage_content_to_id_map:
-                    new_passage = QuizPassage(passage_content=passage_text_from_excel, passage_hash=passage_hash)
-                    db.session.add(new_passage)
-                    db.session.flush()
-                    passage_content_to_id_map[passage_hash] = new_passage.passage_id
-                passage_id_for_db = passage_content_to_id_map[passage_hash]
-            
-            question_data = {
-                'question_id': question_id_from_excel, 'question': question_text or None,
-                'option_a': option_a_text, 'option_b': option_b_text, 'option_c': option_c_text or None,
-                'option_d': option_d_text or None, 'correct_answer': determined_answer, 
-                'pre_question_text': str(row_values[column_map.get('pre_question_text')]).strip() if column_map.get('pre_question_text') is not None and row_values[column_map.get('pre_question_text')] is not None else None,
-                'guidance': str(row_values[column_map.get('guidance')]).strip() if column_map.get('guidance') is not None and row_values[column_map.get('guidance')] is not None else None,
-                'question_image_file': question_image_file or None, 'question_audio_file': question_audio_file or None,
-                'passage_id': passage_id_for_db, 'passage_order': passage_order_from_excel
-            }
-            questions_from_excel.append(question_data)
+    def _process_excel_file(self, question_set, file_stream, sync=False):
+        """
+        Mô tả: Xử lý file Excel để thêm hoặc đồng bộ hóa câu hỏi trong transaction hiện tại.
+               File được đọc ở chế độ read-only từng hàng. Số tham chiếu media của bộ được cập nhật
+               theo chênh lệch trước/sau khi xử lý.
+        """
+        questions_from_excel = []
+        passage_content_to_id_map = self._load_passage_hash_map()
 
+        file_path = save_upload(file_stream)
+        try:
+            with ExcelRowReader(file_path, QUIZ_REQUIRED_HEADERS) as reader:
+                for row_index, row in reader.iter_rows():
+                    question_data, _ = self._parse_excel_row(row, passage_content_to_id_map)
+                    if question_data is not None:
+                        questions_from_excel.append(question_data)
+        finally:
+            remove_upload(file_path)
+
+        media_before = media_registry.question_set_refs(question_set.set_id)
         if sync:
             existing_questions_map = {q.question_id: q for q in question_set.questions}
             excel_question_ids = {q_data['question_id'] for q_data in questions_from_excel if q_data['question_id'] is not None}
@@ -416,6 +470,8 @@ class QuizService:
             questions_to_delete = [q for q_id, q in existing_questions_map.items() if q_id not in excel_question_ids]
             for q in questions_to_delete:
                 db.session.delete(q)
+
+            self._sync_progress_set_ids(question_set.set_id)
         else:
             questions_to_add = []
             for q_data in questions_from_excel:
@@ -426,10 +482,81 @@ class QuizService:
             if questions_to_add:
                 db.session.bulk_save_objects(questions_to_add)
 
+        db.session.flush()
+        media_registry.apply_diff(media_before, media_registry.question_set_refs(question_set.set_id))
+
+    def _import_excel_rows(self, job, file_path):
+        """
+        Mô tả: Tác vụ nền nhập thêm câu hỏi từ file Excel với bộ nhớ giới hạn:
+               đọc từng hàng ở chế độ read-only, ghi mỗi IMPORT_CHUNK_SIZE hàng bằng một lệnh insert
+               hàng loạt và commit ngay, hàng không hợp lệ được ghi lại theo số hàng trong job.
+        Args:
+            job (ImportJob): Tác vụ đang chạy (set_id là bộ đích).
+            file_path (str): File Excel đã lưu tạm, bị xóa khi kết thúc.
+        """
+        log_prefix = f"[QUIZ_SERVICE|ImportExcel|Set:{job.set_id}]"
+        chunk = []
+
+        def _write_chunk():
+            try:
+                db.session.execute(insert(QuizQuestion), chunk)
+                media_refs = Counter()
+                for question_data in chunk:
+                    media_refs.update(quiz_media_refs(question_data))
+                media_registry.apply_changes(media_refs)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            job.inserted += len(chunk)
+            chunk.clear()
+            quiz_set_index.invalidate(set_id=job.set_id)
+            category_count_cache.invalidate(set_id=job.set_id)
+            logger.debug(f"{log_prefix} Đã ghi {job.inserted} câu hỏi.")
+
+        try:
+            passage_content_to_id_map = self._load_passage_hash_map()
+            with ExcelRowReader(file_path, QUIZ_REQUIRED_HEADERS) as reader:
+                for row_index, row in reader.iter_rows():
+                    job.processed_rows += 1
+                    question_data, error = self._parse_excel_row(row, passage_content_to_id_map)
+                    if question_data is None:
+                        job.record_error(row_index, error)
+                        continue
+                    question_data.pop('question_id')
+                    question_data['set_id'] = job.set_id
+                    chunk.append(question_data)
+                    if len(chunk) >= IMPORT_CHUNK_SIZE:
+                        _write_chunk()
+            if chunk:
+                _write_chunk()
+        finally:
+            remove_upload(file_path)
+
+    def start_excel_import(self, set_id, user_id, file_path):
+        """
+        Mô tả: Đưa việc nhập file Excel (đã kiểm tra tiêu đề) vào tác vụ nền.
+        Returns:
+            ImportJob
+        """
+        return import_jobs.submit(IMPORT_KIND_QUIZ, set_id, user_id, self._import_excel_rows, file_path)
+
+    def _sync_progress_set_ids(self, set_id):
+        """
+        Mô tả: Đồng bộ cột set_id trên UserQuizProgress với QuizQuestion.set_id cho các câu hỏi thuộc bộ.
+        """
+        db.session.flush()
+        question_ids_in_set = db.session.query(QuizQuestion.question_id).filter(QuizQuestion.set_id == set_id)
+        UserQuizProgress.query.filter(
+            UserQuizProgress.question_id.in_(question_ids_in_set),
+            UserQuizProgress.set_id.is_distinct_from(set_id)
+        ).update({UserQuizProgress.set_id: set_id}, synchronize_session=False)
+
     def create_question_set(self, data, creator_id, file_stream=None):
         """
         Mô tả: Tạo một bộ câu hỏi mới.
         """
+        file_path = None
         try:
             new_set = QuestionSet(
                 title=data.get('title'), description=data.get('description'),
@@ -437,15 +564,21 @@ class QuizService:
             )
             db.session.add(new_set)
             if file_stream:
-                db.session.flush()
-                self._process_excel_file(new_set, file_stream, sync=False)
+                # Chỉ kiểm tra tiêu đề trong request; các hàng được nhập trong tác vụ nền.
+                file_path = save_upload(file_stream)
+                ExcelRowReader(file_path, QUIZ_REQUIRED_HEADERS).close()
             db.session.commit()
+            quiz_set_index.invalidate(set_id=new_set.set_id)
+            if file_path:
+                self.start_excel_import(new_set.set_id, creator_id, file_path)
             return new_set, "success"
         except ValueError as ve:
             db.session.rollback()
+            remove_upload(file_path)
             return None, str(ve)
         except Exception as e:
             db.session.rollback()
+            remove_upload(file_path)
             if "zip" in str(e).lower():
                  return None, "Lỗi đọc file Excel."
             return None, str(e)
@@ -468,6 +601,9 @@ class QuizService:
             logger.warning(f"{log_prefix} Từ chối quyền truy cập.")
             return None, "permission_denied"
 
+        if file_stream and import_jobs.has_active_job(IMPORT_KIND_QUIZ, set_id):
+            return None, "Bộ câu hỏi đang được nhập dữ liệu trong nền, vui lòng thử lại sau khi hoàn tất."
+
         try:
             set_to_update.title = data.get('title', set_to_update.title)
             set_to_update.description = data.get('description', set_to_update.description)
@@ -477,6 +613,9 @@ class QuizService:
                 self._process_excel_file(set_to_update, file_stream, sync=True)
 
             db.session.commit()
+            if file_stream:
+                quiz_set_index.invalidate(set_id=set_id)
+                category_count_cache.invalidate(set_id=set_id)
             return set_to_update, "success"
         except ValueError as ve:
             db.session.rollback()
@@ -505,8 +644,11 @@ class QuizService:
             return False, "permission_denied"
 
         try:
+            media_registry.release(media_registry.question_set_refs(set_id))
             db.session.delete(set_to_delete)
             db.session.commit()
+            quiz_set_index.invalidate(set_id=set_id)
+            category_count_cache.invalidate(set_id=set_id)
             return True, "success"
         except Exception as e:
             db.session.rollback()
@@ -569,24 +711,140 @@ class QuizService:
         """
         Mô tả: Lấy các số liệu thống kê chi tiết của một bộ câu hỏi quiz.
         """
+        return self._build_quiz_set_stats(user_id, set_id, QuestionSet.query.get(set_id))
+
+    def _build_quiz_set_stats(self, user_id, set_id, question_set):
+        """
+        Mô tả: Tính thống kê của một bộ cho người dùng bằng một truy vấn tổng hợp
+               (tổng số câu hỏi lấy bằng truy vấn con vô hướng).
+        """
         stats = {'set_id': set_id, 'set_title': 'N/A'}
-        question_set = QuestionSet.query.get(set_id)
         if not question_set:
             return stats
 
+        total_questions = select(func.count(QuizQuestion.question_id)).where(QuizQuestion.set_id == set_id).scalar_subquery()
+        row = db.session.execute(
+            select(
+                total_questions,
+                func.count(UserQuizProgress.progress_id),
+                func.coalesce(func.sum(case((UserQuizProgress.times_correct > 0, 1), else_=0)), 0),
+                func.coalesce(func.sum(case((UserQuizProgress.times_incorrect > 0, 1), else_=0)), 0),
+                func.coalesce(func.sum(case((UserQuizProgress.is_mastered == True, 1), else_=0)), 0),
+            ).where(UserQuizProgress.user_id == user_id, UserQuizProgress.set_id == set_id)
+        ).one()
+
         stats['set_title'] = question_set.title
-        stats['total_questions'] = QuizQuestion.query.filter_by(set_id=set_id).count()
-        progress_in_quiz_set = UserQuizProgress.query.join(QuizQuestion).filter(QuizQuestion.set_id == set_id, UserQuizProgress.user_id == user_id)
-        stats['answered_questions'] = progress_in_quiz_set.count()
-        stats['correct_answers'] = progress_in_quiz_set.filter(UserQuizProgress.times_correct > 0).count()
-        stats['incorrect_answers'] = progress_in_quiz_set.filter(UserQuizProgress.times_incorrect > 0).count()
-        stats['mastered_questions'] = progress_in_quiz_set.filter(UserQuizProgress.is_mastered == True).count()
+        stats['total_questions'] = row[0] or 0
+        stats['answered_questions'] = row[1]
+        stats['correct_answers'] = row[2]
+        stats['incorrect_answers'] = row[3]
+        stats['mastered_questions'] = row[4]
         stats['unanswered_questions'] = stats['total_questions'] - stats['answered_questions']
         return stats
 
+    def get_questions_by_category(self, user_id, set_id, category, after=None, before=None, per_page=CATEGORY_PAGE_SIZE):
+        """
+        Mô tả: Lấy một trang câu hỏi của bộ theo danh mục tiến trình, phân trang theo khóa question_id.
+               Điều kiện danh mục được lọc trong SQL; tổng số câu được cache ngắn hạn theo danh mục.
+        Args:
+            category (str): 'correct', 'incorrect', 'unanswered' hoặc 'mastered'.
+            after (str | None): Cursor của trang kế tiếp.
+            before (str | None): Cursor của trang trước.
+        Returns:
+            KeysetPage
+        Raises:
+            ValueError: Nếu danh mục hoặc cursor không hợp lệ.
+        """
+        log_prefix = f"[QUIZSVC|GetQuestions|User:{user_id}|Set:{set_id}|Cat:{category}]"
+
+        if category == 'unanswered':
+            answered = db.session.query(UserQuizProgress.progress_id).filter(
+                UserQuizProgress.user_id == user_id,
+                UserQuizProgress.question_id == QuizQuestion.question_id
+            ).exists()
+            query = QuizQuestion.query.filter(QuizQuestion.set_id == set_id, ~answered)
+        else:
+            category_filters = {
+                'correct': UserQuizProgress.times_correct > 0,
+                'incorrect': UserQuizProgress.times_incorrect > 0,
+                'mastered': UserQuizProgress.is_mastered == True,
+            }
+            if category not in category_filters:
+                raise ValueError(f"Danh mục không hợp lệ: {category}")
+            query = QuizQuestion.query.join(
+                UserQuizProgress, UserQuizProgress.question_id == QuizQuestion.question_id
+            ).filter(
+                UserQuizProgress.user_id == user_id,
+                UserQuizProgress.set_id == set_id,
+                QuizQuestion.set_id == set_id,
+                category_filters[category]
+            )
+
+        page = paginate_keyset(
+            query, [QuizQuestion.question_id], lambda question: (question.question_id,),
+            per_page, after=after, before=before
+        )
+        page.total = category_count_cache.get_or_count(('quiz', user_id, set_id, category), query.count)
+        logger.info(f"{log_prefix} Trả về {len(page.items)}/{page.total} câu hỏi.")
+        return page
+
+    @staticmethod
+    def _remote_image_loader(url):
+        """
+        Mô tả: Tạo hàm tải ảnh từ URL, chỉ được gọi khi luồng ZIP ghi tới entry này.
+        """
+        def load():
+            try:
+                response = requests.get(url, timeout=10)
+            except requests.exceptions.RequestException:
+                return None
+            return response.content if response.status_code == 200 else None
+        return load
+
+    def _collect_zip_media_entries(self, set_id):
+        """
+        Mô tả: Liệt kê các file media (ảnh, audio) của bộ câu hỏi cần đưa vào file ZIP.
+               Chỉ truy vấn các cột media theo từng khối; ảnh từ URL được tải khi ghi entry.
+        Returns:
+            list: Các tuple (arcname, đường dẫn file hoặc hàm tải), không trùng lặp.
+        """
+        entries = []
+        added_media_files = set()
+        media_rows = db.session.query(
+            QuizQuestion.question_image_file, QuizQuestion.question_audio_file
+        ).filter(QuizQuestion.set_id == set_id).order_by(QuizQuestion.question_id).yield_per(IMPORT_CHUNK_SIZE)
+
+        for img_filename, audio_filename in media_rows:
+            if img_filename and img_filename not in added_media_files:
+                if img_filename.startswith(('http://', 'https://')):
+                    safe_filename = hashlib.sha1(img_filename.encode()).hexdigest() + os.path.splitext(img_filename)[1]
+                    entries.append((os.path.join('images', safe_filename), self._remote_image_loader(img_filename)))
+                    added_media_files.add(img_filename)
+                else:
+                    img_path = os.path.join(QUIZ_IMAGES_DIR, img_filename)
+                    if os.path.exists(img_path):
+                        entries.append((os.path.join('images', img_filename), img_path))
+                        added_media_files.add(img_filename)
+
+            if audio_filename and audio_filename not in added_media_files:
+                if audio_filename.startswith(('http://', 'https://')):
+                    # Chỉ đóng gói audio liên kết ngoài khi đã có bản sao cục bộ (tạo khi chạy tạo audio hàng loạt)
+                    mirror_path = quiz_remote_audio_path(audio_filename)
+                    if os.path.exists(mirror_path):
+                        entries.append((os.path.join('audio', os.path.basename(mirror_path)), mirror_path))
+                        added_media_files.add(audio_filename)
+                else:
+                    audio_path = os.path.join(QUIZ_AUDIO_CACHE_DIR, audio_filename)
+                    if os.path.exists(audio_path):
+                        entries.append((os.path.join('audio', audio_filename), audio_path))
+                        added_media_files.add(audio_filename)
+        return entries
+
     def export_question_set_as_zip(self, set_id):
         """
-        Mô tả: Xuất một bộ câu hỏi đầy đủ vào một file ZIP.
+        Mô tả: Xuất một bộ câu hỏi đầy đủ vào một file ZIP dạng luồng.
+        Returns:
+            generator | None: Các khối bytes của file ZIP, None nếu có lỗi.
         """
         log_prefix = f"[QUIZ_SERVICE|ExportZip|Set:{set_id}]"
         set_to_export = self.get_question_set_by_id(set_id)
@@ -598,39 +856,10 @@ class QuizService:
             if not excel_stream:
                 return None
 
-            zip_stream = io.BytesIO()
-            with zipfile.ZipFile(zip_stream, 'w', zipfile.ZIP_DEFLATED) as zf:
-                zf.writestr('data.xlsx', excel_stream.getvalue())
-
-                added_media_files = set()
-                for question in set_to_export.questions:
-                    img_filename = question.question_image_file
-                    if img_filename and img_filename not in added_media_files:
-                        if img_filename.startswith(('http://', 'https://')):
-                            try:
-                                response = requests.get(img_filename, stream=True, timeout=10)
-                                if response.status_code == 200:
-                                    safe_filename = hashlib.sha1(img_filename.encode()).hexdigest() + os.path.splitext(img_filename)[1]
-                                    zf.writestr(os.path.join('images', safe_filename), response.content)
-                                    added_media_files.add(img_filename)
-                            except requests.exceptions.RequestException:
-                                pass
-                        else:
-                            img_path = os.path.join(QUIZ_IMAGES_DIR, img_filename)
-                            if os.path.exists(img_path):
-                                zf.write(img_path, os.path.join('images', img_filename))
-                                added_media_files.add(img_filename)
-
-                    audio_filename = question.question_audio_file
-                    if audio_filename and audio_filename not in added_media_files:
-                        if not audio_filename.startswith(('http://', 'https://')):
-                            audio_path = os.path.join(QUIZ_AUDIO_CACHE_DIR, audio_filename)
-                            if os.path.exists(audio_path):
-                                zf.write(audio_path, os.path.join('audio', audio_filename))
-                                added_media_files.add(audio_filename)
-            
-            zip_stream.seek(0)
-            return zip_stream
+            entries = [('data.xlsx', excel_stream.getvalue())]
+            entries.extend(self._collect_zip_media_entries(set_id))
+            logger.info(f"{log_prefix} Bắt đầu xuất ZIP với {len(entries) - 1} file media.")
+            return stream_zip(entries)
 
         except Exception as e:
             logger.error(f"{log_prefix} Lỗi khi tạo file ZIP: {e}", exc_info=True)
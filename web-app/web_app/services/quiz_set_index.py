@@ -0,0 +1,223 @@
+# web_app/services/quiz_set_index.py
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from ..models import db, QuizQuestion, UserQuizProgress
+from ..config import QUIZ_SET_INDEX_TTL_SECONDS, QUIZ_ANSWERED_CACHE_MAX_ENTRIES
+
+logger = logging.getLogger(__name__)
+
+_RANDOM_PROBE_ATTEMPTS = 8
+
+
+class QuestionSetIndex:
+    """
+    Mô tả: Cấu trúc bất biến mô tả thứ tự câu hỏi của một bộ quiz.
+           - `question_ids`: tuple question_id tăng dần; vị trí trong tuple là số thứ tự bit trong bitmap.
+           - `positions`: question_id -> vị trí.
+           - `passage_ids`: passage_id theo từng vị trí (None nếu câu hỏi không thuộc đoạn văn).
+           - `passage_groups`: passage_id -> tuple question_id theo (passage_order, question_id),
+             cùng thứ tự với truy vấn ORDER BY passage_order trước đây (NULL đứng đầu).
+    """
+    __slots__ = ('set_id', 'built_at', 'question_ids', 'positions', 'passage_ids', 'passage_groups', 'full_mask')
+
+    def __init__(self, set_id, rows, built_at):
+        ordered_rows = sorted(rows, key=lambda row: row[0])
+        groups = {}
+        for question_id, passage_id, passage_order in ordered_rows:
+            if passage_id is not None:
+                groups.setdefault(passage_id, []).append((passage_order is not None, passage_order or 0, question_id))
+
+        self.set_id = set_id
+        self.built_at = built_at
+        self.question_ids = tuple(row[0] for row in ordered_rows)
+        self.positions = {question_id: position for position, question_id in enumerate(self.question_ids)}
+        self.passage_ids = tuple(row[1] for row in ordered_rows)
+        self.passage_groups = {
+            passage_id: tuple(item[2] for item in sorted(items)) for passage_id, items in groups.items()
+        }
+        self.full_mask = (1 << len(self.question_ids)) - 1
+
+    def __len__(self):
+        return len(self.question_ids)
+
+    def group_for(self, question_id):
+        """
+        Mô tả: Nhóm hiển thị của một câu hỏi: cả đoạn văn nếu câu hỏi thuộc đoạn văn, ngược lại chỉ câu hỏi đó.
+        Returns:
+            tuple: (tuple question_id theo thứ tự hiển thị, passage_id hoặc None).
+        """
+        passage_id = self.passage_ids[self.positions[question_id]]
+        if passage_id is None:
+            return (question_id,), None
+        return self.passage_groups[passage_id], passage_id
+
+
+class AnsweredBitmap:
+    """
+    Mô tả: Các câu hỏi người dùng đã trả lời trong một bộ, lưu dưới dạng một số nguyên bitmap
+           theo vị trí của QuestionSetIndex, kèm câu hỏi được trả lời gần nhất.
+    """
+    __slots__ = ('index', 'bits', 'answered_count', 'last_question_id', 'last_answered', 'built_at')
+
+    def __init__(self, index, built_at):
+        self.index = index
+        self.bits = 0
+        self.answered_count = 0
+        self.last_question_id = None
+        self.last_answered = None
+        self.built_at = built_at
+
+    def mark(self, question_id, answered_ts):
+        position = self.index.positions.get(question_id)
+        if position is None:
+            return
+        if not self.bits >> position & 1:
+            self.bits |= 1 << position
+            self.answered_count += 1
+        if answered_ts is not None and (self.last_answered is None or answered_ts >= self.last_answered):
+            self.last_answered = answered_ts
+            self.last_question_id = question_id
+
+    def is_answered(self, question_id):
+        position = self.index.positions.get(question_id)
+        return position is not None and bool(self.bits >> position & 1)
+
+    def first_unanswered(self):
+        """
+        Returns:
+            int | None: question_id nhỏ nhất chưa trả lời.
+        """
+        unanswered = self.index.full_mask & ~self.bits
+        if not unanswered:
+            return None
+        return self.index.question_ids[(unanswered & -unanswered).bit_length() - 1]
+
+    def random_question(self, answered):
+        """
+        Mô tả: Chọn ngẫu nhiên (đồng đều) một câu hỏi đã trả lời hoặc chưa trả lời.
+               Thử vài vị trí ngẫu nhiên trước, chỉ duyệt toàn bộ bitmap khi nhóm cần chọn quá nhỏ.
+        Returns:
+            int | None
+        """
+        size = len(self.index)
+        mask = self.bits if answered else self.index.full_mask & ~self.bits
+        if not mask:
+            return None
+        for _ in range(_RANDOM_PROBE_ATTEMPTS):
+            position = random.randrange(size)
+            if mask >> position & 1:
+                return self.index.question_ids[position]
+        positions = [position for position in range(size) if mask >> position & 1]
+        return self.index.question_ids[random.choice(positions)]
+
+    def has_unanswered(self, question_ids):
+        return any(not self.is_answered(question_id) for question_id in question_ids)
+
+
+class QuizSetIndexRegistry:
+    """
+    Mô tả: Cache trong bộ nhớ các QuestionSetIndex (theo set_id) và AnsweredBitmap (theo (user_id, set_id)).
+           Mỗi chỉ mục dựng bằng một truy vấn trên QuizQuestions, mỗi bitmap bằng một truy vấn trên
+           UserQuizProgress; sau đó việc chọn nhóm câu hỏi tiếp theo hoàn toàn trong bộ nhớ.
+           Chỉ mục bị hủy khi nội dung bộ thay đổi; bitmap được cập nhật sau mỗi lần nộp câu trả lời
+           và tự dựng lại khi chỉ mục của bộ được dựng lại.
+    """
+    def __init__(self, ttl_seconds=QUIZ_SET_INDEX_TTL_SECONDS, max_answered_entries=QUIZ_ANSWERED_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_answered_entries = max_answered_entries
+        self._indexes = {}
+        self._answered = OrderedDict()
+        self._lock = threading.RLock()
+
+    def _build_index(self, set_id, now):
+        rows = db.session.query(
+            QuizQuestion.question_id, QuizQuestion.passage_id, QuizQuestion.passage_order
+        ).filter(QuizQuestion.set_id == set_id).all()
+        index = QuestionSetIndex(set_id, rows, now)
+        logger.debug(f"[QUIZ_SET_INDEX|Set:{set_id}] Đã dựng chỉ mục: {len(index)} câu hỏi, {len(index.passage_groups)} đoạn văn.")
+        return index
+
+    def _build_answered(self, user_id, index, now):
+        rows = db.session.query(
+            UserQuizProgress.question_id, UserQuizProgress.last_answered
+        ).filter(
+            UserQuizProgress.user_id == user_id,
+            UserQuizProgress.set_id == index.set_id
+        ).order_by(UserQuizProgress.last_answered.asc(), UserQuizProgress.question_id.asc()).all()
+        answered = AnsweredBitmap(index, now)
+        for question_id, last_answered in rows:
+            answered.mark(question_id, last_answered)
+        return answered
+
+    def get_index(self, set_id):
+        """
+        Mô tả: Lấy chỉ mục của bộ, dựng mới nếu chưa có hoặc đã hết hạn.
+        Returns:
+            QuestionSetIndex
+        """
+        now = time.time()
+        with self._lock:
+            index = self._indexes.get(set_id)
+            if index is None or now - index.built_at > self.ttl_seconds:
+                index = self._build_index(set_id, now)
+                self._indexes[set_id] = index
+            return index
+
+    def get_answered(self, user_id, set_id):
+        """
+        Mô tả: Lấy bitmap câu đã trả lời của người dùng trong bộ (dựng lại nếu hết hạn hoặc chỉ mục đã đổi).
+        Returns:
+            AnsweredBitmap
+        """
+        key = (user_id, set_id)
+        now = time.time()
+        with self._lock:
+            index = self.get_index(set_id)
+            answered = self._answered.get(key)
+            if answered is None or answered.index is not index or now - answered.built_at > self.ttl_seconds:
+                answered = self._build_answered(user_id, index, now)
+                self._answered[key] = answered
+            self._answered.move_to_end(key)
+            while len(self._answered) > self.max_answered_entries:
+                self._answered.popitem(last=False)
+            return answered
+
+    def on_answers_committed(self, user_id, answered_items, answered_ts):
+        """
+        Mô tả: Cập nhật các bitmap đang có trong cache sau khi câu trả lời đã được commit.
+               Bitmap chưa có trong cache sẽ được dựng từ database ở lần đọc sau.
+        Args:
+            answered_items (iterable): Các tuple (set_id, question_id) theo thứ tự trả lời.
+            answered_ts (int): Thời điểm trả lời.
+        """
+        with self._lock:
+            for set_id, question_id in answered_items:
+                answered = self._answered.get((user_id, set_id))
+                if answered is not None:
+                    answered.mark(question_id, answered_ts)
+
+    def invalidate(self, set_id=None, user_id=None):
+        """
+        Mô tả: Hủy chỉ mục của bộ (và bitmap phụ thuộc) hoặc các bitmap của người dùng.
+               Gọi không tham số để hủy toàn bộ.
+        """
+        with self._lock:
+            if user_id is None:
+                if set_id is None:
+                    self._indexes.clear()
+                else:
+                    self._indexes.pop(set_id, None)
+            for key in list(self._answered.keys()):
+                key_user_id, key_set_id = key
+                if user_id is not None and key_user_id != user_id:
+                    continue
+                if set_id is not None and key_set_id != set_id:
+                    continue
+                del self._answered[key]
+
+
+quiz_set_index = QuizSetIndexRegistry()
@@ -0,0 +1,267 @@
+# web_app/services/review_queue.py
+import heapq
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from ..models import db, UserFlashcardProgress
+from ..config import REVIEW_QUEUE_TTL_SECONDS, REVIEW_QUEUE_MAX_QUEUES
+
+logger = logging.getLogger(__name__)
+
+ORDER_RANDOM = 'random'
+ORDER_HARDEST = 'hardest'
+
+
+class ReviewQueue:
+    """
+    Mô tả: Hàng đợi ôn tập của một người dùng trong một bộ thẻ (hoặc tất cả các bộ nếu set_id là None).
+           - `_pending`: min-heap (due_time, version, progress_id) của các thẻ chưa đến hạn.
+           - Thẻ đã đến hạn được chuyển sang nhóm "ready":
+             + ORDER_RANDOM: danh sách + chỉ mục để chọn/xóa ngẫu nhiên trong O(1).
+             + ORDER_HARDEST: heap (-incorrect_count, -lapse_count, tiebreak, version, progress_id).
+           Các phần tử cũ trong heap bị loại bỏ lười (lazy) dựa trên `version`.
+    """
+    def __init__(self, user_id, set_id, ordering, built_at):
+        self.user_id = user_id
+        self.set_id = set_id
+        self.ordering = ordering
+        self.built_at = built_at
+        self._entries = {}  # progress_id -> (version, due_time, incorrect_count, lapse_count)
+        self._version = 0
+        self._pending = []
+        self._ready_ids = []
+        self._ready_pos = {}
+        self._ready_heap = []
+
+    def load(self, rows):
+        """
+        Mô tả: Nạp toàn bộ tiến trình ban đầu (một lần cho mỗi phiên) và heapify trong O(n).
+        Args:
+            rows (iterable): Các tuple (progress_id, due_time, incorrect_count, lapse_count).
+        """
+        for progress_id, due_time, incorrect_count, lapse_count in rows:
+            self._version += 1
+            self._entries[progress_id] = (self._version, due_time, incorrect_count or 0, lapse_count or 0)
+            self._pending.append((due_time, self._version, progress_id))
+        heapq.heapify(self._pending)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _is_current(self, progress_id, version):
+        entry = self._entries.get(progress_id)
+        return entry is not None and entry[0] == version
+
+    def _remove_from_ready(self, progress_id):
+        if self.ordering == ORDER_RANDOM:
+            pos = self._ready_pos.pop(progress_id, None)
+            if pos is None:
+                return
+            last_id = self._ready_ids.pop()
+            if pos < len(self._ready_ids):
+                self._ready_ids[pos] = last_id
+                self._ready_pos[last_id] = pos
+        # ORDER_HARDEST: phần tử cũ trong heap sẽ bị bỏ qua nhờ so khớp version.
+
+    def _add_to_ready(self, progress_id, version):
+        if self.ordering == ORDER_RANDOM:
+            if progress_id not in self._ready_pos:
+                self._ready_pos[progress_id] = len(self._ready_ids)
+                self._ready_ids.append(progress_id)
+        else:
+            _, _, incorrect_count, lapse_count = self._entries[progress_id]
+            heapq.heappush(self._ready_heap, (-incorrect_count, -lapse_count, random.random(), version, progress_id))
+
+    def _promote_due(self, current_ts):
+        while self._pending and self._pending[0][0] <= current_ts:
+            _, version, progress_id = heapq.heappop(self._pending)
+            if self._is_current(progress_id, version):
+                self._add_to_ready(progress_id, version)
+
+    def peek(self, current_ts):
+        """
+        Mô tả: Lấy progress_id của thẻ đến hạn tiếp theo mà không xóa khỏi hàng đợi.
+               Thẻ chỉ rời nhóm "ready" khi due_time của nó thay đổi (sau khi người dùng đánh giá).
+        Returns:
+            int | None: progress_id hoặc None nếu không có thẻ nào đến hạn.
+        """
+        self._promote_due(current_ts)
+        if self.ordering == ORDER_RANDOM:
+            return random.choice(self._ready_ids) if self._ready_ids else None
+
+        while self._ready_heap:
+            _, _, _, version, progress_id = self._ready_heap[0]
+            if self._is_current(progress_id, version):
+                return progress_id
+            heapq.heappop(self._ready_heap)
+        return None
+
+    def peek_many(self, current_ts, limit):
+        """
+        Mô tả: Lấy tối đa `limit` progress_id đến hạn theo thứ tự của hàng đợi, không xóa khỏi hàng đợi.
+        Returns:
+            list: Danh sách progress_id (không trùng lặp).
+        """
+        self._promote_due(current_ts)
+        if self.ordering == ORDER_RANDOM:
+            return random.sample(self._ready_ids, min(limit, len(self._ready_ids)))
+
+        current_items = [item for item in self._ready_heap if self._is_current(item[4], item[3])]
+        return [item[4] for item in heapq.nsmallest(limit, current_items)]
+
+    def upsert(self, progress_id, due_time, incorrect_count, lapse_count):
+        """
+        Mô tả: Cập nhật (hoặc thêm) một thẻ sau khi due_time/độ khó thay đổi, chi phí O(log n).
+        """
+        self._remove_from_ready(progress_id)
+        self._version += 1
+        self._entries[progress_id] = (self._version, due_time, incorrect_count or 0, lapse_count or 0)
+        heapq.heappush(self._pending, (due_time, self._version, progress_id))
+
+    def discard(self, progress_id):
+        """
+        Mô tả: Loại bỏ một thẻ khỏi hàng đợi (bị xóa, bị bỏ qua hoặc không còn thuộc bộ này).
+        """
+        self._remove_from_ready(progress_id)
+        self._entries.pop(progress_id, None)
+
+
+class ReviewQueueRegistry:
+    """
+    Mô tả: Quản lý các hàng đợi ôn tập trong bộ nhớ theo khóa (user_id, set_id, ordering).
+           Mỗi hàng đợi được dựng một lần cho mỗi phiên (hết hạn sau REVIEW_QUEUE_TTL_SECONDS)
+           và được cập nhật tăng dần khi tiến trình thay đổi.
+           Mọi thẻ lấy ra đều được đối chiếu lại với database nên dữ liệu cũ (ví dụ do một
+           worker khác ghi) chỉ làm hàng đợi tự sửa, không trả về thẻ sai.
+    """
+    def __init__(self, ttl_seconds=REVIEW_QUEUE_TTL_SECONDS, max_queues=REVIEW_QUEUE_MAX_QUEUES):
+        self.ttl_seconds = ttl_seconds
+        self.max_queues = max_queues
+        self._queues = OrderedDict()
+        self._lock = threading.RLock()
+
+    def _load_rows(self, user_id, set_id):
+        query = db.session.query(
+            UserFlashcardProgress.progress_id,
+            UserFlashcardProgress.due_time,
+            UserFlashcardProgress.incorrect_count,
+            UserFlashcardProgress.lapse_count
+        ).filter(
+            UserFlashcardProgress.user_id == user_id,
+            UserFlashcardProgress.is_skipped == 0,
+            UserFlashcardProgress.due_time.isnot(None)
+        )
+        if set_id:
+            query = query.filter(UserFlashcardProgress.set_id == set_id)
+        return query.all()
+
+    def _get_queue(self, user_id, set_id, ordering):
+        key = (user_id, set_id, ordering)
+        queue = self._queues.get(key)
+        now = time.time()
+        if queue is not None and now - queue.built_at <= self.ttl_seconds:
+            self._queues.move_to_end(key)
+            return queue
+
+        queue = ReviewQueue(user_id, set_id, ordering, now)
+        queue.load(self._load_rows(user_id, set_id))
+        self._queues[key] = queue
+        self._queues.move_to_end(key)
+        while len(self._queues) > self.max_queues:
+            self._queues.popitem(last=False)
+        logger.debug(f"[REVIEW_QUEUE|User:{user_id}|Set:{set_id}|{ordering}] Đã dựng hàng đợi với {len(queue)} thẻ.")
+        return queue
+
+    def next_due_progress(self, user_id, set_id, ordering, current_ts):
+        """
+        Mô tả: Lấy tiến trình của thẻ đến hạn tiếp theo theo thứ tự yêu cầu.
+        Args:
+            user_id (int): ID của người dùng.
+            set_id (int | None): ID bộ thẻ, None nghĩa là tất cả các bộ.
+            ordering (str): ORDER_RANDOM hoặc ORDER_HARDEST.
+            current_ts (int): Unix timestamp hiện tại.
+        Returns:
+            UserFlashcardProgress | None
+        """
+        with self._lock:
+            queue = self._get_queue(user_id, set_id, ordering)
+            while True:
+                progress_id = queue.peek(current_ts)
+                if progress_id is None:
+                    return None
+
+                progress = UserFlashcardProgress.query.get(progress_id)
+                if (progress is None or progress.user_id != user_id
+                        or progress.is_skipped or progress.due_time is None
+                        or (set_id and progress.set_id != set_id)):
+                    queue.discard(progress_id)
+                    continue
+                if progress.due_time > current_ts:
+                    queue.upsert(progress_id, progress.due_time, progress.incorrect_count, progress.lapse_count)
+                    continue
+                return progress
+
+    def next_due_progresses(self, user_id, set_id, ordering, current_ts, limit):
+        """
+        Mô tả: Giống next_due_progress nhưng lấy tối đa `limit` thẻ đến hạn, đối chiếu với database
+               bằng một truy vấn IN duy nhất.
+        Returns:
+            list: Danh sách UserFlashcardProgress theo thứ tự của hàng đợi.
+        """
+        with self._lock:
+            queue = self._get_queue(user_id, set_id, ordering)
+            progress_ids = queue.peek_many(current_ts, limit)
+            if not progress_ids:
+                return []
+
+            progress_map = {
+                p.progress_id: p for p in
+                UserFlashcardProgress.query.filter(UserFlashcardProgress.progress_id.in_(progress_ids)).all()
+            }
+            result = []
+            for progress_id in progress_ids:
+                progress = progress_map.get(progress_id)
+                if (progress is None or progress.user_id != user_id
+                        or progress.is_skipped or progress.due_time is None
+                        or (set_id and progress.set_id != set_id)):
+                    queue.discard(progress_id)
+                    continue
+                if progress.due_time > current_ts:
+                    queue.upsert(progress_id, progress.due_time, progress.incorrect_count, progress.lapse_count)
+                    continue
+                result.append(progress)
+            return result
+
+    def on_progress_changed(self, progress):
+        """
+        Mô tả: Cập nhật tăng dần các hàng đợi đang mở của người dùng sau khi một tiến trình thay đổi.
+        Args:
+            progress (UserFlashcardProgress): Tiến trình vừa được lưu.
+        """
+        with self._lock:
+            for (user_id, queue_set_id, _), queue in self._queues.items():
+                if user_id != progress.user_id or queue_set_id not in (None, progress.set_id):
+                    continue
+                if progress.is_skipped or progress.due_time is None:
+                    queue.discard(progress.progress_id)
+                else:
+                    queue.upsert(progress.progress_id, progress.due_time, progress.incorrect_count, progress.lapse_count)
+
+    def invalidate(self, user_id=None, set_id=None):
+        """
+        Mô tả: Hủy các hàng đợi khớp với user_id và/hoặc set_id để dựng lại ở lần truy cập sau.
+        """
+        with self._lock:
+            for key in list(self._queues.keys()):
+                key_user_id, key_set_id, _ = key
+                if user_id is not None and key_user_id != user_id:
+                    continue
+                if set_id is not None and key_set_id not in (None, set_id):
+                    continue
+                del self._queues[key]
+
+
+review_queue_registry = ReviewQueueRegistry()
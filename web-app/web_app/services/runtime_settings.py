@@ -0,0 +1,103 @@
+# web_app/services/runtime_settings.py
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from ..config import MAINTENANCE_CONFIG_PATH, RUNTIME_SETTINGS_CHECK_INTERVAL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class RuntimeSettingsFile:
+    """
+    Mô tả: Một file cấu hình JSON thay đổi lúc chạy (ví dụ chế độ bảo trì), được giữ trong bộ nhớ.
+           - Mỗi tiến trình chỉ kiểm tra mtime/size của file tối đa một lần mỗi `check_interval` giây
+             và chỉ đọc lại nội dung khi file thay đổi, nên các worker khác thấy thay đổi sau tối đa
+             `check_interval` giây mà không cần đọc file ở mỗi request.
+           - Ghi bằng file tạm + os.replace để tiến trình khác không bao giờ đọc phải file ghi dở.
+    """
+    def __init__(self, path, check_interval=RUNTIME_SETTINGS_CHECK_INTERVAL_SECONDS):
+        self.path = path
+        self.check_interval = check_interval
+        self._data = {}
+        self._signature = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def _file_signature(self):
+        try:
+            stat_result = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat_result.st_mtime_ns, stat_result.st_size
+
+    def _reload_if_changed(self, now):
+        signature = self._file_signature()
+        self._checked_at = now
+        if signature == self._signature:
+            return
+        data = {}
+        if signature is not None:
+            try:
+                with open(self.path, 'r') as f:
+                    data = json.load(f)
+            except (IOError, json.JSONDecodeError) as e:
+                logger.warning(f"[RUNTIME_SETTINGS] Không thể đọc {self.path}: {e}")
+                data = {}
+        self._data = data
+        self._signature = signature
+
+    def get(self):
+        """
+        Mô tả: Lấy nội dung cấu hình hiện tại.
+        Returns:
+            dict: Bản sao nội dung file, {} nếu file không tồn tại hoặc không hợp lệ.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._checked_at is None or now - self._checked_at >= self.check_interval:
+                self._reload_if_changed(now)
+            return dict(self._data)
+
+    def write(self, data):
+        """
+        Mô tả: Ghi cấu hình mới một cách nguyên tử và cập nhật bộ nhớ của tiến trình hiện tại ngay lập tức.
+        """
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            fd, temp_path = tempfile.mkstemp(prefix='.tmp_', suffix='.json', dir=directory)
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(data, f, indent=4)
+                os.replace(temp_path, self.path)
+            except Exception:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+            self._data = dict(data)
+            self._signature = self._file_signature()
+            self._checked_at = time.monotonic()
+
+    def invalidate(self):
+        """
+        Mô tả: Buộc lần đọc tiếp theo kiểm tra lại file.
+        """
+        with self._lock:
+            self._checked_at = None
+            self._signature = None
+
+
+maintenance_settings = RuntimeSettingsFile(MAINTENANCE_CONFIG_PATH)
+
+
+def is_maintenance_active(now=None):
+    """
+    Mô tả: Kiểm tra chế độ bảo trì đang bật và chưa hết hạn.
+    """
+    config = maintenance_settings.get()
+    now = time.time() if now is None else now
+    return bool(config.get('is_active', False)) and now < config.get('end_timestamp', 0)
@@ -0,0 +1,206 @@
+# web_app/services/search_index.py
+import logging
+import re
+import threading
+import unicodedata
+
+from markupsafe import Markup, escape
+from sqlalchemy import or_, table, column, literal_column, text
+
+from ..models import db, VocabularySet, Flashcard, QuestionSet, QuizQuestion
+
+logger = logging.getLogger(__name__)
+
+# unicode61 với remove_diacritics 2 bỏ dấu tiếng Việt (kể cả dấu móc của ư/ơ) khi đánh chỉ mục và khi tìm;
+# riêng 'đ' không phân rã được nên được đổi thành 'd' trước khi ghi vào bảng FTS.
+SEARCH_TOKENIZER = 'unicode61 remove_diacritics 2'
+SEARCH_PREFIX_LENGTHS = '2 3'
+
+_TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+
+def fold_text(value):
+    """
+    Mô tả: Chuẩn hóa chuỗi để so khớp không dấu, không phân biệt hoa thường (cùng quy tắc với bảng FTS).
+    """
+    value = (value or '').replace('đ', 'd').replace('Đ', 'D')
+    decomposed = unicodedata.normalize('NFD', value)
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+def search_tokens(search_text):
+    """
+    Returns:
+        list: Các từ khóa đã chuẩn hóa trong chuỗi tìm kiếm.
+    """
+    return [token for token in _TOKEN_PATTERN.findall(fold_text(search_text)) if token.strip('_')]
+
+
+def build_match_expression(search_text, columns=None):
+    """
+    Mô tả: Tạo biểu thức MATCH của FTS5: mọi từ khóa đều phải xuất hiện (AND), so khớp theo tiền tố.
+           Từ khóa luôn được đặt trong dấu nháy nên ký tự đặc biệt của người dùng không thành cú pháp FTS.
+    Returns:
+        str | None: None nếu chuỗi không có từ khóa nào.
+    """
+    tokens = search_tokens(search_text)
+    if not tokens:
+        return None
+    expression = ' '.join(f'"{token}"*' for token in tokens)
+    if columns:
+        expression = f"{{{' '.join(columns)}}} : ({expression})"
+    return expression
+
+
+def highlight_markup(value, search_text):
+    """
+    Mô tả: Đánh dấu (<mark>) các từ trong `value` khớp tiền tố với từ khóa tìm kiếm, so khớp không dấu.
+           Đánh dấu trên chính chuỗi gốc nên dấu tiếng Việt được giữ nguyên.
+    Returns:
+        Markup: Chuỗi HTML đã escape.
+    """
+    if value is None:
+        return Markup('')
+    tokens = search_tokens(search_text)
+    if not tokens:
+        return escape(value)
+    parts = []
+    position = 0
+    for match in _TOKEN_PATTERN.finditer(value):
+        folded = fold_text(match.group())
+        if any(folded.startswith(token) for token in tokens):
+            parts.append(escape(value[position:match.start()]))
+            parts.append(Markup('<mark>') + escape(match.group()) + Markup('</mark>'))
+            position = match.end()
+    parts.append(escape(value[position:]))
+    return Markup('').join(parts)
+
+
+class FullTextIndex:
+    """
+    Mô tả: Bảng FTS5 đi kèm một bảng nội dung (rowid = khóa chính), được giữ đồng bộ bằng trigger
+           nên mọi cách ghi (ORM, insert/update/delete hàng loạt) đều cập nhật chỉ mục.
+           Kết quả được xếp hạng bằng bm25 với trọng số theo cột.
+           Nếu database chưa có bảng FTS (chưa chạy migration), tìm kiếm quay về `ilike` như trước.
+    """
+    def __init__(self, model, fts_table, columns, weights):
+        self.model = model
+        self.fts_table = fts_table
+        self.columns = tuple(columns)
+        self.weights = tuple(weights)
+        self.source_table = model.__tablename__
+        self.pk_name = model.__mapper__.primary_key[0].name
+        self._fts = table(fts_table, column('rowid'), column('rank'))
+        self._available = {}
+        self._lock = threading.Lock()
+
+    @property
+    def pk_column(self):
+        return getattr(self.model, self.pk_name)
+
+    def _folded_values(self, prefix):
+        return ', '.join(
+            f"replace(replace(COALESCE({prefix}{name}, ''), 'đ', 'd'), 'Đ', 'D')" for name in self.columns
+        )
+
+    def ddl_statements(self):
+        """
+        Returns:
+            list: Các lệnh tạo bảng FTS5, cấu hình xếp hạng và trigger đồng bộ (chạy lại được nhiều lần).
+        """
+        column_list = ', '.join(self.columns)
+        insert_new = (
+            f'INSERT INTO "{self.fts_table}" (rowid, {column_list}) '
+            f'VALUES (new.{self.pk_name}, {self._folded_values("new.")});'
+        )
+        delete_old = f'DELETE FROM "{self.fts_table}" WHERE rowid = old.{self.pk_name};'
+        weights = ', '.join(str(weight) for weight in self.weights)
+        return [
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS "{self.fts_table}" USING fts5('
+            f"{column_list}, tokenize = '{SEARCH_TOKENIZER}', prefix = '{SEARCH_PREFIX_LENGTHS}')",
+            f'INSERT INTO "{self.fts_table}" ("{self.fts_table}", rank) VALUES (\'rank\', \'bm25({weights})\')',
+            f'CREATE TRIGGER IF NOT EXISTS "{self.fts_table}_ai" AFTER INSERT ON "{self.source_table}" '
+            f'BEGIN {insert_new} END',
+            f'CREATE TRIGGER IF NOT EXISTS "{self.fts_table}_ad" AFTER DELETE ON "{self.source_table}" '
+            f'BEGIN {delete_old} END',
+            f'CREATE TRIGGER IF NOT EXISTS "{self.fts_table}_au" AFTER UPDATE OF {column_list} ON "{self.source_table}" '
+            f'BEGIN {delete_old} {insert_new} END',
+        ]
+
+    def install(self, connection):
+        """
+        Mô tả: Tạo bảng FTS và trigger, rồi dựng lại toàn bộ chỉ mục từ bảng nội dung.
+        Returns:
+            int: Số dòng đã đánh chỉ mục.
+        """
+        for statement in self.ddl_statements():
+            connection.exec_driver_sql(statement)
+        connection.exec_driver_sql(f'DELETE FROM "{self.fts_table}"')
+        connection.exec_driver_sql(
+            f'INSERT INTO "{self.fts_table}" (rowid, {", ".join(self.columns)}) '
+            f'SELECT {self.pk_name}, {self._folded_values("")} FROM "{self.source_table}"'
+        )
+        self._available.clear()
+        return connection.exec_driver_sql(f'SELECT COUNT(*) FROM "{self.fts_table}"').scalar()
+
+    def is_available(self):
+        """
+        Mô tả: Kiểm tra (một lần cho mỗi database) bảng FTS đã được tạo hay chưa.
+        """
+        engine_key = str(db.engine.url)
+        with self._lock:
+            available = self._available.get(engine_key)
+            if available is None:
+                available = db.session.execute(
+                    text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                    {'name': self.fts_table}
+                ).first() is not None
+                if not available:
+                    logger.warning(f"[SEARCH_INDEX] Chưa có bảng {self.fts_table}, tìm kiếm dùng ilike. Hãy chạy migrate database.")
+                self._available[engine_key] = available
+            return available
+
+    def filter_query(self, query, search_text, columns=None, order_by_rank=True):
+        """
+        Mô tả: Lọc một truy vấn trên model theo chuỗi tìm kiếm.
+        Args:
+            query (Query): Truy vấn trên model của chỉ mục.
+            search_text (str): Chuỗi người dùng nhập.
+            columns (iterable | None): Giới hạn các cột được tìm (mặc định mọi cột của chỉ mục).
+            order_by_rank (bool): Sắp xếp kết quả theo độ liên quan (bm25) trước các điều kiện order_by sau đó.
+        Returns:
+            Query
+        """
+        columns = tuple(columns) if columns else self.columns
+        match_expression = build_match_expression(search_text, columns if columns != self.columns else None)
+        if match_expression is None or not self.is_available():
+            term = f"%{search_text}%"
+            return query.filter(or_(*[getattr(self.model, name).ilike(term) for name in columns]))
+
+        query = query.join(self._fts, self._fts.c.rowid == self.pk_column).filter(
+            literal_column(f'"{self.fts_table}"').op('MATCH')(match_expression)
+        )
+        if order_by_rank:
+            query = query.order_by(self._fts.c.rank)
+        return query
+
+
+vocabulary_set_search = FullTextIndex(VocabularySet, 'VocabularySetsFts', ('title', 'description'), (10.0, 1.0))
+flashcard_search = FullTextIndex(Flashcard, 'FlashcardsFts', ('front', 'back'), (1.0, 1.0))
+question_set_search = FullTextIndex(QuestionSet, 'QuestionSetsFts', ('title', 'description'), (10.0, 1.0))
+quiz_question_search = FullTextIndex(
+    QuizQuestion, 'QuizQuestionsFts',
+    ('question', 'pre_question_text', 'option_a', 'option_b', 'option_c', 'option_d', 'guidance'),
+    (5.0, 2.0, 1.0, 1.0, 1.0, 1.0, 0.5)
+)
+
+SEARCH_INDEXES = (vocabulary_set_search, flashcard_search, question_set_search, quiz_question_search)
+
+
+def install_search_indexes(connection):
+    """
+    Mô tả: Tạo (hoặc dựng lại) mọi chỉ mục tìm kiếm. Dùng trong migration và khi cài database mới.
+    Returns:
+        dict: Tên bảng FTS -> số dòng đã đánh chỉ mục.
+    """
+    return {index.fts_table: index.install(connection) for index in SEARCH_INDEXES}
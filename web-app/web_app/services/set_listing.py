@@ -0,0 +1,110 @@
+# web_app/services/set_listing.py
+import logging
+
+from sqlalchemy import case, func, select
+
+from ..models import db, VocabularySet, Flashcard, UserFlashcardProgress, QuestionSet, QuizQuestion, UserQuizProgress
+from .search_index import vocabulary_set_search, question_set_search
+
+logger = logging.getLogger(__name__)
+
+
+class StartedSetListing:
+    """
+    Mô tả: Danh sách các bộ người dùng đã bắt đầu học, kèm số mục và số mục đã hoàn thành, được tính
+           và sắp xếp hoàn toàn trong SQL rồi phân trang bằng ORDER BY/LIMIT.
+           Thứ tự giữ như giao diện cũ: bộ rỗng trước, rồi các bộ đang học theo tỉ lệ hoàn thành giảm dần,
+           các bộ 0% và 100% xếp cùng nhóm cuối theo tên.
+    """
+    def __init__(self, set_model, item_model, progress_model, search_index, total_attr, completed_attr, completed_condition=None):
+        self.set_model = set_model
+        self.item_model = item_model
+        self.progress_model = progress_model
+        self.search_index = search_index
+        self.total_attr = total_attr
+        self.completed_attr = completed_attr
+        self.completed_condition = completed_condition
+
+    def build_query(self, user_id, search_text=None):
+        """
+        Mô tả: Truy vấn (bộ, tổng số mục, số mục đã hoàn thành) của các bộ mà người dùng đã có tiến trình.
+        Args:
+            search_text (str | None): Lọc theo chỉ mục tìm kiếm của bộ (không xếp theo độ liên quan).
+        Returns:
+            Query
+        """
+        progress = self.progress_model
+        if self.completed_condition is None:
+            completed_count = func.count()
+        else:
+            completed_count = func.sum(case((self.completed_condition, 1), else_=0))
+        progress_counts = select(
+            progress.set_id.label('set_id'), completed_count.label('completed_items')
+        ).where(progress.user_id == user_id, progress.set_id.isnot(None)).group_by(progress.set_id).subquery()
+
+        started_set_ids = select(progress.set_id).where(progress.user_id == user_id)
+        item_totals = select(
+            self.item_model.set_id.label('set_id'), func.count().label('total_items')
+        ).where(self.item_model.set_id.in_(started_set_ids)).group_by(self.item_model.set_id).subquery()
+
+        total_items = func.coalesce(item_totals.c.total_items, 0)
+        completed_items = progress_counts.c.completed_items
+        empty_first = case((total_items == 0, 0), else_=1)
+        ratio_key = case(
+            (total_items == 0, 0.0),
+            (completed_items == total_items, 0.0),
+            else_=-(completed_items * 1.0 / total_items)
+        )
+
+        query = db.session.query(self.set_model, total_items, completed_items)\
+            .join(progress_counts, progress_counts.c.set_id == self.set_model.set_id)\
+            .outerjoin(item_totals, item_totals.c.set_id == self.set_model.set_id)
+        if search_text:
+            query = self.search_index.filter_query(query, search_text, order_by_rank=False)
+        return query.order_by(empty_first, ratio_key, self.set_model.title, self.set_model.set_id)
+
+    def _attach_counts(self, rows):
+        set_items = []
+        for set_item, total_items, completed_items in rows:
+            setattr(set_item, self.total_attr, total_items)
+            setattr(set_item, self.completed_attr, completed_items or 0)
+            set_items.append(set_item)
+        return set_items
+
+    def paginate(self, user_id, page, per_page, search_text=None):
+        """
+        Mô tả: Lấy một trang bộ đã bắt đầu; mỗi bộ được gắn thuộc tính tổng số mục và số mục đã hoàn thành.
+        Returns:
+            Pagination: Đối tượng phân trang của Flask-SQLAlchemy, `items` là danh sách bộ.
+        """
+        pagination = self.build_query(user_id, search_text).paginate(page=page, per_page=per_page, error_out=False)
+        pagination.items = self._attach_counts(pagination.items)
+        logger.debug(f"[SET_LISTING|{self.set_model.__name__}|User:{user_id}] Trang {page}: {len(pagination.items)}/{pagination.total} bộ.")
+        return pagination
+
+    def all(self, user_id):
+        """
+        Returns:
+            list: Mọi bộ đã bắt đầu theo cùng thứ tự, đã gắn số liệu.
+        """
+        return self._attach_counts(self.build_query(user_id).all())
+
+    def started_set_ids_query(self, user_id):
+        """
+        Returns:
+            Select: Truy vấn con các set_id người dùng đã có tiến trình (dùng để loại khỏi danh sách bộ mới).
+        """
+        return select(self.progress_model.set_id).where(
+            self.progress_model.user_id == user_id, self.progress_model.set_id.isnot(None)
+        ).distinct()
+
+
+flashcard_set_listing = StartedSetListing(
+    VocabularySet, Flashcard, UserFlashcardProgress, vocabulary_set_search,
+    total_attr='total_cards', completed_attr='learned_cards',
+    completed_condition=UserFlashcardProgress.learned_date.isnot(None)
+)
+quiz_set_listing = StartedSetListing(
+    QuestionSet, QuizQuestion, UserQuizProgress, question_set_search,
+    total_attr='total_questions', completed_attr='answered_questions'
+)
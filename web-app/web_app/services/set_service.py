@@ -3,15 +3,27 @@ import logging
 import openpyxl
 import io
 import os
-import zipfile
 import hashlib
+from collections import Counter
+from sqlalchemy import insert, update, delete
 from sqlalchemy.orm import joinedload
-from ..models import db, VocabularySet, User, Flashcard, UserFlashcardProgress
-from ..config import FLASHCARD_IMAGES_DIR, FLASHCARD_AUDIO_CACHE_DIR
+from ..models import db, VocabularySet, User, Flashcard, UserFlashcardProgress, FlashcardNote, Feedback
+from ..config import FLASHCARD_IMAGES_DIR, FLASHCARD_AUDIO_CACHE_DIR, IMPORT_CHUNK_SIZE
+from .set_summary_cache import set_summary_cache
+from .keyset_pagination import category_count_cache
+from .review_queue import review_queue_registry
+from .set_sync import row_content_hash, iter_chunks, new_sync_report, SQL_IN_CHUNK_SIZE
+from .excel_import import ExcelRowReader, cell_text, save_upload, remove_upload, import_jobs
+from .zip_stream import stream_zip
+from .media_registry import media_registry, flashcard_media_refs
 # --- XÓA BỎ IMPORT AI SERVICE VÌ KHÔNG CÒN DÙNG Ở ĐÂY ---
 
 logger = logging.getLogger(__name__)
 
+IMPORT_KIND_FLASHCARD = 'flashcard'
+FLASHCARD_REQUIRED_HEADERS = ('front', 'back')
+FLASHCARD_OPTIONAL_COLUMNS = ('front_audio_content', 'back_audio_content', 'front_img', 'back_img', 'notification_text')
+
 class SetService:
     """
     Mô tả: Lớp chứa các hàm xử lý logic nghiệp vụ liên quan đến bộ thẻ (VocabularySet).
@@ -70,103 +82,185 @@ class SetService:
             logger.error(f"{log_prefix} Lỗi khi truy vấn: {e}", exc_info=True)
             return []
 
-    def get_set_by_id(self, set_id):
+    def get_set_by_id(self, set_id, with_cards=True):
         """
         Mô tả: Lấy một bộ thẻ cụ thể bằng ID.
+        Args:
+            with_cards (bool): Nạp sẵn toàn bộ flashcard của bộ (joinedload). Đặt False khi chỉ cần
+                               thông tin bộ thẻ (kiểm tra quyền, form sửa) để tránh nạp mọi thẻ.
         """
+        if not with_cards:
+            return db.session.get(VocabularySet, set_id)
         return VocabularySet.query.options(joinedload(VocabularySet.flashcards)).get(set_id)
 
+    def _parse_excel_row(self, row, set_id):
+        """
+        Mô tả: Chuyển một hàng Excel (dict tiêu đề -> giá trị) thành dữ liệu flashcard.
+        Returns:
+            tuple: (card_data, warnings) với card_data có thêm khóa 'flashcard_id' (None nếu không có/không hợp lệ).
+        """
+        warnings = []
+        flashcard_id_from_excel = None
+        if row.get('flashcard_id') is not None:
+            try:
+                flashcard_id_from_excel = int(row['flashcard_id'])
+            except (ValueError, TypeError):
+                warnings.append("flashcard_id không hợp lệ.")
+
+        front = cell_text(row, 'front')
+        back = cell_text(row, 'back')
+        if not front:
+            warnings.append("Cột 'front' rỗng.")
+        if not back:
+            warnings.append("Cột 'back' rỗng.")
+
+        card_data = {
+            'flashcard_id': flashcard_id_from_excel,
+            'set_id': set_id,
+            'front': front,
+            'back': back
+        }
+        for col_name in FLASHCARD_OPTIONAL_COLUMNS:
+            if col_name in row:
+                card_data[col_name] = cell_text(row, col_name, None)
+        return card_data, warnings
+
     def _process_excel_file(self, vocabulary_set, file_stream, sync_by_id=False):
         """
-        Mô tả: Xử lý file Excel được tải lên để thêm hoặc đồng bộ hóa flashcard.
+        Mô tả: Thêm hoặc đồng bộ hóa flashcard từ file Excel trong transaction hiện tại (không commit).
+               Khi sync_by_id, nội dung mỗi thẻ hiện có được băm (chỉ trên các cột có trong file) và so với
+               hàng cùng flashcard_id trong file: chỉ thẻ thực sự thay đổi mới được UPDATE (hàng loạt theo khóa chính),
+               thẻ không còn trong file bị xóa cùng dữ liệu phụ thuộc bằng các lệnh DELETE theo tập.
+               Hàng không có flashcard_id hợp lệ của bộ được thêm mới. File được đọc read-only từng hàng.
+               Số tham chiếu media của bộ được cập nhật theo chênh lệch trước/sau khi đồng bộ.
+        Returns:
+            dict: Bộ đếm added, changed, unchanged, removed.
         """
-        log_prefix = f"[SET_SERVICE|ProcessExcel|Set:{vocabulary_set.set_id}]"
-        
-        file_content = file_stream.read()
-        in_memory_file = io.BytesIO(file_content)
-        workbook = openpyxl.load_workbook(in_memory_file)
-        
-        sheet = workbook.active
-        
-        headers = [str(cell.value).strip().lower() if cell.value is not None else "" for cell in sheet[1]]
-        required_headers = ['front', 'back']
-        
-        missing_headers = [h for h in required_headers if h not in headers]
-        if missing_headers:
-            raise ValueError(f"File Excel thiếu các cột bắt buộc: {', '.join(missing_headers)}.")
-        
-        column_map = {header: idx for idx, header in enumerate(headers)}
-        
-        flashcards_from_excel = []
+        set_id = vocabulary_set.set_id
+        log_prefix = f"[SET_SERVICE|ProcessExcel|Set:{set_id}]"
+        report = new_sync_report()
+        existing_hashes = {}
+        seen_ids = set()
+        to_insert = []
+        to_update = []
+        media_before = media_registry.flashcard_set_refs(set_id)
 
-        for row_index, row_cells in enumerate(sheet.iter_rows(min_row=2), start=2):
-            row_values = [cell.value for cell in row_cells]
-            
-            flashcard_id_from_excel = None
-            if 'flashcard_id' in column_map and row_values[column_map['flashcard_id']] is not None:
-                try:
-                    flashcard_id_from_excel = int(row_values[column_map['flashcard_id']])
-                except ValueError:
-                    logger.warning(f"{log_prefix} Hàng {row_index}: flashcard_id không hợp lệ.")
-
-            front = str(row_values[column_map['front']]).strip() if row_values[column_map['front']] is not None else ''
-            back = str(row_values[column_map['back']]).strip() if row_values[column_map['back']] is not None else ''
-
-            if not front:
-                logger.warning(f"{log_prefix} Hàng {row_index}: Cột 'front' rỗng.")
-            if not back:
-                logger.warning(f"{log_prefix} Hàng {row_index}: Cột 'back' rỗng.")
-
-            card_data = {
-                'flashcard_id': flashcard_id_from_excel,
-                'set_id': vocabulary_set.set_id, 
-                'front': front, 
-                'back': back
-            }
-            optional_columns = ['front_audio_content', 'back_audio_content', 'front_img', 'back_img', 'notification_text']
-            for col_name in optional_columns:
-                if col_name in column_map:
-                    col_idx = column_map[col_name]
-                    if col_idx < len(row_values):
-                        value = row_values[col_idx]
-                        card_data[col_name] = str(value).strip() if value is not None else None
-            
-            flashcards_from_excel.append(card_data)
-        
-        if sync_by_id:
-            existing_flashcards_map = {f.flashcard_id: f for f in vocabulary_set.flashcards}
-            excel_flashcard_ids = {f_data['flashcard_id'] for f_data in flashcards_from_excel if f_data['flashcard_id'] is not None}
-
-            for f_data in flashcards_from_excel:
-                f_id = f_data.pop('flashcard_id')
-                if f_id is not None and f_id in existing_flashcards_map:
-                    f_to_update = existing_flashcards_map[f_id]
-                    for key, value in f_data.items():
-                        setattr(f_to_update, key, value)
-                    db.session.add(f_to_update)
-                else:
-                    new_flashcard = Flashcard(**f_data)
-                    db.session.add(new_flashcard)
-            
-            flashcards_to_delete = [f for f_id, f in existing_flashcards_map.items() if f_id not in excel_flashcard_ids]
-            for f in flashcards_to_delete:
-                UserFlashcardProgress.query.filter_by(flashcard_id=f.flashcard_id).delete()
-                db.session.delete(f)
-        else:
-            flashcards_to_add = []
-            for f_data in flashcards_from_excel:
-                f_data.pop('flashcard_id')
-                new_flashcard = Flashcard(**f_data)
-                flashcards_to_add.append(new_flashcard)
-            
-            if flashcards_to_add:
-                db.session.bulk_save_objects(flashcards_to_add)
+        file_path = save_upload(file_stream)
+        try:
+            with ExcelRowReader(file_path, FLASHCARD_REQUIRED_HEADERS) as reader:
+                fields = FLASHCARD_REQUIRED_HEADERS + tuple(c for c in FLASHCARD_OPTIONAL_COLUMNS if c in reader.column_map)
+                if sync_by_id:
+                    existing_rows = db.session.query(
+                        Flashcard.flashcard_id, *[getattr(Flashcard, field) for field in fields]
+                    ).filter(Flashcard.set_id == set_id)
+                    existing_hashes = {row[0]: row_content_hash(row[1:]) for row in existing_rows}
+
+                for row_index, row in reader.iter_rows():
+                    card_data, warnings = self._parse_excel_row(row, set_id)
+                    for warning in warnings:
+                        logger.warning(f"{log_prefix} Hàng {row_index}: {warning}")
+                    flashcard_id = card_data.pop('flashcard_id')
+
+                    if flashcard_id is not None and flashcard_id in existing_hashes:
+                        seen_ids.add(flashcard_id)
+                        if row_content_hash(card_data[field] for field in fields) == existing_hashes[flashcard_id]:
+                            report['unchanged'] += 1
+                            continue
+                        update_row = {field: card_data[field] for field in fields}
+                        update_row['flashcard_id'] = flashcard_id
+                        to_update.append(update_row)
+                        report['changed'] += 1
+                        if len(to_update) >= IMPORT_CHUNK_SIZE:
+                            db.session.execute(update(Flashcard), to_update)
+                            to_update = []
+                    else:
+                        to_insert.append(card_data)
+                        report['added'] += 1
+                        if len(to_insert) >= IMPORT_CHUNK_SIZE:
+                            db.session.execute(insert(Flashcard), to_insert)
+                            to_insert = []
+        finally:
+            remove_upload(file_path)
+
+        if to_update:
+            db.session.execute(update(Flashcard), to_update)
+        if to_insert:
+            db.session.execute(insert(Flashcard), to_insert)
+
+        removed_ids = [flashcard_id for flashcard_id in existing_hashes if flashcard_id not in seen_ids]
+        for id_chunk in iter_chunks(removed_ids, SQL_IN_CHUNK_SIZE):
+            for dependent_model in (UserFlashcardProgress, FlashcardNote, Feedback):
+                db.session.execute(delete(dependent_model).where(dependent_model.flashcard_id.in_(id_chunk)))
+            db.session.execute(delete(Flashcard).where(Flashcard.flashcard_id.in_(id_chunk)))
+        report['removed'] = len(removed_ids)
+
+        if report['added'] or report['changed'] or report['removed']:
+            media_registry.apply_diff(media_before, media_registry.flashcard_set_refs(set_id))
+        logger.info(f"{log_prefix} Kết quả: {report}")
+        return report
+
+    def _import_excel_rows(self, job, file_path):
+        """
+        Mô tả: Tác vụ nền nhập thêm flashcard từ file Excel với bộ nhớ giới hạn:
+               đọc từng hàng ở chế độ read-only, ghi mỗi IMPORT_CHUNK_SIZE hàng bằng một lệnh insert
+               hàng loạt và commit ngay, lỗi được ghi theo từng hàng vào job.
+        Args:
+            job (ImportJob): Tác vụ đang chạy (set_id là bộ đích).
+            file_path (str): File Excel đã lưu tạm, bị xóa khi kết thúc.
+        """
+        log_prefix = f"[SET_SERVICE|ImportExcel|Set:{job.set_id}]"
+        chunk = []
+
+        def _write_chunk():
+            try:
+                db.session.execute(insert(Flashcard), chunk)
+                media_refs = Counter()
+                for card_data in chunk:
+                    media_refs.update(flashcard_media_refs(card_data))
+                media_registry.apply_changes(media_refs)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            job.inserted += len(chunk)
+            chunk.clear()
+            set_summary_cache.invalidate(set_id=job.set_id)
+            category_count_cache.invalidate(set_id=job.set_id)
+            logger.debug(f"{log_prefix} Đã ghi {job.inserted} thẻ.")
+
+        try:
+            with ExcelRowReader(file_path, FLASHCARD_REQUIRED_HEADERS) as reader:
+                for row_index, row in reader.iter_rows():
+                    job.processed_rows += 1
+                    card_data, warnings = self._parse_excel_row(row, job.set_id)
+                    card_data.pop('flashcard_id')
+                    if not card_data['front'] and not card_data['back']:
+                        job.record_error(row_index, "Cả hai cột 'front' và 'back' đều rỗng.")
+                        continue
+                    for warning in warnings:
+                        job.record_error(row_index, warning, skipped=False)
+                    chunk.append(card_data)
+                    if len(chunk) >= IMPORT_CHUNK_SIZE:
+                        _write_chunk()
+            if chunk:
+                _write_chunk()
+        finally:
+            remove_upload(file_path)
+
+    def start_excel_import(self, set_id, user_id, file_path):
+        """
+        Mô tả: Đưa việc nhập file Excel (đã kiểm tra tiêu đề) vào tác vụ nền.
+        Returns:
+            ImportJob
+        """
+        return import_jobs.submit(IMPORT_KIND_FLASHCARD, set_id, user_id, self._import_excel_rows, file_path)
 
     def create_set(self, data, creator_id, file_stream=None):
         """
         Mô tả: Tạo một bộ thẻ mới.
         """
         log_prefix = f"[SET_SERVICE|CreateSet|User:{creator_id}]"
+        file_path = None
         try:
             new_set = VocabularySet(
                 title=data.get('title'),
@@ -178,27 +272,41 @@ class SetService:
             db.session.add(new_set)
 
             if file_stream:
-                db.session.flush()
-                self._process_excel_file(new_set, file_stream, sync_by_id=False)
+                # Chỉ kiểm tra tiêu đề trong request; các hàng được nhập trong tác vụ nền.
+                file_path = save_upload(file_stream)
+                ExcelRowReader(file_path, FLASHCARD_REQUIRED_HEADERS).close()
             
             db.session.commit()
+            if file_path:
+                self.start_excel_import(new_set.set_id, creator_id, file_path)
             return new_set, "success"
         except ValueError as ve:
             db.session.rollback()
+            remove_upload(file_path)
             return None, str(ve)
         except Exception as e:
             db.session.rollback()
+            remove_upload(file_path)
             if "zip" in str(e).lower():
                  return None, "Lỗi đọc file Excel. Vui lòng đảm bảo file có định dạng .xlsx hợp lệ."
             return None, str(e)
 
-    def update_set(self, set_id, data, user_id, file_stream=None):
+    def _apply_set_metadata(self, vocabulary_set, data):
+        """
+        Mô tả: Gán thông tin bộ thẻ (tiêu đề, mô tả, tags, công khai) từ dữ liệu form, chưa commit.
+        """
+        vocabulary_set.title = data.get('title', vocabulary_set.title)
+        vocabulary_set.description = data.get('description', vocabulary_set.description)
+        vocabulary_set.tags = data.get('tags', vocabulary_set.tags)
+        vocabulary_set.is_public = int(data.get('is_public', vocabulary_set.is_public))
+
+    def update_set(self, set_id, data, user_id):
         """
-        Mô tả: Cập nhật thông tin và nội dung của một bộ thẻ, có kiểm tra quyền.
+        Mô tả: Cập nhật thông tin của một bộ thẻ, có kiểm tra quyền.
         """
         log_prefix = f"[SET_SERVICE|UpdateSet|Set:{set_id}|User:{user_id}]"
         
-        set_to_update = self.get_set_by_id(set_id)
+        set_to_update = self.get_set_by_id(set_id, with_cards=False)
         if not set_to_update:
             return None, "set_not_found"
             
@@ -211,21 +319,60 @@ class SetService:
             return None, "permission_denied"
 
         try:
-            set_to_update.title = data.get('title', set_to_update.title)
-            set_to_update.description = data.get('description', set_to_update.description)
-            set_to_update.tags = data.get('tags', set_to_update.tags)
-            set_to_update.is_public = int(data.get('is_public', set_to_update.is_public))
-            
-            if file_stream:
-                self._process_excel_file(set_to_update, file_stream, sync_by_id=True)
-
+            self._apply_set_metadata(set_to_update, data)
             db.session.commit()
             return set_to_update, "success"
+        except Exception as e:
+            db.session.rollback()
+            return None, str(e)
+
+    def sync_set_from_excel(self, set_id, user_id, file_stream, data=None):
+        """
+        Mô tả: Đồng bộ nội dung bộ thẻ với file Excel (theo flashcard_id), có kiểm tra quyền.
+               Đồng bộ lại một file không đổi sẽ không ghi gì vào database.
+        Args:
+            data (dict | None): Thông tin bộ thẻ từ form sửa. Nếu có, được cập nhật trong cùng giao dịch
+                                với việc đồng bộ, nên đồng bộ lỗi thì thông tin bộ thẻ cũng không đổi.
+        Returns:
+            tuple: (report, "success") với report là bộ đếm added/changed/unchanged/removed,
+                   hoặc (None, thông báo lỗi).
+        """
+        log_prefix = f"[SET_SERVICE|SyncExcel|Set:{set_id}|User:{user_id}]"
+
+        set_to_update = self.get_set_by_id(set_id, with_cards=False)
+        if not set_to_update:
+            return None, "set_not_found"
+
+        user = User.query.get(user_id)
+        if not user:
+            return None, "user_not_found"
+
+        if user.user_role != 'admin' and set_to_update.creator_user_id != user.user_id:
+            logger.warning(f"{log_prefix} Từ chối quyền truy cập.")
+            return None, "permission_denied"
+
+        if import_jobs.has_active_job(IMPORT_KIND_FLASHCARD, set_id):
+            return None, "Bộ thẻ đang được nhập dữ liệu trong nền, vui lòng thử lại sau khi hoàn tất."
+
+        try:
+            if data is not None:
+                self._apply_set_metadata(set_to_update, data)
+            report = self._process_excel_file(set_to_update, file_stream, sync_by_id=True)
+            db.session.commit()
+            if report['added'] or report['changed'] or report['removed']:
+                set_summary_cache.invalidate(set_id=set_id)
+                category_count_cache.invalidate(set_id=set_id)
+            if report['removed']:
+                review_queue_registry.invalidate(set_id=set_id)
+            return report, "success"
         except ValueError as ve:
             db.session.rollback()
             return None, str(ve)
         except Exception as e:
             db.session.rollback()
+            logger.error(f"{log_prefix} Lỗi khi đồng bộ: {e}", exc_info=True)
+            if "zip" in str(e).lower():
+                 return None, "Lỗi đọc file Excel. Vui lòng đảm bảo file có định dạng .xlsx hợp lệ."
             return None, str(e)
 
     def delete_set(self, set_id, user_id):
@@ -247,8 +394,11 @@ class SetService:
             return False, "permission_denied"
 
         try:
+            media_registry.release(media_registry.flashcard_set_refs(set_id))
             db.session.delete(set_to_delete)
             db.session.commit()
+            set_summary_cache.invalidate(set_id=set_id)
+            category_count_cache.invalidate(set_id=set_id)
             return True, "success"
         except Exception as e:
             db.session.rollback()
@@ -266,6 +416,8 @@ class SetService:
             )
             db.session.add(new_card)
             db.session.commit()
+            set_summary_cache.invalidate(set_id=set_id)
+            category_count_cache.invalidate(set_id=set_id)
             return new_card, "success"
         except Exception as e:
             db.session.rollback()
@@ -302,9 +454,13 @@ class SetService:
         card = self.get_flashcard_by_id(flashcard_id)
         if not card:
             return False, "not_found"
+        set_id = card.set_id
         try:
+            media_registry.release(flashcard_media_refs(card))
             db.session.delete(card)
             db.session.commit()
+            set_summary_cache.invalidate(set_id=set_id)
+            category_count_cache.invalidate(set_id=set_id)
             return True, "success"
         except Exception as e:
             db.session.rollback()
@@ -349,9 +505,46 @@ class SetService:
             logger.error(f"Lỗi khi xuất bộ thẻ ra Excel: {e}", exc_info=True)
             return None
 
+    def _collect_zip_media_entries(self, set_id):
+        """
+        Mô tả: Liệt kê các file media (ảnh, audio cache) của bộ thẻ cần đưa vào file ZIP.
+               Chỉ truy vấn các cột media theo từng khối, không nạp đối tượng Flashcard.
+        Returns:
+            list: Các tuple (arcname, đường dẫn file), không trùng lặp.
+        """
+        entries = []
+        added_media_files = set()
+        media_rows = db.session.query(
+            Flashcard.front_img, Flashcard.back_img, Flashcard.front_audio_content, Flashcard.back_audio_content
+        ).filter(Flashcard.set_id == set_id).order_by(Flashcard.flashcard_id).yield_per(IMPORT_CHUNK_SIZE)
+
+        for front_img, back_img, front_audio_content, back_audio_content in media_rows:
+            for img_filename in (front_img, back_img):
+                if img_filename and img_filename not in added_media_files:
+                    if not (img_filename.startswith('http://') or img_filename.startswith('https://')):
+                        img_path = os.path.join(FLASHCARD_IMAGES_DIR, img_filename)
+                        if os.path.exists(img_path):
+                            entries.append((os.path.join('images', img_filename), img_path))
+                            added_media_files.add(img_filename)
+
+            for audio_content in (front_audio_content, back_audio_content):
+                if audio_content:
+                    content_hash = hashlib.sha1(audio_content.encode('utf-8')).hexdigest()
+                    cache_filename = f"{content_hash}.mp3"
+                    if cache_filename not in added_media_files:
+                        cache_path = os.path.join(FLASHCARD_AUDIO_CACHE_DIR, cache_filename)
+                        if os.path.exists(cache_path):
+                            entries.append((os.path.join('audio', cache_filename), cache_path))
+                            added_media_files.add(cache_filename)
+        return entries
+
     def export_set_as_zip(self, set_id):
         """
-        Mô tả: Xuất một bộ thẻ đầy đủ vào một file ZIP.
+        Mô tả: Xuất một bộ thẻ đầy đủ vào một file ZIP dạng luồng.
+               Danh sách file được xác định trước (để lỗi được báo trước khi bắt đầu gửi),
+               nội dung file được đọc và gửi đi theo từng khối khi response được duyệt.
+        Returns:
+            generator | None: Các khối bytes của file ZIP, None nếu có lỗi.
         """
         log_prefix = f"[SET_SERVICE|ExportZip|Set:{set_id}]"
         set_to_export = self.get_set_by_id(set_id)
@@ -363,34 +556,10 @@ class SetService:
             if not excel_stream:
                 return None
 
-            zip_stream = io.BytesIO()
-            with zipfile.ZipFile(zip_stream, 'w', zipfile.ZIP_DEFLATED) as zf:
-                zf.writestr('data.xlsx', excel_stream.getvalue())
-                
-                added_media_files = set()
-                for card in set_to_export.flashcards:
-                    for img_attr in ['front_img', 'back_img']:
-                        img_filename = getattr(card, img_attr)
-                        if img_filename and img_filename not in added_media_files:
-                            if not (img_filename.startswith('http://') or img_filename.startswith('https://')):
-                                img_path = os.path.join(FLASHCARD_IMAGES_DIR, img_filename)
-                                if os.path.exists(img_path):
-                                    zf.write(img_path, os.path.join('images', img_filename))
-                                    added_media_files.add(img_filename)
-                    
-                    for audio_attr in ['front_audio_content', 'back_audio_content']:
-                        audio_content = getattr(card, audio_attr)
-                        if audio_content:
-                            content_hash = hashlib.sha1(audio_content.encode('utf-8')).hexdigest()
-                            cache_filename = f"{content_hash}.mp3"
-                            if cache_filename not in added_media_files:
-                                cache_path = os.path.join(FLASHCARD_AUDIO_CACHE_DIR, cache_filename)
-                                if os.path.exists(cache_path):
-                                    zf.write(cache_path, os.path.join('audio', cache_filename))
-                                    added_media_files.add(cache_filename)
-
-            zip_stream.seek(0)
-            return zip_stream
+            entries = [('data.xlsx', excel_stream.getvalue())]
+            entries.extend(self._collect_zip_media_entries(set_id))
+            logger.info(f"{log_prefix} Bắt đầu xuất ZIP với {len(entries) - 1} file media.")
+            return stream_zip(entries)
 
         except Exception as e:
             logger.error(f"{log_prefix} Lỗi khi tạo file ZIP: {e}", exc_info=True)
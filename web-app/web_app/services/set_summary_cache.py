@@ -0,0 +1,198 @@
+# web_app/services/set_summary_cache.py
+import bisect
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from ..models import db, Flashcard, UserFlashcardProgress
+from ..config import SET_SUMMARY_CACHE_TTL_SECONDS, SET_SUMMARY_CACHE_MAX_ENTRIES
+
+logger = logging.getLogger(__name__)
+
+MASTERED_STREAK_THRESHOLD = 5  # Thẻ có correct_streak lớn hơn ngưỡng này được tính là đã thuộc
+
+
+class SetSummary:
+    """
+    Mô tả: Tóm tắt tiến trình của một người dùng trong một bộ thẻ.
+           - `_entries`: progress_id -> (due_time, is_skipped, is_mastered).
+           - `_due_times`: danh sách đã sắp xếp (due_time, progress_id) của các thẻ không bị bỏ qua,
+             dùng bisect để đếm thẻ đến hạn và tìm thời điểm đến hạn kế tiếp.
+           - `_skipped_due_times`: progress_id -> due_time của các thẻ bị bỏ qua (hiếm gặp).
+    """
+    def __init__(self, user_id, set_id, total_cards, built_at):
+        self.user_id = user_id
+        self.set_id = set_id
+        self.total_cards = total_cards
+        self.built_at = built_at
+        self.mastered_cards = 0
+        self._entries = {}
+        self._due_times = []
+        self._skipped_due_times = {}
+
+    def load(self, rows):
+        """
+        Mô tả: Nạp toàn bộ tiến trình của người dùng trong bộ (một lần khi dựng cache).
+        Args:
+            rows (iterable): Các tuple (progress_id, due_time, is_skipped, correct_streak).
+        """
+        for progress_id, due_time, is_skipped, correct_streak in rows:
+            self._add(progress_id, due_time, bool(is_skipped), (correct_streak or 0) > MASTERED_STREAK_THRESHOLD)
+        self._due_times.sort()
+
+    @property
+    def learned_cards(self):
+        return len(self._entries)
+
+    def _add(self, progress_id, due_time, is_skipped, is_mastered, keep_sorted=False):
+        self._entries[progress_id] = (due_time, is_skipped, is_mastered)
+        if is_mastered:
+            self.mastered_cards += 1
+        if due_time is None:
+            return
+        if is_skipped:
+            self._skipped_due_times[progress_id] = due_time
+        elif keep_sorted:
+            bisect.insort(self._due_times, (due_time, progress_id))
+        else:
+            self._due_times.append((due_time, progress_id))
+
+    def _remove(self, progress_id):
+        entry = self._entries.pop(progress_id, None)
+        if entry is None:
+            return
+        due_time, is_skipped, is_mastered = entry
+        if is_mastered:
+            self.mastered_cards -= 1
+        if due_time is None:
+            return
+        if is_skipped:
+            self._skipped_due_times.pop(progress_id, None)
+            return
+        index = bisect.bisect_left(self._due_times, (due_time, progress_id))
+        if index < len(self._due_times) and self._due_times[index] == (due_time, progress_id):
+            del self._due_times[index]
+
+    def upsert(self, progress_id, due_time, is_skipped, correct_streak):
+        """
+        Mô tả: Cập nhật (hoặc thêm) một tiến trình sau khi được lưu, chi phí O(log n) tìm kiếm.
+        """
+        self._remove(progress_id)
+        self._add(progress_id, due_time, bool(is_skipped), (correct_streak or 0) > MASTERED_STREAK_THRESHOLD, keep_sorted=True)
+
+    def due_count(self, current_ts):
+        """
+        Mô tả: Số thẻ có due_time <= current_ts (tính cả thẻ bị bỏ qua, giống thống kê trước đây).
+        """
+        count = bisect.bisect_right(self._due_times, (current_ts, float('inf')))
+        return count + sum(1 for due_time in self._skipped_due_times.values() if due_time <= current_ts)
+
+    def next_due_after(self, current_ts):
+        """
+        Mô tả: Thời điểm đến hạn sớm nhất sau current_ts của các thẻ không bị bỏ qua.
+        Returns:
+            int | None
+        """
+        index = bisect.bisect_right(self._due_times, (current_ts, float('inf')))
+        return self._due_times[index][0] if index < len(self._due_times) else None
+
+
+class SetSummaryCache:
+    """
+    Mô tả: Cache trong bộ nhớ các SetSummary theo khóa (user_id, set_id).
+           Được dựng khi cần (một truy vấn trên bảng tiến trình, một COUNT trên Flashcards),
+           cập nhật tăng dần khi tiến trình thay đổi và bị hủy khi nội dung bộ thẻ thay đổi.
+    """
+    def __init__(self, ttl_seconds=SET_SUMMARY_CACHE_TTL_SECONDS, max_entries=SET_SUMMARY_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._summaries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def _build(self, user_id, set_id, now):
+        total_cards = db.session.query(db.func.count(Flashcard.flashcard_id)).filter(Flashcard.set_id == set_id).scalar() or 0
+        rows = db.session.query(
+            UserFlashcardProgress.progress_id,
+            UserFlashcardProgress.due_time,
+            UserFlashcardProgress.is_skipped,
+            UserFlashcardProgress.correct_streak
+        ).filter(
+            UserFlashcardProgress.user_id == user_id,
+            UserFlashcardProgress.set_id == set_id
+        ).all()
+        summary = SetSummary(user_id, set_id, total_cards, now)
+        summary.load(rows)
+        logger.debug(f"[SET_SUMMARY|User:{user_id}|Set:{set_id}] Đã dựng tóm tắt: {total_cards} thẻ, {summary.learned_cards} tiến trình.")
+        return summary
+
+    def get(self, user_id, set_id):
+        """
+        Mô tả: Lấy tóm tắt của người dùng trong bộ, dựng mới nếu chưa có hoặc đã hết hạn.
+        Returns:
+            SetSummary
+        """
+        key = (user_id, set_id)
+        now = time.time()
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is not None and now - summary.built_at <= self.ttl_seconds:
+                self._summaries.move_to_end(key)
+                return summary
+
+            summary = self._build(user_id, set_id, now)
+            self._summaries[key] = summary
+            self._summaries.move_to_end(key)
+            while len(self._summaries) > self.max_entries:
+                self._summaries.popitem(last=False)
+            return summary
+
+    def get_counts(self, user_id, set_id, current_ts):
+        """
+        Mô tả: Các số liệu hiển thị trên trang học.
+        Returns:
+            dict: total_cards, learned_cards, due_cards, mastered_cards.
+        """
+        with self._lock:
+            summary = self.get(user_id, set_id)
+            return {
+                'total_cards': summary.total_cards,
+                'learned_cards': summary.learned_cards,
+                'due_cards': summary.due_count(current_ts),
+                'mastered_cards': summary.mastered_cards
+            }
+
+    def get_next_due_time(self, user_id, set_id, current_ts):
+        """
+        Mô tả: Thời điểm đến hạn sớm nhất sau current_ts trong bộ (thẻ không bị bỏ qua), None nếu không có.
+        """
+        with self._lock:
+            return self.get(user_id, set_id).next_due_after(current_ts)
+
+    def on_progress_changed(self, progress):
+        """
+        Mô tả: Cập nhật tóm tắt đang có trong cache sau khi một tiến trình được lưu.
+               Nếu chưa có tóm tắt cho (user, set) thì không làm gì, lần đọc sau sẽ dựng từ database.
+        Args:
+            progress (UserFlashcardProgress): Tiến trình vừa được lưu.
+        """
+        with self._lock:
+            summary = self._summaries.get((progress.user_id, progress.set_id))
+            if summary is not None:
+                summary.upsert(progress.progress_id, progress.due_time, progress.is_skipped, progress.correct_streak)
+
+    def invalidate(self, user_id=None, set_id=None):
+        """
+        Mô tả: Hủy các tóm tắt khớp với user_id và/hoặc set_id (ví dụ khi nội dung bộ thẻ thay đổi).
+        """
+        with self._lock:
+            for key in list(self._summaries.keys()):
+                key_user_id, key_set_id = key
+                if user_id is not None and key_user_id != user_id:
+                    continue
+                if set_id is not None and key_set_id != set_id:
+                    continue
+                del self._summaries[key]
+
+
+set_summary_cache = SetSummaryCache()
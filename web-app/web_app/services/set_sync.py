@@ -0,0 +1,35 @@
+# web_app/services/set_sync.py
+import hashlib
+import json
+
+# Số id tối đa trong một mệnh đề IN (giới hạn tham số của SQLite là 32766)
+SQL_IN_CHUNK_SIZE = 10000
+
+
+def row_content_hash(values):
+    """
+    Mô tả: Băm nội dung của một dòng (theo đúng thứ tự cột) để so sánh dòng trong file với dòng trong database
+           mà không cần giữ toàn bộ nội dung trong bộ nhớ.
+    Args:
+        values (iterable): Giá trị các cột đã chuẩn hóa (chuỗi hoặc None).
+    Returns:
+        bytes: Digest 16 byte.
+    """
+    payload = json.dumps(list(values), ensure_ascii=False, separators=(',', ':'), default=str)
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).digest()
+
+
+def iter_chunks(items, size):
+    """
+    Mô tả: Chia danh sách thành các phần liên tiếp có tối đa `size` phần tử.
+    """
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def new_sync_report():
+    """
+    Returns:
+        dict: Bộ đếm kết quả đồng bộ: added, changed, unchanged, removed.
+    """
+    return {'added': 0, 'changed': 0, 'unchanged': 0, 'removed': 0}
@@ -1,11 +1,22 @@
 # web_app/services/stats_service.py
 import logging
 from datetime import datetime, timedelta, timezone
-from collections import defaultdict
 
-from ..models import db, User, VocabularySet, Flashcard, UserFlashcardProgress, ScoreLog, QuizQuestion, UserQuizProgress, QuestionSet
+from ..models import db, User, VocabularySet, Flashcard, UserFlashcardProgress, ScoreLog, QuizQuestion, UserQuizProgress, QuestionSet, DailyActivityRollup
 from ..config import DEFAULT_TIMEZONE_OFFSET, LEARNING_MODE_DISPLAY_NAMES, DAILY_HISTORY_MAX_DAYS
-from sqlalchemy import func, case, and_, or_
+from .set_summary_cache import set_summary_cache
+from .activity_rollup import SOURCE_FLASHCARD, SOURCE_QUIZ
+from .leaderboard import leaderboard_engine, PERIODS as LEADERBOARD_PERIODS, PERIOD_ALL_TIME, PERIOD_DAY
+from .last_seen_buffer import last_seen_buffer
+
+# Tiêu chí sắp xếp của bảng xếp hạng -> chỉ số trong LeaderboardTotals
+LEADERBOARD_SORT_METRICS = {
+    'total_score': 'score',
+    'total_reviews': 'review_count',
+    'learned_cards': 'learned_card_count',
+    'new_cards': 'new_card_count',
+    'total_quiz_answers': 'quiz_answer_count'
+}
 
 logger = logging.getLogger(__name__)
 
@@ -70,6 +81,8 @@ class StatsService:
             total_reviews = UserFlashcardProgress.query.count()
 
             # --- BẮT ĐẦU THAY ĐỔI: Tính toán hoạt động trong ngày dựa trên last_seen ---
+            # Ghi các last_seen còn trong bộ đệm để số người hoạt động hôm nay không bị thiếu.
+            last_seen_buffer.flush()
             active_users_today_query = User.query.filter(User.last_seen >= today_midnight_ts)
             active_users_today_count = active_users_today_query.count()
             active_users_today_list = active_users_today_query.all()
@@ -99,20 +112,22 @@ class StatsService:
             logger.error(f"{log_prefix} Lỗi khi lấy dữ liệu admin: {e}", exc_info=True)
             return None
 
-    def get_dashboard_stats(self, user_id):
+    def get_dashboard_stats(self, user_id, user=None):
         """
         Mô tả: Lấy các số liệu thống kê chi tiết cho bảng điều khiển của người dùng.
                Bao gồm thống kê flashcard, thống kê quiz, lịch sử hoạt động,
                và chi tiết theo bộ thẻ.
         Args:
             user_id (int): ID của người dùng.
+            user (User, optional): Đối tượng người dùng đã nạp sẵn trong request, tránh truy vấn lại.
         Returns:
             dict: Một dictionary chứa tất cả các số liệu thống kê cần thiết cho dashboard.
         """
         log_prefix = f"[DASHBOARD_STATS|User:{user_id}]"
         logger.info(f"{log_prefix} Bắt đầu tổng hợp dữ liệu thống kê.")
         
-        user = User.query.get(user_id)
+        if user is None:
+            user = User.query.get(user_id)
         if not user:
             logger.warning(f"{log_prefix} Không tìm thấy người dùng.")
             return None
@@ -140,56 +155,35 @@ class StatsService:
         tz = timezone(timedelta(hours=tz_offset))
         today = datetime.now(tz).date()
         
-        one_year_ago_date = today - timedelta(days=365)
-        one_year_ago_ts = int(datetime.combine(one_year_ago_date, datetime.min.time(), tzinfo=tz).timestamp())
-        
-        reviews_last_year = db.session.query(UserFlashcardProgress.last_reviewed, UserFlashcardProgress.flashcard_id)\
-            .filter(UserFlashcardProgress.user_id == user_id, UserFlashcardProgress.last_reviewed >= one_year_ago_ts)\
+        # Heatmap và biểu đồ đọc từ bảng DailyActivityRollups (một dòng cho mỗi ngày/nguồn),
+        # chi phí không tăng theo lịch sử học.
+        heatmap_rollups = db.session.query(DailyActivityRollup.activity_date, DailyActivityRollup.review_count)\
+            .filter(DailyActivityRollup.user_id == user_id,
+                    DailyActivityRollup.source_type == SOURCE_FLASHCARD,
+                    DailyActivityRollup.activity_date >= (today - timedelta(days=365)).isoformat(),
+                    DailyActivityRollup.review_count > 0)\
             .all()
-        
-        heatmap_activity = defaultdict(int)
-        for review_ts, _ in reviews_last_year:
-            review_date_str = datetime.fromtimestamp(review_ts, tz).strftime('%Y-%m-%d')
-            heatmap_activity[review_date_str] += 1
-        stats['heatmap_data'] = dict(heatmap_activity)
+        stats['heatmap_data'] = {activity_date: review_count for activity_date, review_count in heatmap_rollups}
 
-        thirty_days_ago_ts = int((datetime.now(tz) - timedelta(days=30)).timestamp())
-        
-        review_actions_by_day = defaultdict(int)
-        reviewed_cards_by_day = defaultdict(set)
-        for review_ts, card_id in reviews_last_year:
-            if review_ts >= thirty_days_ago_ts:
-                review_date_str = datetime.fromtimestamp(review_ts, tz).strftime('%d/%m')
-                review_actions_by_day[review_date_str] += 1
-                reviewed_cards_by_day[review_date_str].add(card_id)
-
-        new_cards_last_30_days = db.session.query(UserFlashcardProgress.learned_date)\
-            .filter(UserFlashcardProgress.user_id == user_id, UserFlashcardProgress.learned_date >= thirty_days_ago_ts)\
-            .all()
-        new_card_activity_by_day = defaultdict(int)
-        for new_card in new_cards_last_30_days:
-            if new_card.learned_date:
-                learned_date = datetime.fromtimestamp(new_card.learned_date, tz).strftime('%d/%m')
-                new_card_activity_by_day[learned_date] += 1
-        
-        score_logs_last_30_days = db.session.query(ScoreLog.timestamp, ScoreLog.score_change, ScoreLog.source_type)\
-            .filter(ScoreLog.user_id == user_id, ScoreLog.timestamp >= thirty_days_ago_ts)\
+        chart_days = [today - timedelta(days=i) for i in range(29, -1, -1)]
+        chart_labels = [day.strftime('%d/%m') for day in chart_days]
+        rollups_last_30_days = DailyActivityRollup.query\
+            .filter(DailyActivityRollup.user_id == user_id,
+                    DailyActivityRollup.activity_date >= chart_days[0].isoformat())\
             .all()
-        
-        flashcard_score_gained_by_day = defaultdict(int)
-        quiz_score_gained_by_day = defaultdict(int)
-        for log in score_logs_last_30_days:
-            log_date = datetime.fromtimestamp(log.timestamp, tz).strftime('%d/%m')
-            if log.source_type == 'flashcard':
-                flashcard_score_gained_by_day[log_date] += log.score_change
-            elif log.source_type == 'quiz':
-                quiz_score_gained_by_day[log_date] += log.score_change
-
-        chart_labels = [(today - timedelta(days=i)).strftime('%d/%m') for i in range(29, -1, -1)]
-        review_actions_data = [review_actions_by_day.get(label, 0) for label in chart_labels]
-        distinct_cards_data = [len(reviewed_cards_by_day.get(label, set())) for label in chart_labels]
-        new_cards_chart_data = [new_card_activity_by_day.get(label, 0) for label in chart_labels]
-        flashcard_score_chart_data = [flashcard_score_gained_by_day.get(label, 0) for label in chart_labels]
+        rollups_by_day = {(rollup.activity_date, rollup.source_type): rollup for rollup in rollups_last_30_days}
+
+        def _series(source_type, counter):
+            series = []
+            for day in chart_days:
+                rollup = rollups_by_day.get((day.isoformat(), source_type))
+                series.append(getattr(rollup, counter) if rollup else 0)
+            return series
+
+        review_actions_data = _series(SOURCE_FLASHCARD, 'review_count')
+        distinct_cards_data = _series(SOURCE_FLASHCARD, 'distinct_item_count')
+        new_cards_chart_data = _series(SOURCE_FLASHCARD, 'new_item_count')
+        flashcard_score_chart_data = _series(SOURCE_FLASHCARD, 'score_gained')
 
         stats['activity_chart_data'] = {
             'labels': chart_labels,
@@ -201,8 +195,9 @@ class StatsService:
             ]
         }
 
-        learned_sets = VocabularySet.query.join(Flashcard).join(UserFlashcardProgress)\
-            .filter(UserFlashcardProgress.user_id == user_id).distinct().all()
+        learned_set_ids = db.session.query(UserFlashcardProgress.set_id)\
+            .filter(UserFlashcardProgress.user_id == user_id).distinct()
+        learned_sets = VocabularySet.query.filter(VocabularySet.set_id.in_(learned_set_ids)).all()
         
         stats['learned_sets_count'] = len(learned_sets)
 
@@ -213,8 +208,8 @@ class StatsService:
             set_id = s.set_id
             total_cards = Flashcard.query.filter_by(set_id=set_id).count()
             
-            progress_in_set = UserFlashcardProgress.query.join(Flashcard)\
-                .filter(Flashcard.set_id == set_id, UserFlashcardProgress.user_id == user_id)
+            progress_in_set = UserFlashcardProgress.query\
+                .filter(UserFlashcardProgress.user_id == user_id, UserFlashcardProgress.set_id == set_id)
             
             learned_cards = progress_in_set.count()
             unseen_cards = total_cards - learned_cards
@@ -244,42 +239,30 @@ class StatsService:
         
         stats['questions_answered_count'] = UserQuizProgress.query.filter_by(user_id=user_id).count()
 
-        stats['quiz_sets_started_count'] = db.session.query(QuizQuestion.set_id)\
-            .join(UserQuizProgress)\
+        stats['quiz_sets_started_count'] = db.session.query(UserQuizProgress.set_id)\
             .filter(UserQuizProgress.user_id == user_id)\
             .distinct()\
             .count()
         
-        quiz_questions_answered_by_day = defaultdict(int)
-        quiz_distinct_questions_answered_by_day = defaultdict(set)
-        
-        quiz_progresses_last_30_days = db.session.query(UserQuizProgress.last_answered, UserQuizProgress.question_id)\
-            .filter(UserQuizProgress.user_id == user_id, UserQuizProgress.last_answered >= thirty_days_ago_ts)\
-            .all()
-
-        for answered_ts, question_id in quiz_progresses_last_30_days:
-            answered_date_str = datetime.fromtimestamp(answered_ts, tz).strftime('%d/%m')
-            quiz_questions_answered_by_day[answered_date_str] += 1
-            quiz_distinct_questions_answered_by_day[answered_date_str].add(question_id)
-
         stats['quiz_activity_chart_data'] = {
             'labels': chart_labels,
             'datasets': [
-                {'label': 'Số lần trả lời (Quiz)', 'data': [quiz_questions_answered_by_day.get(label, 0) for label in chart_labels]},
-                {'label': 'Số câu hỏi khác nhau (Quiz)', 'data': [len(quiz_distinct_questions_answered_by_day.get(label, set())) for label in chart_labels]},
-                {'label': 'Điểm đạt được (Quiz)', 'data': [quiz_score_gained_by_day.get(label, 0) for label in chart_labels]}
+                {'label': 'Số lần trả lời (Quiz)', 'data': _series(SOURCE_QUIZ, 'review_count')},
+                {'label': 'Số câu hỏi khác nhau (Quiz)', 'data': _series(SOURCE_QUIZ, 'distinct_item_count')},
+                {'label': 'Điểm đạt được (Quiz)', 'data': _series(SOURCE_QUIZ, 'score_gained')}
             ]
         }
 
-        started_quiz_sets = QuestionSet.query.join(QuizQuestion).join(UserQuizProgress)\
-            .filter(UserQuizProgress.user_id == user_id).distinct().all()
+        started_quiz_set_ids = db.session.query(UserQuizProgress.set_id)\
+            .filter(UserQuizProgress.user_id == user_id).distinct()
+        started_quiz_sets = QuestionSet.query.filter(QuestionSet.set_id.in_(started_quiz_set_ids)).all()
 
         for q_set in started_quiz_sets:
             set_id = q_set.set_id
             total_questions = QuizQuestion.query.filter_by(set_id=set_id).count()
             
-            progress_in_quiz_set = UserQuizProgress.query.join(QuizQuestion)\
-                .filter(QuizQuestion.set_id == set_id, UserQuizProgress.user_id == user_id)
+            progress_in_quiz_set = UserQuizProgress.query\
+                .filter(UserQuizProgress.user_id == user_id, UserQuizProgress.set_id == set_id)
             
             answered_questions = progress_in_quiz_set.count()
             correct_answers = progress_in_quiz_set.filter(UserQuizProgress.times_correct > 0).count()
@@ -301,13 +284,14 @@ class StatsService:
         logger.info(f"{log_prefix} Tổng hợp dữ liệu thành công.")
         return stats
 
-    def get_user_stats_for_context(self, user_id, set_id=None):
+    def get_user_stats_for_context(self, user_id, set_id=None, user=None):
         """
         Mô tả: Lấy các số liệu thống kê cơ bản của người dùng để hiển thị trong panel ngữ cảnh
                trên trang học thẻ.
         Args:
             user_id (int): ID của người dùng.
             set_id (int, optional): ID của bộ thẻ hiện tại. Mặc định là None.
+            user (User, optional): Đối tượng người dùng đã nạp sẵn trong request, tránh truy vấn lại.
         Returns:
             dict: Một dictionary chứa các số liệu thống kê tóm tắt.
         """
@@ -317,7 +301,8 @@ class StatsService:
             'set_learned_cards': 0, 'set_due_cards': 0, 'current_mode_display': 'N/A',
             'set_mastered_cards': 0
         }
-        user = User.query.get(user_id)
+        if user is None:
+            user = User.query.get(user_id)
         if not user:
             logger.warning(f"[GET_CONTEXT_STATS] User {user_id} not found.")
             return stats
@@ -328,25 +313,37 @@ class StatsService:
         overall_progress = UserFlashcardProgress.query.filter_by(user_id=user_id)
         stats['learned_distinct_overall'] = overall_progress.filter(UserFlashcardProgress.learned_date.isnot(None)).distinct(UserFlashcardProgress.flashcard_id).count()
         stats['due_overall'] = overall_progress.filter(UserFlashcardProgress.due_time.isnot(None), UserFlashcardProgress.due_time <= current_ts).count()
-        stats['learned_sets_count'] = db.session.query(Flashcard.set_id).join(UserFlashcardProgress).filter(UserFlashcardProgress.user_id == user_id).distinct().count()
+        stats['learned_sets_count'] = db.session.query(UserFlashcardProgress.set_id).filter(UserFlashcardProgress.user_id == user_id).distinct().count()
 
         if set_id:
             current_set = VocabularySet.query.get(set_id)
             if current_set:
                 stats['set_title'] = current_set.title
-                stats['set_total_cards'] = db.session.query(Flashcard).filter(Flashcard.set_id == set_id).count()
-                
-                progress_in_set_query = UserFlashcardProgress.query.filter_by(user_id=user_id).join(Flashcard).filter(Flashcard.set_id == set_id)
-                
-                stats['set_learned_cards'] = progress_in_set_query.count() 
-                stats['set_due_cards'] = progress_in_set_query.filter(UserFlashcardProgress.due_time.isnot(None), UserFlashcardProgress.due_time <= current_ts).count()
-                stats['set_mastered_cards'] = progress_in_set_query.filter(UserFlashcardProgress.correct_streak > 5).count()
+                # Các số liệu của bộ lấy từ cache tóm tắt, được cập nhật khi tiến trình thay đổi.
+                set_counts = set_summary_cache.get_counts(user_id, set_id, current_ts)
+                stats['set_total_cards'] = set_counts['total_cards']
+                stats['set_learned_cards'] = set_counts['learned_cards']
+                stats['set_due_cards'] = set_counts['due_cards']
+                stats['set_mastered_cards'] = set_counts['mastered_cards']
         
         return stats
 
+    def _resolve_leaderboard_metric(self, sort_by, timeframe):
+        """
+        Mô tả: Chuyển tiêu chí sắp xếp và khung thời gian thành (period, metric) của bảng xếp hạng.
+               'new_cards' luôn tính trong ngày hôm nay, giống cách hiển thị trước đây.
+        """
+        period = timeframe if timeframe in LEADERBOARD_PERIODS else PERIOD_ALL_TIME
+        metric = LEADERBOARD_SORT_METRICS.get(sort_by, 'score')
+        if sort_by == 'new_cards':
+            period = PERIOD_DAY
+        return period, metric
+
     def get_user_leaderboard_data(self, sort_by='total_score', timeframe='all_time', limit=10):
         """
         Mô tả: Lấy dữ liệu bảng xếp hạng người dùng dựa trên tiêu chí sắp xếp và khung thời gian.
+               Dữ liệu lấy từ chỉ mục xếp hạng của leaderboard_engine (tổng cộng dồn theo kỳ),
+               chi phí không phụ thuộc kích thước ScoreLog và các bảng tiến trình.
         Args:
             sort_by (str): Tiêu chí sắp xếp ('total_score', 'total_reviews', 'learned_cards', 'new_cards', 'total_quiz_answers').
             timeframe (str): Khung thời gian ('day', 'week', 'month', 'all_time').
@@ -357,100 +354,46 @@ class StatsService:
         log_prefix = f"[LEADERBOARD_STATS|Sort:{sort_by}|Time:{timeframe}]"
         logger.info(f"{log_prefix} Bắt đầu lấy dữ liệu bảng xếp hạng.")
 
-        current_ts = self._get_current_unix_timestamp(DEFAULT_TIMEZONE_OFFSET)
-        start_ts = None
-
-        tz = timezone(timedelta(hours=DEFAULT_TIMEZONE_OFFSET))
-
-        if timeframe == 'day':
-            start_ts = self._get_midnight_timestamp(current_ts, DEFAULT_TIMEZONE_OFFSET)
-            logger.debug(f"{log_prefix} Timeframe 'day', start_ts: {datetime.fromtimestamp(start_ts, tz)}")
-        elif timeframe == 'week':
-            dt_now_in_tz = datetime.fromtimestamp(current_ts, tz)
-            start_of_week = dt_now_in_tz.date() - timedelta(days=dt_now_in_tz.weekday())
-            start_ts = int(datetime.combine(start_of_week, datetime.min.time(), tzinfo=tz).timestamp())
-            logger.debug(f"{log_prefix} Timeframe 'week', start_ts: {datetime.fromtimestamp(start_ts, tz)}")
-        elif timeframe == 'month':
-            start_of_month = datetime.fromtimestamp(current_ts, tz).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-            start_ts = int(start_of_month.timestamp())
-            logger.debug(f"{log_prefix} Timeframe 'month', start_ts: {datetime.fromtimestamp(start_ts, tz)}")
-
-        score_query = db.session.query(
-            User.user_id,
-            User.username,
-            User.score.label('total_score_overall'),
-            func.sum(case((and_(ScoreLog.source_type == 'flashcard', ScoreLog.timestamp >= start_ts if start_ts else True), ScoreLog.score_change), else_=0)).label('flashcard_score_period'),
-            func.sum(case((and_(ScoreLog.source_type == 'quiz', ScoreLog.timestamp >= start_ts if start_ts else True), ScoreLog.score_change), else_=0)).label('quiz_score_period')
-        ).outerjoin(ScoreLog, and_(User.user_id == ScoreLog.user_id, ScoreLog.timestamp >= start_ts if start_ts else True))
-        
-        score_query = score_query.group_by(User.user_id, User.username, User.score)
-        score_results = score_query.all()
-
-        logger.debug(f"{log_prefix} Raw Score Results: {score_results}")
-
-        flashcard_stats_query = db.session.query(
-            UserFlashcardProgress.user_id,
-            func.count(UserFlashcardProgress.progress_id).label('total_reviews'),
-            func.count(case((UserFlashcardProgress.learned_date.isnot(None), 1))).label('learned_cards'),
-            func.count(case((UserFlashcardProgress.learned_date == self._get_midnight_timestamp(current_ts, DEFAULT_TIMEZONE_OFFSET), 1), else_=None)).label('new_cards_today')
-        )
-        if start_ts:
-            flashcard_stats_query = flashcard_stats_query.filter(UserFlashcardProgress.last_reviewed >= start_ts)
-        
-        flashcard_stats_query = flashcard_stats_query.group_by(UserFlashcardProgress.user_id)
-        flashcard_stats_map = {row.user_id: row for row in flashcard_stats_query.all()}
-
-        logger.debug(f"{log_prefix} Raw Flashcard Stats Map: {flashcard_stats_map}")
-
-        quiz_stats_query = db.session.query(
-            UserQuizProgress.user_id,
-            func.count(UserQuizProgress.progress_id).label('total_quiz_answers')
-        )
-        if start_ts:
-            quiz_stats_query = quiz_stats_query.filter(UserQuizProgress.last_answered >= start_ts)
-        
-        quiz_stats_query = quiz_stats_query.group_by(UserQuizProgress.user_id)
-        quiz_stats_map = {row.user_id: row for row in quiz_stats_query.all()}
-
-        logger.debug(f"{log_prefix} Raw Quiz Stats Map: {quiz_stats_map}")
+        sort_period, sort_metric = self._resolve_leaderboard_metric(sort_by, timeframe)
+        top_entries = leaderboard_engine.top(sort_period, sort_metric, limit)
+        user_ids = [user_id for user_id, _ in top_entries]
+        if not user_ids:
+            return []
+
+        period, _ = self._resolve_leaderboard_metric('total_score', timeframe)
+        period_values = leaderboard_engine.get_values(user_ids, period)
+        today_values = leaderboard_engine.get_values(user_ids, PERIOD_DAY)
+        users = {
+            user_id: (username, score) for user_id, username, score in
+            db.session.query(User.user_id, User.username, User.score).filter(User.user_id.in_(user_ids)).all()
+        }
 
         leaderboard_data = []
-        for user_id, username, total_score_overall, flashcard_score_period, quiz_score_period in score_results:
-            flashcard_stats = flashcard_stats_map.get(user_id)
-            quiz_stats = quiz_stats_map.get(user_id)
-
-            total_reviews = flashcard_stats.total_reviews if flashcard_stats else 0
-            learned_cards = flashcard_stats.learned_cards if flashcard_stats else 0
-            new_cards_today = flashcard_stats.new_cards_today if flashcard_stats else 0
-            total_quiz_answers = quiz_stats.total_quiz_answers if quiz_stats else 0
-
-            current_period_score = (flashcard_score_period if flashcard_score_period else 0) + (quiz_score_period if quiz_score_period else 0)
-
+        for user_id in user_ids:
+            if user_id not in users:
+                continue
+            username, total_score_overall = users[user_id]
+            values = period_values[user_id]
             leaderboard_data.append({
                 'user_id': user_id,
                 'username': username,
                 'total_score_overall': total_score_overall,
-                'current_period_score': current_period_score,
-                'total_reviews': total_reviews,
-                'learned_cards': learned_cards,
-                'new_cards_today': new_cards_today,
-                'total_quiz_answers': total_quiz_answers
+                'current_period_score': values['score'],
+                'total_reviews': values['review_count'],
+                'learned_cards': values['learned_card_count'],
+                'new_cards_today': today_values[user_id]['new_card_count'],
+                'total_quiz_answers': values['quiz_answer_count']
             })
-        
-        if sort_by == 'total_score':
-            leaderboard_data.sort(key=lambda x: x['current_period_score'], reverse=True)
-        elif sort_by == 'total_reviews':
-            leaderboard_data.sort(key=lambda x: x['total_reviews'], reverse=True)
-        elif sort_by == 'learned_cards':
-            leaderboard_data.sort(key=lambda x: x['learned_cards'], reverse=True)
-        elif sort_by == 'new_cards':
-            leaderboard_data.sort(key=lambda x: x['new_cards_today'], reverse=True)
-        elif sort_by == 'total_quiz_answers':
-            leaderboard_data.sort(key=lambda x: x['total_quiz_answers'], reverse=True)
-        else:
-            leaderboard_data.sort(key=lambda x: x['current_period_score'], reverse=True)
-
-        leaderboard_data = leaderboard_data[:limit]
-        
+
         logger.info(f"{log_prefix} Đã lấy thành công {len(leaderboard_data)} người dùng cho bảng xếp hạng.")
         return leaderboard_data
+
+    def get_user_leaderboard_rank(self, user_id, sort_by='total_score', timeframe='all_time'):
+        """
+        Mô tả: Lấy thứ hạng của một người dùng theo tiêu chí và khung thời gian của bảng xếp hạng.
+        Returns:
+            dict: {'rank', 'value', 'total_users'}; rank là None nếu người dùng chưa có trong bảng xếp hạng.
+        """
+        period, metric = self._resolve_leaderboard_metric(sort_by, timeframe)
+        rank, value, total_users = leaderboard_engine.rank(user_id, period, metric)
+        return {'rank': rank, 'value': value, 'total_users': total_users}
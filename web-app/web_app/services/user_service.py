@@ -4,6 +4,9 @@ import logging
 from werkzeug.security import generate_password_hash, check_password_hash
 # KẾT THÚC THAY ĐỔI
 from ..models import db, User
+from .leaderboard import leaderboard_engine
+from .quiz_set_index import quiz_set_index
+from .keyset_pagination import category_count_cache
 
 logger = logging.getLogger(__name__)
 
@@ -111,6 +114,9 @@ class UserService:
         try:
             db.session.delete(user)
             db.session.commit()
+            leaderboard_engine.invalidate()
+            quiz_set_index.invalidate(user_id=user_id)
+            category_count_cache.invalidate(user_id=user_id)
             logger.info(f"{log_prefix} Xóa người dùng thành công.")
             return True, "success"
         except Exception as e:
@@ -0,0 +1,92 @@
+# web_app/services/zip_stream.py
+import logging
+import os
+import time
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+# Định dạng đã nén sẵn: lưu nguyên (ZIP_STORED), nén lại chỉ tốn CPU mà không giảm kích thước
+STORED_EXTENSIONS = {'.mp3', '.jpg', '.jpeg', '.png', '.gif', '.webp', '.xlsx', '.zip', '.ogg', '.m4a'}
+
+ZIP_STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class _ChunkSink:
+    """
+    Mô tả: Đích ghi không seek được cho zipfile: gom các byte vừa ghi để generator trả ra rồi bỏ đi.
+           zipfile tự chuyển sang chế độ data descriptor khi đích không hỗ trợ seek/tell.
+    """
+    def __init__(self):
+        self._chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        self.size = 0
+        return data
+
+
+def _compress_type_for(arcname):
+    extension = os.path.splitext(arcname)[1].lower()
+    return zipfile.ZIP_STORED if extension in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+
+
+def stream_zip(entries):
+    """
+    Mô tả: Tạo file ZIP dạng luồng: mỗi entry được ghi và trả ra theo từng khối ZIP_STREAM_CHUNK_SIZE,
+           nên bộ nhớ chỉ phụ thuộc kích thước khối (và entry dạng bytes), không phụ thuộc tổng dung lượng.
+           File media đã nén (mp3/jpg/png...) được lưu nguyên thay vì nén lại.
+    Args:
+        entries (iterable): Các tuple (arcname, source) với source là đường dẫn file, bytes,
+                            hoặc hàm không tham số trả về bytes (None để bỏ qua entry).
+    Yields:
+        bytes: Các khối dữ liệu của file ZIP.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for arcname, source in entries:
+            compress_type = _compress_type_for(arcname)
+            if callable(source):
+                try:
+                    source = source()
+                except Exception as e:
+                    logger.warning(f"[ZIP_STREAM] Bỏ qua '{arcname}': {e}")
+                    continue
+                if source is None:
+                    continue
+
+            if isinstance(source, bytes):
+                zinfo = zipfile.ZipInfo(arcname, date_time=time.localtime()[:6])
+                zinfo.compress_type = compress_type
+                zf.writestr(zinfo, source)
+            else:
+                try:
+                    src = open(source, 'rb')
+                except OSError as e:
+                    logger.warning(f"[ZIP_STREAM] Không thể mở '{source}': {e}")
+                    continue
+                with src:
+                    zinfo = zipfile.ZipInfo.from_file(source, arcname)
+                    zinfo.compress_type = compress_type
+                    with zf.open(zinfo, 'w') as dest:
+                        while True:
+                            block = src.read(ZIP_STREAM_CHUNK_SIZE)
+                            if not block:
+                                break
+                            dest.write(block)
+                            if sink.size >= ZIP_STREAM_CHUNK_SIZE:
+                                yield sink.drain()
+            if sink.size:
+                yield sink.drain()
+    if sink.size:
+        yield sink.drain()
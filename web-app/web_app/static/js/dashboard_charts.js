@@ -267,19 +267,23 @@ document.addEventListener('DOMContentLoaded', function () {
      * @param {string} type - Loại ('flashcard' hoặc 'quiz').
      * @param {string} setId - ID của bộ.
      * @param {string} category - Danh mục (ví dụ: 'due', 'correct').
-     * @param {number} page - Số trang.
+     * @param {number} page - Số trang (chỉ để hiển thị).
+     * @param {object} cursor - { after } hoặc { before } lấy từ next_cursor/prev_cursor của trang đang xem.
      */
-    async function fetchAndShowItems(type, setId, category, page = 1) {
+    async function fetchAndShowItems(type, setId, category, page = 1, cursor = {}) {
         modal.style.display = 'flex';
         modalTitle.textContent = categoryTitles[type][category] || 'Danh sách';
         cardListContainer.innerHTML = '<div class="loader-container"><div class="loader"></div></div>';
         paginationContainer.innerHTML = '';
         
+        const params = new URLSearchParams({ page });
+        if (cursor.after) params.set('after', cursor.after);
+        if (cursor.before) params.set('before', cursor.before);
         let apiUrl = '';
         if (type === 'flashcard') {
-            apiUrl = `/api/cards_by_category/${setId}/${category}?page=${page}`;
+            apiUrl = `/api/cards_by_category/${setId}/${category}?${params}`;
         } else if (type === 'quiz') {
-            apiUrl = `/api/quiz_questions_by_category/${setId}/${category}?page=${page}`;
+            apiUrl = `/api/quiz_questions_by_category/${setId}/${category}?${params}`;
         }
 
         try {
@@ -339,19 +343,20 @@ document.addEventListener('DOMContentLoaded', function () {
      */
     function renderPagination(type, pagination, setId, category) {
         paginationContainer.innerHTML = '';
-        if (pagination.pages <= 1) return;
+        if (!pagination.has_prev && !pagination.has_next) return;
         const prevButton = document.createElement('button');
         prevButton.innerHTML = '&laquo;';
         prevButton.disabled = !pagination.has_prev;
-        prevButton.addEventListener('click', () => fetchAndShowItems(type, setId, category, pagination.page - 1));
+        prevButton.addEventListener('click', () => fetchAndShowItems(type, setId, category, pagination.page - 1, { before: pagination.prev_cursor }));
         paginationContainer.appendChild(prevButton);
         const pageInfo = document.createElement('span');
-        pageInfo.textContent = `Trang ${pagination.page} / ${pagination.pages}`;
+        // Tổng số được cache ngắn hạn nên có thể chậm hơn danh sách thực tế
+        pageInfo.textContent = `Trang ${pagination.page} / ${Math.max(pagination.pages, pagination.page)}`;
         paginationContainer.appendChild(pageInfo);
         const nextButton = document.createElement('button');
         nextButton.innerHTML = '&raquo;';
         nextButton.disabled = !pagination.has_next;
-        nextButton.addEventListener('click', () => fetchAndShowItems(type, setId, category, pagination.page + 1));
+        nextButton.addEventListener('click', () => fetchAndShowItems(type, setId, category, pagination.page + 1, { after: pagination.next_cursor }));
         paginationContainer.appendChild(nextButton);
     }
 
@@ -0,0 +1,53 @@
+// web_app/static/js/import_status.js
+
+document.addEventListener('DOMContentLoaded', function() {
+    const statusBox = document.getElementById('import-job-status');
+    if (!statusBox || statusBox.dataset.active !== '1') return;
+
+    const messageEl = statusBox.querySelector('.import-job-message');
+    const errorsEl = statusBox.querySelector('.import-job-errors');
+    const POLL_INTERVAL_MS = 2000;
+
+    /**
+     * Mô tả: Vẽ lại danh sách lỗi theo hàng từ báo cáo của tác vụ.
+     * @param {Array} errors - Danh sách {row, message}.
+     * @param {number} errorCount - Tổng số lỗi (có thể lớn hơn số lỗi được giữ lại).
+     */
+    function renderErrors(errors, errorCount) {
+        errorsEl.innerHTML = '';
+        errors.forEach(error => {
+            const item = document.createElement('li');
+            item.textContent = `Hàng ${error.row}: ${error.message}`;
+            errorsEl.appendChild(item);
+        });
+        if (errorCount > errors.length) {
+            const item = document.createElement('li');
+            item.textContent = `... và ${errorCount - errors.length} lỗi khác.`;
+            errorsEl.appendChild(item);
+        }
+    }
+
+    async function poll() {
+        try {
+            const response = await fetch(statusBox.dataset.statusUrl);
+            const result = await response.json();
+            if (!response.ok || result.status !== 'success') throw new Error(result.message || 'Lỗi server');
+
+            const job = result.job;
+            renderErrors(job.errors, job.error_count);
+            if (job.status === 'queued' || job.status === 'running') {
+                messageEl.textContent = `Đang xử lý... đã đọc ${job.processed_rows} hàng, đã thêm ${job.inserted}.`;
+                setTimeout(poll, POLL_INTERVAL_MS);
+                return;
+            }
+            messageEl.textContent = job.message;
+            statusBox.classList.remove('alert-info');
+            statusBox.classList.add(job.status === 'error' ? 'alert-error' : 'alert-success');
+        } catch (error) {
+            console.error('Lỗi khi lấy tiến độ nhập Excel:', error);
+            messageEl.textContent = 'Không thể lấy tiến độ nhập dữ liệu. Vui lòng tải lại trang.';
+        }
+    }
+
+    setTimeout(poll, POLL_INTERVAL_MS);
+});
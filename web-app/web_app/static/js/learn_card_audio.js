@@ -18,19 +18,64 @@ document.addEventListener('DOMContentLoaded', function() {
     const isFront = jsDataElement.dataset.isFront === 'true';
     const hasBackAudioContent = jsDataElement.dataset.hasBackAudioContent === 'true';
 
+    const AUDIO_POLL_MAX_ATTEMPTS = 30;
+    let audioSourcePromise = null;
+
+    /**
+     * Mô tả: Lấy nguồn audio có thể phát. Nếu server trả 202 (audio đang được tạo trong hàng đợi),
+     * chờ theo header Retry-After rồi hỏi lại cùng URL cho đến khi nhận được file.
+     * Kết quả được giữ lại để các lần phát sau không phải tải lại.
+     */
+    function resolveAudioSource() {
+        if (audioSourcePromise) return audioSourcePromise;
+
+        audioSourcePromise = new Promise((resolve, reject) => {
+            let attempts = 0;
+
+            function poll() {
+                attempts += 1;
+                fetch(audioUrl, { credentials: 'same-origin' })
+                    .then(response => {
+                        if (response.status === 202) {
+                            if (attempts >= AUDIO_POLL_MAX_ATTEMPTS) {
+                                throw new Error("Hết thời gian chờ tạo audio.");
+                            }
+                            const retryAfter = parseFloat(response.headers.get('Retry-After')) || 1;
+                            setTimeout(poll, retryAfter * 1000);
+                            return;
+                        }
+                        if (!response.ok) {
+                            throw new Error(`Server trả về mã lỗi ${response.status}.`);
+                        }
+                        return response.blob().then(blob => resolve(URL.createObjectURL(blob)));
+                    })
+                    .catch(error => {
+                        audioSourcePromise = null;
+                        reject(error);
+                    });
+            }
+
+            poll();
+        });
+        return audioSourcePromise;
+    }
+
     /**
-     * Mô tả: Hàm cốt lõi để phát audio.
-     * Nó chỉ thực hiện một việc: gán src và play.
+     * Mô tả: Hàm cốt lõi để phát audio: lấy nguồn audio (chờ nếu đang được tạo), gán src và play.
      */
     function playAudio() {
         if (audioUrl) {
-            // SỬA LỖI: Reset trình phát trước khi gán nguồn mới
-            // để tránh lỗi trạng thái "kẹt" trên một số trình duyệt.
-            cardAudioPlayer.load(); 
-            cardAudioPlayer.src = audioUrl;
-            cardAudioPlayer.play().catch(error => {
-                console.error("Lỗi khi phát audio:", error);
-            });
+            resolveAudioSource()
+                .then(source => {
+                    // SỬA LỖI: Reset trình phát trước khi gán nguồn mới
+                    // để tránh lỗi trạng thái "kẹt" trên một số trình duyệt.
+                    cardAudioPlayer.load();
+                    cardAudioPlayer.src = source;
+                    return cardAudioPlayer.play();
+                })
+                .catch(error => {
+                    console.error("Lỗi khi phát audio:", error);
+                });
         } else {
             console.log("Không có URL audio để phát.");
         }